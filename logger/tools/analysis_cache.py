@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Analysis Cache - Traffic Light MQTT Demo
+Per-directory cache of per-file analysis results, stored next to the results
+(.analysis_cache.json), so re-analysing an unchanged results tree is a lookup.
+
+An entry is valid when the file still has the same size and either the same
+mtime (fast path, no read) or, if the mtime changed (copy, checkout, touch),
+the same sha256. Entries are also tied to the analysis version of the caller,
+so a change in how stats are computed invalidates them.
+
+Usage:
+    python analysis_cache.py ../results            # show cache status per file
+    python analysis_cache.py ../results --clear    # delete the cache file
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Optional
+
+CACHE_FILE = ".analysis_cache.json"
+
+
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _jsonable(value):
+    """json.dump default: numpy scalars -> Python numbers."""
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+class AnalysisCache:
+    """Cache of JSON-serialisable results keyed by file name within one directory."""
+
+    def __init__(self, directory: Path, version: str):
+        self.path = Path(directory) / CACHE_FILE
+        self.version = version
+        self.entries: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == version:
+                self.entries = data.get("entries", {})
+        except (OSError, ValueError):
+            pass  # no cache yet, or unreadable: start empty
+
+    def get(self, path: Path) -> Optional[dict]:
+        """Cached result for path, or None if missing or the file changed."""
+        path = Path(path)
+        entry = self.entries.get(path.name)
+        try:
+            st = path.stat()
+        except OSError:
+            entry = None
+        if entry is None or entry["size"] != st.st_size:
+            self.misses += 1
+            return None
+        if entry["mtime_ns"] != st.st_mtime_ns:
+            if file_sha256(path) != entry["sha256"]:
+                self.misses += 1
+                return None
+            entry["mtime_ns"] = st.st_mtime_ns  # same content, new mtime
+            self.dirty = True
+        self.hits += 1
+        return entry["result"]
+
+    def put(self, path: Path, result: dict):
+        path = Path(path)
+        st = path.stat()
+        self.entries[path.name] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": file_sha256(path),
+            "result": result,
+        }
+        self.dirty = True
+
+    def save(self):
+        """Write the cache atomically (only if it changed)."""
+        if not self.dirty:
+            return
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "entries": self.entries}, f, indent=1, default=_jsonable)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def describe(self) -> str:
+        return f"{self.hits} hit(s), {self.misses} miss(es)"
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Inspect or clear the per-directory analysis cache',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python analysis_cache.py ../results
+  python analysis_cache.py ../results --clear
+        """
+    )
+    parser.add_argument('directory', help='Results directory containing .analysis_cache.json')
+    parser.add_argument('--clear', action='store_true', help='Delete the cache file')
+    args = parser.parse_args()
+
+    path = Path(args.directory) / CACHE_FILE
+    if not path.exists():
+        print(f"ℹ️ No cache in {args.directory}")
+        return
+    if args.clear:
+        path.unlink()
+        print(f"🗑️ Removed {path}")
+        return
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ Unreadable cache {path}: {e}")
+        sys.exit(1)
+
+    print(f"🗃️ {path} (analysis version {data.get('version')})")
+    for name, entry in sorted(data.get("entries", {}).items()):
+        file = Path(args.directory) / name
+        if not file.exists():
+            status = "missing"
+        elif file.stat().st_size != entry["size"]:
+            status = "stale"
+        elif file.stat().st_mtime_ns != entry["mtime_ns"]:
+            status = "mtime changed (rehash on next use)"
+        else:
+            status = "valid"
+        print(f"  {name:<40} {entry['size']:>12,} B  {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,29 +5,63 @@ Analyzes benchmark CSV results and generates statistics + optional histogram.
 
 Usage:
     python analyze_results.py results.csv
+    python analyze_results.py results.npy
     python analyze_results.py results.csv --histogram
     python analyze_results.py results.csv --threshold-mean 200 --threshold-p95 500
+    python analyze_results.py soak.csv --stream --chunksize 500000
+    python analyze_results.py results/ --jobs 8 --out-dir results/analysis
+    python analyze_results.py "results/**/raw/*.csv" --stream
+
+--stream reads the file in chunks (typed columns) into fixed-memory running
+statistics and quantile sketches (streaming_stats.py); percentiles are then
+approximate (within +/-1% relative).
+
+Several files, globs or directories switch to batch mode: files are analyzed
+in worker processes and written as one table (batch_summary.csv/.md) with an
+aggregate row merged from every file's accumulator. A file that fails is
+listed with its error; the rest of the batch still runs.
 """
 
 import argparse
+import csv
+import glob
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
+from typing import List, Optional
 
 import numpy as np
 import pandas as pd
 
-# Optional matplotlib for histogram
-try:
-    import matplotlib.pyplot as plt
-    HAS_MATPLOTLIB = True
-except ImportError:
-    HAS_MATPLOTLIB = False
+from raw_columnar import (CALIBRATION_DIR, columnar_to_dataframe, is_columnar, is_raw_results, load_columnar,
+                          read_results)
+from streaming_stats import GroupedStats, QuantileSketch, RunningStats
+
+# Payload size buckets (payload_size, bytes)
+PAYLOAD_BINS = [0, 100, 200, 500, 1000, float('inf')]
+PAYLOAD_LABELS = ['0-100', '101-200', '201-500', '501-1000', '>1000']
+
+# Columns needed by the streaming analysis and their types
+STREAM_DTYPES = {'rtt_ms': 'float64', 'payload_size': 'float64', 'note': 'str'}
+DEFAULT_CHUNKSIZE = 200000
+
+def load_pyplot():
+    """Import matplotlib (non-interactive backend) only when a histogram is requested; None if not installed."""
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return None
+    return plt
 
 
 def load_csv(filename: str) -> pd.DataFrame:
-    """Load CSV file into DataFrame."""
+    """Load CSV (or memory-mapped columnar .npy) file into DataFrame."""
     try:
-        df = pd.read_csv(filename)
+        df = read_results(filename)
         print(f"📂 Loaded {len(df)} records from {filename}")
         return df
     except FileNotFoundError:
@@ -95,14 +129,153 @@ def analyze_payload_impact(df: pd.DataFrame):
         return None
     
     # Group by payload size ranges
-    df_valid['size_bucket'] = pd.cut(df_valid['payload_size'], 
-                                      bins=[0, 100, 200, 500, 1000, float('inf')],
-                                      labels=['0-100', '101-200', '201-500', '501-1000', '>1000'])
+    df_valid['size_bucket'] = pd.cut(df_valid['payload_size'], bins=PAYLOAD_BINS, labels=PAYLOAD_LABELS)
     
-    grouped = df_valid.groupby('size_bucket', observed=True)['rtt_ms'].agg(['count', 'mean', 'p95'])
+    grouped = df_valid.groupby('size_bucket', observed=True)['rtt_ms'].agg(
+        count='count', mean='mean', p95=lambda x: x.quantile(0.95))
     return grouped
 
 
+# =============================================================================
+# STREAMING ANALYSIS
+# =============================================================================
+
+class StreamAccumulator:
+    """
+    Chunk-by-chunk equivalent of calculate_statistics / analyze_by_command /
+    analyze_payload_impact. Memory does not grow with the file (mergeable).
+    """
+    
+    def __init__(self, alpha: float = 0.01):
+        self.total = 0
+        self.rtt = RunningStats()
+        self.sketch = QuantileSketch(alpha)
+        self.by_command = GroupedStats(alpha)
+        self.by_payload = GroupedStats(alpha)
+    
+    def add_chunk(self, df: pd.DataFrame):
+        rtts = df['rtt_ms'].to_numpy(dtype=float)
+        self.total += len(df)
+        self.rtt.add_many(rtts)
+        self.sketch.add_many(rtts)
+        
+        if 'note' in df.columns:
+            notes = df['note']
+            has_note = notes.notna().to_numpy()
+            self.by_command.add_many(notes[has_note].astype(str).to_numpy(), rtts[has_note])
+        
+        if 'payload_size' in df.columns:
+            buckets = pd.cut(df['payload_size'], bins=PAYLOAD_BINS, labels=PAYLOAD_LABELS)
+            valid = (buckets.notna() & df['rtt_ms'].notna()).to_numpy()
+            self.by_payload.add_many(buckets[valid].astype(str).to_numpy(), rtts[valid])
+    
+    def merge(self, other: "StreamAccumulator"):
+        self.total += other.total
+        self.rtt.merge(other.rtt)
+        self.sketch.merge(other.sketch)
+        self.by_command.merge(other.by_command)
+        self.by_payload.merge(other.by_payload)
+    
+    def statistics(self) -> dict:
+        """Same keys as calculate_statistics (percentiles from the sketch)."""
+        received = self.rtt.n
+        lost = self.total - received
+        stats = {
+            'total_sent': self.total,
+            'total_received': received,
+            'total_lost': lost,
+            'loss_rate': (lost / self.total * 100) if self.total > 0 else 0,
+        }
+        if received > 0:
+            q = self.sketch.quantile
+            stats.update({
+                'min': self.rtt.min,
+                'max': self.rtt.max,
+                'mean': self.rtt.mean,
+                'median': q(0.50),
+                'std': self.rtt.std if self.rtt.std is not None else float('nan'),
+                'p50': q(0.50),
+                'p75': q(0.75),
+                'p90': q(0.90),
+                'p95': q(0.95),
+                'p99': q(0.99),
+            })
+        else:
+            stats.update({
+                'min': None, 'max': None, 'mean': None, 'median': None,
+                'std': None, 'p50': None, 'p75': None, 'p90': None, 
+                'p95': None, 'p99': None
+            })
+        return stats
+    
+    def command_table(self) -> Optional[pd.DataFrame]:
+        """Same layout as analyze_by_command."""
+        if not self.by_command.stats:
+            return None
+        rows = {}
+        for key in sorted(self.by_command.stats):
+            rs = self.by_command.stats[key]
+            rows[key] = {
+                'count': rs.n,
+                'mean': rs.mean if rs.n else np.nan,
+                'median': self.by_command.sketches[key].quantile(0.5) if rs.n else np.nan,
+                'std': rs.std if rs.std is not None else np.nan,
+                'max': rs.max if rs.n else np.nan,
+            }
+        table = pd.DataFrame.from_dict(rows, orient='index')
+        table.index.name = 'note'
+        return table
+    
+    def payload_table(self) -> Optional[pd.DataFrame]:
+        """Same layout as analyze_payload_impact."""
+        if not self.by_payload.stats:
+            return None
+        rows = {}
+        for key in [label for label in PAYLOAD_LABELS if label in self.by_payload.stats]:
+            rs = self.by_payload.stats[key]
+            rows[key] = {'count': rs.n, 'mean': rs.mean,
+                         'p95': self.by_payload.sketches[key].quantile(0.95)}
+        table = pd.DataFrame.from_dict(rows, orient='index')
+        table.index.name = 'size_bucket'
+        return table
+
+
+def iter_chunks(filename: str, chunksize: int):
+    """Yield DataFrame chunks of a raw results file (.csv streamed, .npy memory-mapped)."""
+    if is_columnar(filename):
+        arr = load_columnar(filename)
+        for start in range(0, len(arr), chunksize):
+            yield columnar_to_dataframe(arr[start:start + chunksize])
+        return
+    
+    header = pd.read_csv(filename, nrows=0).columns
+    usecols = [c for c in STREAM_DTYPES if c in header]
+    yield from pd.read_csv(filename, usecols=usecols, chunksize=chunksize,
+                           dtype={c: STREAM_DTYPES[c] for c in usecols})
+
+
+def accumulate_file(filename: str, chunksize: int = DEFAULT_CHUNKSIZE) -> StreamAccumulator:
+    """Accumulate a whole file chunk by chunk (raises on read errors)."""
+    acc = StreamAccumulator()
+    for chunk in iter_chunks(filename, chunksize):
+        acc.add_chunk(chunk)
+    return acc
+
+
+def stream_file(filename: str, chunksize: int = DEFAULT_CHUNKSIZE) -> StreamAccumulator:
+    """accumulate_file() for the CLI: exits with a message on errors."""
+    try:
+        acc = accumulate_file(filename, chunksize)
+    except FileNotFoundError:
+        print(f"❌ File not found: {filename}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error reading {filename}: {e}")
+        sys.exit(1)
+    print(f"📂 Streamed {acc.total} records from {filename} (chunks of {chunksize})")
+    return acc
+
+
 def print_statistics(stats: dict, thresholds: dict):
     """Print formatted statistics table."""
     print("\n" + "=" * 60)
@@ -172,7 +345,8 @@ def print_statistics(stats: dict, thresholds: dict):
 
 def plot_histogram(df: pd.DataFrame, output_file: str):
     """Generate and save RTT histogram."""
-    if not HAS_MATPLOTLIB:
+    plt = load_pyplot()
+    if plt is None:
         print("⚠️ matplotlib not installed. Skipping histogram.")
         return
     
@@ -212,6 +386,192 @@ def plot_histogram(df: pd.DataFrame, output_file: str):
     plt.close()
 
 
+# =============================================================================
+# BATCH ANALYSIS
+# =============================================================================
+
+BATCH_COLUMNS = ['file', 'sent', 'received', 'lost', 'loss_rate', 'min', 'mean', 'median',
+                 'std', 'p95', 'p99', 'max', 'verdict', 'error']
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+    """
+    Files, glob patterns and directories -> raw result files (.npy preferred over .csv).
+    Directories and globs keep only files with the raw per-command schema, outside
+    calibration/ (the harness floor run); files named explicitly are always
+    analysed (a wrong one is reported as an error).
+    """
+    found, explicit = [], set()
+    for item in inputs:
+        if os.path.isdir(item):
+            found += [str(p) for p in Path(item).rglob('*') if p.suffix in ('.csv', '.npy')]
+        elif glob.has_magic(item):
+            found += glob.glob(item, recursive=True)
+        else:
+            found.append(item)
+            explicit.add(item)
+    
+    by_stem = {}
+    for path in sorted(set(found), key=lambda f: not f.endswith('.npy')):
+        if path not in explicit and (Path(path).parent.name == CALIBRATION_DIR or not is_raw_results(path)):
+            continue
+        by_stem.setdefault(os.path.splitext(path)[0], path)
+    return sorted(by_stem.values())
+
+
+def threshold_verdict(stats: dict, thresholds: dict) -> str:
+    if stats['mean'] is None:
+        return "FAIL (no ack)"
+    failed = [name for name, ok in (
+        ('mean', stats['mean'] <= thresholds['mean']),
+        ('p95', stats['p95'] <= thresholds['p95']),
+        ('loss', stats['loss_rate'] <= thresholds['loss']),
+    ) if not ok]
+    return "PASS" if not failed else "FAIL (" + ", ".join(failed) + ")"
+
+
+def analyze_file(filename: str, stream: bool, chunksize: int) -> dict:
+    """
+    Worker: statistics for one file plus its accumulator (for the aggregate).
+    Never raises; errors are returned in the result.
+    """
+    try:
+        if stream:
+            acc = accumulate_file(filename, chunksize)
+            stats = acc.statistics()
+        else:
+            df = read_results(filename)
+            if 'rtt_ms' not in df.columns:
+                raise ValueError("no rtt_ms column (not a raw results file)")
+            stats = calculate_statistics(df)
+            acc = StreamAccumulator()
+            acc.add_chunk(df)
+        return {'file': filename, 'stats': stats, 'acc': acc, 'error': ''}
+    except Exception as e:
+        return {'file': filename, 'stats': None, 'acc': None, 'error': f"{type(e).__name__}: {e}"}
+
+
+def run_batch(files: List[str], stream: bool, chunksize: int, jobs: int) -> List[dict]:
+    """Analyze files in a process pool; results in input order."""
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(analyze_file, f, stream, chunksize): f for f in files}
+        for future in as_completed(futures):
+            r = future.result()
+            results[r['file']] = r
+            mark = "❌" if r['error'] else "✅"
+            print(f"  {mark} [{len(results)}/{len(files)}] {r['file']}" +
+                  (f" — {r['error']}" if r['error'] else ""))
+    return [results[f] for f in files]
+
+
+def write_batch_outputs(results: List[dict], aggregate: dict, thresholds: dict,
+                        out_dir: str, stream: bool):
+    os.makedirs(out_dir, exist_ok=True)
+    
+    def row(name: str, stats: Optional[dict], error: str = '') -> dict:
+        if stats is None:
+            return {**{c: '' for c in BATCH_COLUMNS}, 'file': name, 'verdict': 'ERROR', 'error': error}
+        return {
+            'file': name, 'sent': stats['total_sent'], 'received': stats['total_received'],
+            'lost': stats['total_lost'], 'loss_rate': stats['loss_rate'],
+            'min': stats['min'], 'mean': stats['mean'], 'median': stats['median'], 'std': stats['std'],
+            'p95': stats['p95'], 'p99': stats['p99'], 'max': stats['max'],
+            'verdict': threshold_verdict(stats, thresholds), 'error': error,
+        }
+    
+    rows = [row(r['file'], r['stats'], r['error']) for r in results]
+    agg_row = row('AGGREGATE', aggregate)
+    
+    csv_file = os.path.join(out_dir, 'batch_summary.csv')
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=BATCH_COLUMNS)
+        writer.writeheader()
+        for r in rows + [agg_row]:
+            writer.writerow({k: (f"{v:.2f}" if isinstance(v, float) else v) for k, v in r.items()})
+    print(f"💾 Saved: {csv_file}")
+    
+    def md(value) -> str:
+        if value is None or value == '':
+            return "N/A"
+        return f"{value:.1f}" if isinstance(value, float) else str(value)
+    
+    md_file = os.path.join(out_dir, 'batch_summary.md')
+    errors = [r for r in rows if r['error']]
+    with open(md_file, 'w', encoding='utf-8') as f:
+        f.write("# 📊 Batch RTT Analysis\n\n")
+        f.write(f"> Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"> Files: {len(rows)} ({len(errors)} errors), mode: {'stream' if stream else 'in-memory'}\n")
+        f.write(f"> Thresholds: mean <= {thresholds['mean']}ms, P95 <= {thresholds['p95']}ms, "
+                f"loss <= {thresholds['loss']}%\n\n")
+        f.write("| File | Sent | Recv | Loss% | Min | Mean | Median | P95 | P99 | Max | Verdict |\n")
+        f.write("|------|------|------|-------|-----|------|--------|-----|-----|-----|---------|\n")
+        for r in rows + [agg_row]:
+            name = f"**{r['file']}**" if r is agg_row else r['file']
+            f.write(f"| {name} | {md(r['sent'])} | {md(r['received'])} | {md(r['loss_rate'])} | "
+                    f"{md(r['min'])} | {md(r['mean'])} | {md(r['median'])} | {md(r['p95'])} | "
+                    f"{md(r['p99'])} | {md(r['max'])} | {r['verdict']} |\n")
+        f.write("\nAggregate percentiles come from the merged quantile sketches (±1% relative).\n")
+        if errors:
+            f.write("\n## Errors\n\n")
+            for r in errors:
+                f.write(f"- `{r['file']}`: {r['error']}\n")
+    print(f"📝 Saved: {md_file}")
+
+
+def batch_main(args, files: List[str], thresholds: dict):
+    print(f"\n🗂️  Batch: {len(files)} files, {args.jobs} workers, "
+          f"{'stream' if args.stream else 'in-memory'}")
+    results = run_batch(files, args.stream, args.chunksize, args.jobs)
+    
+    total = StreamAccumulator()
+    for r in results:
+        if r['acc'] is not None:
+            total.merge(r['acc'])
+    aggregate = total.statistics() if total.total else None
+    
+    write_batch_outputs(results, aggregate, thresholds, args.out_dir, args.stream)
+    
+    errors = sum(1 for r in results if r['error'])
+    failed = sum(1 for r in results if r['stats'] and threshold_verdict(r['stats'], thresholds) != "PASS")
+    print("\n" + "=" * 60)
+    print(f"  Files:     {len(results)}  (errors: {errors}, threshold FAIL: {failed})")
+    if aggregate:
+        print(f"  Aggregate: n={aggregate['total_sent']}, mean={aggregate['mean']:.2f}ms, "
+              f"p95={aggregate['p95']:.2f}ms, loss={aggregate['loss_rate']:.2f}% "
+              f"→ {threshold_verdict(aggregate, thresholds)}")
+    print("=" * 60 + "\n")
+    sys.exit(0 if errors == 0 and failed == 0 else 1)
+
+
+def plot_sketch_histogram(acc: StreamAccumulator, output_file: str):
+    """Histogram from the streaming sketch buckets (log-width bins)."""
+    plt = load_pyplot()
+    if plt is None:
+        print("⚠️ matplotlib not installed. Skipping histogram.")
+        return
+    if acc.rtt.n == 0:
+        print("⚠️ No RTT data for histogram")
+        return
+    
+    stats = acc.statistics()
+    lower, upper, counts = acc.sketch.histogram()
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.bar(lower, counts, width=upper - lower, align='edge', edgecolor='black',
+           linewidth=0.3, alpha=0.7, color='steelblue')
+    ax.axvline(stats['mean'], color='red', linestyle='--', linewidth=2, label=f"Mean: {stats['mean']:.1f}ms")
+    ax.axvline(stats['p95'], color='orange', linestyle='--', linewidth=2, label=f"P95: {stats['p95']:.1f}ms")
+    ax.set_xlabel('RTT (ms)')
+    ax.set_ylabel('Frequency (per sketch bucket)')
+    ax.set_title(f'RTT Distribution (streamed, n={acc.rtt.n})')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    
+    plt.tight_layout()
+    plt.savefig(output_file, dpi=150, bbox_inches='tight')
+    print(f"📊 Histogram saved to: {output_file}")
+    plt.close()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Analyze RTT benchmark results from CSV',
@@ -221,12 +581,22 @@ Examples:
   python analyze_results.py results.csv
   python analyze_results.py results.csv --histogram
   python analyze_results.py results.csv --threshold-mean 200 --threshold-p95 500 --threshold-loss 1.0
+  python analyze_results.py results/ --jobs 8 --out-dir results/analysis
+  python analyze_results.py "results/**/raw/*.csv" --stream
         """
     )
     
-    parser.add_argument('csv_file', help='CSV file from logger.py')
+    parser.add_argument('inputs', nargs='+',
+                        help='CSV (or .npy) file from logger.py; several files, globs or directories = batch')
     parser.add_argument('--histogram', action='store_true', help='Generate histogram PNG')
     parser.add_argument('--histogram-output', default=None, help='Histogram output filename')
+    parser.add_argument('--stream', action='store_true',
+                        help='Chunked fixed-memory analysis (approximate percentiles)')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help='Rows per chunk with --stream')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes in batch mode')
+    parser.add_argument('--out-dir', default='.', help='Output directory for batch_summary.csv/.md')
     
     # Thresholds
     parser.add_argument('--threshold-mean', type=float, default=200, 
@@ -238,12 +608,6 @@ Examples:
     
     args = parser.parse_args()
     
-    # Load data
-    df = load_csv(args.csv_file)
-    
-    # Calculate statistics
-    stats = calculate_statistics(df)
-    
     # Define thresholds
     thresholds = {
         'mean': args.threshold_mean,
@@ -251,21 +615,52 @@ Examples:
         'loss': args.threshold_loss
     }
     
+    files = expand_inputs(args.inputs)
+    if not files:
+        print(f"❌ No result files found in: {' '.join(args.inputs)}")
+        sys.exit(1)
+    if len(files) > 1 or len(args.inputs) > 1 or files[0] != args.inputs[0]:
+        batch_main(args, files, thresholds)
+    args.csv_file = files[0]
+    
+    # Load data and calculate statistics
+    if args.stream:
+        acc = stream_file(args.csv_file, args.chunksize)
+        stats = acc.statistics()
+        cmd_stats = acc.command_table()
+        payload_stats = acc.payload_table()
+    else:
+        df = load_csv(args.csv_file)
+        stats = calculate_statistics(df)
+        cmd_stats = analyze_by_command(df)
+        payload_stats = analyze_payload_impact(df)
+    
     # Print results
     passed = print_statistics(stats, thresholds)
+    if args.stream:
+        print(f"ℹ️  Streamed: percentiles/median from a quantile sketch (±{acc.sketch.alpha:.0%} relative)\n")
     
     # Command breakdown
-    cmd_stats = analyze_by_command(df)
     if cmd_stats is not None and len(cmd_stats) > 1:
         print("\n📋 RTT BY COMMAND TYPE")
         print("-" * 60)
         print(cmd_stats.to_string())
         print()
     
+    # Payload size buckets
+    if payload_stats is not None and len(payload_stats) > 1:
+        print("\n📦 RTT BY PAYLOAD SIZE (bytes)")
+        print("-" * 60)
+        print(payload_stats.to_string())
+        print()
+    
     # Generate histogram
     if args.histogram:
         hist_file = args.histogram_output or Path(args.csv_file).stem + '_histogram.png'
-        plot_histogram(df, hist_file)
+        if args.stream:
+            plot_sketch_histogram(acc, hist_file)
+        else:
+            plot_histogram(df, hist_file)
     
     # Exit code based on thresholds
     sys.exit(0 if passed else 1)
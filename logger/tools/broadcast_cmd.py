@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Broadcast Command - Traffic Light MQTT Demo
+Fan one command (PING by default, EMERGENCY with --type) out to N intersections
+at once and time how fast the whole district acknowledges it. An EMERGENCY
+drill is followed by a SET_MODE AUTO broadcast to the devices that acked
+(--no-restore keeps them blinking).
+
+All commands are published back to back from one connection (paho's QoS 1
+in-flight limit of 20 is lifted, otherwise it would meter the fan-out) and
+matched to acks on city/<city>/intersection/+/ack by cmd_id. Times are from the
+first publish:
+    first ack       fastest device
+    p50 / p99 acked when 50% / 99% of the targets had acked
+    all acked       when the last target acked (only if every target did)
+plus the publish spread (first to last publish) and per-device RTT (own
+publish to ack), which separates fan-out cost from device latency.
+Stragglers: no ack before --timeout, or acked later than --straggler-factor x
+the median ack time.
+
+Measured rounds follow --warmup PING broadcasts: a mock that has just announced
+ONLINE can still take seconds to answer its first command (CPU-bound startup),
+which is not what the drill should measure. The default is one warm-up round
+when this script starts the fleet (--mocks) and none for a running fleet: every
+PING takes a slot in the device's cmd_id dedup cache (firmware
+CMD_ID_CACHE_SIZE = 10), evicting the ids of real commands.
+
+Targets come from --ids, --devices/--first-id or --discover (online devices
+from the retained status topic). --mocks starts the fleet: process/thread run
+real mock_esp32 instances; virtual answers for every target from one
+connection, for thousands of targets.
+
+Usage:
+    python broadcast_cmd.py --host 127.0.0.1 --devices 20 --mocks thread
+    python broadcast_cmd.py --host 127.0.0.1 --city sim --devices 5000 --mocks virtual --rounds 5
+    python broadcast_cmd.py --host 127.0.0.1 --discover --type EMERGENCY
+"""
+
+import argparse
+import csv
+import json
+import math
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from command_client import CommandClient, CommandFuture
+from multi_device_test import StatusWatcher, start_mocks, stop_mocks
+from timeline import percentile
+
+
+@dataclass
+class TargetResult:
+    round: int
+    intersection: str
+    t_send_ms: float                      # since the first publish of the round
+    t_ack_ms: Optional[float] = None      # since the first publish of the round
+    rtt_ms: Optional[float] = None
+    ok: Optional[bool] = None
+    err: Optional[str] = None
+
+
+@dataclass
+class RoundSummary:
+    round: int
+    targets: int
+    acked: int
+    failed: int                           # acked with ok=false
+    publish_spread_ms: float
+    first_ms: Optional[float]
+    p50_ms: Optional[float]
+    p99_ms: Optional[float]
+    all_ms: Optional[float]
+    rtt_p50_ms: Optional[float]
+    rtt_p99_ms: Optional[float]
+    stragglers: List[str]
+
+
+# =============================================================================
+# VIRTUAL FLEET
+# =============================================================================
+
+class VirtualFleet:
+    """Acks every command on city/<city>/intersection/+/cmd from one connection."""
+
+    def __init__(self, args):
+        self.qos = args.qos
+        self.acked = 0
+        self.subscribed = threading.Event()
+        self.client = mqtt.Client(
+            client_id=f"bcast-fleet-{uuid.uuid4().hex[:8]}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.username_pw_set(args.user, args.password)
+        self.client.max_inflight_messages_set(0)
+        self.client.on_connect = lambda c, userdata, flags, rc, properties=None: c.subscribe(
+            f"city/{args.city}/intersection/+/cmd", qos=args.qos)
+        self.client.on_subscribe = lambda c, userdata, mid, reason_codes, properties=None: self.subscribed.set()
+        self.client.on_message = self._on_message
+        self.client.connect(args.host, args.port, keepalive=30)
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            cmd = json.loads(msg.payload)
+        except ValueError:
+            return
+        ack = {"cmd_id": cmd.get("cmd_id"), "ok": True, "err": None, "edge_recv_ts_ms": int(time.time() * 1000)}
+        client.publish(msg.topic[:-3] + "ack", json.dumps(ack), qos=self.qos)
+        self.acked += 1
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+# =============================================================================
+# BROADCAST
+# =============================================================================
+
+class Broadcaster:
+    """One connection: publishes to every target's cmd topic, collects acks from +/ack."""
+
+    def __init__(self, args):
+        self.city = args.city
+        self.subscribed = threading.Event()
+        self.client = mqtt.Client(
+            client_id=f"bcast-{uuid.uuid4().hex[:8]}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.username_pw_set(args.user, args.password)
+        self.client.max_inflight_messages_set(0)
+        self.commands = CommandClient(self.client, None, qos=args.qos, timeout=args.timeout)
+        self.client.on_connect = lambda c, userdata, flags, rc, properties=None: c.subscribe(
+            f"city/{args.city}/intersection/+/ack", qos=args.qos)
+        self.client.on_subscribe = lambda c, userdata, mid, reason_codes, properties=None: self.subscribed.set()
+        self.client.on_message = self._on_message
+        self.client.connect(args.host, args.port, keepalive=30)
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, msg):
+        t_recv = time.time() * 1000
+        try:
+            self.commands.on_ack(json.loads(msg.payload), t_recv)
+        except ValueError:
+            pass
+
+    def broadcast(self, ids: List[str], cmd: dict) -> Dict[str, CommandFuture]:
+        """Publish cmd (own cmd_id each) to every target; returns intersection -> future."""
+        return {iid: self.commands.send(dict(cmd), topic=f"city/{self.city}/intersection/{iid}/cmd")
+                for iid in ids}
+
+    def close(self):
+        self.commands.close()
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def run_round(bcast: Broadcaster, ids: List[str], cmd: dict, n: int, straggler_factor: float):
+    futures = bcast.broadcast(ids, cmd)
+    bcast.commands.drain()
+    t0 = min(f.t_send_ms for f in futures.values())
+    rows = []
+    for iid, fut in futures.items():
+        row = TargetResult(n, iid, fut.t_send_ms - t0)
+        if fut.exception() is None:
+            ack = fut.result()
+            row.t_ack_ms, row.rtt_ms = ack.t_recv_ms - t0, ack.rtt_ms
+            row.ok, row.err = ack.ok, ack.payload.get("err")
+        rows.append(row)
+    return rows, summarize_round(n, rows, straggler_factor)
+
+
+def _time_to_fraction(ack_times: List[float], targets: int, fraction: float) -> Optional[float]:
+    """Time by which ceil(fraction x targets) targets had acked, None if never reached."""
+    need = max(1, math.ceil(fraction * targets))
+    return ack_times[need - 1] if len(ack_times) >= need else None
+
+
+def summarize_round(n: int, rows: List[TargetResult], straggler_factor: float) -> RoundSummary:
+    acked = [r for r in rows if r.t_ack_ms is not None]
+    ack_times = sorted(r.t_ack_ms for r in acked)
+    rtts = sorted(r.rtt_ms for r in acked)
+    p50 = _time_to_fraction(ack_times, len(rows), 0.50)
+    late = straggler_factor * percentile(ack_times, 0.50) if ack_times else 0.0
+    stragglers = sorted((r for r in rows if r.t_ack_ms is None or r.t_ack_ms > late),
+                        key=lambda r: -(r.t_ack_ms if r.t_ack_ms is not None else math.inf))
+    return RoundSummary(
+        round=n, targets=len(rows), acked=len(acked), failed=sum(1 for r in acked if not r.ok),
+        publish_spread_ms=max(r.t_send_ms for r in rows),
+        first_ms=ack_times[0] if ack_times else None, p50_ms=p50,
+        p99_ms=_time_to_fraction(ack_times, len(rows), 0.99),
+        all_ms=ack_times[-1] if len(ack_times) == len(rows) else None,
+        rtt_p50_ms=percentile(rtts, 0.50) if rtts else None,
+        rtt_p99_ms=percentile(rtts, 0.99) if rtts else None,
+        stragglers=[r.intersection for r in stragglers],
+    )
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:.1f}" if value is not None else "—"
+
+
+def print_round(s: RoundSummary):
+    print(f"  #{s.round:<3} acked {s.acked}/{s.targets}"
+          f"{f' ({s.failed} failed)' if s.failed else ''} | publish {s.publish_spread_ms:.1f} ms | "
+          f"first {_ms(s.first_ms)} | p50 {_ms(s.p50_ms)} | p99 {_ms(s.p99_ms)} | all {_ms(s.all_ms)} ms | "
+          f"RTT p50/p99 {_ms(s.rtt_p50_ms)}/{_ms(s.rtt_p99_ms)} ms | stragglers {len(s.stragglers)}")
+
+
+def print_summary(summaries: List[RoundSummary], rows: List[TargetResult], top: int):
+    print("\n" + "=" * 72)
+    print(f"📊 BROADCAST SUMMARY ({len(summaries)} round(s), {summaries[0].targets} targets)")
+    print("=" * 72)
+    for label, attr in (("Publish spread", "publish_spread_ms"), ("First ack", "first_ms"),
+                        ("p50 acked", "p50_ms"), ("p99 acked", "p99_ms"), ("All acked", "all_ms")):
+        values = sorted(getattr(s, attr) for s in summaries if getattr(s, attr) is not None)
+        if values:
+            print(f"  {label:<16} median {percentile(values, 0.5):8.1f} ms   worst {values[-1]:8.1f} ms"
+                  f"{'' if len(values) == len(summaries) else f'   (reached in {len(values)}/{len(summaries)})'}")
+        else:
+            print(f"  {label:<16} never reached")
+
+    counts: Dict[str, int] = {}
+    for s in summaries:
+        for iid in s.stragglers:
+            counts[iid] = counts.get(iid, 0) + 1
+    if counts:
+        by_device: Dict[str, List[TargetResult]] = {}
+        for r in rows:
+            if r.intersection in counts:
+                by_device.setdefault(r.intersection, []).append(r)
+        print(f"\n  🐢 Stragglers ({len(counts)} device(s)):")
+        for iid, c in sorted(counts.items(), key=lambda kv: -kv[1])[:top]:
+            times = [r.t_ack_ms for r in by_device[iid]]
+            missing = sum(1 for t in times if t is None)
+            acked = [t for t in times if t is not None]
+            detail = f"worst ack {max(acked):.1f} ms" if acked else "never acked"
+            print(f"    {iid:<12} {c}/{len(summaries)} round(s), {detail}"
+                  f"{f', {missing} timeout(s)' if missing else ''}")
+        if len(counts) > top:
+            print(f"    ... {len(counts) - top} more")
+    print("=" * 72)
+
+
+def save_csv(rows: List[TargetResult], path: str):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["round", "intersection", "t_send_ms", "t_ack_ms", "rtt_ms", "ok", "err"])
+        for r in rows:
+            writer.writerow([r.round, r.intersection, f"{r.t_send_ms:.3f}",
+                             "" if r.t_ack_ms is None else f"{r.t_ack_ms:.3f}",
+                             "" if r.rtt_ms is None else f"{r.rtt_ms:.3f}",
+                             "" if r.ok is None else int(r.ok), r.err or ""])
+    print(f"💾 Saved: {path}")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Broadcast one command to N intersections and time until all have acked',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python broadcast_cmd.py --host 127.0.0.1 --devices 20 --first-id 301 --mocks thread
+  python broadcast_cmd.py --host 127.0.0.1 --city sim --devices 5000 --mocks virtual --rounds 5
+  python broadcast_cmd.py --host 127.0.0.1 --discover --type EMERGENCY   # every online device, then AUTO
+  python broadcast_cmd.py --host 127.0.0.1 --ids 001,002 --type SET_MODE --mode AUTO
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) instead of using --host')
+    parser.add_argument('--city', default='demo', help='City ID')
+    parser.add_argument('--devices', type=int, default=10, help='Number of targets')
+    parser.add_argument('--first-id', type=int, default=1, help='First intersection id (ids are zero-padded)')
+    parser.add_argument('--ids', default=None, help='Comma-separated intersection ids (overrides --devices)')
+    parser.add_argument('--discover', action='store_true',
+                        help='Target every intersection whose retained status is online')
+    parser.add_argument('--type', default='PING', help='Command type (EMERGENCY for a drill)')
+    parser.add_argument('--mode', default=None, help='mode field (SET_MODE)')
+    parser.add_argument('--rounds', type=int, default=1, help='Broadcasts to send')
+    parser.add_argument('--warmup', type=int, default=None,
+                        help='Unmeasured PING broadcasts first (default: 1 with --mocks, 0 for a running fleet)')
+    parser.add_argument('--gap-s', type=float, default=1.0, help='Pause between rounds (s)')
+    parser.add_argument('--restore', dest='restore', action='store_true', default=None,
+                        help='Broadcast SET_MODE AUTO afterwards (default for --type EMERGENCY)')
+    parser.add_argument('--no-restore', dest='restore', action='store_false',
+                        help='Leave the devices in the broadcast state')
+    parser.add_argument('--qos', type=int, choices=[0, 1, 2], default=1, help='cmd/ack QoS')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Ack deadline per target (s)')
+    parser.add_argument('--straggler-factor', type=float, default=3.0,
+                        help='Acked later than this x the median ack time counts as straggler')
+    parser.add_argument('--mocks', choices=['process', 'thread', 'virtual', 'none'], default='none',
+                        help='Start the target fleet (virtual: one connection acks for all)')
+    parser.add_argument('--ack_delay_ms', type=int, default=0, help='Mock ack delay (ms, process/thread)')
+    parser.add_argument('--ack_jitter_ms', type=int, default=0, help='Mock extra random ack delay (ms)')
+    parser.add_argument('--ready-timeout', type=float, default=30.0, help='Seconds to wait for all targets online')
+    parser.add_argument('--top', type=int, default=10, help='Stragglers listed')
+    parser.add_argument('--csv', default=None, help='Save per-target results as CSV')
+    args = parser.parse_args()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        start_embedded_broker(args)
+
+    if args.discover and args.mocks != "none":
+        parser.error("--discover targets a running fleet; use it with --mocks none")
+    if args.warmup is None:
+        args.warmup = 1 if args.mocks != "none" else 0
+    if args.restore is None:
+        args.restore = args.type == "EMERGENCY"
+    cmd = {"type": args.type}
+    if args.mode:
+        cmd["mode"] = args.mode
+
+    fleet, mocks, watcher = None, [], None
+    try:
+        if args.mocks == "virtual":
+            fleet = VirtualFleet(args)
+            if not fleet.subscribed.wait(5.0):
+                print("❌ Virtual fleet: no SUBACK")
+                sys.exit(2)
+        else:
+            watcher = StatusWatcher(args.host, args.port, args.user, args.password, args.city,
+                                    accept_retained=args.mocks == "none")
+            if not watcher.subscribed.wait(5.0):
+                print("❌ No SUBACK for the status topic")
+                sys.exit(2)
+        bcast = Broadcaster(args)
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(2)
+
+    try:
+        if args.discover:
+            time.sleep(1.0)                     # let the retained statuses arrive
+            with watcher.cond:
+                ids = sorted(i for i, online in watcher.online.items() if online)
+        elif args.ids:
+            ids = [i.strip() for i in args.ids.split(",") if i.strip()]
+        else:
+            width = max(3, len(str(args.first_id + args.devices - 1)))
+            ids = [f"{args.first_id + n:0{width}d}" for n in range(args.devices)]
+        if not ids:
+            print("❌ No targets")
+            sys.exit(1)
+
+        print("\n" + "=" * 72)
+        print(f"📢 BROADCAST {args.type} -> {len(ids)} intersection(s) in city/{args.city} "
+              f"({ids[0]}..{ids[-1]}), QoS {args.qos}, mocks: {args.mocks}")
+        print("=" * 72)
+
+        if args.mocks in ("process", "thread"):
+            mocks = start_mocks(ids, args)
+        if watcher is not None:
+            t_ready = time.perf_counter()
+            missing = watcher.wait_ready(ids, args.ready_timeout)
+            if missing:
+                print(f"⚠️ {len(missing)}/{len(ids)} target(s) not online: "
+                      f"{', '.join(missing[:10])}{' ...' if len(missing) > 10 else ''} (broadcasting anyway)")
+            else:
+                print(f"✅ All {len(ids)} targets online ({(time.perf_counter() - t_ready) * 1000:.0f} ms)")
+        if not bcast.subscribed.wait(5.0):
+            print("❌ No SUBACK for the ack topic")
+            sys.exit(2)
+
+        for _ in range(args.warmup):
+            t_warm = time.perf_counter()
+            futures = bcast.broadcast(ids, {"type": "PING"})
+            bcast.commands.drain()
+            acked = sum(1 for f in futures.values() if f.exception() is None)
+            print(f"🔥 Warm-up PING: {acked}/{len(ids)} acked in {(time.perf_counter() - t_warm) * 1000:.0f} ms")
+            time.sleep(args.gap_s)
+
+        rows: List[TargetResult] = []
+        summaries: List[RoundSummary] = []
+        for n in range(1, args.rounds + 1):
+            if n > 1:
+                time.sleep(args.gap_s)
+            round_rows, summary = run_round(bcast, ids, cmd, n, args.straggler_factor)
+            rows.extend(round_rows)
+            summaries.append(summary)
+            print_round(summary)
+
+        if args.restore:
+            acked = sorted({r.intersection for r in rows if r.ok})
+            futures = bcast.broadcast(acked, {"type": "SET_MODE", "mode": "AUTO"})
+            bcast.commands.drain()
+            restored = sum(1 for f in futures.values() if f.exception() is None and f.result().ok)
+            print(f"↩️ Restored AUTO on {restored}/{len(acked)} device(s)")
+    finally:
+        bcast.close()
+        if watcher is not None:
+            watcher.close()
+        if fleet is not None:
+            fleet.stop()
+        if mocks:
+            print("🛑 Stopping devices...")
+            stop_mocks(mocks)
+
+    print_summary(summaries, rows, args.top)
+    if args.csv:
+        save_csv(rows, args.csv)
+    sys.exit(0 if all(s.all_ms is not None and not s.failed for s in summaries) else 1)
+
+
+if __name__ == "__main__":
+    main()
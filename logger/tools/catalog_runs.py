@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Benchmark Run Catalog - Traffic Light MQTT Demo
+Indexes every results directory (bench_*, run_*, ...) into a local SQLite DB.
+
+A run is any directory containing a summary.csv, or a meta.json plus the
+sweep.csv of run_benchmark_report --sweep (indexed with kind 'sweep', one case
+per offered rate). Scans are incremental: a run
+is re-read only when its file listing (relpath, size, mtime) changed, and
+only changed files are re-hashed.
+
+Usage:
+    python catalog_runs.py scan --root results --root ../../results
+    python catalog_runs.py list --last 20
+    python catalog_runs.py query --pad 512 --metric p95 --last 30
+    python catalog_runs.py query --kind sweep --metric p99 --last 5
+    python catalog_runs.py sql "SELECT name, p95 FROM cases JOIN runs ON runs.id = run_id"
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_DB = "results/catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    path        TEXT UNIQUE NOT NULL,
+    name        TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    started_at  TEXT,
+    fingerprint TEXT NOT NULL,
+    indexed_at  TEXT NOT NULL,
+    params      TEXT,
+    environment TEXT
+);
+CREATE TABLE IF NOT EXISTS cases (
+    run_id      INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    case_name   TEXT NOT NULL,
+    pad_bytes   INTEGER,
+    count       INTEGER,
+    interval_ms REAL,
+    sent        INTEGER,
+    received    INTEGER,
+    lost        INTEGER,
+    loss_rate   REAL,
+    mean        REAL,
+    median      REAL,
+    std         REAL,
+    min         REAL,
+    max         REAL,
+    p50         REAL,
+    p75         REAL,
+    p90         REAL,
+    p95         REAL,
+    p99         REAL,
+    outliers    INTEGER,
+    payload_bytes_mean REAL,
+    status      TEXT,
+    reason      TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    run_id   INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    relpath  TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256   TEXT NOT NULL,
+    PRIMARY KEY (run_id, relpath)
+);
+CREATE INDEX IF NOT EXISTS idx_cases_pad ON cases(pad_bytes, run_id);
+CREATE INDEX IF NOT EXISTS idx_cases_run ON cases(run_id);
+CREATE INDEX IF NOT EXISTS idx_runs_started ON runs(started_at);
+"""
+
+CASE_COLUMNS = ['case_name', 'pad_bytes', 'count', 'interval_ms', 'sent', 'received', 'lost',
+                'loss_rate', 'mean', 'median', 'std', 'min', 'max', 'p50', 'p75', 'p90',
+                'p95', 'p99', 'outliers', 'payload_bytes_mean', 'status', 'reason']
+
+METRICS = ['mean', 'median', 'std', 'min', 'max', 'p50', 'p75', 'p90', 'p95', 'p99', 'loss_rate']
+
+TIMESTAMP_RE = re.compile(r'(\d{8})_(\d{4,6})')
+
+SWEEP_FILE = 'sweep.csv'
+
+
+# =============================================================================
+# DATABASE
+# =============================================================================
+
+def open_db(db_file: str) -> sqlite3.Connection:
+    directory = os.path.dirname(db_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+# =============================================================================
+# DISCOVERY
+# =============================================================================
+
+def is_sweep_run(filenames) -> bool:
+    """run_benchmark_report --sweep output: meta.json + sweep.csv, no summary.csv."""
+    return 'summary.csv' not in filenames and SWEEP_FILE in filenames and 'meta.json' in filenames
+
+
+def find_runs(roots: List[str]) -> List[str]:
+    """Every directory under the roots that contains a summary.csv or a sweep run."""
+    runs = []
+    for root in roots:
+        if not os.path.isdir(root):
+            print(f"⚠️ Results root not found: {root}")
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            if 'summary.csv' in filenames or is_sweep_run(filenames):
+                runs.append(os.path.abspath(dirpath))
+    return runs
+
+
+def list_files(run_dir: str) -> Dict[str, Tuple[int, int]]:
+    """relpath -> (size, mtime_ns) for every file in the run directory."""
+    listing = {}
+    for dirpath, _, filenames in os.walk(run_dir):
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            st = os.stat(full)
+            listing[os.path.relpath(full, run_dir).replace(os.sep, '/')] = (st.st_size, st.st_mtime_ns)
+    return listing
+
+
+def fingerprint(listing: Dict[str, Tuple[int, int]]) -> str:
+    h = hashlib.sha1()
+    for relpath in sorted(listing):
+        size, mtime_ns = listing[relpath]
+        h.update(f"{relpath}\0{size}\0{mtime_ns}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# =============================================================================
+# PARSING
+# =============================================================================
+
+def _number(value: Optional[str], cast=float):
+    if value is None or value.strip() in ('', 'NA', 'N/A'):
+        return None
+    try:
+        return cast(float(value))
+    except ValueError:
+        return None
+
+
+def parse_summary(summary_file: str) -> List[dict]:
+    """Rows of a run_benchmark_report or run_experiments summary.csv."""
+    with open(summary_file, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    cases = []
+    for row in rows:
+        cases.append({
+            'case_name': row.get('case') or row.get('file') or '?',
+            'pad_bytes': _number(row.get('pad_bytes'), int),
+            'count': _number(row.get('count'), int),
+            'interval_ms': _number(row.get('interval_ms')),
+            'sent': _number(row.get('sent'), int),
+            'received': _number(row.get('received'), int),
+            'lost': _number(row.get('lost'), int),
+            'loss_rate': _number(row.get('loss_rate')),
+            'mean': _number(row.get('mean')),
+            'median': _number(row.get('median')),
+            'std': _number(row.get('std')),
+            'min': _number(row.get('min')),
+            'max': _number(row.get('max')),
+            'p50': _number(row.get('p50')),
+            'p75': _number(row.get('p75')),
+            'p90': _number(row.get('p90')),
+            'p95': _number(row.get('p95')),
+            'p99': _number(row.get('p99')),
+            'outliers': _number(row.get('outliers'), int),
+            'payload_bytes_mean': _number(row.get('payload_bytes_mean')),
+            'status': row.get('status') or None,
+            'reason': row.get('reason') or None,
+        })
+    return cases
+
+
+def parse_sweep(sweep_file: str) -> List[dict]:
+    """Rows of a run_benchmark_report --sweep sweep.csv, one case per offered rate."""
+    with open(sweep_file, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    cases = []
+    for row in rows:
+        offered = _number(row.get('offered_hz'))
+        sent = _number(row.get('sent'), int)
+        received = _number(row.get('received'), int)
+        ok = _number(row.get('ok'), int)
+        cases.append({
+            'case_name': f"sweep_{row.get('offered_hz') or '?'}hz_{row.get('phase') or 'ramp'}",
+            'pad_bytes': _number(row.get('pad_bytes'), int),
+            'count': _number(row.get('count'), int),
+            'interval_ms': round(1000.0 / offered, 3) if offered else None,
+            'sent': sent,
+            'received': received,
+            'lost': sent - received if sent is not None and received is not None else None,
+            'loss_rate': _number(row.get('loss_rate')),
+            'mean': _number(row.get('mean')),
+            'median': _number(row.get('p50')),
+            'std': None,
+            'min': None,
+            'max': _number(row.get('max')),
+            'p50': _number(row.get('p50')),
+            'p75': None,
+            'p90': None,
+            'p95': _number(row.get('p95')),
+            'p99': _number(row.get('p99')),
+            'outliers': None,
+            'payload_bytes_mean': None,
+            'status': None if ok is None else ('PASS' if ok else 'FAIL'),
+            'reason': row.get('reason') or None,
+        })
+    return cases
+
+
+def parse_started_at(run_dir: str, meta: dict) -> Optional[str]:
+    """Run timestamp from meta.json, the directory name, or the report header."""
+    if meta.get('created_at'):
+        return meta['created_at']
+
+    for part in reversed(run_dir.replace(os.sep, '/').split('/')):
+        m = TIMESTAMP_RE.search(part)
+        if m:
+            time_part = m.group(2).ljust(6, '0')
+            return datetime.strptime(m.group(1) + time_part, "%Y%m%d%H%M%S").isoformat()
+
+    report = os.path.join(run_dir, 'report.md')
+    if os.path.exists(report):
+        with open(report, encoding='utf-8') as f:
+            for line in f:
+                m = re.search(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})', line)
+                if m:
+                    return m.group(1).replace(' ', 'T')
+    return None
+
+
+def parse_report_environment(run_dir: str) -> dict:
+    """Fallback environment: the setup table of report.md (older runs)."""
+    env = {}
+    report = os.path.join(run_dir, 'report.md')
+    if not os.path.exists(report):
+        return env
+    with open(report, encoding='utf-8') as f:
+        for line in f:
+            m = re.match(r'\|\s*(Broker|Edge Device|QoS cmd/ack)\s*\|\s*(.+?)\s*\|', line)
+            if m:
+                env[m.group(1)] = m.group(2)
+    return env
+
+
+def derive_params(cases: List[dict]) -> dict:
+    return {
+        'cases': [c['pad_bytes'] for c in cases],
+        'count': sorted({c['count'] for c in cases if c['count'] is not None}),
+        'interval_ms': sorted({c['interval_ms'] for c in cases if c['interval_ms'] is not None}),
+    }
+
+
+def run_identity(run_dir: str) -> Tuple[str, str]:
+    """(name, kind) from the nearest 'bench_2026...'-style path component."""
+    for part in reversed(run_dir.replace(os.sep, '/').split('/')):
+        m = re.match(r'([a-z]+)_\d', part)
+        if m:
+            return part, m.group(1)
+    return os.path.basename(run_dir), 'other'
+
+
+# =============================================================================
+# INDEXING
+# =============================================================================
+
+def index_run(conn: sqlite3.Connection, run_dir: str, listing: Dict[str, Tuple[int, int]],
+              fp: str, run_id: Optional[int]):
+    """(Re)index one run directory. Only files whose size/mtime changed are re-hashed."""
+    meta = {}
+    meta_file = os.path.join(run_dir, 'meta.json')
+    if os.path.exists(meta_file):
+        try:
+            with open(meta_file, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+
+    sweep = not os.path.exists(os.path.join(run_dir, 'summary.csv'))
+    if sweep:
+        cases = parse_sweep(os.path.join(run_dir, SWEEP_FILE))
+    else:
+        cases = parse_summary(os.path.join(run_dir, 'summary.csv'))
+    params = meta.get('params') or derive_params(cases)
+    environment = meta.get('environment') or parse_report_environment(run_dir)
+
+    known = {}
+    if run_id is not None:
+        for relpath, size, mtime_ns, digest in conn.execute(
+                "SELECT relpath, size, mtime_ns, sha256 FROM files WHERE run_id = ?", (run_id,)):
+            known[relpath] = (size, mtime_ns, digest)
+
+    name, kind = run_identity(run_dir)
+    if sweep:
+        kind = 'sweep'
+    row = (run_dir, name, kind, parse_started_at(run_dir, meta),
+           fp, datetime.now().isoformat(timespec='seconds'),
+           json.dumps(params, sort_keys=True), json.dumps(environment, sort_keys=True))
+    if run_id is None:
+        cur = conn.execute(
+            "INSERT INTO runs (path, name, kind, started_at, fingerprint, indexed_at, params, environment) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+        run_id = cur.lastrowid
+    else:
+        conn.execute(
+            "UPDATE runs SET path = ?, name = ?, kind = ?, started_at = ?, fingerprint = ?, "
+            "indexed_at = ?, params = ?, environment = ? WHERE id = ?", row + (run_id,))
+        conn.execute("DELETE FROM cases WHERE run_id = ?", (run_id,))
+        conn.execute("DELETE FROM files WHERE run_id = ?", (run_id,))
+
+    conn.executemany(
+        f"INSERT INTO cases (run_id, {', '.join(CASE_COLUMNS)}) "
+        f"VALUES (?, {', '.join('?' for _ in CASE_COLUMNS)})",
+        [(run_id,) + tuple(c[k] for k in CASE_COLUMNS) for c in cases])
+
+    files = []
+    for relpath, (size, mtime_ns) in listing.items():
+        prev = known.get(relpath)
+        if prev and prev[0] == size and prev[1] == mtime_ns:
+            digest = prev[2]
+        else:
+            digest = sha256_file(os.path.join(run_dir, relpath))
+        files.append((run_id, relpath, size, mtime_ns, digest))
+    conn.executemany("INSERT INTO files (run_id, relpath, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                     files)
+
+
+def scan(conn: sqlite3.Connection, roots: List[str], prune: bool = True) -> dict:
+    """Incrementally index all runs under the roots."""
+    existing = {path: (run_id, fp) for run_id, path, fp in
+                conn.execute("SELECT id, path, fingerprint FROM runs")}
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'removed': 0, 'errors': 0}
+    root_paths = [os.path.abspath(r) for r in roots]
+
+    seen = set()
+    for run_dir in find_runs(roots):
+        seen.add(run_dir)
+        listing = list_files(run_dir)
+        fp = fingerprint(listing)
+        run_id, old_fp = existing.get(run_dir, (None, None))
+        if old_fp == fp:
+            counts['unchanged'] += 1
+            continue
+        try:
+            with conn:
+                index_run(conn, run_dir, listing, fp, run_id)
+            counts['changed' if run_id is not None else 'new'] += 1
+        except (OSError, csv.Error, sqlite3.Error) as e:
+            counts['errors'] += 1
+            print(f"❌ Failed to index {run_dir}: {e}")
+
+    if prune:
+        with conn:
+            for path, (run_id, _) in existing.items():
+                under_root = any(path == r or path.startswith(r + os.sep) for r in root_paths)
+                if under_root and path not in seen:
+                    conn.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+                    counts['removed'] += 1
+    return counts
+
+
+# =============================================================================
+# QUERIES
+# =============================================================================
+
+def query_metric(conn: sqlite3.Connection, metric: str, pad_bytes: Optional[int] = None,
+                 last: int = 30, kind: Optional[str] = None) -> List[tuple]:
+    """Metric per case over the `last` most recent matching runs (newest first)."""
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    where, params = [], []
+    if pad_bytes is not None:
+        where.append("c.pad_bytes = ?")
+        params.append(pad_bytes)
+    if kind:
+        where.append("r.kind = ?")
+        params.append(kind)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    sql = (f"SELECT r.started_at, r.name, c.case_name, c.pad_bytes, c.{metric} "
+           f"FROM cases c JOIN runs r ON r.id = c.run_id "
+           f"WHERE r.id IN (SELECT r.id FROM runs r JOIN cases c ON c.run_id = r.id {where_sql} "
+           f"GROUP BY r.id ORDER BY r.started_at DESC, r.id DESC LIMIT ?) "
+           f"{'AND ' + ' AND '.join(where) if where else ''} "
+           f"ORDER BY r.started_at DESC, r.id DESC, c.pad_bytes, c.interval_ms DESC, c.case_name")
+    return conn.execute(sql, params + [last] + params).fetchall()
+
+
+def print_rows(headers: List[str], rows: List[tuple]):
+    def fmt(v):
+        if v is None:
+            return "N/A"
+        if isinstance(v, float):
+            return f"{v:.2f}"
+        return str(v)
+
+    table = [headers] + [[fmt(v) for v in row] for row in rows]
+    widths = [max(len(r[i]) for r in table) for i in range(len(headers))]
+    for i, row in enumerate(table):
+        print("  " + "  ".join(cell.ljust(w) for cell, w in zip(row, widths)))
+        if i == 0:
+            print("  " + "  ".join("-" * w for w in widths))
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Index and query historical benchmark runs',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python catalog_runs.py scan --root results --root ../../results
+  python catalog_runs.py list --last 20
+  python catalog_runs.py query --pad 512 --metric p95 --last 30
+  python catalog_runs.py query --kind sweep --metric p99 --last 5
+  python catalog_runs.py sql "SELECT kind, COUNT(*) FROM runs GROUP BY kind"
+        """
+    )
+    parser.add_argument('--db', default=DEFAULT_DB, help='SQLite catalog file')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_scan = sub.add_parser('scan', help='Index new/changed run directories')
+    p_scan.add_argument('--root', action='append', default=None,
+                        help='Results root to scan (repeatable, default: results)')
+    p_scan.add_argument('--no-prune', action='store_true', help='Keep runs whose directory is gone')
+
+    p_list = sub.add_parser('list', help='List indexed runs')
+    p_list.add_argument('--last', type=int, default=20, help='Number of runs')
+
+    p_query = sub.add_parser('query', help='Metric per case over recent runs')
+    p_query.add_argument('--metric', default='p95', choices=METRICS, help='Metric column')
+    p_query.add_argument('--pad', type=int, default=None, help='Filter by pad_bytes')
+    p_query.add_argument('--kind', default=None, help='Filter by run kind (bench, run, sweep, ...)')
+    p_query.add_argument('--last', type=int, default=30, help='Number of most recent runs')
+
+    p_sql = sub.add_parser('sql', help='Run a read-only SQL query')
+    p_sql.add_argument('statement')
+
+    args = parser.parse_args()
+    conn = open_db(args.db)
+
+    t0 = time.perf_counter()
+    if args.command == 'scan':
+        roots = args.root or ['results']
+        counts = scan(conn, roots, prune=not args.no_prune)
+        elapsed = (time.perf_counter() - t0) * 1000
+        print(f"📚 Catalog: {args.db}")
+        print(f"   new={counts['new']} changed={counts['changed']} unchanged={counts['unchanged']} "
+              f"removed={counts['removed']} errors={counts['errors']} ({elapsed:.0f} ms)")
+        sys.exit(1 if counts['errors'] else 0)
+
+    if args.command == 'list':
+        rows = conn.execute(
+            "SELECT r.started_at, r.kind, r.name, COUNT(c.run_id), r.path FROM runs r "
+            "LEFT JOIN cases c ON c.run_id = r.id GROUP BY r.id "
+            "ORDER BY r.started_at DESC, r.id DESC LIMIT ?", (args.last,)).fetchall()
+        print_rows(['started_at', 'kind', 'name', 'cases', 'path'], rows)
+    elif args.command == 'query':
+        rows = query_metric(conn, args.metric, args.pad, args.last, args.kind)
+        print_rows(['started_at', 'run', 'case', 'pad_bytes', args.metric], rows)
+    else:
+        ro = sqlite3.connect(f"file:{os.path.abspath(args.db)}?mode=ro", uri=True)
+        try:
+            cur = ro.execute(args.statement)
+            print_rows([d[0] for d in cur.description or []], cur.fetchall())
+        except sqlite3.Error as e:
+            print(f"❌ SQL error: {e}")
+            sys.exit(1)
+
+    print(f"\n⏱️  {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
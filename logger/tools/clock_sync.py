@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Clock Offset Estimation - Traffic Light MQTT Demo
+NTP-style offset/drift estimate between the logger clock and the edge clock.
+
+A ping is an ordinary command ({"type": "PING"}) on the cmd topic. The edge acks
+it like any unknown command, with its own edge_recv_ts_ms, which gives one
+sample:
+    t_send (local) -> t_edge (edge clock) -> t_recv (local)
+    delay  = t_recv - t_send
+    offset = t_edge - (t_send + t_recv) / 2        (edge - local)
+
+The offset of one sample is only known to +/- delay/2 (unknown path asymmetry),
+so samples are filtered by minimum RTT: within each ping burst only the samples
+within a small slack of the burst's fastest ping are kept. Drift is a linear fit
+of offset over time across bursts (e.g. one before and one after a benchmark
+case).
+
+Every PING takes a slot in the edge's cmd_id idempotency cache (ESP32 firmware:
+CMD_ID_CACHE_SIZE = 10, mock_esp32: 32), so a burst evicts the cmd_ids of
+earlier commands: a retried or duplicated command after a burst is executed
+again instead of being recognized. run_benchmark_report.py therefore only
+probes when asked (--clock-pings N).
+
+Usage:
+    python clock_sync.py --host 127.0.0.1
+    python clock_sync.py --host 127.0.0.1 --pings 50 --bursts 3 --burst-gap-s 5
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+import paho.mqtt.client as mqtt
+
+from command_client import CommandClient, CommandTimeout
+
+# Timestamps above this are epoch ms; below, the edge is reporting uptime
+EPOCH_MS_MIN = 1600000000000
+
+# Drift is only fitted over at least this span (below it, 1 ms timestamp
+# quantization swamps real crystal drift)
+MIN_DRIFT_SPAN_MS = 10000.0
+
+
+# =============================================================================
+# ESTIMATOR
+# =============================================================================
+
+@dataclass
+class ClockSample:
+    t_send_ms: float
+    t_edge_ms: float
+    t_recv_ms: float
+    burst: int = 0
+
+    @property
+    def delay_ms(self) -> float:
+        return self.t_recv_ms - self.t_send_ms
+
+    @property
+    def mid_ms(self) -> float:
+        return (self.t_send_ms + self.t_recv_ms) / 2
+
+    @property
+    def offset_ms(self) -> float:
+        return self.t_edge_ms - self.mid_ms
+
+
+@dataclass
+class ClockEstimate:
+    offset_ms: float          # edge - local at ref_time_ms
+    uncertainty_ms: float     # +/- bound on offset_ms
+    drift_ppm: float          # edge clock rate error relative to local
+    ref_time_ms: float        # local time the offset refers to
+    samples: int
+    used: int
+    min_delay_ms: float
+
+    def offset_at(self, t_local_ms: float) -> float:
+        return self.offset_ms + self.drift_ppm * 1e-6 * (t_local_ms - self.ref_time_ms)
+
+    def to_local(self, t_edge_ms: float) -> float:
+        """Convert an edge timestamp to the local clock."""
+        # offset_at() takes local time; edge time is close enough to evaluate drift
+        return t_edge_ms - self.offset_at(t_edge_ms - self.offset_ms)
+
+
+class ClockOffsetEstimator:
+    """Collects ping samples and fits offset (+ drift) from the fastest ones."""
+
+    def __init__(self, slack_ratio: float = 0.5, slack_ms: float = 1.0):
+        self.slack_ratio = slack_ratio
+        self.slack_ms = slack_ms
+        self.samples: List[ClockSample] = []
+
+    def add(self, t_send_ms: float, t_edge_ms: float, t_recv_ms: float, burst: int = 0):
+        if t_recv_ms >= t_send_ms:
+            self.samples.append(ClockSample(t_send_ms, t_edge_ms, t_recv_ms, burst))
+
+    def filtered(self) -> List[ClockSample]:
+        """Minimum-RTT filter: per burst, pings with delay <= min * (1 + slack_ratio) + slack_ms."""
+        kept = []
+        for burst in sorted({s.burst for s in self.samples}):
+            group = [s for s in self.samples if s.burst == burst]
+            limit = min(s.delay_ms for s in group) * (1 + self.slack_ratio) + self.slack_ms
+            kept.extend(s for s in group if s.delay_ms <= limit)
+        return kept
+
+    def estimate(self) -> Optional[ClockEstimate]:
+        kept = self.filtered()
+        if not kept:
+            return None
+
+        ref = sum(s.mid_ms for s in kept) / len(kept)
+        xs = [s.mid_ms - ref for s in kept]
+        ys = [s.offset_ms for s in kept]
+        y_mean = sum(ys) / len(ys)
+
+        slope = 0.0
+        sxx = sum(x * x for x in xs)
+        if len({s.burst for s in kept}) > 1 and (max(xs) - min(xs)) >= MIN_DRIFT_SPAN_MS and sxx > 0:
+            slope = sum(x * (y - y_mean) for x, y in zip(xs, ys)) / sxx
+
+        residuals = [y - (y_mean + slope * x) for x, y in zip(xs, ys)]
+        resid_std = (sum(r * r for r in residuals) / len(residuals)) ** 0.5
+        min_delay = min(s.delay_ms for s in kept)
+
+        return ClockEstimate(
+            offset_ms=y_mean,
+            # Asymmetry bound of the best sample, plus scatter of the kept ones
+            uncertainty_ms=min_delay / 2 + resid_std,
+            drift_ppm=slope * 1e6,
+            ref_time_ms=ref,
+            samples=len(self.samples),
+            used=len(kept),
+            min_delay_ms=min_delay,
+        )
+
+
+# =============================================================================
+# PING EXCHANGE
+# =============================================================================
+
+def make_ping() -> dict:
+    return {"cmd_id": str(uuid.uuid4()), "type": "PING", "ts_ms": int(time.time() * 1000)}
+
+
+class PingExchange:
+    """
+    Sends PING commands one at a time through a CommandClient and feeds the
+    replies into a ClockOffsetEstimator (acks reach it via the client's on_ack()).
+    """
+
+    def __init__(self, commands: CommandClient, estimator: ClockOffsetEstimator):
+        self.commands = commands
+        self.estimator = estimator
+        self.burst = 0
+
+    def run_burst(self, count: int, timeout_s: float = 1.0, gap_s: float = 0.005) -> int:
+        """Send count sequential pings (next one after the reply). Returns replies received."""
+        before = len(self.estimator.samples)
+        for _ in range(count):
+            try:
+                ack = self.commands.send(make_ping(), timeout=timeout_s).result()
+            except CommandTimeout:
+                continue
+            edge_ts = ack.payload.get("edge_recv_ts_ms")
+            if isinstance(edge_ts, (int, float)) and edge_ts > 0:
+                self.estimator.add(ack.t_send_ms, float(edge_ts), ack.t_recv_ms, self.burst)
+            time.sleep(gap_s)
+        self.burst += 1
+        return len(self.estimator.samples) - before
+
+
+def describe(est: Optional[ClockEstimate]) -> str:
+    if est is None:
+        return "no clock samples (edge ack has no edge_recv_ts_ms?)"
+    clock = "epoch" if est.offset_ms + est.ref_time_ms > EPOCH_MS_MIN else "uptime"
+    return (f"offset {est.offset_ms:+.1f} ms ± {est.uncertainty_ms:.1f} ms, "
+            f"drift {est.drift_ppm:+.0f} ppm, {est.used}/{est.samples} samples, "
+            f"min RTT {est.min_delay_ms:.1f} ms, edge clock: {clock}")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Estimate the edge clock offset and drift with PING commands',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python clock_sync.py --host 127.0.0.1
+  python clock_sync.py --host 127.0.0.1 --pings 50 --bursts 3 --burst-gap-s 5
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) and mock_esp32 instead of using --host')
+    parser.add_argument('--city', default='demo', help='City name')
+    parser.add_argument('--intersection', default='001', help='Intersection ID')
+    parser.add_argument('--pings', type=int, default=20, help='Pings per burst')
+    parser.add_argument('--bursts', type=int, default=2, help='Number of bursts (>1 to fit drift)')
+    parser.add_argument('--burst-gap-s', type=float, default=2.0, help='Pause between bursts')
+    parser.add_argument('--slack', type=float, default=0.5,
+                        help='Keep pings with RTT <= fastest * (1 + slack) + 1ms in each burst')
+    args = parser.parse_args()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        start_embedded_broker(args, with_mock=True)
+
+    base = f"city/{args.city}/intersection/{args.intersection}"
+    estimator = ClockOffsetEstimator(slack_ratio=args.slack)
+    connected = threading.Event()
+
+    client = mqtt.Client(
+        client_id=f"clock-sync-{uuid.uuid4().hex[:8]}",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+    )
+    client.username_pw_set(args.user, args.password)
+    commands = CommandClient(client, f"{base}/cmd")
+    pinger = PingExchange(commands, estimator)
+
+    def on_connect(c, userdata, flags, rc, properties=None):
+        if rc == 0:
+            c.subscribe(f"{base}/ack", qos=1)
+            connected.set()
+
+    def on_message(c, userdata, msg):
+        t_recv = time.time() * 1000
+        try:
+            commands.on_ack(json.loads(msg.payload.decode()), t_recv)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            pass
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+
+    try:
+        client.connect(args.host, args.port, keepalive=60)
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(1)
+    client.loop_start()
+    try:
+        if not connected.wait(5.0):
+            print("❌ Connection timeout")
+            sys.exit(1)
+        time.sleep(0.2)  # let the subscription settle
+        for b in range(args.bursts):
+            got = pinger.run_burst(args.pings)
+            print(f"🏓 Burst {b + 1}/{args.bursts}: {got}/{args.pings} replies")
+            if b < args.bursts - 1:
+                time.sleep(args.burst_gap_s)
+    finally:
+        commands.close()
+        client.loop_stop()
+        client.disconnect()
+
+    est = estimator.estimate()
+    print(f"\n🕐 {describe(est)}")
+    sys.exit(0 if est else 1)
+
+
+if __name__ == "__main__":
+    main()
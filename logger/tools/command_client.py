@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Command Client - Traffic Light MQTT Demo
+Future-based command/ack matching shared by smoke_test, logger, run_benchmark_report
+and clock_sync.
+
+    commands = CommandClient(client, "city/demo/intersection/001/cmd", qos=1)
+    # owner's on_message: commands.on_ack(json.loads(msg.payload), time.time() * 1000)
+    fut = commands.send({"cmd_id": ..., "type": "SET_MODE", "mode": "AUTO"}, timeout=5.0)
+    ack = fut.result()          # Ack, or raises CommandTimeout at the deadline
+
+Any number of commands can be in flight; each resolves when its ack arrives
+(timestamped in the MQTT callback, so RTT has no polling quantization) or fails
+with CommandTimeout when its deadline passes. One reaper thread handles all
+deadlines. The client does not own the MQTT connection: the owner subscribes
+to the ack topic and routes ack payloads to on_ack().
+
+Nagle's algorithm is turned off on the connection's socket: otherwise a command
+published right after an ack (sequential pings, window 1) is held back until the
+broker's delayed TCP ACK for our PUBACK, adding ~40 ms to its RTT.
+
+Usage:
+    python command_client.py --host 127.0.0.1 --count 200 --window 50
+"""
+
+import argparse
+import heapq
+import json
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, wait
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+DEFAULT_TIMEOUT_S = 5.0
+
+
+class CommandTimeout(TimeoutError):
+    """No ack for a command before its deadline."""
+
+
+@dataclass
+class Ack:
+    cmd_id: str
+    payload: dict
+    t_send_ms: float      # local clock, just before publish
+    t_recv_ms: float      # local clock, when the ack message arrived
+
+    @property
+    def rtt_ms(self) -> float:
+        return self.t_recv_ms - self.t_send_ms
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.payload.get("ok"))
+
+
+class CommandFuture(Future):
+    """Future[Ack] that also carries the command, its JSON payload and send time."""
+
+    def __init__(self, cmd: dict, payload: str, t_send_ms: float, deadline: float):
+        super().__init__()
+        self.cmd = cmd
+        self.cmd_id = cmd["cmd_id"]
+        self.payload = payload
+        self.t_send_ms = t_send_ms
+        self.deadline = deadline
+
+
+class CommandClient:
+    """
+    Publishes commands and resolves one Future per cmd_id from the acks routed to on_ack().
+    topic_cmd is the default cmd topic; send(topic=...) lets one client drive many devices.
+    """
+
+    def __init__(self, client: mqtt.Client, topic_cmd: Optional[str], qos: int = 1,
+                 timeout: float = DEFAULT_TIMEOUT_S):
+        self.client = client
+        self.topic_cmd = topic_cmd
+        self.qos = qos
+        self.timeout = timeout
+        self.pending: Dict[str, CommandFuture] = {}
+        self._deadlines: List[tuple] = []
+        self._cond = threading.Condition()
+        self._reaper: Optional[threading.Thread] = None
+        self._closed = False
+        self._nodelay_sock = None
+
+    def _disable_nagle(self):
+        """Set TCP_NODELAY once per socket (paho leaves Nagle on; reconnects get a new socket)."""
+        sock = self.client.socket()
+        if sock is None or sock is self._nodelay_sock:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass  # not a TCP socket (e.g. websockets/unix); nothing to tune
+        self._nodelay_sock = sock
+
+    def send(self, cmd: dict, timeout: Optional[float] = None,
+             topic: Optional[str] = None) -> CommandFuture:
+        """Publish cmd (a cmd_id is added if missing); the Future resolves to an Ack."""
+        cmd.setdefault("cmd_id", str(uuid.uuid4()))
+        payload = json.dumps(cmd)
+        t_send = time.time() * 1000
+        fut = CommandFuture(cmd, payload, t_send,
+                            time.monotonic() + (self.timeout if timeout is None else timeout))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("command client is closed")
+            self.pending[fut.cmd_id] = fut
+            heapq.heappush(self._deadlines, (fut.deadline, fut.cmd_id))
+            self._cond.notify()
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, daemon=True)
+                self._reaper.start()
+        self._disable_nagle()
+        self.client.publish(topic or self.topic_cmd, payload, qos=self.qos)
+        return fut
+
+    def on_ack(self, payload: dict, t_recv_ms: float) -> bool:
+        """Resolve the command an ack answers. Returns True if it was one of ours."""
+        with self._cond:
+            fut = self.pending.pop(payload.get("cmd_id"), None)
+        if fut is None:
+            return False  # not ours, a duplicate, or already timed out
+        fut.set_result(Ack(fut.cmd_id, payload, fut.t_send_ms, t_recv_ms))
+        return True
+
+    def _reap(self):
+        """Fail futures whose deadline passed (one thread for all commands)."""
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                expired = []
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, cmd_id = heapq.heappop(self._deadlines)
+                    fut = self.pending.pop(cmd_id, None)
+                    if fut is not None:
+                        expired.append(fut)
+                if expired:
+                    self._cond.release()
+                    try:
+                        for fut in expired:
+                            fut.set_exception(CommandTimeout(f"no ack for {fut.cmd_id}"))
+                    finally:
+                        self._cond.acquire()
+                    continue
+                self._cond.wait(self._deadlines[0][0] - now if self._deadlines else None)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every command sent so far has an ack or has timed out."""
+        with self._cond:
+            futures = list(self.pending.values())
+        done, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def close(self):
+        """Stop the reaper; commands still in flight fail with CommandTimeout."""
+        with self._cond:
+            self._closed = True
+            leftover = list(self.pending.values())
+            self.pending.clear()
+            self._cond.notify()
+        for fut in leftover:
+            fut.set_exception(CommandTimeout(f"client closed before ack for {fut.cmd_id}"))
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pipelined command/ack round trips with a fixed number of commands in flight',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python command_client.py --host 127.0.0.1
+  python command_client.py --host 127.0.0.1 --count 1000 --window 100 --timeout 2
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) and mock_esp32 instead of using --host')
+    parser.add_argument('--city', default='demo', help='City ID')
+    parser.add_argument('--intersection', default='001', help='Intersection ID')
+    parser.add_argument('--count', type=int, default=200, help='Commands to send')
+    parser.add_argument('--window', type=int, default=20, help='Max commands in flight')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_S, help='Ack deadline per command (s)')
+    parser.add_argument('--qos', type=int, choices=[0, 1, 2], default=1, help='cmd/ack QoS')
+    args = parser.parse_args()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        start_embedded_broker(args, with_mock=True)
+
+    base = f"city/{args.city}/intersection/{args.intersection}"
+    ready = threading.Event()
+    client = mqtt.Client(
+        client_id=f"cmd-client-{uuid.uuid4().hex[:8]}",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+    )
+    client.username_pw_set(args.user, args.password)
+    commands = CommandClient(client, f"{base}/cmd", qos=args.qos, timeout=args.timeout)
+
+    def on_connect(c, userdata, flags, rc, properties=None):
+        if rc == 0:
+            c.subscribe(f"{base}/ack", qos=args.qos)
+
+    def on_message(c, userdata, msg):
+        t_recv = time.time() * 1000
+        try:
+            commands.on_ack(json.loads(msg.payload.decode()), t_recv)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            pass
+
+    client.on_connect = on_connect
+    client.on_subscribe = lambda c, userdata, mid, reason_codes, properties=None: ready.set()
+    client.on_message = on_message
+    try:
+        client.connect(args.host, args.port, keepalive=60)
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(2)
+    client.loop_start()
+
+    try:
+        if not ready.wait(5.0):
+            print("❌ Connection timeout")
+            sys.exit(2)
+        slots = threading.Semaphore(args.window)
+        futures = []
+        t0 = time.perf_counter()
+        for _ in range(args.count):
+            slots.acquire()
+            fut = commands.send({"type": "SET_MODE", "mode": "AUTO", "ts_ms": int(time.time() * 1000)})
+            fut.add_done_callback(lambda f: slots.release())
+            futures.append(fut)
+        commands.drain()
+        elapsed = time.perf_counter() - t0
+    finally:
+        commands.close()
+        client.loop_stop()
+        client.disconnect()
+
+    rtts = sorted(f.result().rtt_ms for f in futures if f.exception() is None)
+    lost = len(futures) - len(rtts)
+    print(f"📤 {args.count} commands, window {args.window}: {len(rtts)} acked, {lost} timed out, "
+          f"{args.count / elapsed:.0f} cmd/s")
+    if rtts:
+        print(f"📏 RTT p50 {rtts[len(rtts) // 2]:.1f} ms, p99 {rtts[min(int(len(rtts) * 0.99), len(rtts) - 1)]:.1f} ms, "
+              f"max {rtts[-1]:.1f} ms")
+    sys.exit(0 if not lost else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Run Comparison / Regression Gate - Traffic Light MQTT Demo
+Compares a candidate benchmark run against a baseline run, case by case.
+
+Raw files are found anywhere under a run directory by their schema
+(raw_columnar.is_raw_results): raw/case_*.csv of run_benchmark_report,
+cases/<hash>/results_<hash>.csv of run_experiments, or files at the top level;
+the echo calibration (calibration/) is not a case. For every case present in
+both runs (matched by file name, e.g. case_256b), it reports percentile deltas with bootstrap confidence
+intervals and a one-sided Mann-Whitney U test (plus the KS distance). A case
+is a regression only when the shift is statistically significant AND the
+lower CI bound of a gated percentile's relative delta exceeds --min-effect,
+or when loss grows by more than --loss-tolerance percentage points.
+
+Usage:
+    python compare_runs.py results/bench_20260208_1718 results/bench_20260209_1123
+    python compare_runs.py results/bench_20260208_1716 results/bench_20260208_1718 --percentiles 50,95 --out compare.md
+
+Exit codes:
+    0 = No significant regression
+    1 = Significant regression in at least one case
+    2 = Input error (missing runs / no common cases)
+"""
+
+import argparse
+import math
+import os
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from raw_columnar import CALIBRATION_DIR, is_raw_results, read_results
+
+# Bootstrap resample indices held in memory at once, per run (~16 MB of int64)
+BOOT_MAX_CELLS = 2_000_000
+
+
+@dataclass
+class PercentileDelta:
+    q: int
+    base: float
+    cand: float
+    delta: float
+    rel: float
+    ci_low: float
+    ci_high: float
+
+
+@dataclass
+class CaseComparison:
+    case: str
+    base_n: int
+    cand_n: int
+    base_loss: float
+    cand_loss: float
+    percentiles: List[PercentileDelta] = field(default_factory=list)
+    mw_u: float = 0.0
+    mw_p: float = 1.0
+    ks_d: float = 0.0
+    ks_p: float = 1.0
+    regression: bool = False
+    reasons: List[str] = field(default_factory=list)
+
+
+# =============================================================================
+# RAW FILE DISCOVERY
+# =============================================================================
+
+def find_raw_files(run_dir: str) -> Dict[str, Path]:
+    """
+    Case key -> raw file, for every raw per-command file under run_dir (any run
+    layout). Prefers .npy over .csv for the same case. The key is the file stem
+    (case_256b, results_<hash>), or the path relative to run_dir where two files
+    of the run share a stem.
+    """
+    root = Path(run_dir)
+    candidates = [p for p in root.rglob("*") if p.suffix in (".csv", ".npy")
+                  and CALIBRATION_DIR not in p.relative_to(root).parts[:-1] and is_raw_results(str(p))]
+
+    by_case: Dict[Path, Path] = {}
+    for path in sorted(candidates, key=lambda p: p.suffix != ".npy"):
+        by_case.setdefault(path.relative_to(root).with_suffix(""), path)
+    stems = [case.name for case in by_case]
+    return {(case.name if stems.count(case.name) == 1 else case.as_posix()): path
+            for case, path in sorted(by_case.items())}
+
+
+def load_case(path: Path) -> Tuple[np.ndarray, float]:
+    """(sorted RTT samples, loss rate %) for one raw file."""
+    df = read_results(str(path))
+    rtts = df['rtt_ms'].dropna().to_numpy(dtype=float)
+    total = len(df)
+    loss = ((total - len(rtts)) / total * 100) if total else 0.0
+    return np.sort(rtts), loss
+
+
+# =============================================================================
+# STATISTICS
+# =============================================================================
+
+def rankdata(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Average ranks (1-based) and tie-group sizes."""
+    order = np.argsort(values, kind='mergesort')
+    sorted_vals = values[order]
+    _, starts, counts = np.unique(sorted_vals, return_index=True, return_counts=True)
+    avg = starts + (counts + 1) / 2.0
+    ranks = np.empty(len(values), dtype=float)
+    ranks[order] = np.repeat(avg, counts)
+    return ranks, counts
+
+
+def mann_whitney_greater(base: np.ndarray, cand: np.ndarray) -> Tuple[float, float]:
+    """
+    One-sided Mann-Whitney U (H1: candidate stochastically greater).
+    Normal approximation with tie and continuity correction.
+    """
+    n1, n2 = len(cand), len(base)
+    ranks, ties = rankdata(np.concatenate([cand, base]))
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    mu = n1 * n2 / 2.0
+    tie_term = (ties ** 3 - ties).sum() / (n * (n - 1)) if n > 1 else 0.0
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return u, 1.0
+    z = (u - mu - 0.5) / sigma
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def ks_two_sample(base: np.ndarray, cand: np.ndarray) -> Tuple[float, float]:
+    """Two-sample KS distance and asymptotic p-value (inputs sorted)."""
+    grid = np.concatenate([base, cand])
+    cdf_b = np.searchsorted(base, grid, side='right') / len(base)
+    cdf_c = np.searchsorted(cand, grid, side='right') / len(cand)
+    d = float(np.max(np.abs(cdf_b - cdf_c)))
+    en = math.sqrt(len(base) * len(cand) / (len(base) + len(cand)))
+    lam = (en + 0.12 + 0.11 / en) * d
+    if lam < 1e-3:
+        return d, 1.0
+    p = 2 * sum((-1) ** (k - 1) * math.exp(-2 * (k * lam) ** 2) for k in range(1, 101))
+    return d, min(max(p, 0.0), 1.0)
+
+
+def bootstrap_percentile_delta(base: np.ndarray, cand: np.ndarray, q: float,
+                               n_boot: int, rng: np.random.Generator,
+                               confidence: float = 0.95,
+                               max_cells: int = BOOT_MAX_CELLS) -> Tuple[float, float]:
+    """
+    Percentile CI of (cand_q - base_q) / base_q by resampling both runs.
+    Resamples are drawn in batches of at most max_cells indices per run, so
+    memory stays bounded for large runs (n_boot x n never materializes).
+    """
+    batch = max(1, max_cells // max(len(base), len(cand)))
+    rel = np.empty(n_boot)
+    done = 0
+    while done < n_boot:
+        b = min(batch, n_boot - done)
+        qb = np.quantile(base[rng.integers(0, len(base), (b, len(base)))], q, axis=1)
+        qc = np.quantile(cand[rng.integers(0, len(cand), (b, len(cand)))], q, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel[done:done + b] = np.where(qb > 0, (qc - qb) / qb, 0.0)
+        done += b
+    alpha = (1 - confidence) / 2
+    return float(np.quantile(rel, alpha)), float(np.quantile(rel, 1 - alpha))
+
+
+def compare_case(name: str, base_file: Path, cand_file: Path, percentiles: List[int],
+                 n_boot: int, alpha: float, min_effect: float, loss_tolerance: float,
+                 rng: np.random.Generator) -> CaseComparison:
+    base, base_loss = load_case(base_file)
+    cand, cand_loss = load_case(cand_file)
+    result = CaseComparison(case=name, base_n=len(base), cand_n=len(cand),
+                            base_loss=base_loss, cand_loss=cand_loss)
+
+    if cand_loss - base_loss > loss_tolerance:
+        result.regression = True
+        result.reasons.append(f"loss +{cand_loss - base_loss:.2f}pp")
+
+    if len(base) < 2 or len(cand) < 2:
+        result.reasons.append("not enough acked samples for distribution tests")
+        return result
+
+    result.mw_u, result.mw_p = mann_whitney_greater(base, cand)
+    result.ks_d, result.ks_p = ks_two_sample(base, cand)
+
+    for q in percentiles:
+        pb = float(np.quantile(base, q / 100))
+        pc = float(np.quantile(cand, q / 100))
+        lo, hi = bootstrap_percentile_delta(base, cand, q / 100, n_boot, rng, 1 - alpha)
+        result.percentiles.append(PercentileDelta(
+            q=q, base=pb, cand=pc, delta=pc - pb,
+            rel=((pc - pb) / pb) if pb > 0 else 0.0, ci_low=lo, ci_high=hi))
+
+    if result.mw_p < alpha:
+        shifted = [p for p in result.percentiles if p.ci_low > min_effect]
+        if shifted:
+            result.regression = True
+            result.reasons.extend(
+                f"P{p.q} +{p.rel * 100:.1f}% (CI low {p.ci_low * 100:+.1f}%)" for p in shifted)
+    return result
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+def print_comparison(results: List[CaseComparison], alpha: float):
+    print("\n" + "=" * 78)
+    print("📊 RUN COMPARISON (candidate vs baseline)")
+    print("=" * 78)
+    for r in results:
+        verdict = "❌ REGRESSION" if r.regression else "✅ OK"
+        print(f"\n  {r.case}: {verdict}")
+        print(f"    n: {r.base_n} → {r.cand_n}   loss: {r.base_loss:.2f}% → {r.cand_loss:.2f}%")
+        print(f"    Mann-Whitney p={r.mw_p:.4f} (α={alpha})   KS D={r.ks_d:.3f} p={r.ks_p:.4f}")
+        for p in r.percentiles:
+            print(f"    P{p.q:<3} {p.base:>8.2f} → {p.cand:>8.2f} ms  "
+                  f"Δ {p.delta:>+8.2f} ms ({p.rel * 100:+6.1f}%)  "
+                  f"{(1 - alpha) * 100:g}% CI [{p.ci_low * 100:+.1f}%, {p.ci_high * 100:+.1f}%]")
+        if r.reasons:
+            print(f"    → {'; '.join(r.reasons)}")
+    print("\n" + "=" * 78)
+    regressions = [r.case for r in results if r.regression]
+    if regressions:
+        print(f"⚠️ REGRESSION in: {', '.join(regressions)}")
+    else:
+        print("🎉 NO SIGNIFICANT REGRESSION")
+    print("=" * 78 + "\n")
+
+
+def write_markdown(results: List[CaseComparison], baseline: str, candidate: str,
+                   output_file: str, alpha: float):
+    lines = [
+        "# 📊 Run Comparison",
+        "",
+        f"- Baseline: `{baseline}`",
+        f"- Candidate: `{candidate}`",
+        "",
+        f"| Case | Percentile | Baseline (ms) | Candidate (ms) | Δ% | {(1 - alpha) * 100:g}% CI | MW p | KS D | Verdict |",
+        "|------|------------|---------------|----------------|----|--------|------|------|---------|",
+    ]
+    for r in results:
+        verdict = "❌ REGRESSION" if r.regression else "✅ OK"
+        for p in r.percentiles:
+            lines.append(
+                f"| {r.case} | P{p.q} | {p.base:.1f} | {p.cand:.1f} | {p.rel * 100:+.1f}% | "
+                f"[{p.ci_low * 100:+.1f}%, {p.ci_high * 100:+.1f}%] | {r.mw_p:.4f} | {r.ks_d:.3f} | {verdict} |")
+        if not r.percentiles:
+            lines.append(f"| {r.case} | - | - | - | - | - | - | - | {verdict} |")
+    lines.append("")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+    print(f"📝 Saved: {output_file}")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare a candidate benchmark run against a baseline',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exit codes:
+  0 = No significant regression
+  1 = Significant regression
+  2 = Input error
+
+Examples:
+  python compare_runs.py results/bench_20260208_1718 results/bench_20260209_1123
+  python compare_runs.py results/bench_20260208_1716 results/bench_20260208_1718 --percentiles 50,95 --out compare.md
+        """
+    )
+    parser.add_argument('baseline', help='Baseline run directory')
+    parser.add_argument('candidate', help='Candidate run directory')
+    parser.add_argument('--percentiles', default='50,95,99', help='Gated percentiles')
+    parser.add_argument('--alpha', type=float, default=0.01, help='Significance level')
+    parser.add_argument('--min-effect', type=float, default=0.10,
+                        help='Minimum relative percentile increase (CI lower bound) to flag')
+    parser.add_argument('--loss-tolerance', type=float, default=1.0,
+                        help='Allowed loss-rate increase (percentage points)')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='Bootstrap resamples')
+    parser.add_argument('--seed', type=int, default=0, help='Bootstrap RNG seed')
+    parser.add_argument('--out', default=None, help='Markdown output file')
+
+    args = parser.parse_args()
+
+    try:
+        percentiles = [int(x) for x in args.percentiles.split(',')]
+    except ValueError:
+        print("❌ Invalid --percentiles format. Use comma-separated integers.")
+        sys.exit(2)
+
+    for run_dir in (args.baseline, args.candidate):
+        if not os.path.isdir(run_dir):
+            print(f"❌ Run directory not found: {run_dir}")
+            sys.exit(2)
+
+    base_files = find_raw_files(args.baseline)
+    cand_files = find_raw_files(args.candidate)
+    common = sorted(set(base_files) & set(cand_files))
+    if not common:
+        print("❌ No common cases between baseline and candidate")
+        sys.exit(2)
+    for name in sorted(set(base_files) ^ set(cand_files)):
+        print(f"⚠️ Case {name} present in only one run, skipped")
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for name in common:
+        try:
+            results.append(compare_case(name, base_files[name], cand_files[name], percentiles,
+                                        args.bootstrap, args.alpha, args.min_effect,
+                                        args.loss_tolerance, rng))
+        except Exception as e:
+            print(f"❌ Failed to compare {name}: {e}")
+            sys.exit(2)
+
+    print_comparison(results, args.alpha)
+    if args.out:
+        write_markdown(results, args.baseline, args.candidate, args.out, args.alpha)
+
+    sys.exit(1 if any(r.regression for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Echo Floor - Traffic Light MQTT Demo
+Loopback echo responder for measuring the harness's own latency floor.
+
+EchoResponder subscribes to a private cmd topic (city/_calib/intersection/<id>/cmd)
+and acks every command at once from its MQTT callback: no JSON validation, no
+state, no edge clock skew. An RTT measured against it is what the benchmark
+itself costs on this machine (two paho network threads, the GIL, the callback
+path and two broker hops) with no edge work in it. run_benchmark_report.py runs
+a short calibration case against it before the real cases, reports that floor
+and can subtract it (--subtract-floor), so runs from different machines can be
+compared on the edge's share of the RTT.
+
+The responder turns Nagle off on its socket (like CommandClient): otherwise
+acks queued behind the broker's delayed TCP ACK add tens of ms to the floor.
+
+Usage:
+    python echo_floor.py --host 127.0.0.1
+    python echo_floor.py --host 127.0.0.1 --intersection bench01 --ack-qos 0
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+import uuid
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+CALIB_CITY = "_calib"
+
+
+class EchoResponder:
+    """Acks every command on city/_calib/intersection/<id>/cmd immediately."""
+
+    def __init__(self, host: str, port: int, user: str, password: str,
+                 intersection: Optional[str] = None, cmd_qos: int = 1, ack_qos: int = 1):
+        self.host = host
+        self.port = port
+        self.city = CALIB_CITY
+        self.intersection = intersection or uuid.uuid4().hex[:8]
+        self.cmd_qos = cmd_qos
+        self.ack_qos = ack_qos
+        base = f"city/{self.city}/intersection/{self.intersection}"
+        self.topic_cmd = f"{base}/cmd"
+        self.topic_ack = f"{base}/ack"
+        self.echoed = 0
+        self.subscribed = False
+
+        self.client = mqtt.Client(
+            client_id=f"echo-{self.intersection}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.username_pw_set(user, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_message = self._on_message
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            print(f"❌ Echo responder connection failed: {rc}")
+            return
+        try:
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+        client.subscribe(self.topic_cmd, qos=self.cmd_qos)
+
+    def _on_subscribe(self, client, userdata, mid, reason_codes, properties=None):
+        self.subscribed = True
+
+    def _on_message(self, client, userdata, msg):
+        recv_ts = int(time.time() * 1000)
+        try:
+            cmd_id = json.loads(msg.payload.decode()).get("cmd_id")
+        except (ValueError, AttributeError):
+            return
+        client.publish(self.topic_ack, json.dumps({
+            "cmd_id": cmd_id, "ok": True, "err": None, "edge_recv_ts_ms": recv_ts
+        }), qos=self.ack_qos)
+        self.echoed += 1
+
+    def start(self, timeout: float = 5.0) -> bool:
+        """Connect and subscribe; False if the broker did not accept us in time."""
+        try:
+            self.client.connect(self.host, self.port, keepalive=60)
+        except OSError as e:
+            print(f"❌ Echo responder cannot connect: {e}")
+            return False
+        self.client.loop_start()
+        deadline = time.time() + timeout
+        while not self.subscribed and time.time() < deadline:
+            time.sleep(0.02)
+        if not self.subscribed:
+            self.stop()
+        return self.subscribed
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Loopback echo responder (harness latency floor)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python echo_floor.py --host 127.0.0.1
+  python echo_floor.py --host 127.0.0.1 --intersection bench01
+  python logger.py --host 127.0.0.1 --city _calib --intersection bench01 --count 200
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--intersection', default=None, help='Responder id (default: random)')
+    parser.add_argument('--cmd-qos', type=int, choices=[0, 1, 2], default=1, help='Subscription QoS')
+    parser.add_argument('--ack-qos', type=int, choices=[0, 1, 2], default=1, help='Ack publish QoS')
+    args = parser.parse_args()
+
+    responder = EchoResponder(args.host, args.port, args.user, args.password,
+                              args.intersection, args.cmd_qos, args.ack_qos)
+    if not responder.start():
+        sys.exit(1)
+    print(f"🔁 Echoing {responder.topic_cmd} -> {responder.topic_ack} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        responder.stop()
+        print(f"\n🔁 Echoed {responder.echoed} commands")
+
+
+if __name__ == "__main__":
+    main()
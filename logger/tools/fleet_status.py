@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Fleet Status - Traffic Light MQTT Demo
+Live online/offline index of every intersection, built from the retained
+status topic (ONLINE on connect, LWT/graceful OFFLINE), with status-change
+latency tracking.
+
+Index queries (all under one lock, cheap enough to call from a dashboard):
+    offline(city)       O(k) - per-city sets of offline devices
+    online_count(city)  O(1) - per-city counters
+    flapping()          O(k) - devices with >= --flap-changes changes in --flap-window-s
+
+The initial burst of retained messages (10k+ devices) only fills the index: it
+is not counted as changes. Live changes record how long they took to arrive:
+    announce  receive time - ts_ms in the status payload (ONLINE / graceful
+              OFFLINE; edge clock, so includes any clock skew)
+    silence   LWT OFFLINE (no ts_ms): receive time - last message seen from the
+              device (needs --activity, which also subscribes to state)
+    probe     --lwt-probe: a mock is started, killed (or frozen: the broker must
+              wait for the keepalive to expire) and the time from the kill to
+              the observed OFFLINE is measured exactly
+
+Usage:
+    python fleet_status.py --host 127.0.0.1
+    python fleet_status.py --host 127.0.0.1 --activity --interval 5 --json fleet_status.json
+    python fleet_status.py --host 127.0.0.1 --lwt-probe 5
+    python fleet_status.py --host 127.0.0.1 --lwt-probe 1 --probe-mode freeze
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Set
+
+import paho.mqtt.client as mqtt
+
+from clock_sync import EPOCH_MS_MIN
+from timeline import percentile
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclass
+class DeviceStatus:
+    city: str
+    intersection: str
+    online: bool
+    since_ms: float                       # local time of the last change (or first sight)
+    changes: Deque[float] = field(default_factory=deque)   # live change times in the flap window
+    last_seen_ms: Optional[float] = None  # last message of any kind (--activity)
+
+
+@dataclass
+class StatusChange:
+    key: str
+    online: bool
+    t_recv_ms: float
+    latency_ms: Optional[float]
+    kind: str                             # announce | silence | "" (unknown)
+
+
+class FleetStatusIndex:
+    """Online/offline state per intersection with per-city counters and flap detection."""
+
+    def __init__(self, flap_window_s: float = 600.0, flap_changes: int = 4, keep_latencies: int = 10000):
+        self.flap_window_ms = flap_window_s * 1000
+        self.flap_changes = flap_changes
+        self.devices: Dict[str, DeviceStatus] = {}
+        self.online_by_city: Dict[str, int] = {}
+        self.offline_by_city: Dict[str, Set[str]] = {}
+        self.flapping_keys: Set[str] = set()
+        self.latencies: Dict[str, Deque[float]] = {
+            kind: deque(maxlen=keep_latencies) for kind in ("announce", "silence", "probe")}
+        self.snapshot_messages = 0
+        self.live_changes = 0
+        self.listeners: List = []          # callables(StatusChange), e.g. the LWT probe
+        self.lock = threading.Lock()
+
+    def _set(self, dev: DeviceStatus, online: bool):
+        key = f"{dev.city}/{dev.intersection}"
+        if online:
+            self.online_by_city[dev.city] = self.online_by_city.get(dev.city, 0) + 1
+            self.offline_by_city.get(dev.city, set()).discard(key)
+        else:
+            self.offline_by_city.setdefault(dev.city, set()).add(key)
+        dev.online = online
+
+    def apply_status(self, city: str, intersection: str, online: bool, t_recv_ms: float,
+                     edge_ts_ms: Optional[float], retained: bool) -> Optional[StatusChange]:
+        """Update one device from a status message. Returns the change for live transitions."""
+        key = f"{city}/{intersection}"
+        with self.lock:
+            dev = self.devices.get(key)
+            if dev is None:
+                dev = self.devices[key] = DeviceStatus(city, intersection, online=False, since_ms=t_recv_ms)
+                self.offline_by_city.setdefault(city, set()).add(key)
+                if online:
+                    self.offline_by_city[city].discard(key)
+                    self._set(dev, True)
+                if retained:
+                    self.snapshot_messages += 1
+                    return None
+            elif dev.online == online:
+                return None                 # repeated state (e.g. resubscribe)
+            else:
+                if dev.online:
+                    self.online_by_city[city] -= 1
+                self._set(dev, online)
+            if retained:
+                self.snapshot_messages += 1
+                dev.since_ms = t_recv_ms
+                return None
+
+            # Live transition
+            self.live_changes += 1
+            dev.since_ms = t_recv_ms
+            dev.changes.append(t_recv_ms)
+            self._prune(key, dev, t_recv_ms)
+
+            latency, kind = None, ""
+            if isinstance(edge_ts_ms, (int, float)) and edge_ts_ms > EPOCH_MS_MIN:
+                latency, kind = t_recv_ms - edge_ts_ms, "announce"
+            elif not online and dev.last_seen_ms is not None:
+                latency, kind = t_recv_ms - dev.last_seen_ms, "silence"
+            if kind:
+                self.latencies[kind].append(latency)
+            change = StatusChange(key, online, t_recv_ms, latency, kind)
+        for listener in self.listeners:
+            listener(change)
+        return change
+
+    def remove(self, city: str, intersection: str):
+        """Forget a device whose retained status was cleared (decommissioned)."""
+        key = f"{city}/{intersection}"
+        with self.lock:
+            dev = self.devices.pop(key, None)
+            if dev is None:
+                return
+            if dev.online:
+                self.online_by_city[city] -= 1
+            self.offline_by_city.get(city, set()).discard(key)
+            self.flapping_keys.discard(key)
+
+    def seen(self, city: str, intersection: str, t_ms: float):
+        dev = self.devices.get(f"{city}/{intersection}")
+        if dev is not None:
+            dev.last_seen_ms = t_ms
+
+    def _prune(self, key: str, dev: DeviceStatus, now_ms: float):
+        while dev.changes and now_ms - dev.changes[0] > self.flap_window_ms:
+            dev.changes.popleft()
+        if len(dev.changes) >= self.flap_changes:
+            self.flapping_keys.add(key)
+        else:
+            self.flapping_keys.discard(key)
+
+    # -- queries ---------------------------------------------------------------------------
+
+    def offline(self, city: Optional[str] = None) -> List[str]:
+        with self.lock:
+            if city is not None:
+                return sorted(self.offline_by_city.get(city, ()))
+            return sorted(k for keys in self.offline_by_city.values() for k in keys)
+
+    def online_count(self, city: Optional[str] = None) -> int:
+        with self.lock:
+            if city is not None:
+                return self.online_by_city.get(city, 0)
+            return sum(self.online_by_city.values())
+
+    def city_counts(self) -> Dict[str, tuple]:
+        """city -> (online, offline)."""
+        with self.lock:
+            cities = set(self.online_by_city) | set(self.offline_by_city)
+            return {c: (self.online_by_city.get(c, 0), len(self.offline_by_city.get(c, ())))
+                    for c in sorted(cities)}
+
+    def flapping(self, now_ms: Optional[float] = None) -> List[str]:
+        now_ms = time.time() * 1000 if now_ms is None else now_ms
+        with self.lock:
+            for key in list(self.flapping_keys):
+                self._prune(key, self.devices[key], now_ms)
+            return sorted(self.flapping_keys)
+
+    def latency_summary(self) -> Dict[str, dict]:
+        with self.lock:
+            out = {}
+            for kind, values in self.latencies.items():
+                data = sorted(values)
+                out[kind] = {"n": len(data)} if not data else {
+                    "n": len(data), "p50": percentile(data, 0.50), "p95": percentile(data, 0.95),
+                    "max": data[-1]}
+            return out
+
+    def to_dict(self) -> dict:
+        return {
+            "cities": {c: {"online": on, "offline": off} for c, (on, off) in self.city_counts().items()},
+            "offline": self.offline(),
+            "flapping": self.flapping(),
+            "latency_ms": self.latency_summary(),
+            "live_changes": self.live_changes,
+            "devices": len(self.devices),
+        }
+
+
+# =============================================================================
+# MQTT
+# =============================================================================
+
+class StatusSubscriber:
+    """Feeds status (and with activity=True, state) messages of a city pattern into the index."""
+
+    def __init__(self, index: FleetStatusIndex, args):
+        self.index = index
+        self.city = args.city
+        self.activity = args.activity
+        self.subscribed = threading.Event()
+        self.t_subscribe = 0.0
+        self.t_last_retained = 0.0
+        self.client = mqtt.Client(
+            client_id=f"fleet-status-{uuid.uuid4().hex[:8]}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.username_pw_set(args.user, args.password)
+        self.client.on_connect = self._on_connect
+        self.client.on_subscribe = lambda c, userdata, mid, reason_codes, properties=None: self.subscribed.set()
+        self.client.on_message = self._on_message
+        self.client.connect(args.host, args.port, keepalive=30)
+        self.client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            print(f"❌ Connection failed with code: {rc}")
+            return
+        topics = [(f"city/{self.city}/intersection/+/status", 1)]
+        if self.activity:
+            topics.append((f"city/{self.city}/intersection/+/state", 0))
+        self.t_subscribe = time.perf_counter()
+        client.subscribe(topics)
+
+    def _on_message(self, client, userdata, msg):
+        t_recv = time.time() * 1000
+        parts = msg.topic.split("/")
+        if len(parts) != 5:
+            return
+        if parts[4] == "state":
+            self.index.seen(parts[1], parts[3], t_recv)
+            return
+        if not msg.payload:
+            self.index.remove(parts[1], parts[3])   # cleared retained status
+            return
+        try:
+            payload = json.loads(msg.payload)
+            online = bool(payload.get("online"))
+        except (ValueError, AttributeError):
+            return
+        if msg.retain:
+            self.t_last_retained = time.perf_counter()
+        self.index.apply_status(parts[1], parts[3], online, t_recv, payload.get("ts_ms"), msg.retain)
+
+    def wait_snapshot(self, quiet_s: float = 0.5, timeout: float = 30.0) -> float:
+        """Wait for the retained burst to end. Returns its duration (ms) from subscribe."""
+        if not self.subscribed.wait(5.0):
+            raise OSError("no SUBACK for the status topic")
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            last = max(self.t_last_retained, self.t_subscribe)
+            if time.perf_counter() - last >= quiet_s:
+                break
+            time.sleep(0.05)
+        return (max(self.t_last_retained, self.t_subscribe) - self.t_subscribe) * 1000
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+# =============================================================================
+# LWT PROBE
+# =============================================================================
+
+def lwt_probe(index: FleetStatusIndex, args, rounds: int) -> List[float]:
+    """Start a mock, kill or freeze it, and time the kill -> observed OFFLINE (LWT)."""
+    observed: Dict[str, threading.Event] = {}
+    t_obs: Dict[str, float] = {}
+
+    def listener(change: StatusChange):
+        key = (change.key, change.online)
+        if key in observed:
+            t_obs[key] = change.t_recv_ms
+            observed[key].set()
+
+    index.listeners.append(listener)
+    city = args.city if args.city != "+" else "demo"
+    results = []
+    for n in range(rounds):
+        iid = f"probe-{uuid.uuid4().hex[:6]}"
+        key = f"{city}/{iid}"
+        observed[(key, True)] = threading.Event()
+        observed[(key, False)] = threading.Event()
+        proc = subprocess.Popen(
+            [sys.executable, "mock_esp32.py", "--host", args.host, "--port", str(args.port),
+             "--user", args.user, "--password", args.password, "--city", city, "--intersection", iid],
+            cwd=TOOLS_DIR, stdout=subprocess.DEVNULL)
+        try:
+            if not observed[(key, True)].wait(15):
+                print(f"   ⚠️ Probe {n + 1}: {iid} never came online")
+                continue
+            time.sleep(0.5)
+            proc.send_signal(signal.SIGKILL if args.probe_mode == "kill" else signal.SIGSTOP)
+            t_kill = time.time() * 1000
+            if observed[(key, False)].wait(args.probe_timeout):
+                latency = t_obs[(key, False)] - t_kill
+                results.append(latency)
+                with index.lock:
+                    index.latencies["probe"].append(latency)
+                print(f"   🔌 Probe {n + 1}/{rounds}: {args.probe_mode} -> OFFLINE observed after {latency:.0f} ms")
+            else:
+                print(f"   ⚠️ Probe {n + 1}/{rounds}: no OFFLINE within {args.probe_timeout:g}s")
+        finally:
+            proc.kill()
+            proc.wait()
+            # Leave no retained status behind for the probe device
+            index_client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+            index_client.username_pw_set(args.user, args.password)
+            index_client.connect(args.host, args.port)
+            index_client.loop_start()
+            index_client.publish(f"city/{city}/intersection/{iid}/status", b"", qos=1, retain=True).wait_for_publish(5)
+            index_client.loop_stop()
+            index_client.disconnect()
+    index.listeners.remove(listener)
+    return results
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+def print_report(index: FleetStatusIndex, max_rows: int = 20):
+    data = index.to_dict()
+    total_on = sum(c["online"] for c in data["cities"].values())
+    total_off = sum(c["offline"] for c in data["cities"].values())
+    print("\n" + "=" * 60)
+    print(f"🚦 FLEET STATUS: {data['devices']} devices, {total_on} online, {total_off} offline")
+    print("=" * 60)
+    for city, c in data["cities"].items():
+        print(f"  {city:<20} 🟢 {c['online']:>6}  🔴 {c['offline']:>6}")
+    if data["offline"]:
+        shown = ", ".join(data["offline"][:max_rows])
+        more = f" (+{len(data['offline']) - max_rows} more)" if len(data["offline"]) > max_rows else ""
+        print(f"\n  🔴 Offline: {shown}{more}")
+    if data["flapping"]:
+        print(f"  ⚠️ Flapping ({index.flap_changes}+ changes in {index.flap_window_ms / 60000:g} min): "
+              f"{', '.join(data['flapping'][:max_rows])}")
+    print(f"\n  Live changes: {data['live_changes']}")
+    labels = {"announce": "announce (edge ts -> seen)", "silence": "LWT (last msg -> seen)",
+              "probe": "LWT probe (kill -> seen)"}
+    for kind, s in data["latency_ms"].items():
+        if s["n"]:
+            print(f"  ⏱️ {labels[kind]:<28} n={s['n']:<5} p50 {s['p50']:.0f} ms, p95 {s['p95']:.0f} ms, "
+                  f"max {s['max']:.0f} ms")
+    print("=" * 60)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Live online/offline index of every intersection with status-change latency',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python fleet_status.py --host 127.0.0.1
+  python fleet_status.py --host 127.0.0.1 --activity --interval 5 --duration 600
+  python fleet_status.py --host 127.0.0.1 --lwt-probe 5
+  python fleet_status.py --host 127.0.0.1 --lwt-probe 1 --probe-mode freeze   # keepalive-driven LWT
+
+Freeze probes need a broker that enforces keepalive (mosquitto: 1.5 x 30 s = ~45 s).
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--city', default='+', help='City ID (default: all)')
+    parser.add_argument('--activity', action='store_true',
+                        help='Also subscribe to state to time LWT OFFLINE from the last message')
+    parser.add_argument('--flap-window-s', type=float, default=600.0, help='Flap detection window (s)')
+    parser.add_argument('--flap-changes', type=int, default=4, help='Changes in the window that count as flapping')
+    parser.add_argument('--interval', type=float, default=10.0, help='Report interval (s)')
+    parser.add_argument('--duration', type=float, default=0, help='Seconds to run (0 = until Ctrl+C)')
+    parser.add_argument('--lwt-probe', type=int, default=0, metavar='N',
+                        help='Run N LWT probes (start a mock, kill it, time the OFFLINE) and exit')
+    parser.add_argument('--probe-mode', choices=['kill', 'freeze'], default='kill',
+                        help='kill: socket closes (immediate LWT); freeze: SIGSTOP, LWT after keepalive')
+    parser.add_argument('--probe-timeout', type=float, default=90.0, help='Max wait for the probe OFFLINE (s)')
+    parser.add_argument('--json', default=None, help='Save the final index summary as JSON')
+    args = parser.parse_args()
+
+    index = FleetStatusIndex(args.flap_window_s, args.flap_changes)
+    try:
+        sub = StatusSubscriber(index, args)
+        snapshot_ms = sub.wait_snapshot()
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(2)
+    print(f"📥 Snapshot: {index.snapshot_messages:,} retained status message(s), {len(index.devices):,} devices "
+          f"({index.online_count():,} online) in {snapshot_ms:.0f} ms")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    try:
+        if args.lwt_probe:
+            lwt_probe(index, args, args.lwt_probe)
+        else:
+            deadline = time.monotonic() + args.duration if args.duration else None
+            while not stop.wait(args.interval):
+                if deadline and time.monotonic() >= deadline:
+                    break
+                print_report(index)
+    finally:
+        sub.close()
+
+    print_report(index)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f, indent=2)
+        print(f"💾 Saved: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
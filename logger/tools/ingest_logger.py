@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Ingest Logger - Traffic Light MQTT Demo
+Subscribes to every intersection topic (state, telemetry, status, ...) and
+writes the messages as gzip-compressed JSONL, rotated by size and age.
+
+The MQTT network thread only timestamps the message and appends it to a
+bounded in-memory queue; when the queue is full the message is dropped and
+counted (never blocks the network thread). A writer thread takes batches off
+the queue, validates the JSON payload, formats the lines and writes each batch
+with a single call. Files are written as .part and renamed when rotated, so a
+reader never sees a half-written file.
+
+One line per message:
+    {"t_ms": 1718000000123.4, "topic": "city/demo/intersection/001/state", "payload": {...}}
+t_ms is the local receive time (epoch ms). Retained messages get "retain": true;
+payloads that are not JSON are kept as a string under "raw" and counted.
+
+Usage:
+    python ingest_logger.py --host 127.0.0.1
+    python ingest_logger.py --host 127.0.0.1 --outdir results/ingest --max-mb 32 --max-age-s 600
+    python ingest_logger.py --selftest 500000          # pipeline throughput, no broker needed
+"""
+
+import argparse
+import gzip
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+DEFAULT_TOPIC = "city/+/intersection/+/#"
+
+
+@dataclass
+class IngestStats:
+    received: int = 0        # messages handed over by the network thread
+    dropped: int = 0         # queue full (overload)
+    written: int = 0         # lines written
+    bad_json: int = 0        # non-JSON payloads (written under "raw")
+    files: int = 0           # files closed (rotated)
+    bytes_in: int = 0        # uncompressed JSONL bytes
+    bytes_out: int = 0       # compressed bytes of closed files
+
+
+# =============================================================================
+# ROTATING GZIP JSONL WRITER
+# =============================================================================
+
+class RotatingJsonlWriter:
+    """gzip JSONL files, rotated when the compressed size or the age passes a limit."""
+
+    def __init__(self, outdir: str, prefix: str = "ingest", max_bytes: int = 64 << 20,
+                 max_age_s: float = 3600.0, compresslevel: int = 3):
+        self.outdir = outdir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.compresslevel = compresslevel
+        self.seq = 0
+        self.raw = None
+        self.gz: Optional[gzip.GzipFile] = None
+        self.path = ""
+        self.opened_at = 0.0
+        self.closed_files: List[str] = []
+        self.bytes_out = 0
+        os.makedirs(outdir, exist_ok=True)
+
+    def _open(self):
+        self.seq += 1
+        name = f"{self.prefix}_{datetime.now():%Y%m%d_%H%M%S}_{self.seq:04d}.jsonl.gz"
+        self.path = os.path.join(self.outdir, name)
+        self.raw = open(self.path + ".part", "wb")
+        self.gz = gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=self.compresslevel)
+        self.opened_at = time.monotonic()
+
+    def write(self, data: bytes):
+        if self.gz is None:
+            self._open()
+        self.gz.write(data)
+        if self.raw.tell() >= self.max_bytes:
+            self.close()
+
+    def maybe_rotate(self):
+        """Time-based rotation (called on every batch and while idle)."""
+        if self.gz is not None and time.monotonic() - self.opened_at >= self.max_age_s:
+            self.close()
+
+    def flush(self):
+        """Sync-flush the compressor so everything written so far is readable after a crash."""
+        if self.gz is not None:
+            self.gz.flush()
+
+    def close(self):
+        if self.gz is None:
+            return
+        self.gz.close()
+        self.bytes_out += self.raw.tell()
+        self.raw.close()
+        os.replace(self.path + ".part", self.path)
+        self.closed_files.append(self.path)
+        self.gz = self.raw = None
+
+
+# =============================================================================
+# INGEST PIPELINE
+# =============================================================================
+
+class IngestPipeline:
+    """Bounded queue between the MQTT network thread and the batching writer thread."""
+
+    def __init__(self, writer: RotatingJsonlWriter, queue_size: int = 200_000,
+                 batch_size: int = 2000, flush_s: float = 5.0):
+        self.writer = writer
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.queue: deque = deque()
+        self.stats = IngestStats()
+        self.running = True
+        self.topic_json: Dict[str, bytes] = {}   # topic -> JSON-encoded topic (topics repeat)
+        self.thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def on_message(self, client, userdata, msg):
+        """paho callback: timestamp and enqueue only (runs on the network thread)."""
+        self.stats.received += 1
+        if len(self.queue) >= self.queue_size:
+            self.stats.dropped += 1
+            return
+        self.queue.append((time.time() * 1000, msg.topic, msg.payload, msg.retain))
+
+    def _format(self, t_ms: float, topic: str, payload: bytes, retain: bool) -> bytes:
+        topic_json = self.topic_json.get(topic)
+        if topic_json is None:
+            topic_json = self.topic_json[topic] = json.dumps(topic).encode()
+        if not payload:
+            body = b'"payload":null'          # e.g. a cleared retained message
+        else:
+            try:
+                value = json.loads(payload)
+                # Keep the device's bytes as-is unless they would break the line
+                body = b'"payload":' + (payload if b"\n" not in payload and b"\r" not in payload
+                                        else json.dumps(value, separators=(",", ":")).encode())
+            except (ValueError, UnicodeDecodeError):
+                self.stats.bad_json += 1
+                body = b'"raw":' + json.dumps(payload.decode("utf-8", "replace")).encode()
+        line = b'{"t_ms":%.1f,"topic":%s,%s' % (t_ms, topic_json, body)
+        return line + (b',"retain":true}\n' if retain else b"}\n")
+
+    def _run(self):
+        queue, fmt, stats = self.queue, self._format, self.stats
+        last_flush = time.monotonic()
+        while self.running or queue:
+            n = min(len(queue), self.batch_size)
+            if n == 0:
+                self.writer.maybe_rotate()
+                time.sleep(0.005)
+                continue
+            data = b"".join([fmt(*queue.popleft()) for _ in range(n)])
+            self.writer.write(data)
+            stats.written += n
+            stats.bytes_in += len(data)
+            self.writer.maybe_rotate()
+            if time.monotonic() - last_flush >= self.flush_s:
+                self.writer.flush()
+                last_flush = time.monotonic()
+
+    def stop(self):
+        """Drain the queue and close the current file."""
+        self.running = False
+        self.thread.join()
+        self.writer.close()
+        self.stats.files = len(self.writer.closed_files)
+        self.stats.bytes_out = self.writer.bytes_out
+
+
+def print_progress(stats: IngestStats, prev: IngestStats, elapsed_s: float, depth: int):
+    rate_in = (stats.received - prev.received) / elapsed_s
+    rate_out = (stats.written - prev.written) / elapsed_s
+    print(f"   📥 {rate_in:>8,.0f} msg/s in, {rate_out:>8,.0f} msg/s written, queue {depth:,}, "
+          f"dropped {stats.dropped:,}, bad JSON {stats.bad_json:,}")
+
+
+def print_summary(stats: IngestStats, elapsed_s: float, cpu_s: float):
+    print("\n" + "=" * 60)
+    print("📊 INGEST SUMMARY")
+    print("=" * 60)
+    print(f"  Received:    {stats.received:,}")
+    print(f"  Written:     {stats.written:,}")
+    print(f"  Dropped:     {stats.dropped:,} (queue full)")
+    print(f"  Bad JSON:    {stats.bad_json:,}")
+    print(f"  Files:       {stats.files}")
+    if stats.bytes_out:
+        print(f"  Size:        {stats.bytes_in / 1e6:.1f} MB JSONL -> {stats.bytes_out / 1e6:.1f} MB gzip "
+              f"({stats.bytes_in / stats.bytes_out:.1f}x)")
+    if elapsed_s > 0:
+        print(f"  Throughput:  {stats.written / elapsed_s:,.0f} msg/s over {elapsed_s:.1f}s, "
+              f"CPU {cpu_s / elapsed_s * 100:.0f}% of one core")
+    print("=" * 60 + "\n")
+
+
+# =============================================================================
+# SELF-TEST (no broker)
+# =============================================================================
+
+def synthetic_messages(count: int, devices: int = 500) -> List[mqtt.MQTTMessage]:
+    """Realistic state/telemetry/status messages (a small pool, reused)."""
+    pool = []
+    for n in range(min(count, 5000)):
+        iid = f"{n % devices:03d}"
+        kind = ("state", "state", "state", "telemetry", "status")[n % 5]
+        if kind == "state":
+            payload = {"mode": "AUTO", "phase": n % 6, "since_ms": n * 37 % 10000,
+                       "uptime_s": 3600 + n, "ts_ms": 1718000000000 + n}
+        elif kind == "telemetry":
+            payload = {"rssi_dbm": -55 - n % 9, "heap_free_kb": 214.3, "uptime_s": 3600 + n,
+                       "ts_ms": 1718000000000 + n}
+        else:
+            payload = {"online": True, "ts_ms": 1718000000000 + n}
+        msg = mqtt.MQTTMessage(topic=f"city/demo/intersection/{iid}/{kind}".encode())
+        msg.payload = json.dumps(payload).encode()
+        msg.retain = kind == "status"
+        pool.append(msg)
+    return pool
+
+
+def verify_files(paths: List[str]) -> int:
+    """Read every file back; returns the number of valid lines (raises on a bad line)."""
+    lines = 0
+    for path in paths:
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                json.loads(line)
+                lines += 1
+    return lines
+
+
+def selftest(args) -> int:
+    outdir = args.outdir if args.outdir_given else tempfile.mkdtemp(prefix="ingest_selftest_")
+    writer = RotatingJsonlWriter(outdir, args.prefix, int(args.max_mb * (1 << 20)), args.max_age_s,
+                                 args.compresslevel)
+    pipeline = IngestPipeline(writer, args.queue_size, args.batch_size, args.flush_s)
+    pool = synthetic_messages(args.selftest)
+    print(f"🧪 Self-test: {args.selftest:,} messages through on_message -> queue -> writer "
+          f"({outdir})")
+
+    pipeline.start()
+    t0, cpu0 = time.perf_counter(), time.process_time()
+    on_message = pipeline.on_message
+    interval = 1.0 / args.rate if args.rate else 0.0
+    t_next = t0
+    for n in range(args.selftest):
+        on_message(None, None, pool[n % len(pool)])
+        if interval:
+            t_next += interval
+            delay = t_next - time.perf_counter()
+            if delay > 0.001:
+                time.sleep(delay)
+    pipeline.stop()
+    elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+
+    print_summary(pipeline.stats, elapsed, cpu)
+    stats = pipeline.stats
+    lines = verify_files(writer.closed_files)
+    consistent = stats.received == stats.written + stats.dropped and lines == stats.written
+    print(f"{'✅' if consistent else '❌'} Read back {lines:,} lines from {len(writer.closed_files)} file(s); "
+          f"received = written + dropped: {stats.received:,} = {stats.written:,} + {stats.dropped:,}")
+    return 0 if consistent else 1
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Ingest every intersection message into rotated, compressed JSONL',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python ingest_logger.py --host 127.0.0.1
+  python ingest_logger.py --host 127.0.0.1 --topic "city/demo/intersection/+/telemetry"
+  python ingest_logger.py --host 127.0.0.1 --max-mb 16 --max-age-s 300 --queue-size 50000
+  python ingest_logger.py --selftest 1000000
+  python ingest_logger.py --selftest 200000 --rate 50000 --queue-size 10000
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--topic', default=DEFAULT_TOPIC, help='Subscription (wildcards allowed)')
+    parser.add_argument('--qos', type=int, choices=[0, 1, 2], default=0, help='Subscription QoS')
+    parser.add_argument('--outdir', default=None, help='Output directory (default: results/ingest)')
+    parser.add_argument('--prefix', default='ingest', help='File name prefix')
+    parser.add_argument('--max-mb', type=float, default=64.0, help='Rotate when a file reaches this compressed size')
+    parser.add_argument('--max-age-s', type=float, default=3600.0, help='Rotate when a file is this old')
+    parser.add_argument('--compresslevel', type=int, choices=range(1, 10), default=3, metavar='1-9',
+                        help='gzip level (higher = smaller, slower)')
+    parser.add_argument('--queue-size', type=int, default=200_000, help='Max queued messages before dropping')
+    parser.add_argument('--batch-size', type=int, default=2000, help='Max lines per write')
+    parser.add_argument('--flush-s', type=float, default=5.0,
+                        help='Sync-flush interval (bounds what a crash can lose)')
+    parser.add_argument('--stats-s', type=float, default=10.0, help='Progress line interval (0 = off)')
+    parser.add_argument('--selftest', type=int, default=0, metavar='N',
+                        help='Push N synthetic messages through the pipeline (no broker) and verify the files')
+    parser.add_argument('--rate', type=float, default=0.0, help='Self-test: offered msg/s (0 = as fast as possible)')
+    args = parser.parse_args()
+    args.outdir_given = args.outdir is not None
+    args.outdir = args.outdir or os.path.join("results", "ingest")
+
+    if args.selftest:
+        sys.exit(selftest(args))
+
+    writer = RotatingJsonlWriter(args.outdir, args.prefix, int(args.max_mb * (1 << 20)), args.max_age_s,
+                                 args.compresslevel)
+    pipeline = IngestPipeline(writer, args.queue_size, args.batch_size, args.flush_s)
+    stop = threading.Event()
+
+    client = mqtt.Client(
+        client_id=f"ingest-{uuid.uuid4().hex[:8]}",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+    )
+    client.username_pw_set(args.user, args.password)
+
+    def on_connect(c, userdata, flags, rc, properties=None):
+        if rc == 0:
+            c.subscribe(args.topic, qos=args.qos)
+            print(f"✅ Connected to {args.host}:{args.port}, subscribed to {args.topic} (QoS {args.qos})")
+        else:
+            print(f"❌ Connection failed with code: {rc}")
+
+    def on_subscribe(c, userdata, mid, reason_codes, properties=None):
+        if any(code.is_failure for code in reason_codes):
+            print(f"❌ Subscription to {args.topic} refused (broker ACL needs 'topic read {args.topic}')")
+            stop.set()
+
+    def on_disconnect(c, userdata, disconnect_flags, rc, properties=None):
+        if rc != 0:
+            print(f"⚠️ Unexpected disconnect: {rc} (reconnecting)")
+
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_disconnect = on_disconnect
+    client.on_message = pipeline.on_message
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    try:
+        client.connect(args.host, args.port, keepalive=60)
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(2)
+
+    print(f"📝 Writing {args.outdir}/{args.prefix}_*.jsonl.gz "
+          f"(rotate at {args.max_mb:g} MB / {args.max_age_s:g}s, queue {args.queue_size:,})")
+    pipeline.start()
+    client.loop_start()
+    t0, cpu0 = time.perf_counter(), time.process_time()
+    prev, t_prev = IngestStats(), t0
+    while not stop.wait(args.stats_s or None):
+        now = time.perf_counter()
+        print_progress(pipeline.stats, prev, now - t_prev, len(pipeline.queue))
+        prev, t_prev = IngestStats(**asdict(pipeline.stats)), now
+
+    print("\n🛑 Stopping (draining queue)...")
+    client.loop_stop()
+    client.disconnect()
+    pipeline.stop()
+    print_summary(pipeline.stats, time.perf_counter() - t0, time.process_time() - cpu0)
+    for path in writer.closed_files[-5:]:
+        print(f"💾 {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,15 @@ Usage:
     python logger.py --host 192.168.1.100 --count 100 --mode AUTO --out results.csv
     python logger.py --host 192.168.1.100 --count 500 --phase 0 --interval_ms 100
     python logger.py --host localhost --count 1000 --mode AUTO --pad_bytes 100
+    python logger.py --host localhost --count 1000 --format both --out results.csv
+    python logger.py --host localhost --count 500 --qos 0
+    python logger.py --embedded-broker --count 200 --interval_ms 20
+
+Library use (one connection, several cases):
+    args = build_parser().parse_args(["--host", "localhost", "--count", "200"])
+    client = connect(args)
+    stats = run(args, client)
+    disconnect(client)
 """
 
 import argparse
@@ -17,10 +26,14 @@ import threading
 import time
 import uuid
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 import paho.mqtt.client as mqtt
 
+from command_client import CommandClient, CommandFuture
+
+ACK_TIMEOUT_S = 5.0
+
 # =============================================================================
 # DATA STRUCTURES
 # =============================================================================
@@ -28,8 +41,8 @@ import paho.mqtt.client as mqtt
 @dataclass
 class CommandRecord:
     cmd_id: str
-    t_send_ms: int
-    t_ack_recv_ms: Optional[int] = None
+    t_send_ms: float                          # epoch ms, µs resolution (sub-ms RTTs)
+    t_ack_recv_ms: Optional[float] = None
     rtt_ms: Optional[float] = None
     mode: Optional[str] = None
     phase: Optional[int] = None
@@ -45,6 +58,7 @@ class BenchmarkState:
     received_count: int = 0
     connected: bool = False
     done: bool = False
+    subscribed: threading.Event = field(default_factory=threading.Event)
     lock: threading.Lock = field(default_factory=threading.Lock)
 
 
@@ -61,38 +75,74 @@ def on_connect(client, userdata, flags, rc, properties=None):
         state.connected = True
         
         # Subscribe to ack topic
-        ack_topic = f"city/{args.city}/intersection/{args.intersection}/ack"
-        client.subscribe(ack_topic, qos=1)
-        print(f"📥 Subscribed to: {ack_topic}")
+        subscribe_acks(client, args)
     else:
         print(f"❌ Connection failed with code: {rc}")
         state.connected = False
 
 
+def on_subscribe(client, userdata, mid, reason_codes, properties=None):
+    userdata['state'].subscribed.set()
+
+
+def ack_topic(args) -> str:
+    return f"city/{args.city}/intersection/{args.intersection}/ack"
+
+
+def subscribe_acks(client, args):
+    """Subscribe to the ack topic of args at args.qos (remembered for reuse by run())."""
+    userdata = client.user_data_get()
+    userdata['state'].subscribed.clear()
+    userdata['subscription'] = (ack_topic(args), args.qos)
+    client.subscribe(ack_topic(args), qos=args.qos)
+    print(f"📥 Subscribed to: {ack_topic(args)} (QoS {args.qos})")
+
+
 def on_message(client, userdata, msg):
-    state: BenchmarkState = userdata['state']
-    t_recv = int(time.time() * 1000)
+    t_recv = time.time() * 1000
+    commands: Optional[CommandClient] = userdata.get('commands')
+    if commands is None:
+        return
     
     try:
-        payload = json.loads(msg.payload.decode())
-        cmd_id = payload.get("cmd_id")
-        
-        if cmd_id and cmd_id in state.records:
-            with state.lock:
-                record = state.records[cmd_id]
-                record.t_ack_recv_ms = t_recv
-                record.rtt_ms = t_recv - record.t_send_ms
-                state.received_count += 1
-                
-                # Log progress every 50 acks
-                if state.received_count % 50 == 0:
-                    print(f"   Received {state.received_count} acks...")
-                    
+        commands.on_ack(json.loads(msg.payload.decode()), t_recv)
     except json.JSONDecodeError:
         pass
 
 
-def on_disconnect(client, userdata, rc, properties=None):
+def record_send(state: BenchmarkState, fut: CommandFuture):
+    """Add the record of a command that was just published."""
+    with state.lock:
+        state.records[fut.cmd_id] = CommandRecord(
+            cmd_id=fut.cmd_id,
+            t_send_ms=round(fut.t_send_ms, 3),
+            mode=fut.cmd.get("mode"),
+            phase=fut.cmd.get("phase"),
+            payload_size=len(fut.payload),
+            actual_payload_bytes=len(fut.payload.encode('utf-8')),
+            note=fut.cmd["type"]
+        )
+        state.sent_count += 1
+
+
+def record_ack(state: BenchmarkState, fut: CommandFuture):
+    """Done callback: fill in the command's record once its ack arrived."""
+    if fut.exception() is not None:
+        return  # timed out, stays lost
+    ack = fut.result()
+    t_recv = round(ack.t_recv_ms, 3)
+    with state.lock:
+        record = state.records[ack.cmd_id]
+        record.t_ack_recv_ms = t_recv
+        record.rtt_ms = round(t_recv - record.t_send_ms, 3)
+        state.received_count += 1
+        
+        # Log progress every 50 acks
+        if state.received_count % 50 == 0:
+            print(f"   Received {state.received_count} acks...")
+
+
+def on_disconnect(client, userdata, disconnect_flags, rc, properties=None):
     state: BenchmarkState = userdata['state']
     state.connected = False
     if rc != 0:
@@ -127,56 +177,41 @@ def build_command(args, pad_bytes: int = 0) -> dict:
     return cmd
 
 
-def run_benchmark(client: mqtt.Client, state: BenchmarkState, args):
+def run_benchmark(commands: CommandClient, state: BenchmarkState, args):
     """Run the benchmark sending commands."""
-    cmd_topic = f"city/{args.city}/intersection/{args.intersection}/cmd"
     interval_s = args.interval_ms / 1000.0
+    t_next = time.perf_counter()
     
     print(f"\n🚀 Starting benchmark: {args.count} commands, {args.interval_ms}ms interval")
-    print(f"📤 Publishing to: {cmd_topic}\n")
+    print(f"📤 Publishing to: {commands.topic_cmd}\n")
     
     for i in range(args.count):
         if not state.connected:
             print("❌ Lost connection, stopping benchmark")
             break
         
-        cmd = build_command(args, args.pad_bytes)
-        cmd_id = cmd["cmd_id"]
-        payload = json.dumps(cmd)
-        actual_payload_bytes = len(payload.encode('utf-8'))
-        t_send = int(time.time() * 1000)
+        fut = commands.send(build_command(args, args.pad_bytes))
         
-        # Record command
-        with state.lock:
-            state.records[cmd_id] = CommandRecord(
-                cmd_id=cmd_id,
-                t_send_ms=t_send,
-                mode=cmd.get("mode"),
-                phase=cmd.get("phase"),
-                payload_size=len(payload),
-                actual_payload_bytes=actual_payload_bytes,
-                note=cmd["type"]
-            )
-            state.sent_count += 1
-        
-        # Publish
-        result = client.publish(cmd_topic, payload, qos=1)
+        # Record command (an ack that already arrived is applied by add_done_callback)
+        record_send(state, fut)
+        fut.add_done_callback(lambda f: record_ack(state, f))
         
         # Log progress every 100 commands
         if (i + 1) % 100 == 0:
             print(f"   Sent {i + 1}/{args.count} commands...")
         
-        # Wait for interval
+        # Fixed schedule: publish/record time does not stretch the interval
         if i < args.count - 1:
-            time.sleep(interval_s)
+            t_next += interval_s
+            delay = t_next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
     
     print(f"\n✅ Sent {state.sent_count} commands")
     
-    # Wait for remaining acks (with timeout)
-    print("⏳ Waiting for remaining acks (max 5s)...")
-    wait_start = time.time()
-    while state.received_count < state.sent_count and (time.time() - wait_start) < 5.0:
-        time.sleep(0.1)
+    # Every command has its own ack deadline; wait until each is acked or expired
+    print(f"⏳ Waiting for remaining acks (max {ACK_TIMEOUT_S:.0f}s per command)...")
+    commands.drain()
     
     state.done = True
 
@@ -225,8 +260,8 @@ def save_csv(state: BenchmarkState, filename: str):
             writer.writerow([
                 record.cmd_id,
                 record.t_send_ms,
-                record.t_ack_recv_ms or '',
-                record.rtt_ms or '',
+                record.t_ack_recv_ms if record.t_ack_recv_ms is not None else '',
+                record.rtt_ms if record.rtt_ms is not None else '',
                 record.mode or '',
                 record.phase if record.phase is not None else '',
                 record.payload_size,
@@ -237,6 +272,15 @@ def save_csv(state: BenchmarkState, filename: str):
     print(f"💾 Results saved to: {filename}")
 
 
+def save_results(state: BenchmarkState, filename: str, fmt: str = "csv"):
+    """Save results as CSV, columnar .npy, or both."""
+    if fmt in ("csv", "both"):
+        save_csv(state, filename)
+    if fmt in ("npy", "both"):
+        from raw_columnar import columnar_path, save_columnar
+        save_columnar(state.records.values(), columnar_path(filename))
+
+
 def print_statistics(stats: dict):
     """Print benchmark statistics."""
     print("\n" + "=" * 50)
@@ -262,10 +306,11 @@ def print_statistics(stats: dict):
 
 
 # =============================================================================
-# MAIN
+# LIBRARY API
 # =============================================================================
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
+    """Argument parser for the CLI; also used to build args for in-process runs."""
     parser = argparse.ArgumentParser(
         description='RTT Benchmark Logger for Traffic Light MQTT Demo',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -274,6 +319,9 @@ Examples:
   python logger.py --host 192.168.1.100 --count 100 --mode AUTO
   python logger.py --host localhost --count 500 --phase 0 --interval_ms 50
   python logger.py --host 192.168.1.100 --count 1000 --mode MANUAL --pad_bytes 100
+  python logger.py --host localhost --count 1000 --format npy --out results.csv
+  python logger.py --host localhost --count 500 --qos 0
+  python logger.py --embedded-broker --count 200 --interval_ms 20
         """
     )
     
@@ -282,6 +330,8 @@ Examples:
     parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
     parser.add_argument('--user', default='demo', help='MQTT username')
     parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) and mock_esp32 instead of using --host')
     
     # Topic args
     parser.add_argument('--city', default='demo', help='City ID for topic')
@@ -290,6 +340,8 @@ Examples:
     # Benchmark args
     parser.add_argument('--count', type=int, default=100, help='Number of commands to send')
     parser.add_argument('--interval_ms', type=int, default=100, help='Interval between commands (ms)')
+    parser.add_argument('--qos', type=int, choices=[0, 1, 2], default=1,
+                        help='QoS for cmd publish and ack subscription')
     
     # Command args (mutually exclusive)
     parser.add_argument('--mode', choices=['AUTO', 'MANUAL', 'BLINK', 'OFF'], 
@@ -303,8 +355,115 @@ Examples:
     
     # Output args
     parser.add_argument('--out', default='results.csv', help='Output CSV filename')
+    parser.add_argument('--format', choices=['csv', 'npy', 'both'], default='csv',
+                        help='Raw output format (npy = typed columnar, same name with .npy)')
+    return parser
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    return build_parser().parse_args(argv)
+
+
+def connect(args, timeout: float = 5.0) -> Optional[mqtt.Client]:
+    """
+    Connect and subscribe to the ack topic of args.city/args.intersection.
+    Returns the running client, or None on failure. The client can be passed to
+    run() for any number of cases (run() resubscribes if a case changes the
+    intersection or QoS).
+    """
+    state = BenchmarkState()
+    userdata = {'state': state, 'args': args}
     
-    args = parser.parse_args()
+    client = mqtt.Client(
+        client_id=f"rtt-logger-{uuid.uuid4().hex[:8]}",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        userdata=userdata
+    )
+    client.username_pw_set(args.user, args.password)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.on_subscribe = on_subscribe
+    client.on_disconnect = on_disconnect
+    
+    print(f"🔌 Connecting to {args.host}:{args.port}...")
+    try:
+        client.connect(args.host, args.port, keepalive=60)
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        return None
+    client.loop_start()
+    
+    # Wait for connection
+    start = time.time()
+    while not state.connected and (time.time() - start) < timeout:
+        time.sleep(0.1)
+    
+    if not state.connected:
+        print("❌ Connection timeout")
+        client.loop_stop()
+        return None
+    return client
+
+
+def disconnect(client: mqtt.Client):
+    client.loop_stop()
+    client.disconnect()
+    print("👋 Disconnected from broker")
+
+
+def run(args, client: Optional[mqtt.Client] = None) -> Optional[dict]:
+    """
+    Run one benchmark case, print statistics and save raw results to args.out.
+    Uses the given connected client (from connect()), or opens and closes a
+    connection of its own. Returns the statistics dict, or None if no
+    connection could be made.
+    """
+    own_client = client is None
+    if own_client:
+        client = connect(args)
+        if client is None:
+            return None
+    
+    # Fresh per-case state on the (possibly reused) connection
+    userdata = client.user_data_get()
+    state = BenchmarkState(connected=userdata['state'].connected)
+    if userdata.get('subscription') == (ack_topic(args), args.qos):
+        state.subscribed.set()
+    userdata['state'] = state
+    userdata['args'] = args
+    if not state.subscribed.is_set():
+        if userdata.get('subscription', (None,))[0] not in (None, ack_topic(args)):
+            client.unsubscribe(userdata['subscription'][0])
+        subscribe_acks(client, args)
+        if not state.subscribed.wait(5.0):
+            print("⚠️ No SUBACK for the ack topic, acks may be missed")
+    
+    commands = CommandClient(client, f"city/{args.city}/intersection/{args.intersection}/cmd",
+                             qos=args.qos, timeout=ACK_TIMEOUT_S)
+    userdata['commands'] = commands
+    try:
+        run_benchmark(commands, state, args)
+    finally:
+        commands.close()
+        userdata['commands'] = None
+        if own_client:
+            disconnect(client)
+    
+    stats = calculate_statistics(state)
+    print_statistics(stats)
+    save_results(state, args.out, args.format)
+    return stats
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    args = parse_args()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        start_embedded_broker(args, with_mock=True)
     
     # Print configuration
     print("\n" + "=" * 50)
@@ -316,6 +475,7 @@ Examples:
     print(f"  Intersect:  {args.intersection}")
     print(f"  Count:      {args.count}")
     print(f"  Interval:   {args.interval_ms}ms")
+    print(f"  QoS:        {args.qos}")
     if args.mode:
         print(f"  Command:    SET_MODE {args.mode}")
     elif args.phase is not None:
@@ -324,59 +484,17 @@ Examples:
         print(f"  Command:    SET_MODE AUTO (default)")
     if args.pad_bytes > 0:
         print(f"  Padding:    {args.pad_bytes} bytes")
-    print(f"  Output:     {args.out}")
+    print(f"  Output:     {args.out} ({args.format})")
     print("=" * 50 + "\n")
     
-    # Initialize state
-    state = BenchmarkState()
-    userdata = {'state': state, 'args': args}
-    
-    # Create MQTT client
-    client = mqtt.Client(
-        client_id=f"rtt-logger-{uuid.uuid4().hex[:8]}",
-        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
-        userdata=userdata
-    )
-    client.username_pw_set(args.user, args.password)
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.on_disconnect = on_disconnect
-    
-    # Connect
     try:
-        print(f"🔌 Connecting to {args.host}:{args.port}...")
-        client.connect(args.host, args.port, keepalive=60)
-        client.loop_start()
-        
-        # Wait for connection
-        timeout = 5.0
-        start = time.time()
-        while not state.connected and (time.time() - start) < timeout:
-            time.sleep(0.1)
-        
-        if not state.connected:
-            print("❌ Connection timeout")
+        if run(args) is None:
             sys.exit(1)
-        
-        # Run benchmark
-        run_benchmark(client, state, args)
-        
-        # Calculate and print statistics
-        stats = calculate_statistics(state)
-        print_statistics(stats)
-        
-        # Save CSV
-        save_csv(state, args.out)
-        
     except KeyboardInterrupt:
         print("\n⚠️ Interrupted by user")
     except Exception as e:
         print(f"❌ Error: {e}")
         sys.exit(1)
-    finally:
-        client.loop_stop()
-        client.disconnect()
-        print("👋 Disconnected from broker")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+"""
+Microbench - Traffic Light MQTT Demo
+Client-side overhead of the RTT harness (logger.py / run_benchmark_report.py),
+stage by stage, without a broker.
+
+Send path:    build_command -> json.dumps -> paho publish -> CommandClient.send
+              -> record_send (state.lock)
+Receive path: paho read + dispatch -> json.loads -> CommandClient.on_ack
+              -> record_ack (state.lock) / RTTBenchmark._on_ack
+
+The RTT window runs from t_send in CommandClient.send (taken after its
+json.dumps) to t_recv at the top of on_message. Only the rest of send (Future,
+deadline heap, paho publish) and paho's read path up to the callback are inside
+a measured RTT. build_command, record_send and the ack handling after t_recv
+cost client CPU (they cap the send rate) but are not part of the RTT.
+
+paho runs its real publish/read code against a fake socket: sends are
+discarded, reads are served from pre-encoded ack packets. The fake socket costs
+far less than a syscall, so the paho stages are a lower bound. Faking the
+connection uses private paho 2.x client attributes (PAHO_INTERNALS); on other
+paho versions the tool stops with an error instead of measuring garbage.
+
+Per stage:
+    ns/op        best of --repeat batches of --number ops (GC off, loop and
+                 call overhead subtracted), plus the median batch
+    peak B/op    median transient memory of one op (tracemalloc peak)
+    kept B/op    memory still held after the batch / ops (e.g. records)
+    blocks/op    live allocations still held after the batch / ops
+CPython exposes no allocation counter, so temporaries show up only in peak B/op.
+
+Results go to results/microbench_<timestamp>.json; --baseline compares with an
+earlier run and exits 1 when a stage got slower than --max-regression.
+
+Usage:
+    python microbench.py
+    python microbench.py --number 5000 --repeat 9 --stage paho
+    python microbench.py --baseline results/microbench_20260101_120000.json --max-regression 0.25
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+
+import paho.mqtt.client as mqtt
+
+import logger
+from command_client import Ack, CommandClient, CommandFuture
+from run_benchmark_report import RTTBenchmark
+
+TOPIC_CMD = "city/demo/intersection/001/cmd"
+TOPIC_ACK = "city/demo/intersection/001/ack"
+ALLOC_SAMPLES = 200
+# Private paho 2.x client state the fake transport drives (not a public API)
+PAHO_INTERNALS = ("_sock", "_state", "_out_message_mutex", "_out_messages", "_inflight_messages")
+
+
+@dataclass
+class StageResult:
+    name: str
+    path: str                     # send | receive | total
+    ns_per_op: float              # best batch
+    ns_median: float              # median batch
+    peak_bytes_per_op: Optional[float] = None
+    kept_bytes_per_op: Optional[float] = None
+    blocks_per_op: Optional[float] = None
+    note: str = ""
+
+
+@dataclass
+class Stage:
+    name: str
+    path: str
+    prepare: Callable[[int], list]        # untimed: n inputs for one batch
+    op: Callable                          # timed: op(input)
+    note: str = ""
+
+
+# =============================================================================
+# FAKE TRANSPORT
+# =============================================================================
+
+class FakeSocket:
+    """Stands in for the broker connection: sends are discarded, recv serves queued bytes."""
+
+    def __init__(self):
+        self.data = b""
+        self.pos = 0
+        self.sent = 0
+
+    def load(self, data: bytes):
+        self.data, self.pos = data, 0
+
+    def send(self, buf) -> int:
+        self.sent += len(buf)
+        return len(buf)
+
+    def recv(self, bufsize: int) -> bytes:
+        if self.pos >= len(self.data):
+            raise BlockingIOError()
+        chunk = self.data[self.pos:self.pos + bufsize]
+        self.pos += len(chunk)
+        return chunk
+
+    def setsockopt(self, *args):
+        pass
+
+    def fileno(self) -> int:
+        return -1
+
+    def close(self):
+        pass
+
+
+def _paho_version() -> Optional[str]:
+    try:
+        from importlib.metadata import version
+        return version("paho-mqtt")
+    except Exception:
+        return None
+
+
+def fake_client() -> mqtt.Client:
+    """A paho client that believes it is connected, writing to / reading from a FakeSocket."""
+    client = mqtt.Client(client_id="microbench", callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    missing = [name for name in PAHO_INTERNALS if not hasattr(client, name)]
+    if missing or not hasattr(getattr(mqtt, "_ConnectionState", None), "MQTT_CS_CONNECTED"):
+        raise RuntimeError(f"fake transport needs paho-mqtt 2.x client internals, "
+                           f"not found in paho-mqtt {_paho_version() or '?'}: "
+                           f"{', '.join(missing) or '_ConnectionState.MQTT_CS_CONNECTED'}")
+    client.max_inflight_messages_set(0)
+    client._sock = FakeSocket()
+    client._state = mqtt._ConnectionState.MQTT_CS_CONNECTED   # paho 2.x internals
+    return client
+
+
+def reset_outbound(client: mqtt.Client):
+    """Forget unacked QoS 1 publishes (no broker will PUBACK them)."""
+    with client._out_message_mutex:
+        client._out_messages.clear()
+        client._inflight_messages = 0
+
+
+def publish_packet(topic: str, payload: bytes, qos: int, mid: int) -> bytes:
+    body = struct.pack("!H", len(topic)) + topic.encode() + (struct.pack("!H", mid) if qos else b"") + payload
+    length, n = bytearray(), len(body)
+    while True:
+        byte, n = n % 128, n // 128
+        length.append(byte | 0x80 if n else byte)
+        if not n:
+            break
+    return bytes([0x30 | (qos << 1)]) + bytes(length) + body
+
+
+def ack_payload(cmd_id: str) -> bytes:
+    return json.dumps({"cmd_id": cmd_id, "ok": True, "err": None,
+                       "edge_recv_ts_ms": int(time.time() * 1000)}).encode()
+
+
+def new_future(cmd: dict) -> CommandFuture:
+    return CommandFuture(cmd, json.dumps(cmd), time.time() * 1000, time.monotonic() + 3600)
+
+
+def resolved_future(cmd: dict) -> CommandFuture:
+    fut = new_future(cmd)
+    fut.set_result(Ack(fut.cmd_id, json.loads(ack_payload(fut.cmd_id)), fut.t_send_ms, fut.t_send_ms + 1.5))
+    return fut
+
+
+# =============================================================================
+# STAGES
+# =============================================================================
+
+def build_stages() -> List[Stage]:
+    args = logger.build_parser().parse_args(["--mode", "AUTO"])
+    sample = logger.build_command(args, 0)
+    commands_for = lambda n, pad=0: [logger.build_command(args, pad) for _ in range(n)]
+    stages: List[Stage] = []
+
+    # -- send path --------------------------------------------------------------------------
+    stages.append(Stage("build_command", "send", lambda n: [None] * n,
+                        lambda _: logger.build_command(args, 0), "uuid4 + time + dict"))
+    stages.append(Stage("build_command pad=900", "send", lambda n: [None] * n,
+                        lambda _: logger.build_command(args, 900)))
+    stages.append(Stage("json.dumps", "send", commands_for, json.dumps, f"{len(json.dumps(sample))} B command"))
+
+    client0 = fake_client()
+    payload = json.dumps(sample)
+    stages.append(Stage("paho publish qos0", "send", lambda n: [payload] * n,
+                        lambda p: client0.publish(TOPIC_CMD, p, qos=0), "packet build + write to fake socket"))
+
+    client1 = fake_client()
+
+    def prepare_qos1(n):
+        reset_outbound(client1)
+        return [payload] * n
+
+    stages.append(Stage("paho publish qos1", "send", prepare_qos1,
+                        lambda p: client1.publish(TOPIC_CMD, p, qos=1), "+ inflight bookkeeping"))
+
+    client_send = fake_client()
+    commands_send = CommandClient(client_send, TOPIC_CMD, qos=1, timeout=3600)
+
+    def prepare_send(n):
+        reset_outbound(client_send)
+        with commands_send._cond:
+            commands_send.pending.clear()
+            commands_send._deadlines.clear()
+        return commands_for(n)
+
+    stages.append(Stage("CommandClient.send", "send", prepare_send, commands_send.send,
+                        "json.dumps + Future + deadline heap + paho publish qos1"))
+
+    state_send = logger.BenchmarkState()
+
+    def prepare_record_send(n):
+        state_send.records.clear()
+        return [new_future(c) for c in commands_for(n)]
+
+    stages.append(Stage("record_send (state.lock)", "send", prepare_record_send,
+                        lambda fut: logger.record_send(state_send, fut), "CommandRecord under the lock"))
+
+    # -- receive path -----------------------------------------------------------------------
+    client_recv = fake_client()
+    client_recv.on_message = lambda c, userdata, msg: None
+    ack = ack_payload(sample["cmd_id"])
+
+    def prepare_read(qos):
+        def prepare(n):
+            client_recv._sock.load(b"".join(publish_packet(TOPIC_ACK, ack, qos, (i % 65535) + 1)
+                                            for i in range(n)))
+            return [None] * n
+        return prepare
+
+    stages.append(Stage("paho read+dispatch qos0", "receive", prepare_read(0),
+                        lambda _: client_recv.loop_read(), f"{len(ack)} B ack -> on_message (no-op)"))
+    stages.append(Stage("paho read+dispatch qos1", "receive", prepare_read(1),
+                        lambda _: client_recv.loop_read(), "+ PUBACK written back"))
+    stages.append(Stage("json.loads ack", "receive", lambda n: [ack] * n,
+                        lambda p: json.loads(p.decode()), "payload.decode + loads"))
+
+    client_ack = fake_client()
+    commands_ack = CommandClient(client_ack, TOPIC_CMD)
+
+    def prepare_on_ack(n):
+        futures = [new_future(c) for c in commands_for(n)]
+        with commands_ack._cond:
+            commands_ack.pending = {f.cmd_id: f for f in futures}
+        return [json.loads(ack_payload(f.cmd_id)) for f in futures]
+
+    t_recv = time.time() * 1000
+    stages.append(Stage("CommandClient.on_ack", "receive", prepare_on_ack,
+                        lambda p: commands_ack.on_ack(p, t_recv), "pending pop + Future.set_result"))
+
+    state_ack = logger.BenchmarkState()
+
+    def prepare_record_ack(n):
+        futures = [resolved_future(c) for c in commands_for(n)]
+        state_ack.records = {f.cmd_id: logger.CommandRecord(f.cmd_id, int(f.t_send_ms)) for f in futures}
+        state_ack.received_count = 1   # keep the every-50 progress print out of the loop
+        return futures
+
+    def record_ack_quiet(fut):
+        state_ack.received_count = 1
+        logger.record_ack(state_ack, fut)
+
+    stages.append(Stage("record_ack (state.lock)", "receive", prepare_record_ack, record_ack_quiet,
+                        "record update under the lock"))
+
+    bench = RTTBenchmark("127.0.0.1", 1883, "demo", "demo_pass")
+
+    def prepare_bench_ack(n):
+        futures = [resolved_future(c) for c in commands_for(n)]
+        bench.records = {f.cmd_id: {"t_send_ms": int(f.t_send_ms)} for f in futures}
+        return futures
+
+    stages.append(Stage("RTTBenchmark._on_ack", "receive", prepare_bench_ack, bench._on_ack,
+                        "record dict + timeline window"))
+
+    # -- whole receive callback (logger.on_message: decode, loads, on_ack, record_ack) -------
+    client_full = fake_client()
+    commands_full = CommandClient(client_full, TOPIC_CMD)
+    state_full = logger.BenchmarkState()
+    userdata = {"commands": commands_full, "state": state_full}
+
+    def prepare_on_message(n):
+        futures = [new_future(c) for c in commands_for(n)]
+        state_full.records = {f.cmd_id: logger.CommandRecord(f.cmd_id, int(f.t_send_ms)) for f in futures}
+        state_full.received_count = 1
+        for f in futures:
+            f.add_done_callback(lambda fut: (setattr(state_full, "received_count", 1),
+                                             logger.record_ack(state_full, fut)))
+        with commands_full._cond:
+            commands_full.pending = {f.cmd_id: f for f in futures}
+        messages = []
+        for f in futures:
+            msg = mqtt.MQTTMessage(topic=TOPIC_ACK.encode())
+            msg.payload = ack_payload(f.cmd_id)
+            messages.append(msg)
+        return messages
+
+    stages.append(Stage("logger.on_message (full ack)", "total", prepare_on_message,
+                        lambda msg: logger.on_message(client_full, userdata, msg),
+                        "decode + loads + on_ack + record_ack callback"))
+    return stages
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+def _noop(_):
+    pass
+
+
+def time_batch(op: Callable, inputs: list) -> int:
+    gc_was = gc.isenabled()
+    gc.disable()
+    try:
+        t0 = time.perf_counter_ns()
+        for x in inputs:
+            op(x)
+        return time.perf_counter_ns() - t0
+    finally:
+        if gc_was:
+            gc.enable()
+
+
+def measure(stage: Stage, number: int, repeat: int, overhead_ns: float, alloc: bool) -> StageResult:
+    time_batch(stage.op, stage.prepare(min(number, 200)))          # warm-up
+    per_op = []
+    for _ in range(repeat):
+        inputs = stage.prepare(number)
+        per_op.append(max(0.0, time_batch(stage.op, inputs) / number - overhead_ns))
+    result = StageResult(stage.name, stage.path, min(per_op), statistics.median(per_op), note=stage.note)
+    if alloc:
+        inputs = stage.prepare(number)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            base = tracemalloc.get_traced_memory()[0]
+            peaks = []
+            for i, x in enumerate(inputs):
+                if i < ALLOC_SAMPLES:
+                    current = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    stage.op(x)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - current)
+                else:
+                    stage.op(x)
+            kept = tracemalloc.get_traced_memory()[0] - base
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        blocks = sum(s.count_diff for s in after.compare_to(before, "filename"))
+        result.peak_bytes_per_op = statistics.median(peaks)
+        result.kept_bytes_per_op = kept / number
+        result.blocks_per_op = blocks / number
+    return result
+
+
+def loop_overhead(number: int, repeat: int) -> float:
+    inputs = [None] * number
+    return min(time_batch(_noop, inputs) for _ in range(repeat)) / number
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+def print_results(results: List[StageResult], overhead_ns: float, baseline: Optional[dict]):
+    base = {s["name"]: s for s in baseline["stages"]} if baseline else {}
+    print("\n" + "=" * 100)
+    print(f"⏱️ HARNESS MICROBENCHMARK (loop+call overhead {overhead_ns:.0f} ns/op subtracted)")
+    print("=" * 100)
+    header = f"  {'Stage':<30} {'ns/op':>9} {'median':>9} {'peak B':>8} {'kept B':>8} {'blocks':>7}"
+    print(header + ("   vs baseline" if base else ""))
+    path = None
+    for r in results:
+        if r.path != path:
+            path = r.path
+            print(f"  [{path}]")
+        alloc = (f" {r.peak_bytes_per_op:>8.0f} {r.kept_bytes_per_op:>8.0f} {r.blocks_per_op:>7.2f}"
+                 if r.peak_bytes_per_op is not None else f" {'-':>8} {'-':>8} {'-':>7}")
+        delta = ""
+        if r.name in base:
+            change = r.ns_per_op / base[r.name]["ns_per_op"] - 1 if base[r.name]["ns_per_op"] else 0.0
+            delta = f"   {change:+.0%}"
+        print(f"  {r.name:<30} {r.ns_per_op:>9.0f} {r.ns_median:>9.0f}{alloc}{delta}")
+
+    by_name = {r.name: r for r in results}
+    send = [by_name.get(n) for n in ("build_command", "CommandClient.send", "record_send (state.lock)")]
+    recv = [by_name.get(n) for n in ("paho read+dispatch qos1", "logger.on_message (full ack)")]
+    if all(send) and all(recv):
+        send_ns, recv_ns = sum(r.ns_per_op for r in send), sum(r.ns_per_op for r in recv)
+        print(f"\n  📤 Send path  (build_command + CommandClient.send + record_send): {send_ns / 1000:6.1f} µs")
+        print(f"  📥 Ack path   (paho read qos1 + logger.on_message):             {recv_ns / 1000:6.1f} µs")
+        print(f"  🧮 Client CPU per command: {(send_ns + recv_ns) / 1000:.1f} µs (caps the send rate)")
+        dumps = by_name.get("json.dumps")
+        if dumps:
+            # t_send is taken after send's json.dumps, t_recv before on_message does any work
+            window_ns = send[1].ns_per_op - dumps.ns_per_op + recv[0].ns_per_op
+            print(f"  ⏱️ Inside the RTT window: {window_ns / 1000:.1f} µs "
+                  f"(CommandClient.send after json.dumps + paho read qos1; the rest is outside)")
+    print("=" * 100)
+
+
+def compare(results: List[StageResult], baseline: dict, max_regression: float) -> List[str]:
+    base = {s["name"]: s["ns_per_op"] for s in baseline["stages"]}
+    return [f"{r.name}: {base[r.name]:.0f} -> {r.ns_per_op:.0f} ns/op ({r.ns_per_op / base[r.name] - 1:+.0%})"
+            for r in results if base.get(r.name) and r.ns_per_op > base[r.name] * (1 + max_regression)]
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Per-stage client overhead of the RTT harness (fake transport, no broker)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python microbench.py
+  python microbench.py --number 5000 --repeat 9
+  python microbench.py --stage paho --no-alloc
+  python microbench.py --baseline results/microbench_20260101_120000.json --max-regression 0.25
+        """
+    )
+    parser.add_argument('--number', type=int, default=2000, help='Ops per timed batch')
+    parser.add_argument('--repeat', type=int, default=7, help='Timed batches per stage (best is reported)')
+    parser.add_argument('--stage', default=None, help='Only stages whose name contains this text')
+    parser.add_argument('--no-alloc', action='store_true', help='Skip the tracemalloc pass')
+    parser.add_argument('--outdir', default='results', help='Directory for microbench_<timestamp>.json')
+    parser.add_argument('--baseline', default=None, help='Earlier microbench JSON to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='With --baseline: fail when a stage is this much slower (0.25 = +25%%)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot read baseline {args.baseline}: {e}")
+            sys.exit(2)
+
+    try:
+        stages = [s for s in build_stages() if not args.stage or args.stage.lower() in s.name.lower()]
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    if not stages:
+        print(f"❌ No stage matches '{args.stage}'")
+        sys.exit(2)
+    print(f"🧪 {len(stages)} stage(s), {args.repeat} x {args.number} ops each"
+          f"{'' if args.no_alloc else ', + tracemalloc pass'}")
+
+    overhead_ns = loop_overhead(args.number, args.repeat)
+    results = []
+    for stage in stages:
+        results.append(measure(stage, args.number, args.repeat, overhead_ns, not args.no_alloc))
+        print(f"   {stage.name:<30} {results[-1].ns_per_op:>8.0f} ns/op")
+
+    print_results(results, overhead_ns, baseline)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    out = os.path.join(args.outdir, f"microbench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "paho_mqtt": getattr(mqtt, "__version__", None) or _paho_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "number": args.number,
+                "repeat": args.repeat,
+                "loop_overhead_ns": overhead_ns,
+            },
+            "stages": [asdict(r) for r in results],
+        }, f, indent=2)
+    print(f"💾 Saved: {out}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n❌ {len(regressions)} stage(s) slower than baseline by more than {args.max_regression:.0%}:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"\n✅ No stage slower than baseline by more than {args.max_regression:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,785 @@
+#!/usr/bin/env python3
+"""
+Mini Broker - Traffic Light MQTT Demo
+Pure-Python asyncio MQTT 3.1.1 broker covering what the tools use, for running
+benchmarks and checks without the Docker Mosquitto (plain Python sandboxes, CI).
+
+Supported:
+- QoS 0/1/2 in both directions, retained messages, LWT (will qos/retain)
+- username/password: plain users or the Mosquitto pwfile ($6$ / $7$ hashes),
+  so docker/mosquitto/pwfile works as is; optional anonymous access
+- + / # wildcards (topic trie; $-topics are not matched by a leading wildcard)
+- persistent sessions (clean session = 0): subscriptions survive, QoS 1/2
+  messages are queued while offline (up to max_queued, like Mosquitto's
+  max_queued_messages) and unacked ones are resent on reconnect
+- keepalive (disconnect after 1.5 x keepalive, will is published), client-id
+  takeover, Mosquitto-style $SYS counters every sys_interval (qos_matrix)
+- message_size_limit (default 1024 B, as in docker/mosquitto/mosquitto.conf):
+  larger payloads are acknowledged to the publisher and dropped, like Mosquitto
+  does for MQTT 3.1.1 clients
+
+Not supported: ACLs (every authenticated client may publish/subscribe to
+anything), websockets, TLS, disk persistence, MQTT 5.
+
+Tools that talk to the broker take --embedded-broker: they start this broker
+in-process on a free loopback port (user/password from their own flags), and
+the single-device tools also start an in-process mock_esp32 on it.
+
+Usage:
+    python mini_broker.py                                   # 127.0.0.1:1883, user demo/demo_pass
+    python mini_broker.py --port 1884 --pwfile ../../docker/mosquitto/pwfile
+    python mini_broker.py --host 0.0.0.0 --allow-anonymous -v
+    python smoke_test.py --embedded-broker
+"""
+
+import argparse
+import asyncio
+import atexit
+import base64
+import hashlib
+import hmac
+import signal
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional, Tuple
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+CONNACK_ACCEPTED = 0
+CONNACK_BAD_PROTOCOL = 1
+CONNACK_BAD_CLIENT_ID = 2
+CONNACK_BAD_CREDENTIALS = 4
+CONNACK_NOT_AUTHORIZED = 5
+
+MAX_WRITE_BUFFER = 32 << 20   # a subscriber this far behind is disconnected
+MESSAGE_SIZE_LIMIT = 1024     # payload bytes, docker/mosquitto/mosquitto.conf message_size_limit
+
+
+class ProtocolError(Exception):
+    """Malformed or out-of-order packet; the connection is closed."""
+
+
+# =============================================================================
+# ENCODING
+# =============================================================================
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def _packet(first: int, body: bytes = b"") -> bytes:
+    return bytes([first]) + _varint(len(body)) + body
+
+
+def _utf8(data: bytes) -> bytes:
+    return struct.pack("!H", len(data)) + data
+
+
+class _Reader:
+    """Cursor over a packet body."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def u8(self) -> int:
+        if self.pos >= len(self.data):
+            raise ProtocolError("truncated packet")
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    def u16(self) -> int:
+        if self.pos + 2 > len(self.data):
+            raise ProtocolError("truncated packet")
+        self.pos += 2
+        return struct.unpack_from("!H", self.data, self.pos - 2)[0]
+
+    def bytes(self) -> bytes:
+        n = self.u16()
+        if self.pos + n > len(self.data):
+            raise ProtocolError("truncated packet")
+        self.pos += n
+        return self.data[self.pos - n:self.pos]
+
+    def str(self) -> str:
+        try:
+            return self.bytes().decode("utf-8")
+        except UnicodeDecodeError:
+            raise ProtocolError("invalid UTF-8 string")
+
+    def rest(self) -> bytes:
+        return self.data[self.pos:]
+
+    def at_end(self) -> bool:
+        return self.pos >= len(self.data)
+
+
+# =============================================================================
+# AUTH
+# =============================================================================
+
+def load_pwfile(path: str) -> Dict[str, str]:
+    """user -> stored password (Mosquitto $6$/$7$ hash or plain text) from a pwfile."""
+    users = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and ":" in line:
+                user, stored = line.split(":", 1)
+                users[user] = stored
+    return users
+
+
+def check_password(stored: str, password: str) -> bool:
+    """Mosquitto pwfile hashes: $6$salt$sha512(pw+salt), $7$iterations$salt$pbkdf2-sha512."""
+    pw = password.encode("utf-8")
+    try:
+        if stored.startswith("$6$"):
+            _, _, salt, digest = stored.split("$")
+            salt = base64.b64decode(salt)
+            return hmac.compare_digest(hashlib.sha512(pw + salt).digest(), base64.b64decode(digest))
+        if stored.startswith("$7$"):
+            _, _, iterations, salt, digest = stored.split("$")
+            calc = hashlib.pbkdf2_hmac("sha512", pw, base64.b64decode(salt), int(iterations))
+            return hmac.compare_digest(calc, base64.b64decode(digest))
+    except ValueError:
+        return False
+    return hmac.compare_digest(stored.encode("utf-8"), pw)
+
+
+# =============================================================================
+# TOPICS
+# =============================================================================
+
+def valid_filter(topic_filter: str) -> bool:
+    if not topic_filter:
+        return False
+    levels = topic_filter.split("/")
+    for i, level in enumerate(levels):
+        if "#" in level and (level != "#" or i != len(levels) - 1):
+            return False
+        if "+" in level and level != "+":
+            return False
+    return True
+
+
+def filter_matches(topic_filter: str, topic: str) -> bool:
+    if topic.startswith("$") and topic_filter[:1] in ("+", "#"):
+        return False
+    f_levels, t_levels = topic_filter.split("/"), topic.split("/")
+    for i, level in enumerate(f_levels):
+        if level == "#":
+            return True
+        if i >= len(t_levels) or (level != "+" and level != t_levels[i]):
+            return False
+    return len(f_levels) == len(t_levels)
+
+
+class _Node:
+    __slots__ = ("children", "subs")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.subs: Dict[str, int] = {}       # client_id -> granted qos
+
+
+class TopicTree:
+    """Subscriptions by filter level, so a publish only visits the branches it can match."""
+
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, topic_filter: str, client_id: str, qos: int):
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.subs[client_id] = qos
+
+    def remove(self, topic_filter: str, client_id: str):
+        path = [self.root]
+        for level in topic_filter.split("/"):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].subs.pop(client_id, None)
+        levels = topic_filter.split("/")
+        for i in range(len(levels), 0, -1):       # prune empty branches
+            node = path[i]
+            if node.subs or node.children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+
+    def match(self, topic: str) -> Dict[str, int]:
+        """client_id -> highest granted qos among the filters matching topic."""
+        levels = topic.split("/")
+        out: Dict[str, int] = {}
+
+        def merge(subs: Dict[str, int]):
+            for cid, qos in subs.items():
+                if out.get(cid, -1) < qos:
+                    out[cid] = qos
+
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            wildcards_ok = not (i == 0 and topic.startswith("$"))
+            hash_node = node.children.get("#") if wildcards_ok else None
+            if hash_node is not None:
+                merge(hash_node.subs)                 # 'a/#' also matches 'a'
+            if i == len(levels):
+                if node.subs:
+                    merge(node.subs)
+                continue
+            child = node.children.get(levels[i])
+            if child is not None:
+                stack.append((child, i + 1))
+            if wildcards_ok:
+                plus = node.children.get("+")
+                if plus is not None:
+                    stack.append((plus, i + 1))
+        return out
+
+
+# =============================================================================
+# SESSIONS
+# =============================================================================
+
+@dataclass
+class Message:
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool = False
+    topic_b: bytes = b""
+
+    def __post_init__(self):
+        if not self.topic_b:
+            self.topic_b = _utf8(self.topic.encode("utf-8"))
+
+
+@dataclass
+class Session:
+    client_id: str
+    clean: bool
+    subscriptions: Dict[str, int] = field(default_factory=dict)
+    queue: Deque[Tuple[Message, int]] = field(default_factory=deque)    # offline, qos > 0
+    inflight: Dict[int, Tuple[Message, int]] = field(default_factory=dict)  # outbound, unacked
+    released: set = field(default_factory=set)        # outbound qos 2 waiting for PUBCOMP
+    incoming_qos2: set = field(default_factory=set)   # inbound qos 2 ids waiting for PUBREL
+    conn: Optional["Connection"] = None
+    _next_pid: int = 0
+
+    def next_pid(self) -> int:
+        for _ in range(65535):
+            self._next_pid = self._next_pid % 65535 + 1
+            if self._next_pid not in self.inflight:
+                return self._next_pid
+        raise ProtocolError("no free packet id")
+
+
+@dataclass
+class BrokerStats:
+    messages_received: int = 0
+    messages_sent: int = 0
+    publish_received: int = 0
+    publish_sent: int = 0
+    publish_dropped: int = 0
+    bytes_received: int = 0
+    bytes_sent: int = 0
+
+
+class Connection:
+    def __init__(self, broker: "MiniBroker", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.session: Optional[Session] = None
+        self.keepalive = 0
+        self.last_activity = time.monotonic()
+        self.will: Optional[Message] = None
+        self.closed = False
+        peer = writer.get_extra_info("peername")
+        self.peer = f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else str(peer)
+
+    def write(self, data: bytes):
+        if self.closed:
+            return
+        self.writer.write(data)
+        stats = self.broker.stats
+        stats.messages_sent += 1
+        stats.bytes_sent += len(data)
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            self.broker.log(f"⚠️ {self.session.client_id if self.session else self.peer}: "
+                            f"write buffer over {MAX_WRITE_BUFFER >> 20} MB, disconnecting")
+            self.abort()
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.transport.abort()
+
+    def send_publish(self, msg: Message, qos: int, retain: bool = False, dup: bool = False,
+                     pid: Optional[int] = None):
+        first = (PUBLISH << 4) | (qos << 1) | (0x08 if dup else 0) | (0x01 if retain else 0)
+        if qos:
+            if pid is None:
+                pid = self.session.next_pid()
+                self.session.inflight[pid] = (msg, qos)
+            body = msg.topic_b + struct.pack("!H", pid) + msg.payload
+        else:
+            body = msg.topic_b + msg.payload
+        self.write(_packet(first, body))
+        self.broker.stats.publish_sent += 1
+
+    async def read_packet(self) -> Tuple[int, int, bytes]:
+        first = (await self.reader.readexactly(1))[0]
+        length, shift = 0, 0
+        for _ in range(4):
+            byte = (await self.reader.readexactly(1))[0]
+            length += (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        else:
+            raise ProtocolError("malformed remaining length")
+        body = await self.reader.readexactly(length) if length else b""
+        self.last_activity = time.monotonic()
+        stats = self.broker.stats
+        stats.messages_received += 1
+        stats.bytes_received += length + 2
+        return first >> 4, first & 0x0F, body
+
+
+# =============================================================================
+# BROKER
+# =============================================================================
+
+class MiniBroker:
+    """
+    In-process MQTT 3.1.1 broker. start() runs it on a background event loop
+    thread and returns once it listens (port=0 picks a free port, see .port).
+    users=None with allow_anonymous=True accepts everyone.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 1883, users: Optional[Dict[str, str]] = None,
+                 allow_anonymous: bool = False, max_queued: int = 1000, sys_interval: float = 10.0,
+                 verbose: bool = False, message_size_limit: int = MESSAGE_SIZE_LIMIT):
+        self.host = host
+        self.port = port
+        self.users = users or {}
+        self.allow_anonymous = allow_anonymous
+        self.max_queued = max_queued
+        self.message_size_limit = message_size_limit   # 0 = no limit
+        self.sys_interval = sys_interval
+        self.verbose = verbose
+        self.sessions: Dict[str, Session] = {}
+        self.tree = TopicTree()
+        self.retained: Dict[str, Message] = {}
+        self.stats = BrokerStats()
+        self.devices: list = []           # in-process mocks started with the broker (stopped first)
+        self.started = time.time()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._serve_task: Optional[asyncio.Task] = None
+        self._handlers: set = set()
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def log(self, message: str):
+        if self.verbose:
+            print(f"[{time.strftime('%H:%M:%S')}] {message}")
+
+    # -- lifecycle ---------------------------------------------------------------------------
+
+    async def serve(self):
+        """Listen until cancelled (also the entry point of the CLI)."""
+        self._serve_task = asyncio.current_task()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.started = time.time()
+        housekeeping = asyncio.ensure_future(self._housekeeping())
+        self._ready.set()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            housekeeping.cancel()
+            for session in list(self.sessions.values()):
+                if session.conn is not None:
+                    session.conn.abort()
+            if self._handlers:
+                await asyncio.wait(self._handlers, timeout=2.0)
+
+    def start(self, timeout: float = 5.0) -> "MiniBroker":
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.serve())
+            except asyncio.CancelledError:
+                pass
+            except BaseException as e:     # noqa: BLE001 - reported to start()
+                self._error = e
+                self._ready.set()
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mini-broker", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout) or self._error is not None:
+            raise OSError(f"mini broker failed to start on {self.host}:{self.port}: {self._error}")
+        return self
+
+    def stop(self):
+        for device in self.devices:
+            device.stop()
+        self.devices = []
+        if self._loop is not None and self._serve_task is not None:
+            self._loop.call_soon_threadsafe(self._serve_task.cancel)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    async def _housekeeping(self):
+        """Keepalive timeouts every second, $SYS counters every sys_interval."""
+        next_sys = time.monotonic()
+        while True:
+            now = time.monotonic()
+            for session in list(self.sessions.values()):
+                conn = session.conn
+                if conn is not None and conn.keepalive and now - conn.last_activity > 1.5 * conn.keepalive:
+                    self.log(f"⏱️ {session.client_id}: keepalive expired")
+                    conn.abort()
+            if self.sys_interval and now >= next_sys:
+                self._publish_sys()
+                next_sys = now + self.sys_interval
+            await asyncio.sleep(1.0)
+
+    def _publish_sys(self):
+        s = self.stats
+        values = [
+            ("$SYS/broker/version", "mini_broker (Traffic Light MQTT Demo)"),
+            ("$SYS/broker/uptime", f"{int(time.time() - self.started)} seconds"),
+            ("$SYS/broker/clients/connected", sum(1 for x in self.sessions.values() if x.conn is not None)),
+            ("$SYS/broker/retained messages/count", len(self.retained)),
+            ("$SYS/broker/bytes/received", s.bytes_received),
+            ("$SYS/broker/bytes/sent", s.bytes_sent),
+            ("$SYS/broker/messages/received", s.messages_received),
+            ("$SYS/broker/publish/messages/received", s.publish_received),
+            ("$SYS/broker/publish/messages/sent", s.publish_sent),
+            ("$SYS/broker/publish/messages/dropped", s.publish_dropped),
+            ("$SYS/broker/messages/sent", s.messages_sent),   # last: readers take it as "update done"
+        ]
+        for topic, value in values:
+            self.publish(Message(topic, str(value).encode(), 0, retain=True), count=False)
+
+    # -- routing -----------------------------------------------------------------------------
+
+    def publish(self, msg: Message, count: bool = True):
+        """Store if retained, then deliver to every matching subscription."""
+        if count:
+            self.stats.publish_received += 1
+        if msg.retain:
+            if msg.payload:
+                self.retained[msg.topic] = msg
+            else:
+                self.retained.pop(msg.topic, None)
+        for client_id, sub_qos in self.tree.match(msg.topic).items():
+            session = self.sessions.get(client_id)
+            if session is None:
+                continue
+            qos = min(msg.qos, sub_qos)
+            if session.conn is not None:
+                session.conn.send_publish(msg, qos)
+            elif qos and len(session.queue) < self.max_queued:
+                session.queue.append((msg, qos))
+            else:
+                self.stats.publish_dropped += 1
+
+    # -- connection handling -----------------------------------------------------------------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = Connection(self, reader, writer)
+        graceful = False
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            ptype, flags, body = await asyncio.wait_for(conn.read_packet(), timeout=10.0)
+            if ptype != CONNECT or not self._on_connect(conn, body):
+                return
+            while not conn.closed:
+                ptype, flags, body = await conn.read_packet()
+                if ptype == DISCONNECT:
+                    graceful = True
+                    break
+                self._dispatch(conn, ptype, flags, body)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ProtocolError) as e:
+            if isinstance(e, ProtocolError):
+                self.log(f"❌ {conn.peer}: {e}")
+        finally:
+            self._on_close(conn, graceful)
+            conn.closed = True
+            writer.close()
+            self._handlers.discard(task)
+
+    def _on_connect(self, conn: Connection, body: bytes) -> bool:
+        r = _Reader(body)
+        protocol, level = r.str(), r.u8()
+        if (protocol, level) not in (("MQTT", 4), ("MQIsdp", 3)):
+            conn.write(_packet(CONNACK << 4, bytes([0, CONNACK_BAD_PROTOCOL])))
+            return False
+        flags = r.u8()
+        conn.keepalive = r.u16()
+        clean = bool(flags & 0x02)
+        client_id = r.str()
+        if flags & 0x04:
+            will_topic = r.str()
+            conn.will = Message(will_topic, r.bytes(), (flags >> 3) & 0x03, bool(flags & 0x20))
+        username = r.str() if flags & 0x80 else None
+        password = r.bytes().decode("utf-8", "replace") if flags & 0x40 else None
+
+        if not client_id:
+            if not clean:
+                conn.write(_packet(CONNACK << 4, bytes([0, CONNACK_BAD_CLIENT_ID])))
+                return False
+            client_id = f"auto-{uuid.uuid4().hex[:12]}"
+        if username is None:
+            authorized = self.allow_anonymous
+        else:
+            stored = self.users.get(username)
+            authorized = (stored is not None and password is not None and check_password(stored, password)) \
+                or (not self.users and self.allow_anonymous)
+        if not authorized:
+            self.log(f"🔒 {client_id} ({conn.peer}): bad username/password")
+            conn.write(_packet(CONNACK << 4, bytes([0, CONNACK_BAD_CREDENTIALS if username else
+                                                    CONNACK_NOT_AUTHORIZED])))
+            return False
+
+        session = self.sessions.get(client_id)
+        if session is not None and session.conn is not None:
+            self.log(f"♻️ {client_id}: taken over by {conn.peer}")
+            old = session.conn
+            self._on_close(old, graceful=False)       # the old connection's will is published
+            old.abort()
+        if session is not None and (clean or session.clean):
+            self._drop_session(session)
+            session = None
+        present = session is not None
+        if session is None:
+            session = self.sessions[client_id] = Session(client_id, clean)
+        session.conn = conn
+        conn.session = session
+        conn.write(_packet(CONNACK << 4, bytes([1 if present else 0, CONNACK_ACCEPTED])))
+        self.log(f"✅ {client_id} connected from {conn.peer} (clean={int(clean)}, keepalive={conn.keepalive}s"
+                 f"{', session resumed' if present else ''})")
+
+        if present:
+            for pid, (msg, qos) in sorted(session.inflight.items()):
+                if pid in session.released:
+                    conn.write(_packet((PUBREL << 4) | 0x02, struct.pack("!H", pid)))
+                else:
+                    conn.send_publish(msg, qos, dup=True, pid=pid)
+            while session.queue:
+                msg, qos = session.queue.popleft()
+                conn.send_publish(msg, qos)
+        return True
+
+    def _drop_session(self, session: Session):
+        for topic_filter in session.subscriptions:
+            self.tree.remove(topic_filter, session.client_id)
+        self.sessions.pop(session.client_id, None)
+
+    def _on_close(self, conn: Connection, graceful: bool):
+        session = conn.session
+        if session is None or session.conn is not conn:
+            return
+        session.conn = None
+        if conn.will is not None and not graceful:
+            self.log(f"💀 {session.client_id}: publishing will on {conn.will.topic}")
+            self.publish(conn.will)
+        conn.will = None
+        if session.clean:
+            self._drop_session(session)
+        self.log(f"👋 {session.client_id} {'disconnected' if graceful else 'connection lost'}")
+
+    def _dispatch(self, conn: Connection, ptype: int, flags: int, body: bytes):
+        session = conn.session
+        if ptype == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            if qos == 3:
+                raise ProtocolError("invalid QoS 3")
+            r = _Reader(body)
+            topic = r.str()
+            if not topic or "+" in topic or "#" in topic:
+                raise ProtocolError(f"invalid publish topic {topic!r}")
+            pid = r.u16() if qos else 0
+            msg = Message(topic, r.rest(), qos, bool(flags & 0x01))
+            if qos == 2:
+                conn.write(_packet(PUBREC << 4, struct.pack("!H", pid)))
+                if pid in session.incoming_qos2:
+                    return                            # resent before our PUBREC arrived
+                session.incoming_qos2.add(pid)
+            if self.message_size_limit and len(msg.payload) > self.message_size_limit:
+                # Mosquitto (MQTT 3.1.1): acknowledged, but never delivered
+                self.stats.publish_dropped += 1
+                self.log(f"🚫 {session.client_id}: {len(msg.payload)} B on {topic} exceeds "
+                         f"message_size_limit {self.message_size_limit}")
+            else:
+                self.publish(msg)
+            if qos == 1:
+                conn.write(_packet(PUBACK << 4, struct.pack("!H", pid)))
+        elif ptype == PUBACK or ptype == PUBCOMP:
+            pid = _Reader(body).u16()
+            session.inflight.pop(pid, None)
+            session.released.discard(pid)
+        elif ptype == PUBREC:
+            pid = _Reader(body).u16()
+            session.released.add(pid)
+            conn.write(_packet((PUBREL << 4) | 0x02, struct.pack("!H", pid)))
+        elif ptype == PUBREL:
+            pid = _Reader(body).u16()
+            session.incoming_qos2.discard(pid)
+            conn.write(_packet(PUBCOMP << 4, struct.pack("!H", pid)))
+        elif ptype == SUBSCRIBE:
+            self._on_subscribe(conn, body)
+        elif ptype == UNSUBSCRIBE:
+            r = _Reader(body)
+            pid = r.u16()
+            while not r.at_end():
+                topic_filter = r.str()
+                if session.subscriptions.pop(topic_filter, None) is not None:
+                    self.tree.remove(topic_filter, session.client_id)
+            conn.write(_packet(UNSUBACK << 4, struct.pack("!H", pid)))
+        elif ptype == PINGREQ:
+            conn.write(_packet(PINGRESP << 4))
+        else:
+            raise ProtocolError(f"unexpected packet type {ptype}")
+
+    def _on_subscribe(self, conn: Connection, body: bytes):
+        session = conn.session
+        r = _Reader(body)
+        pid = r.u16()
+        granted, new_filters = [], []
+        while not r.at_end():
+            topic_filter, qos = r.str(), r.u8() & 0x03
+            if not valid_filter(topic_filter) or qos == 3:
+                granted.append(0x80)
+                continue
+            session.subscriptions[topic_filter] = qos
+            self.tree.add(topic_filter, session.client_id, qos)
+            granted.append(qos)
+            new_filters.append((topic_filter, qos))
+        if not granted:
+            raise ProtocolError("SUBSCRIBE without topic filters")
+        conn.write(_packet(SUBACK << 4, struct.pack("!H", pid) + bytes(granted)))
+        for topic_filter, qos in new_filters:
+            for topic, msg in list(self.retained.items()):
+                if filter_matches(topic_filter, topic):
+                    conn.send_publish(msg, min(msg.qos, qos), retain=True)
+        self.log(f"📥 {session.client_id} subscribed: {', '.join(f for f, _ in new_filters)}")
+
+
+# =============================================================================
+# TOOL HELPER
+# =============================================================================
+
+def start_embedded_broker(args, with_mock: bool = False, fleet_size: int = 0) -> MiniBroker:
+    """
+    --embedded-broker for the tools: a private broker on a free loopback port
+    accepting args.user/args.password ($SYS every second). args.host/args.port
+    are pointed at it.
+    with_mock also starts an in-process mock_esp32 for args.city/args.intersection
+    (single-device tools: nothing else can reach this broker); fleet_size starts
+    that many for intersections 001..N instead (fleet tools). All are stopped
+    at exit.
+    """
+    broker = MiniBroker("127.0.0.1", 0, users={args.user: args.password}, sys_interval=1.0).start()
+    atexit.register(broker.stop)
+    args.host, args.port = "127.0.0.1", broker.port
+    print(f"🧪 Embedded broker: 127.0.0.1:{broker.port} (mini_broker.py)")
+    city = getattr(args, "city", "demo")
+    intersections = ([f"{n:03d}" for n in range(1, fleet_size + 1)] if fleet_size
+                     else [getattr(args, "intersection", "001")] if with_mock else [])
+    if intersections:
+        from mock_esp32 import MockESP32
+    for intersection in intersections:
+        mock = MockESP32(args.host, args.port, args.user, args.password, city, intersection, verbose=False)
+        if not mock.start():
+            broker.stop()
+            raise OSError("embedded mock_esp32 did not connect")
+        broker.devices.append(mock)
+    if intersections:
+        ids = intersections[0] if len(intersections) == 1 else f"{intersections[0]}..{intersections[-1]}"
+        print(f"🧪 Embedded mock_esp32: city/{city}/intersection/{ids}")
+    return broker
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pure-Python MQTT 3.1.1 broker (QoS 0-2, retained, LWT, auth, wildcards)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python mini_broker.py
+  python mini_broker.py --port 1884 --pwfile ../../docker/mosquitto/pwfile -v
+  python mini_broker.py --host 0.0.0.0 --allow-anonymous
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='Listen address')
+    parser.add_argument('--port', type=int, default=1883, help='Listen port (0 = any free port)')
+    parser.add_argument('--user', default='demo', help='Username (ignored with --pwfile)')
+    parser.add_argument('--password', default='demo_pass', help='Password (ignored with --pwfile)')
+    parser.add_argument('--pwfile', default=None, help='Mosquitto password file (mosquitto_passwd format)')
+    parser.add_argument('--allow-anonymous', action='store_true', help='Accept clients without credentials')
+    parser.add_argument('--max-queued', type=int, default=1000, help='Queued QoS 1/2 messages per offline session')
+    parser.add_argument('--sys-interval', type=float, default=10.0, help='$SYS update interval (s, 0 = off)')
+    parser.add_argument('--message-size-limit', type=int, default=MESSAGE_SIZE_LIMIT,
+                        help='Drop publishes with a larger payload (bytes, 0 = no limit; mosquitto.conf: 1024)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log connects, subscriptions, wills')
+    args = parser.parse_args()
+
+    users = load_pwfile(args.pwfile) if args.pwfile else {args.user: args.password}
+    broker = MiniBroker(args.host, args.port, users, args.allow_anonymous, args.max_queued,
+                        args.sys_interval, args.verbose, args.message_size_limit)
+
+    async def run():
+        task = asyncio.ensure_future(broker.serve())
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGINT, task.cancel)
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+        while not broker._ready.is_set() and not task.done():
+            await asyncio.sleep(0.01)
+        if not task.done():
+            print(f"🚦 Mini broker listening on {args.host}:{broker.port} "
+                  f"({len(users)} user(s){', anonymous allowed' if args.allow_anonymous else ''})")
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        s = broker.stats
+        print(f"\n🛑 Stopped. Received {s.publish_received:,} publishes, sent {s.publish_sent:,}, "
+              f"dropped {s.publish_dropped:,}")
+
+    try:
+        asyncio.run(run())
+    except OSError as e:
+        print(f"❌ Cannot listen on {args.host}:{args.port}: {e}")
+        raise SystemExit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,16 +9,24 @@ Features:
 - Subscribes to cmd topic and responds with ack
 - Publishes state periodically (1s interval)
 - Idempotent command handling (deduplicates cmd_id)
-- Optional ack delay for RTT testing
+- Optional ack delay (+ uniform jitter) for RTT testing; delayed acks wait in a
+  delay queue, so delays of back-to-back commands overlap
+- Answers PING clock probes immediately; optional simulated clock skew
 
 Usage:
     python mock_esp32.py --host localhost
     python mock_esp32.py --host 192.168.1.100 --ack_delay_ms 50
+    python mock_esp32.py --host localhost --ack_delay_ms 30 --ack_jitter_ms 20
+    python mock_esp32.py --host localhost --cmd_qos 2 --ack_qos 0 --persistent
+    python mock_esp32.py --host localhost --clock_skew_ms 40
 """
 
 import argparse
+import heapq
 import json
+import random
 import signal
+import socket
 import sys
 import threading
 import time
@@ -31,13 +39,21 @@ import paho.mqtt.client as mqtt
 class MockESP32:
     def __init__(self, host: str, port: int, user: str, password: str,
                  city: str, intersection: str, ack_delay_ms: int = 0,
-                 speed: float = 1.0):
+                 speed: float = 1.0, cmd_qos: int = 1, ack_qos: int = 1,
+                 clean_session: bool = True, verbose: bool = True,
+                 clock_skew_ms: float = 0.0, ack_jitter_ms: int = 0):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.ack_delay_ms = ack_delay_ms
+        self.ack_jitter_ms = ack_jitter_ms  # extra uniform 0..jitter delay per ack
         self.speed = max(0.1, speed)  # speed multiplier for demo
+        self.cmd_qos = cmd_qos
+        self.ack_qos = ack_qos
+        self.clean_session = clean_session
+        self.verbose = verbose
+        self.clock_skew_ms = clock_skew_ms  # simulated edge clock error
         
         # Topics
         base = f"city/{city}/intersection/{intersection}"
@@ -65,10 +81,19 @@ class MockESP32:
         # Idempotency - cache last 32 cmd_ids
         self.cmd_id_cache = deque(maxlen=32)
         
-        # MQTT client
+        # Delayed acks: (due monotonic s, seq, cmd_id, ok, err, recv_ts), sent by _delay_loop
+        self._delayed = []
+        self._delayed_seq = 0
+        self._delayed_cond = threading.Condition()
+        self._delay_thread = None
+        
+        # MQTT client (persistent sessions need a stable client id)
+        client_id = (f"mock-esp32-{uuid.uuid4().hex[:8]}" if clean_session
+                     else f"mock-esp32-{city}-{intersection}")
         self.client = mqtt.Client(
-            client_id=f"mock-esp32-{uuid.uuid4().hex[:8]}",
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+            client_id=client_id,
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            clean_session=clean_session
         )
         self.client.username_pw_set(user, password)
         
@@ -81,14 +106,29 @@ class MockESP32:
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
     
+    def _now_ms(self) -> int:
+        """Edge clock (epoch ms, shifted by the simulated skew)."""
+        return int(time.time() * 1000 + self.clock_skew_ms)
+    
+    def _log(self, message: str):
+        """Per-message output (disabled for in-process use by benchmark tools)."""
+        if self.verbose:
+            print(message)
+    
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             self.connected = True
-            print(f"✅ Connected to MQTT broker: {self.host}:{self.port}")
+            self._log(f"✅ Connected to MQTT broker: {self.host}:{self.port}")
+            # Nagle off (like CommandClient): acks sent from the delay queue would
+            # otherwise wait for the broker's TCP ACK of the previous publish
+            try:
+                client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (OSError, AttributeError):
+                pass
             
             # Subscribe to cmd topic
-            client.subscribe(self.topic_cmd, qos=1)
-            print(f"📥 Subscribed to: {self.topic_cmd}")
+            client.subscribe(self.topic_cmd, qos=self.cmd_qos)
+            self._log(f"📥 Subscribed to: {self.topic_cmd}")
             
             # Publish ONLINE status (retained)
             self._publish_status(online=True)
@@ -96,37 +136,44 @@ class MockESP32:
             print(f"❌ Connection failed with code: {rc}")
     
     def _on_message(self, client, userdata, msg):
-        print(f"\n📨 Received: {msg.topic}")
+        recv_ts = self._now_ms()
+        self._log(f"\n📨 Received: {msg.topic}")
         
         try:
             payload = json.loads(msg.payload.decode())
-            print(f"   Payload: {json.dumps(payload, indent=2)}")
+            if self.verbose:
+                print(f"   Payload: {json.dumps(payload, indent=2)}")
         except json.JSONDecodeError:
-            print("   ❌ Invalid JSON")
+            self._log("   ❌ Invalid JSON")
             return
         
         # Check required field
         cmd_id = payload.get("cmd_id")
         if not cmd_id:
-            print("   ❌ Missing cmd_id")
+            self._log("   ❌ Missing cmd_id")
             self._publish_ack(None, ok=False, err="ERR_INVALID_CMD")
             return
         
+        # Clock probe (clock_sync.py): ack at once, no delay, no state change
+        if payload.get("type") == "PING":
+            self._publish_ack(cmd_id, ok=True, recv_ts=recv_ts)
+            return
+        
         # Idempotency check
         if cmd_id in self.cmd_id_cache:
-            print(f"   ⚠️ Duplicate cmd_id, acking without re-execution")
-            self._publish_ack(cmd_id, ok=True)
+            self._log(f"   ⚠️ Duplicate cmd_id, acking without re-execution")
+            self._publish_ack(cmd_id, ok=True, recv_ts=recv_ts)
             return
         
         # Process command
-        self._handle_command(payload)
+        self._handle_command(payload, recv_ts)
     
-    def _on_disconnect(self, client, userdata, rc, properties=None):
+    def _on_disconnect(self, client, userdata, disconnect_flags, rc, properties=None):
         self.connected = False
         if rc != 0:
             print(f"⚠️ Unexpected disconnect: {rc}")
     
-    def _handle_command(self, payload: dict):
+    def _handle_command(self, payload: dict, recv_ts: int = None):
         cmd_id = payload["cmd_id"]
         cmd_type = payload.get("type", "")
         
@@ -139,68 +186,95 @@ class MockESP32:
                 self.mode = mode
                 self.phase_start = time.time()
                 ok = True
-                print(f"   ✅ Mode changed to: {self.mode}")
+                self._log(f"   ✅ Mode changed to: {self.mode}")
             else:
                 err = "ERR_INVALID_MODE"
-                print(f"   ❌ Invalid mode: {mode}")
+                self._log(f"   ❌ Invalid mode: {mode}")
                 
         elif cmd_type == "SET_PHASE":
             if self.mode != "MANUAL":
                 err = "ERR_NOT_MANUAL_MODE"
-                print(f"   ❌ SET_PHASE rejected: not in MANUAL mode")
+                self._log(f"   ❌ SET_PHASE rejected: not in MANUAL mode")
             else:
                 phase = payload.get("phase")
                 if isinstance(phase, int) and 0 <= phase <= 5:
                     self.phase = phase
                     self.phase_start = time.time()
                     ok = True
-                    print(f"   ✅ Phase set to: {self.phase}")
+                    self._log(f"   ✅ Phase set to: {self.phase}")
                 else:
                     err = "ERR_INVALID_PHASE"
-                    print(f"   ❌ Invalid phase: {phase}")
+                    self._log(f"   ❌ Invalid phase: {phase}")
                     
         elif cmd_type == "EMERGENCY":
             self.mode = "BLINK"
             self.phase = 2  # ALL_RED
             self.phase_start = time.time()
             ok = True
-            print(f"   ✅ EMERGENCY activated: BLINK mode")
+            self._log(f"   ✅ EMERGENCY activated: BLINK mode")
             
         else:
             err = "ERR_UNKNOWN_TYPE"
-            print(f"   ❌ Unknown command type: {cmd_type}")
+            self._log(f"   ❌ Unknown command type: {cmd_type}")
         
         # Cache cmd_id
         self.cmd_id_cache.append(cmd_id)
         
-        # Optional delay
-        if self.ack_delay_ms > 0:
-            time.sleep(self.ack_delay_ms / 1000.0)
+        # Optional delay: queued, not slept, so paho's network thread keeps reading
+        delay_ms = self.ack_delay_ms + (random.uniform(0, self.ack_jitter_ms) if self.ack_jitter_ms else 0)
+        if delay_ms > 0:
+            self._schedule_ack(delay_ms, cmd_id, ok, err, recv_ts)
+            return
         
         # Publish ack
-        self._publish_ack(cmd_id, ok, err)
+        self._publish_ack(cmd_id, ok, err, recv_ts)
         
         # Publish updated state
         self._publish_state()
     
+    def _schedule_ack(self, delay_ms: float, cmd_id: str, ok: bool, err: str, recv_ts: int):
+        """Send the ack (and state) delay_ms from now without blocking the caller."""
+        with self._delayed_cond:
+            self._delayed_seq += 1
+            heapq.heappush(self._delayed, (time.monotonic() + delay_ms / 1000.0, self._delayed_seq,
+                                           cmd_id, ok, err, recv_ts))
+            if self._delay_thread is None:
+                self._delay_thread = threading.Thread(target=self._delay_loop, daemon=True)
+                self._delay_thread.start()
+            self._delayed_cond.notify()
+    
+    def _delay_loop(self):
+        while True:
+            with self._delayed_cond:
+                while self.running:
+                    wait = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._delayed_cond.wait(wait)
+                if not self.running:
+                    return
+                _, _, cmd_id, ok, err, recv_ts = heapq.heappop(self._delayed)
+            self._publish_ack(cmd_id, ok, err, recv_ts)
+            self._publish_state()
+    
     def _publish_status(self, online: bool):
         payload = {
             "online": online,
-            "ts_ms": int(time.time() * 1000)
+            "ts_ms": self._now_ms()
         }
         self.client.publish(self.topic_status, json.dumps(payload), qos=1, retain=True)
-        print(f"📤 Published status: online={online}")
+        self._log(f"📤 Published status: online={online}")
     
-    def _publish_ack(self, cmd_id: str, ok: bool, err: str = None):
+    def _publish_ack(self, cmd_id: str, ok: bool, err: str = None, recv_ts: int = None):
         payload = {
             "cmd_id": cmd_id,
             "ok": ok,
             "err": err,
-            "edge_recv_ts_ms": int(time.time() * 1000)
+            "edge_recv_ts_ms": recv_ts if recv_ts is not None else self._now_ms()
         }
-        self.client.publish(self.topic_ack, json.dumps(payload), qos=1)
+        self.client.publish(self.topic_ack, json.dumps(payload), qos=self.ack_qos)
         status = "✅" if ok else "❌"
-        print(f"📤 Published ack: {status} cmd_id={cmd_id[:8]}...")
+        self._log(f"📤 Published ack: {status} cmd_id={str(cmd_id)[:8]}...")
     
     def _publish_state(self):
         payload = {
@@ -208,13 +282,12 @@ class MockESP32:
             "phase": self.phase,
             "since_ms": int((time.time() - self.phase_start) * 1000),
             "uptime_s": int(time.time() - self.start_time),
-            "ts_ms": int(time.time() * 1000)
+            "ts_ms": self._now_ms()
         }
         self.client.publish(self.topic_state, json.dumps(payload), qos=0)
     
     def _publish_telemetry(self):
         """Publish simulated telemetry — realistic drift over time."""
-        import random
         uptime = int(time.time() - self.start_time)
         # RSSI: base ± 4 dBm jitter, drifts -1 dBm per 5 min
         rssi = self.base_rssi + random.randint(-4, 4) - (uptime // 300)
@@ -226,7 +299,7 @@ class MockESP32:
             "rssi_dbm": rssi,
             "heap_free_kb": heap,
             "uptime_s": uptime,
-            "ts_ms": int(time.time() * 1000)
+            "ts_ms": self._now_ms()
         }
         self.client.publish(self.topic_telemetry, json.dumps(payload), qos=0)
     
@@ -239,7 +312,7 @@ class MockESP32:
             self.phase = (self.phase + 1) % 6
             self.phase_start = time.time()
             names = ['NS_GREEN','NS_YELLOW','ALL_RED','EW_GREEN','EW_YELLOW','ALL_RED']
-            print(f"🔄 Phase {old_phase}→{self.phase}: {names[self.phase]}")
+            self._log(f"🔄 Phase {old_phase}→{self.phase}: {names[self.phase]}")
     
     def _state_loop(self):
         """Publish state every 1 second, telemetry every 5 seconds."""
@@ -273,7 +346,10 @@ class MockESP32:
         print(f"  Host:       {self.host}:{self.port}")
         print(f"  User:       {self.user}")
         print(f"  Speed:      {self.speed}x")
-        print(f"  Ack Delay:  {self.ack_delay_ms}ms")
+        print(f"  Ack Delay:  {self.ack_delay_ms}ms" +
+              (f" (+0..{self.ack_jitter_ms}ms jitter)" if self.ack_jitter_ms else ""))
+        if self.clock_skew_ms:
+            print(f"  Clock Skew: {self.clock_skew_ms:+g}ms")
         print("=" * 60)
         print(f"  Topics:")
         print(f"    state:  {self.topic_state}")
@@ -285,23 +361,10 @@ class MockESP32:
         # Connect
         try:
             print(f"🔌 Connecting to {self.host}:{self.port}...")
-            self.client.connect(self.host, self.port, keepalive=30)
-            self.client.loop_start()
-            
-            # Wait for connection
-            timeout = 5.0
-            start = time.time()
-            while not self.connected and (time.time() - start) < timeout:
-                time.sleep(0.1)
-            
-            if not self.connected:
+            if not self.start():
                 print("❌ Connection timeout")
                 return False
             
-            # Start state publishing thread
-            state_thread = threading.Thread(target=self._state_loop, daemon=True)
-            state_thread.start()
-            
             print("\n✅ Mock ESP32 running. Press Ctrl+C to stop.\n")
             
             # Run until interrupted
@@ -319,9 +382,30 @@ class MockESP32:
         
         return False
     
+    def start(self, timeout: float = 5.0) -> bool:
+        """Connect and start the state loop without blocking (for in-process use)."""
+        self.client.connect(self.host, self.port, keepalive=30)
+        self.client.loop_start()
+        
+        # Wait for connection
+        start = time.time()
+        while not self.connected and (time.time() - start) < timeout:
+            time.sleep(0.05)
+        
+        if not self.connected:
+            self.client.loop_stop()
+            return False
+        
+        # Start state publishing thread
+        state_thread = threading.Thread(target=self._state_loop, daemon=True)
+        state_thread.start()
+        return True
+    
     def stop(self):
         """Stop the mock ESP32."""
         self.running = False
+        with self._delayed_cond:
+            self._delayed_cond.notify()
         
         if self.connected:
             # Publish offline status before disconnect
@@ -330,7 +414,7 @@ class MockESP32:
         
         self.client.loop_stop()
         self.client.disconnect()
-        print("👋 Mock ESP32 stopped")
+        self._log("👋 Mock ESP32 stopped")
 
 
 def main():
@@ -342,6 +426,8 @@ Examples:
   python mock_esp32.py --host localhost
   python mock_esp32.py --host localhost --speed 2    (2x faster for demo)
   python mock_esp32.py --host localhost --ack_delay_ms 50
+  python mock_esp32.py --host localhost --ack_delay_ms 30 --ack_jitter_ms 20
+  python mock_esp32.py --host localhost --clock_skew_ms 40   (edge clock 40ms ahead)
         """
     )
     
@@ -353,8 +439,18 @@ Examples:
     parser.add_argument('--intersection', default='001', help='Intersection ID')
     parser.add_argument('--ack_delay_ms', type=int, default=0, 
                         help='Delay before sending ack (ms) for RTT testing')
+    parser.add_argument('--ack_jitter_ms', type=int, default=0,
+                        help='Extra random 0..N ms added to each ack delay')
     parser.add_argument('--speed', type=float, default=1.0,
                         help='Speed multiplier (2=2x faster cycle, good for demo)')
+    parser.add_argument('--cmd_qos', type=int, choices=[0, 1, 2], default=1,
+                        help='QoS of the cmd subscription')
+    parser.add_argument('--ack_qos', type=int, choices=[0, 1, 2], default=1,
+                        help='QoS used to publish acks')
+    parser.add_argument('--persistent', action='store_true',
+                        help='Persistent session (clean_session=False, stable client id)')
+    parser.add_argument('--clock_skew_ms', type=float, default=0.0,
+                        help='Shift the edge clock (edge_recv_ts_ms, ts_ms) to test clock sync')
     
     args = parser.parse_args()
     
@@ -367,7 +463,12 @@ Examples:
         city=args.city,
         intersection=args.intersection,
         ack_delay_ms=args.ack_delay_ms,
-        speed=args.speed
+        speed=args.speed,
+        cmd_qos=args.cmd_qos,
+        ack_qos=args.ack_qos,
+        clean_session=not args.persistent,
+        clock_skew_ms=args.clock_skew_ms,
+        ack_jitter_ms=args.ack_jitter_ms
     )
     
     def signal_handler(sig, frame):
@@ -1,50 +1,515 @@
 #!/usr/bin/env python3
 """
-Multi-Device Stress Test for Traffic Light MQTT Demo
-Runs two instance of mock_esp32.py simultaneously and sends concurrent benchmarks.
+Multi-Device Stress Test - Traffic Light MQTT Demo
+Drives N intersections concurrently at a fixed per-device command rate and
+reports global and per-device RTT percentiles, fairness across devices and
+total broker throughput.
+
+Devices are mock_esp32 instances started here (one process each by default,
+or threads in this process), or already-running devices (--mocks none).
+Readiness comes from the retained status topic: the watcher subscribes to
+city/<city>/intersection/+/status before any mock starts, so a device counts
+as ready only when it announces online=true itself (a retained online=true
+left by an earlier run is not enough). With --mocks none the retained status
+is accepted as-is.
+
+All devices are driven from one open-loop schedule (per-device sends are
+staggered across the period, so the broker sees an even aggregate rate), over
+--connections MQTT connections. Each command resolves through the shared
+CommandClient, so acks are timestamped in the MQTT callback.
+
+Fairness is the spread of per-device p95 RTT: max - min, max/min and the
+coefficient of variation. Throughput counts acks per second over the window
+from the first send to the last ack, and broker publishes per second
+(each command and each ack is one publish in and one out).
+
+Output (in results/multi_<timestamp>/):
+    raw.csv        one row per command, with the intersection id
+    devices.csv    per-device summary
+    summary.json   global stats, fairness, throughput and the run settings
+
+Usage:
+    python multi_device_test.py --host 127.0.0.1 --devices 10 --rate 20 --duration 30
+    python multi_device_test.py --host 127.0.0.1 --devices 50 --rate 5 --mocks thread
+    python multi_device_test.py --host 192.168.1.100 --mocks none --ids 001,002,003
 """
+
+import argparse
+import csv
+import heapq
+import json
+import os
+import signal
 import subprocess
-import time
 import sys
 import threading
-from run_benchmark_report import RTTBenchmark, BenchmarkCase
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from command_client import CommandClient, CommandFuture
+from timeline import percentile
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# =============================================================================
+# DATA STRUCTURES
+# =============================================================================
+
+@dataclass
+class Device:
+    intersection: str
+    commands: Optional[CommandClient] = None
+    sent: int = 0
+    rows: List[dict] = field(default_factory=list)   # one per finished command
+
+
+@dataclass
+class DeviceStats:
+    intersection: str
+    sent: int
+    acked: int
+    lost: int
+    loss_rate: float
+    p50: Optional[float]
+    p95: Optional[float]
+    p99: Optional[float]
+    max_rtt: Optional[float]
+
 
-def run_mock(intersection, speed):
-    print(f"Starting MOCK ESP32 for intersection {intersection}...")
-    return subprocess.Popen(
-        ["python", "mock_esp32.py", "--host", "127.0.0.1", "--intersection", intersection, "--speed", str(speed)],
-        cwd="."
+def rtt_stats(name: str, sent: int, rtts: List[float]) -> DeviceStats:
+    rtts = sorted(rtts)
+    lost = sent - len(rtts)
+    if not rtts:
+        return DeviceStats(name, sent, 0, lost, 100.0 if sent else 0.0, None, None, None, None)
+    return DeviceStats(
+        intersection=name, sent=sent, acked=len(rtts), lost=lost,
+        loss_rate=lost / sent * 100 if sent else 0.0,
+        p50=percentile(rtts, 0.50), p95=percentile(rtts, 0.95),
+        p99=percentile(rtts, 0.99), max_rtt=rtts[-1],
     )
 
-def run_bench(intersection, cases_prefix):
-    print(f"\n--- Running Benchmark for intersection {intersection} ---")
-    bench = RTTBenchmark("127.0.0.1", 1883, "demo", "demo_pass", "demo", intersection)
-    if bench.client:
-        case = BenchmarkCase(f"{cases_prefix}_load", 256, 100, 50, f"Concurrent load {intersection}")
-        bench.run(case, f"results/multi_{intersection}.csv")
+
+def fairness(per_device: List[DeviceStats]) -> dict:
+    """Spread of per-device p95 RTT (devices without acks are left out)."""
+    p95s = [d.p95 for d in per_device if d.p95 is not None]
+    if not p95s:
+        return {"p95_min": None, "p95_max": None, "spread_ms": None, "ratio": None, "cv": None,
+                "worst": None}
+    mean = sum(p95s) / len(p95s)
+    std = (sum((p - mean) ** 2 for p in p95s) / len(p95s)) ** 0.5
+    worst = max((d for d in per_device if d.p95 is not None), key=lambda d: d.p95)
+    return {
+        "p95_min": min(p95s),
+        "p95_max": max(p95s),
+        "spread_ms": max(p95s) - min(p95s),
+        "ratio": max(p95s) / min(p95s) if min(p95s) > 0 else None,
+        "cv": std / mean if mean > 0 else None,
+        "worst": worst.intersection,
+    }
+
+
+# =============================================================================
+# READINESS (retained status topic)
+# =============================================================================
+
+class StatusWatcher:
+    """Online/offline state of every intersection of a city, from the status topic."""
+
+    def __init__(self, host: str, port: int, user: str, password: str, city: str,
+                 accept_retained: bool):
+        self.accept_retained = accept_retained
+        self.online: Dict[str, bool] = {}
+        self.cond = threading.Condition()
+        self.subscribed = threading.Event()
+        self.topic = f"city/{city}/intersection/+/status"
+        self.client = mqtt.Client(
+            client_id=f"multi-status-{uuid.uuid4().hex[:8]}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.username_pw_set(user, password)
+        self.client.on_connect = lambda c, userdata, flags, rc, properties=None: c.subscribe(self.topic, qos=1)
+        self.client.on_subscribe = lambda c, userdata, mid, reason_codes, properties=None: self.subscribed.set()
+        self.client.on_message = self._on_message
+        self.client.connect(host, port, keepalive=30)
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, msg):
+        # A retained message is the last state before we subscribed; when we start
+        # the mocks ourselves, only their own (live) announcement counts
+        if msg.retain and not self.accept_retained:
+            return
+        try:
+            online = bool(json.loads(msg.payload.decode()).get("online"))
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+            return
+        with self.cond:
+            self.online[msg.topic.split("/")[3]] = online
+            self.cond.notify_all()
+
+    def wait_ready(self, ids: List[str], timeout: float) -> List[str]:
+        """Wait until every id is online. Returns the ids still not ready."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                missing = [i for i in ids if not self.online.get(i)]
+                remaining = deadline - time.monotonic()
+                if not missing or remaining <= 0:
+                    return missing
+                self.cond.wait(remaining)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+# =============================================================================
+# MOCK DEVICES
+# =============================================================================
+
+def start_mocks(ids: List[str], args) -> list:
+    """Start one mock_esp32 per id, as processes or in-process threads."""
+    if args.mocks == "process":
+        return [subprocess.Popen(
+            [sys.executable, "mock_esp32.py", "--host", args.host, "--port", str(args.port),
+             "--user", args.user, "--password", args.password, "--city", args.city,
+             "--intersection", iid, "--ack_delay_ms", str(args.ack_delay_ms),
+             "--ack_jitter_ms", str(args.ack_jitter_ms),
+             "--cmd_qos", str(args.qos), "--ack_qos", str(args.qos)],
+            cwd=TOOLS_DIR, stdout=subprocess.DEVNULL
+        ) for iid in ids]
+
+    from mock_esp32 import MockESP32
+    mocks = []
+    for iid in ids:
+        mock = MockESP32(args.host, args.port, args.user, args.password, args.city, iid,
+                         ack_delay_ms=args.ack_delay_ms, ack_jitter_ms=args.ack_jitter_ms,
+                         cmd_qos=args.qos, ack_qos=args.qos, verbose=False)
+        if mock.start():
+            mocks.append(mock)  # a mock that failed to connect shows up as not ready
+    return mocks
+
+
+def stop_mocks(mocks: list):
+    """Stop every mock in parallel (each publishes its offline status first)."""
+    for mock in mocks:
+        if isinstance(mock, subprocess.Popen):
+            mock.send_signal(signal.SIGINT)
+    stoppers = [threading.Thread(target=m.stop) for m in mocks if not isinstance(m, subprocess.Popen)]
+    for t in stoppers:
+        t.start()
+    for t in stoppers:
+        t.join()
+    for mock in mocks:
+        if isinstance(mock, subprocess.Popen):
+            try:
+                mock.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                mock.kill()
+                mock.wait()
+
+
+# =============================================================================
+# DRIVER
+# =============================================================================
+
+class Driver:
+    """MQTT connections carrying the commands; devices are spread round-robin."""
+
+    def __init__(self, devices: List[Device], args):
+        self.devices = devices
+        self.lock = threading.Lock()
+        self.connections: List[mqtt.Client] = []
+        self.routes: Dict[str, CommandClient] = {}   # ack topic -> CommandClient
+        subscribed = []
+
+        # A failed connect or SUBACK timeout must not leak the connections already started
+        try:
+            n_conn = max(1, min(args.connections, len(devices)))
+            for n in range(n_conn):
+                mine = devices[n::n_conn]
+                done = threading.Event()
+                subscribed.append(done)
+                acks = [(f"city/{args.city}/intersection/{d.intersection}/ack", args.qos) for d in mine]
+                client = mqtt.Client(
+                    client_id=f"multi-driver-{n}-{uuid.uuid4().hex[:8]}",
+                    callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+                )
+                client.username_pw_set(args.user, args.password)
+                client.on_connect = lambda c, userdata, flags, rc, properties=None, acks=acks: c.subscribe(acks)
+                client.on_subscribe = (lambda c, userdata, mid, reason_codes, properties=None, done=done:
+                                       done.set())
+                client.on_message = self._on_message
+                for d, (topic, _) in zip(mine, acks):
+                    d.commands = CommandClient(client, f"city/{args.city}/intersection/{d.intersection}/cmd",
+                                               qos=args.qos, timeout=args.timeout)
+                    self.routes[topic] = d.commands
+                client.connect(args.host, args.port, keepalive=60)
+                client.loop_start()
+                self.connections.append(client)
+
+            for done in subscribed:
+                if not done.wait(5.0):
+                    raise OSError("driver connection timeout")
+        except BaseException:
+            self.close()
+            raise
+
+    def _on_message(self, client, userdata, msg):
+        t_recv = time.time() * 1000
+        commands = self.routes.get(msg.topic)
+        if commands is None:
+            return
+        try:
+            commands.on_ack(json.loads(msg.payload.decode()), t_recv)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            pass
+
+    def _record(self, device: Device, fut: CommandFuture):
+        row = {"intersection": device.intersection, "cmd_id": fut.cmd_id,
+               "t_send_ms": round(fut.t_send_ms, 3), "t_ack_recv_ms": None, "rtt_ms": None,
+               "payload_bytes": len(fut.payload)}
+        if fut.exception() is None:
+            ack = fut.result()
+            row["t_ack_recv_ms"] = round(ack.t_recv_ms, 3)
+            row["rtt_ms"] = round(ack.rtt_ms, 3)
+        with self.lock:
+            device.rows.append(row)
+
+    def run(self, rate: float, count: int, pad_bytes: int) -> float:
+        """Send count commands per device at rate/s each. Returns the worst scheduler lag (ms)."""
+        period = 1.0 / rate
+        t0 = time.perf_counter()
+        # Stagger devices across one period so the aggregate rate is even
+        schedule = [(t0 + i * period / len(self.devices), i) for i in range(len(self.devices))]
+        heapq.heapify(schedule)
+        max_lag = 0.0
+
+        while schedule:
+            t_due, i = heapq.heappop(schedule)
+            delay = t_due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay * 1000)
+
+            device = self.devices[i]
+            cmd = {"type": "SET_MODE", "mode": "AUTO", "ts_ms": int(time.time() * 1000)}
+            if pad_bytes > 0:
+                cmd["pad"] = "x" * pad_bytes
+            fut = device.commands.send(cmd)
+            fut.add_done_callback(lambda f, device=device: self._record(device, f))
+            device.sent += 1
+            if device.sent < count:
+                heapq.heappush(schedule, (t_due + period, i))
+
+        for device in self.devices:
+            device.commands.drain()
+        return max_lag
+
+    def close(self):
+        for device in self.devices:
+            if device.commands is not None:
+                device.commands.close()
+        for client in self.connections:
+            client.loop_stop()
+            client.disconnect()
+
+
+# =============================================================================
+# RESULTS
+# =============================================================================
+
+def summarize(devices: List[Device], args, max_lag_ms: float) -> dict:
+    per_device = [rtt_stats(d.intersection, d.sent, [r["rtt_ms"] for r in d.rows if r["rtt_ms"] is not None])
+                  for d in devices]
+    rows = [r for d in devices for r in d.rows]
+    acked = [r for r in rows if r["rtt_ms"] is not None]
+    sent = sum(d.sent for d in devices)
+
+    throughput = {"window_s": None, "acks_per_s": None, "broker_publishes_per_s": None}
+    if acked:
+        window_s = (max(r["t_ack_recv_ms"] for r in acked) - min(r["t_send_ms"] for r in rows)) / 1000
+        if window_s > 0:
+            throughput = {
+                "window_s": window_s,
+                "acks_per_s": len(acked) / window_s,
+                # cmd: us -> broker -> device, ack: device -> broker -> us
+                "broker_publishes_per_s": 2 * (sent + len(acked)) / window_s,
+            }
+
+    return {
+        "settings": {
+            "devices": len(devices), "rate_per_device": args.rate, "duration_s": args.duration,
+            "offered_per_s": args.rate * len(devices), "pad_bytes": args.pad_bytes, "qos": args.qos,
+            "connections": args.connections, "mocks": args.mocks,
+        },
+        "global": asdict(rtt_stats("all", sent, [r["rtt_ms"] for r in acked])),
+        "fairness": fairness(per_device),
+        "throughput": throughput,
+        "max_scheduler_lag_ms": max_lag_ms,
+        "devices": [asdict(d) for d in per_device],
+    }
+
+
+def save_results(devices: List[Device], summary: dict, outdir: str):
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, "raw.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["intersection", "cmd_id", "t_send_ms", "t_ack_recv_ms",
+                                               "rtt_ms", "payload_bytes"])
+        writer.writeheader()
+        for device in devices:
+            writer.writerows(sorted(device.rows, key=lambda r: r["t_send_ms"]))
+    with open(os.path.join(outdir, "devices.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(summary["devices"][0]))
+        writer.writeheader()
+        writer.writerows(summary["devices"])
+    with open(os.path.join(outdir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print(f"💾 Results saved to: {outdir}")
+
+
+def _ms(value: Optional[float]) -> str:
+    return "N/A" if value is None else f"{value:.1f}"
+
+
+def print_summary(summary: dict, max_rows: int = 20):
+    s, g, fair, tp = summary["settings"], summary["global"], summary["fairness"], summary["throughput"]
+    print("\n" + "=" * 72)
+    print(f"📊 MULTI-DEVICE RESULTS: {s['devices']} devices x {s['rate_per_device']:g} cmd/s "
+          f"(offered {s['offered_per_s']:g} cmd/s)")
+    print("=" * 72)
+    print(f"  Sent {g['sent']}, acked {g['acked']}, lost {g['lost']} ({g['loss_rate']:.2f}%)")
+    print(f"  Global RTT (ms):  p50 {_ms(g['p50'])}  p95 {_ms(g['p95'])}  p99 {_ms(g['p99'])}  "
+          f"max {_ms(g['max_rtt'])}")
+    if tp["acks_per_s"] is not None:
+        print(f"  Throughput:       {tp['acks_per_s']:.0f} acks/s, "
+              f"{tp['broker_publishes_per_s']:.0f} broker publishes/s over {tp['window_s']:.1f}s")
+    if fair["spread_ms"] is not None:
+        ratio = "N/A" if fair["ratio"] is None else f"{fair['ratio']:.2f}x"
+        cv = "N/A" if fair["cv"] is None else f"{fair['cv']:.2f}"
+        print(f"  Fairness (p95):   {_ms(fair['p95_min'])}..{_ms(fair['p95_max'])} ms, "
+              f"spread {_ms(fair['spread_ms'])} ms, {ratio}, CV {cv} (worst: {fair['worst']})")
+    if summary["max_scheduler_lag_ms"] > 50:
+        print(f"  ⚠️ Sender fell behind schedule by up to {summary['max_scheduler_lag_ms']:.0f} ms "
+              f"(offered rate not fully reached; try more --connections)")
+
+    devices = sorted(summary["devices"], key=lambda d: -(d["p95"] or float("inf")))
+    print(f"\n  {'Device':<10} {'Sent':>6} {'Acked':>6} {'Loss%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'Max':>8}")
+    print("  " + "-" * 66)
+    for d in devices[:max_rows]:
+        print(f"  {d['intersection']:<10} {d['sent']:>6} {d['acked']:>6} {d['loss_rate']:>6.2f} "
+              f"{_ms(d['p50']):>8} {_ms(d['p95']):>8} {_ms(d['p99']):>8} {_ms(d['max_rtt']):>8}")
+    if len(devices) > max_rows:
+        print(f"  ... {len(devices) - max_rows} more (worst p95 first) in devices.csv")
+    print("=" * 72)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
 
 def main():
-    print("Multi-Device Stress Test Started")
-    p1 = run_mock("001", 1.0)
-    p2 = run_mock("002", 1.0)
-    
-    time.sleep(2) # wait for connect
-    
-    t1 = threading.Thread(target=run_bench, args=("001", "dev1"))
-    t2 = threading.Thread(target=run_bench, args=("002", "dev2"))
-    
-    t1.start()
-    t2.start()
-    
-    t1.join()
-    t2.join()
-    
-    print("\nBenchmark finished. Terminating mock instances...")
-    p1.terminate()
-    p2.terminate()
-    p1.wait()
-    p2.wait()
-    print("Stress test complete.")
+    parser = argparse.ArgumentParser(
+        description='Concurrent N-device stress test with per-device and global RTT statistics',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python multi_device_test.py --host 127.0.0.1 --devices 10 --rate 20 --duration 30
+  python multi_device_test.py --host 127.0.0.1 --devices 50 --rate 5 --mocks thread --connections 4
+  python multi_device_test.py --host 127.0.0.1 --devices 20 --rate 10 --ack_delay_ms 20 --ack_jitter_ms 30
+  python multi_device_test.py --host 192.168.1.100 --mocks none --ids 001,002,003 --rate 2
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) instead of using --host')
+    parser.add_argument('--city', default='demo', help='City ID')
+    parser.add_argument('--devices', type=int, default=2, help='Number of devices')
+    parser.add_argument('--first-id', type=int, default=1,
+                        help='First intersection number (ids are zero-padded: 001, 002, ...)')
+    parser.add_argument('--ids', default=None, help='Comma-separated intersection ids (overrides --devices)')
+    parser.add_argument('--rate', type=float, default=10.0, help='Commands per second per device')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load')
+    parser.add_argument('--pad_bytes', type=int, default=0, help='Padding bytes per command')
+    parser.add_argument('--qos', type=int, choices=[0, 1, 2], default=1, help='cmd/ack QoS')
+    parser.add_argument('--timeout', type=float, default=5.0, help='Ack deadline per command (s)')
+    parser.add_argument('--connections', type=int, default=2, help='MQTT connections used to drive the devices')
+    parser.add_argument('--mocks', choices=['process', 'thread', 'none'], default='process',
+                        help='Start mock_esp32 per device as processes, threads, or not at all (real devices)')
+    parser.add_argument('--ack_delay_ms', type=int, default=0, help='Mock ack delay (ms)')
+    parser.add_argument('--ack_jitter_ms', type=int, default=0, help='Mock extra random ack delay (ms)')
+    parser.add_argument('--ready-timeout', type=float, default=20.0, help='Seconds to wait for all devices online')
+    parser.add_argument('--outdir', default='results', help='Parent directory for multi_<timestamp>/')
+    args = parser.parse_args()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        start_embedded_broker(args)
+
+    if args.rate <= 0 or args.duration <= 0:
+        parser.error("--rate and --duration must be positive")
+    if args.devices < 1:
+        parser.error("--devices must be >= 1")
+    ids = ([i.strip() for i in args.ids.split(",") if i.strip()] if args.ids
+           else [f"{args.first_id + n:03d}" for n in range(args.devices)])
+    if not ids:
+        parser.error("--ids lists no intersection ids")
+    count = max(1, round(args.rate * args.duration))
+
+    print("\n" + "=" * 72)
+    print("🚦 MULTI-DEVICE STRESS TEST")
+    print("=" * 72)
+    print(f"  Devices:   {len(ids)} ({ids[0]}..{ids[-1]}), mocks: {args.mocks}")
+    print(f"  Load:      {args.rate:g} cmd/s x {args.duration:g}s per device = {count} commands each, "
+          f"{args.rate * len(ids):g} cmd/s total")
+    print(f"  Payload:   pad {args.pad_bytes} B, QoS {args.qos}, {args.connections} connection(s)")
+    print("=" * 72)
+
+    try:
+        watcher = StatusWatcher(args.host, args.port, args.user, args.password, args.city,
+                                accept_retained=args.mocks == "none")
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(2)
+    if not watcher.subscribed.wait(5.0):
+        print("❌ No SUBACK for the status topic")
+        watcher.close()
+        sys.exit(2)
+
+    mocks = start_mocks(ids, args) if args.mocks != "none" else []
+    devices = [Device(i) for i in ids]
+    driver = None
+    try:
+        t_ready = time.perf_counter()
+        missing = watcher.wait_ready(ids, args.ready_timeout)
+        if missing:
+            print(f"❌ {len(missing)}/{len(ids)} device(s) not online after {args.ready_timeout:g}s: "
+                  f"{', '.join(missing[:10])}{' ...' if len(missing) > 10 else ''}")
+            sys.exit(1)
+        print(f"✅ All {len(ids)} devices online ({(time.perf_counter() - t_ready) * 1000:.0f} ms)")
+
+        driver = Driver(devices, args)
+        print(f"🚀 Driving {len(ids)} devices...")
+        max_lag = driver.run(args.rate, count, args.pad_bytes)
+    finally:
+        if driver is not None:
+            driver.close()
+        watcher.close()
+        print("🛑 Stopping devices...")
+        stop_mocks(mocks)
+
+    summary = summarize(devices, args, max_lag)
+    print_summary(summary)
+    save_results(devices, summary, os.path.join(args.outdir, f"multi_{datetime.now():%Y%m%d_%H%M%S}"))
+
 
 if __name__ == "__main__":
     main()
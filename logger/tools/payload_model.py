@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Payload Cost Model - Traffic Light MQTT Demo
+Fits RTT against actual_payload_bytes across all cases of a run.
+
+- Robust linear fit (Huber IRLS):   rtt = fixed + per_byte * bytes
+- Piecewise (hinge) fit:            rtt = fixed + b1 * bytes + (b2 - b1) * max(0, bytes - breakpoint)
+  breakpoint found by grid search; "detected" only if the slope change is
+  significant (bootstrap CI excludes 0) and the fit improves by MIN_GAIN.
+
+Confidence intervals are percentile bootstrap over commands (resampled with
+replacement). Large runs are bootstrapped on a subsample of m points and the
+spread is rescaled by sqrt(m/n) (m-out-of-n bootstrap). Breakpoints need at least MIN_SIZES_FOR_BREAKPOINT distinct
+payload sizes (e.g. --cases "0,128,256,512,768,1024").
+
+Usage:
+    python payload_model.py results/bench_xxx
+    python payload_model.py results/bench_xxx/raw/case_0b.csv results/bench_xxx/raw/case_1024b.npy
+    python payload_model.py results/bench_xxx --plot payload_model.png --json payload_model.json
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+HUBER_K = 1.345                # 95% efficiency under Gaussian noise
+MIN_SIZES_FOR_BREAKPOINT = 4
+MIN_GAIN = 0.05                # piecewise must reduce the robust loss by >= 5%
+BREAKPOINT_GRID = 25
+DEFAULT_BOOTSTRAP = 200
+BOOTSTRAP_MAX_POINTS = 5000    # bootstrap on a random subsample of large runs
+CONFIDENCE = 0.95
+CASE_PREFIX = "case_"           # run_benchmark_report raw file names
+
+
+@dataclass
+class Estimate:
+    value: float
+    low: float
+    high: float
+
+    def fmt(self, scale: float = 1.0, digits: int = 2, unit: str = "") -> str:
+        return (f"{self.value * scale:.{digits}f}{unit} "
+                f"[{self.low * scale:.{digits}f}, {self.high * scale:.{digits}f}]")
+
+
+@dataclass
+class LinearFit:
+    fixed_ms: Estimate
+    per_byte_ms: Estimate
+    scale_ms: float            # robust residual scale (MAD)
+    loss: float
+
+
+@dataclass
+class PiecewiseFit:
+    breakpoint_bytes: Estimate
+    fixed_ms: Estimate
+    slope_before: Estimate     # ms/byte below the breakpoint
+    slope_after: Estimate      # ms/byte above the breakpoint
+    slope_change: Estimate
+    gain: float                # relative robust-loss reduction vs linear
+    detected: bool
+
+
+@dataclass
+class PayloadModel:
+    points: int
+    sizes: int
+    size_min: int
+    size_max: int
+    linear: Optional[LinearFit]
+    piecewise: Optional[PiecewiseFit]
+    note: str = ""
+
+
+# =============================================================================
+# ROBUST FITTING
+# =============================================================================
+
+def _huber_weights(resid: np.ndarray, scale: float, k: float = HUBER_K) -> np.ndarray:
+    a = np.abs(resid) / scale
+    return np.where(a <= k, 1.0, k / np.maximum(a, 1e-12))
+
+
+def huber_loss(resid: np.ndarray, scale: float, k: float = HUBER_K) -> float:
+    a = np.abs(resid) / scale
+    return float(np.where(a <= k, 0.5 * a * a, k * a - 0.5 * k * k).sum())
+
+
+def robust_scale(resid: np.ndarray) -> float:
+    """MAD scale, floored so exact fits (identical RTTs) do not divide by zero."""
+    mad = float(np.median(np.abs(resid - np.median(resid)))) / 0.6745
+    return max(mad, 1e-3)
+
+
+def huber_fit(X: np.ndarray, y: np.ndarray, scale: Optional[float] = None,
+              iters: int = 30, tol: float = 1e-6) -> Tuple[np.ndarray, float]:
+    """Huber M-estimate by IRLS. Returns (coefficients, scale)."""
+    def wls(w):
+        # Normal equations: X has 2-3 columns, much cheaper than lstsq per iteration
+        Xw = X * w[:, None]
+        return np.linalg.lstsq(Xw.T @ X, Xw.T @ y, rcond=None)[0]
+
+    beta = wls(np.ones(len(y)))
+    fixed_scale = scale
+    for _ in range(iters):
+        resid = y - X @ beta
+        s = fixed_scale or robust_scale(resid)
+        new = wls(_huber_weights(resid, s))
+        if np.max(np.abs(new - beta)) < tol * (1 + np.max(np.abs(beta))):
+            beta = new
+            break
+        beta = new
+    return beta, fixed_scale or robust_scale(y - X @ beta)
+
+
+def _linear_design(x: np.ndarray) -> np.ndarray:
+    return np.column_stack([np.ones_like(x), x])
+
+
+def _hinge_design(x: np.ndarray, bp: float) -> np.ndarray:
+    return np.column_stack([np.ones_like(x), x, np.maximum(0.0, x - bp)])
+
+
+def breakpoint_grid(x: np.ndarray, n: int = BREAKPOINT_GRID) -> np.ndarray:
+    """Candidates between the 2nd and 2nd-to-last distinct size (>= 2 sizes per segment)."""
+    sizes = np.unique(x)
+    if len(sizes) < MIN_SIZES_FOR_BREAKPOINT:
+        return np.array([])
+    grid = np.linspace(sizes[1], sizes[-2], n)
+    return np.unique(np.concatenate([grid, sizes[1:-1]]))
+
+
+def fit_hinge(x: np.ndarray, y: np.ndarray, grid: np.ndarray, scale: float) -> Tuple[float, np.ndarray, float]:
+    """Best breakpoint on the grid by robust loss (scale fixed for comparability)."""
+    best = (float(grid[0]), None, np.inf)
+    for bp in grid:
+        X = _hinge_design(x, bp)
+        beta, _ = huber_fit(X, y, scale=scale)
+        loss = huber_loss(y - X @ beta, scale)
+        if loss < best[2]:
+            best = (float(bp), beta, loss)
+    return best
+
+
+def _ci(samples: List[float], point: float, shrink: float = 1.0) -> Estimate:
+    """Bootstrap percentile spread re-centred on point; shrink rescales a subsample bootstrap."""
+    if not samples:
+        return Estimate(float(point), float('nan'), float('nan'))
+    tail = (1 - CONFIDENCE) / 2 * 100
+    samples = np.asarray(samples, dtype=float)
+    center = np.median(samples)
+    low, high = point + (np.percentile(samples, [tail, 100 - tail]) - center) * shrink
+    return Estimate(float(point), float(low), float(high))
+
+
+def fit_payload_model(x: np.ndarray, y: np.ndarray, bootstrap: int = DEFAULT_BOOTSTRAP,
+                      seed: int = 0) -> PayloadModel:
+    """Linear + piecewise fit of RTT (ms) on payload bytes, with bootstrap CIs."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[ok], y[ok]
+    sizes = np.unique(x)
+    model = PayloadModel(points=len(x), sizes=len(sizes),
+                         size_min=int(sizes.min()) if len(sizes) else 0,
+                         size_max=int(sizes.max()) if len(sizes) else 0,
+                         linear=None, piecewise=None)
+    if len(sizes) < 2:
+        model.note = "need at least 2 distinct payload sizes"
+        return model
+
+    rng = np.random.default_rng(seed)
+    lin_beta, scale = huber_fit(_linear_design(x), y)
+    lin_loss = huber_loss(y - _linear_design(x) @ lin_beta, scale)
+
+    grid = breakpoint_grid(x)
+    hinge = fit_hinge(x, y, grid, scale) if len(grid) else None
+
+    # Bootstrap (on a subsample for large runs)
+    idx_pool = np.arange(len(x))
+    if len(x) > BOOTSTRAP_MAX_POINTS:
+        idx_pool = rng.choice(idx_pool, BOOTSTRAP_MAX_POINTS, replace=False)
+    shrink = float(np.sqrt(len(idx_pool) / len(x)))
+    boot_lin, boot_hinge = [], []
+    for _ in range(bootstrap):
+        idx = rng.choice(idx_pool, len(idx_pool), replace=True)
+        bx, by = x[idx], y[idx]
+        if len(np.unique(bx)) < 2:
+            continue
+        beta, _ = huber_fit(_linear_design(bx), by, scale=scale)
+        boot_lin.append(beta)
+        if hinge is not None and len(np.unique(bx)) >= MIN_SIZES_FOR_BREAKPOINT:
+            bp, hb, _ = fit_hinge(bx, by, grid, scale)
+            boot_hinge.append((bp, hb[0], hb[1], hb[1] + hb[2], hb[2]))
+
+    model.linear = LinearFit(
+        fixed_ms=_ci([b[0] for b in boot_lin], lin_beta[0], shrink),
+        per_byte_ms=_ci([b[1] for b in boot_lin], lin_beta[1], shrink),
+        scale_ms=scale,
+        loss=lin_loss,
+    )
+
+    if hinge is None:
+        model.note = (f"breakpoint search needs >= {MIN_SIZES_FOR_BREAKPOINT} distinct payload sizes "
+                      f"(have {len(sizes)})")
+        return model
+
+    bp, hb, hinge_loss = hinge
+    cols = list(zip(*boot_hinge)) if boot_hinge else [[]] * 5
+    change = _ci(list(cols[4]), hb[2], shrink)
+    gain = (lin_loss - hinge_loss) / lin_loss if lin_loss > 0 else 0.0
+    significant = not (change.low <= 0 <= change.high) and not np.isnan(change.low)
+    model.piecewise = PiecewiseFit(
+        breakpoint_bytes=_ci(list(cols[0]), bp, shrink),
+        fixed_ms=_ci(list(cols[1]), hb[0], shrink),
+        slope_before=_ci(list(cols[2]), hb[1], shrink),
+        slope_after=_ci(list(cols[3]), hb[1] + hb[2], shrink),
+        slope_change=change,
+        gain=gain,
+        detected=bool(significant and gain >= MIN_GAIN),
+    )
+    return model
+
+
+# =============================================================================
+# INPUT / OUTPUT
+# =============================================================================
+
+def load_points(files: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """(actual_payload_bytes, rtt_ms) of every acked command in the given raw files."""
+    from raw_columnar import read_results
+
+    xs, ys = [], []
+    for file in files:
+        df = read_results(str(file))
+        column = 'actual_payload_bytes' if 'actual_payload_bytes' in df.columns else 'payload_size'
+        df = df.dropna(subset=['rtt_ms', column])
+        xs.append(df[column].to_numpy(dtype=float))
+        ys.append(df['rtt_ms'].to_numpy(dtype=float))
+    if not xs:
+        return np.array([]), np.array([])
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+    """Raw files from file arguments and run directories (raw/case_*, .npy preferred over .csv).
+
+    Directory scans keep only the per-case files (case_*): the multi-device raw.csv,
+    calibration and other tools' outputs have no payload sweep to fit.
+    """
+    from compare_runs import find_raw_files
+
+    files = []
+    for item in inputs:
+        if Path(item).is_dir():
+            files.extend(str(p) for p in find_raw_files(item).values()
+                         if p.stem.startswith(CASE_PREFIX))
+        else:
+            files.append(item)
+    return files
+
+
+def describe(model: PayloadModel) -> List[str]:
+    """Human-readable summary lines."""
+    lines = [f"Points: {model.points}, payload sizes: {model.sizes} "
+             f"({model.size_min}-{model.size_max} B)"]
+    if model.linear:
+        lin = model.linear
+        lines.append(f"Linear:    fixed {lin.fixed_ms.fmt(unit=' ms')}, "
+                     f"per KB {lin.per_byte_ms.fmt(scale=1024, digits=3, unit=' ms')}")
+    if model.piecewise:
+        pw = model.piecewise
+        verdict = "DETECTED" if pw.detected else "not significant"
+        lines.append(f"Piecewise: breakpoint {pw.breakpoint_bytes.fmt(digits=0, unit=' B')} ({verdict}, "
+                     f"loss -{pw.gain * 100:.1f}%)")
+        lines.append(f"           per KB below {pw.slope_before.fmt(scale=1024, digits=3, unit=' ms')}, "
+                     f"above {pw.slope_after.fmt(scale=1024, digits=3, unit=' ms')}")
+    if model.note:
+        lines.append(f"Note: {model.note}")
+    return lines
+
+
+def save_json(model: PayloadModel, filename: str):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(asdict(model), f, indent=2)
+    print(f"💾 Saved: {filename}")
+
+
+def plot_model(x: np.ndarray, y: np.ndarray, model: PayloadModel, filename: str, title: str = ""):
+    """Per-command scatter, per-size medians, linear and piecewise fits (ImportError without matplotlib)."""
+    from analyze_results import load_pyplot
+
+    plt = load_pyplot()
+    if plt is None:
+        raise ImportError("matplotlib is not installed")
+
+    rng = np.random.default_rng(0)
+    shown = rng.choice(len(x), min(len(x), 20000), replace=False) if len(x) else []
+    sizes = np.unique(x)
+    medians = [np.median(y[x == s]) for s in sizes]
+    xs = np.linspace(sizes.min(), sizes.max(), 200) if len(sizes) else np.array([])
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.scatter(x[shown], y[shown], s=4, alpha=0.15, color='#90A4AE', label='Commands')
+    ax.plot(sizes, medians, 'o', color='#2196F3', label='Median per size')
+    if model.linear:
+        lin = model.linear
+        ax.plot(xs, lin.fixed_ms.value + lin.per_byte_ms.value * xs, color='#4CAF50',
+                label=f'Linear: {lin.per_byte_ms.value * 1024:.2f} ms/KB')
+    if model.piecewise:
+        pw = model.piecewise
+        bp = pw.breakpoint_bytes.value
+        ys = pw.fixed_ms.value + pw.slope_before.value * xs + \
+            (pw.slope_after.value - pw.slope_before.value) * np.maximum(0, xs - bp)
+        ax.plot(xs, ys, color='#f44336' if pw.detected else '#FF9800', linestyle='--',
+                label=f"Piecewise ({'breakpoint' if pw.detected else 'n.s.'} {bp:.0f}B)")
+        if pw.detected and not np.isnan(pw.breakpoint_bytes.low):
+            ax.axvspan(pw.breakpoint_bytes.low, pw.breakpoint_bytes.high, color='#f44336', alpha=0.1)
+    ax.set_xlabel('Actual payload (bytes)')
+    ax.set_ylabel('RTT (ms)')
+    if len(y):
+        ax.set_ylim(0, np.percentile(y, 99) * 1.2)
+    ax.set_title(title or 'RTT vs payload size')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    plt.savefig(filename, dpi=150, bbox_inches='tight')
+    plt.close()
+    print(f"📊 Saved: {filename}")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fit per-byte RTT cost (robust linear + piecewise) across payload cases',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python payload_model.py results/bench_xxx
+  python payload_model.py raw/case_0b.csv raw/case_256b.csv raw/case_1024b.csv
+  python payload_model.py results/bench_xxx --plot payload_model.png --json payload_model.json
+        """
+    )
+    parser.add_argument('inputs', nargs='+', help='Run directories and/or raw files (.csv/.npy)')
+    parser.add_argument('--bootstrap', type=int, default=DEFAULT_BOOTSTRAP, help='Bootstrap resamples for CIs')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--plot', default=None, help='Save the fit plot (PNG)')
+    parser.add_argument('--json', default=None, help='Save the model as JSON')
+    args = parser.parse_args()
+
+    files = expand_inputs(args.inputs)
+    try:
+        x, y = load_points(files)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ Cannot load raw data: {e}")
+        sys.exit(1)
+    if len(x) == 0:
+        print("❌ No acked commands in the inputs")
+        sys.exit(1)
+
+    print(f"📂 {len(files)} raw file(s)")
+    model = fit_payload_model(x, y, args.bootstrap, args.seed)
+    print("\n📐 PAYLOAD COST MODEL (95% CI)")
+    print("-" * 60)
+    for line in describe(model):
+        print(f"  {line}")
+    print()
+
+    if args.json:
+        save_json(model, args.json)
+    if args.plot:
+        plot_model(x, y, model, args.plot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+QoS / Session Matrix Benchmark - Traffic Light MQTT Demo
+Benchmarks every combination of cmd QoS x ack QoS x clean/persistent session
+against an in-process mock_esp32 and reports RTT, loss and broker message
+counts per cell.
+
+Each cell uses its own intersection id (e.g. qos-c1-a2-p) so queued messages
+of a persistent session never leak into the next cell. Persistent cells end
+with an offline step: the mock disconnects, --offline-count commands are
+published while it is away, and the mock reconnects with the same client id;
+the step reports how many of them the broker queued and delivered (QoS 1/2
+only, QoS 0 is not queued) and how long the backlog took to drain.
+
+Broker counts are deltas of the Mosquitto $SYS counters between cell
+boundaries (one snapshot per boundary, shared by adjacent cells); they update
+every sys_interval (default 10 s) and include the mock's own state/telemetry
+traffic. If the broker publishes no $SYS, the counters are switched off after
+the first wait.
+
+Usage:
+    python qos_matrix.py --host 127.0.0.1
+    python qos_matrix.py --host 127.0.0.1 --count 300 --interval_ms 20 --cmd-qos 0,1 --ack-qos 1
+    python qos_matrix.py --host 127.0.0.1 --no-sys
+    python qos_matrix.py --embedded-broker --sessions persistent --offline-count 50
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from mock_esp32 import MockESP32
+from run_benchmark_report import BenchmarkCase, CaseResult, RTTBenchmark, configure_console_output
+
+SYS_TOPICS = {
+    "$SYS/broker/messages/received": "msgs_received",
+    "$SYS/broker/messages/sent": "msgs_sent",
+    "$SYS/broker/publish/messages/received": "publish_received",
+    "$SYS/broker/publish/messages/sent": "publish_sent",
+    "$SYS/broker/publish/messages/dropped": "publish_dropped",
+}
+
+
+@dataclass
+class MatrixCell:
+    cmd_qos: int
+    ack_qos: int
+    clean_session: bool
+
+    @property
+    def label(self) -> str:
+        return f"c{self.cmd_qos}-a{self.ack_qos}-{'clean' if self.clean_session else 'persistent'}"
+
+
+@dataclass
+class CellResult:
+    cell: MatrixCell
+    result: Optional[CaseResult]
+    broker: Dict[str, Optional[int]]
+    error: str = ""
+    offline: Optional["OfflineResult"] = None
+
+
+@dataclass
+class OfflineResult:
+    sent: int                       # commands published while the mock was offline
+    acked: int                      # of those, acked after the mock reconnected
+    drain_ms: Optional[float]       # reconnect -> last queued ack
+
+
+# =============================================================================
+# BROKER $SYS COUNTERS
+# =============================================================================
+
+class SysCounters:
+    """Latest Mosquitto $SYS message counters, with a wait for a fresh update."""
+
+    def __init__(self, host: str, port: int, user: str, password: str):
+        self.values: Dict[str, int] = {}
+        self.updates = 0
+        self.cond = threading.Condition()
+        self.client = mqtt.Client(
+            client_id=f"qos-matrix-sys-{uuid.uuid4().hex[:8]}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.username_pw_set(user, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.host = host
+        self.port = port
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            for topic in SYS_TOPICS:
+                client.subscribe(topic, qos=0)
+
+    def _on_message(self, client, userdata, msg):
+        key = SYS_TOPICS.get(msg.topic)
+        if key is None:
+            return
+        try:
+            value = int(float(msg.payload.decode()))
+        except ValueError:
+            return
+        with self.cond:
+            self.values[key] = value
+            if key == "msgs_sent":
+                self.updates += 1
+                self.cond.notify_all()
+
+    def start(self):
+        self.client.connect(self.host, self.port, keepalive=60)
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def snapshot(self, timeout: float) -> Optional[Dict[str, int]]:
+        """
+        Wait for the next $SYS publication (up to timeout) and return the counters.
+        None if the broker has never published them (no $SYS support).
+        """
+        with self.cond:
+            seen = self.updates
+            self.cond.wait_for(lambda: self.updates > seen, timeout=timeout)
+            return dict(self.values) if self.updates else None
+
+
+def counter_delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, Optional[int]]:
+    return {key: (after[key] - before[key]) if key in before and key in after else None
+            for key in SYS_TOPICS.values()}
+
+
+# =============================================================================
+# OFFLINE QUEUE STEP (persistent sessions)
+# =============================================================================
+
+def offline_queue_step(cell: MatrixCell, args, intersection: str, mock: MockESP32):
+    """
+    Disconnect the mock, publish args.offline_count commands, stay offline for
+    args.offline_s and reconnect it with the same client id.
+    Returns (OfflineResult, the new mock).
+    """
+    base = f"city/{args.city}/intersection/{intersection}"
+    acks: Dict[str, float] = {}
+    pending = set()
+    cond = threading.Condition()
+    subscribed = threading.Event()
+
+    def on_message(client, userdata, msg):
+        t_recv = time.time() * 1000
+        try:
+            cmd_id = json.loads(msg.payload.decode()).get("cmd_id")
+        except (ValueError, AttributeError):
+            return
+        with cond:
+            if cmd_id in pending and cmd_id not in acks:
+                acks[cmd_id] = t_recv
+                cond.notify_all()
+
+    probe = mqtt.Client(
+        client_id=f"qos-matrix-offline-{uuid.uuid4().hex[:8]}",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+    )
+    probe.username_pw_set(args.user, args.password)
+    probe.on_connect = lambda c, u, f, rc, p=None: c.subscribe(f"{base}/ack", qos=cell.ack_qos)
+    probe.on_subscribe = lambda *_: subscribed.set()
+    probe.on_message = on_message
+    probe.connect(args.host, args.port, keepalive=60)
+    probe.loop_start()
+    try:
+        probe.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if not subscribed.wait(5.0):
+            raise OSError("offline probe subscribe timeout")
+
+        mock.stop()   # clean DISCONNECT: the broker keeps the persistent session
+        for _ in range(args.offline_count):
+            cmd_id = str(uuid.uuid4())
+            with cond:
+                pending.add(cmd_id)
+            probe.publish(f"{base}/cmd", json.dumps({
+                "cmd_id": cmd_id, "type": "SET_MODE", "mode": "AUTO", "ts_ms": int(time.time() * 1000)
+            }), qos=cell.cmd_qos).wait_for_publish(5.0)
+        time.sleep(args.offline_s)   # QoS 0 "published" = queued locally; let all reach the broker
+
+        mock = MockESP32(args.host, args.port, args.user, args.password, args.city, intersection,
+                         ack_delay_ms=args.ack_delay_ms, cmd_qos=cell.cmd_qos, ack_qos=cell.ack_qos,
+                         clean_session=False, verbose=False)
+        t_reconnect = time.time() * 1000
+        if not mock.start():
+            raise OSError("mock reconnect timeout")
+        with cond:
+            cond.wait_for(lambda: len(acks) >= len(pending), timeout=args.offline_wait)
+            drain_ms = max(acks.values()) - t_reconnect if acks else None
+            return OfflineResult(len(pending), len(acks), drain_ms), mock
+    finally:
+        probe.loop_stop()
+        probe.disconnect()
+
+
+# =============================================================================
+# MATRIX RUNNER
+# =============================================================================
+
+def run_cell(cell: MatrixCell, args, raw_dir: str, sys_counters: Optional[SysCounters],
+             before: Dict[str, int]):
+    """
+    Run one cell. `before` is the $SYS snapshot taken at the previous boundary;
+    returns (CellResult, the snapshot at the end of this cell).
+    """
+    intersection = f"qos-{cell.label}"
+    mock = MockESP32(args.host, args.port, args.user, args.password, args.city, intersection,
+                     ack_delay_ms=args.ack_delay_ms, cmd_qos=cell.cmd_qos, ack_qos=cell.ack_qos,
+                     clean_session=cell.clean_session, verbose=False)
+    try:
+        if not mock.start():
+            return CellResult(cell, None, {}, "mock connection timeout"), before
+    except OSError as e:
+        return CellResult(cell, None, {}, f"mock: {e}"), before
+
+    try:
+        bench = RTTBenchmark(args.host, args.port, args.user, args.password, args.city, intersection,
+                             raw_format=args.raw_format, cmd_qos=cell.cmd_qos, ack_qos=cell.ack_qos,
+                             clean_session=cell.clean_session)
+        case = BenchmarkCase(
+            name=cell.label,
+            pad_bytes=args.pad_bytes,
+            count=args.count,
+            interval_ms=args.interval_ms,
+            description=f"cmd QoS {cell.cmd_qos}, ack QoS {cell.ack_qos}, "
+                        f"{'clean' if cell.clean_session else 'persistent'} session"
+        )
+        result = bench.run(case, os.path.join(raw_dir, f"{cell.label}.csv"))
+        offline, error = None, "" if result else "benchmark connection failed"
+        if result and not cell.clean_session and args.offline_count > 0:
+            try:
+                offline, mock = offline_queue_step(cell, args, intersection, mock)
+                print(f"📴 Offline queue: {offline.acked}/{offline.sent} delivered after reconnect"
+                      f" (drain {fmt(offline.drain_ms)} ms)")
+            except OSError as e:
+                error = f"offline step: {e}"
+        after = (sys_counters.snapshot(args.sys_wait) or {}) if sys_counters else {}
+        return CellResult(cell, result, counter_delta(before, after), error, offline), after
+    finally:
+        mock.stop()
+
+
+def fmt(value, digits: int = 1) -> str:
+    if value is None:
+        return "N/A"
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def write_outputs(cells: List[CellResult], outdir: str, args):
+    csv_file = os.path.join(outdir, "qos_matrix.csv")
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cmd_qos', 'ack_qos', 'session', 'sent', 'received', 'loss_rate',
+                         'mean', 'p50', 'p95', 'p99', 'max'] + list(SYS_TOPICS.values()) +
+                        ['offline_sent', 'offline_acked', 'offline_drain_ms', 'error'])
+        for c in cells:
+            r, o = c.result, c.offline
+            writer.writerow([
+                c.cell.cmd_qos, c.cell.ack_qos, 'clean' if c.cell.clean_session else 'persistent',
+                r.sent if r else 0, r.received if r else 0,
+                f"{r.loss_rate:.2f}" if r else "NA",
+                fmt(r.mean if r else None, 2), fmt(r.p50 if r else None, 2),
+                fmt(r.p95 if r else None, 2), fmt(r.p99 if r else None, 2),
+                fmt(r.max_rtt if r else None, 2)
+            ] + [fmt(c.broker.get(k)) for k in SYS_TOPICS.values()] + [
+                o.sent if o else "NA", o.acked if o else "NA", fmt(o.drain_ms if o else None, 2), c.error
+            ])
+    print(f"💾 Saved: {csv_file}")
+
+    md_file = os.path.join(outdir, "qos_matrix.md")
+    lines = [
+        "# 📊 QoS / Session Matrix",
+        "",
+        f"> **Ngày tạo:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "",
+        f"Count/cell: {args.count}, Interval: {args.interval_ms}ms, Payload pad: {args.pad_bytes}B, "
+        f"Mock ack delay: {args.ack_delay_ms}ms",
+        "",
+        "Broker columns are $SYS deltas over the cell (resolution = sys_interval, "
+        "includes mock state/telemetry traffic). Offline = commands published while the "
+        f"persistent-session mock was disconnected ({args.offline_count}/cell) that were delivered "
+        "after it reconnected, and the time to drain them.",
+        "",
+        "| cmd QoS | ack QoS | Session | Sent | Recv | Loss% | Mean | P50 | P95 | P99 | Max | "
+        "Broker msgs recv | Broker msgs sent | Dropped | Offline delivered | Drain (ms) |",
+        "|---------|---------|---------|------|------|-------|------|-----|-----|-----|-----|"
+        "------------------|------------------|---------|-------------------|------------|",
+    ]
+    for c in cells:
+        r, o = c.result, c.offline
+        session = 'clean' if c.cell.clean_session else 'persistent'
+        if r is None:
+            lines.append(f"| {c.cell.cmd_qos} | {c.cell.ack_qos} | {session} | - | - | - | - | - | - | - | - | "
+                         f"- | - | - | - | - |")
+            continue
+        lines.append(
+            f"| {c.cell.cmd_qos} | {c.cell.ack_qos} | {session} | {r.sent} | {r.received} | "
+            f"{r.loss_rate:.1f}% | {fmt(r.mean)} | {fmt(r.p50)} | {fmt(r.p95)} | {fmt(r.p99)} | "
+            f"{fmt(r.max_rtt)} | {fmt(c.broker.get('msgs_received'))} | {fmt(c.broker.get('msgs_sent'))} | "
+            f"{fmt(c.broker.get('publish_dropped'))} | {f'{o.acked}/{o.sent}' if o else '-'} | "
+            f"{fmt(o.drain_ms) if o else '-'} |")
+    lines.append("")
+    with open(md_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+    print(f"📝 Saved: {md_file}")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='QoS / clean-session matrix benchmark against mock_esp32',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python qos_matrix.py --host 127.0.0.1
+  python qos_matrix.py --host 127.0.0.1 --count 300 --interval_ms 20 --cmd-qos 0,1 --ack-qos 1
+  python qos_matrix.py --host 127.0.0.1 --no-sys
+  python qos_matrix.py --embedded-broker --sessions persistent --offline-count 50
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) instead of using --host')
+    parser.add_argument('--city', default='demo', help='City ID for topics')
+    parser.add_argument('--count', type=int, default=200, help='Commands per cell')
+    parser.add_argument('--interval_ms', type=float, default=50, help='Interval between commands (ms)')
+    parser.add_argument('--pad_bytes', type=int, default=0, help='Payload padding')
+    parser.add_argument('--ack_delay_ms', type=int, default=0, help='Mock ack delay (ms)')
+    parser.add_argument('--cmd-qos', default='0,1,2', help='cmd QoS levels')
+    parser.add_argument('--ack-qos', default='0,1,2', help='ack QoS levels')
+    parser.add_argument('--sessions', default='clean,persistent', help='Session modes')
+    parser.add_argument('--no-sys', action='store_true', help='Do not read broker $SYS counters')
+    parser.add_argument('--sys-wait', type=float, default=11.0,
+                        help='Max wait for a fresh $SYS update at cell boundaries (s)')
+    parser.add_argument('--offline-count', type=int, default=20,
+                        help='Persistent cells: commands published while the mock is offline (0 = skip)')
+    parser.add_argument('--offline-s', type=float, default=1.0,
+                        help='Persistent cells: time the mock stays offline (s)')
+    parser.add_argument('--offline-wait', type=float, default=5.0,
+                        help='Max wait for queued acks after the mock reconnects (s)')
+    parser.add_argument('--raw-format', choices=['csv', 'npy', 'both'], default='csv',
+                        help='Raw per-command output format')
+    parser.add_argument('--outdir', default=None, help='Output directory')
+
+    args = parser.parse_args()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        start_embedded_broker(args)
+    configure_console_output()
+
+    try:
+        cmd_levels = [int(x) for x in args.cmd_qos.split(',')]
+        ack_levels = [int(x) for x in args.ack_qos.split(',')]
+        sessions = [s.strip() for s in args.sessions.split(',')]
+        if any(q not in (0, 1, 2) for q in cmd_levels + ack_levels):
+            raise ValueError
+        if any(s not in ('clean', 'persistent') for s in sessions):
+            raise ValueError
+    except ValueError:
+        print("❌ Invalid --cmd-qos/--ack-qos/--sessions. Use e.g. '0,1,2' and 'clean,persistent'.")
+        sys.exit(1)
+
+    outdir = args.outdir or f"results/qos_{datetime.now().strftime('%Y%m%d_%H%M')}"
+    raw_dir = os.path.join(outdir, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+
+    cells = [MatrixCell(c, a, s == 'clean') for c, a, s in itertools.product(cmd_levels, ack_levels, sessions)]
+
+    print("\n" + "=" * 70)
+    print("🧮 QoS / SESSION MATRIX")
+    print("=" * 70)
+    print(f"  Host:   {args.host}:{args.port}")
+    print(f"  Cells:  {len(cells)} (cmd QoS {cmd_levels} × ack QoS {ack_levels} × {sessions})")
+    print(f"  Count:  {args.count}/cell, Interval: {args.interval_ms}ms")
+    print(f"  Output: {outdir}")
+    print("=" * 70)
+
+    sys_counters = None
+    if not args.no_sys:
+        sys_counters = SysCounters(args.host, args.port, args.user, args.password)
+        try:
+            sys_counters.start()
+        except OSError as e:
+            print(f"⚠️ $SYS monitor unavailable ({e}), broker counts disabled")
+            sys_counters = None
+
+    results = []
+    try:
+        # One $SYS snapshot per boundary: the end of a cell is the start of the next
+        boundary = {}
+        if sys_counters:
+            boundary = sys_counters.snapshot(args.sys_wait)
+            if boundary is None:
+                print("⚠️ Broker publishes no $SYS counters, broker counts disabled")
+                sys_counters.stop()
+                sys_counters, boundary = None, {}
+        for cell in cells:
+            cell_result, boundary = run_cell(cell, args, raw_dir, sys_counters, boundary)
+            if cell_result.error:
+                print(f"⚠️ {cell.label}: {cell_result.error}")
+            results.append(cell_result)
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("\n⚠️ Interrupted by user, writing partial matrix")
+    finally:
+        if sys_counters:
+            sys_counters.stop()
+
+    if not any(c.result for c in results):
+        print("❌ All cells failed. Check broker connectivity.")
+        sys.exit(1)
+
+    write_outputs(results, outdir, args)
+    print("\n" + "=" * 70)
+    print("✅ MATRIX COMPLETE")
+    print("=" * 70 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Columnar Raw Results - Traffic Light MQTT Demo
+Typed binary storage for per-command benchmark records (alongside CSV).
+
+Records are stored as a single NumPy structured array (.npy), so readers can
+memory-map the file instead of re-parsing text:
+  - cmd_id is stored as the 16 raw UUID bytes (not a 36-char string)
+  - times and RTTs are float ms (epoch ms for t_*), so sub-ms RTTs survive;
+    files written before that have <i8 t_send_ms / t_ack_recv_ms and still load
+  - missing values are explicit: NaN for float columns, dtype-min for int columns
+  - mode/note are fixed-width UTF-8 bytes sized to the longest value
+
+Usage:
+    python raw_columnar.py to-csv results/bench_xxx/raw/case_0b.npy
+    python raw_columnar.py from-csv results/bench_xxx/raw/case_0b.csv
+    python raw_columnar.py bench results/bench_xxx/raw/case_0b.csv --repeat 20
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+# Sentinels for missing integer values: the minimum of each column's dtype
+INT_NA = np.iinfo(np.int64).min        # t_send_ms, t_ack_recv_ms of older <i8 files
+INT32_NA = np.iinfo(np.int32).min      # payload_size, actual_payload_bytes (<i4)
+PHASE_NA = np.iinfo(np.int16).min      # phase (<i2)
+
+COLUMNAR_SUFFIX = ".npy"
+# run_benchmark_report writes the echo calibration here, beside raw/: it has the raw
+# schema but measures the harness, not a case, so directory scans leave it out
+CALIBRATION_DIR = "calibration"
+
+# Column order matches the CSV written by RTTBenchmark._save_csv
+CSV_COLUMNS = ['cmd_id', 't_send_ms', 't_ack_recv_ms', 'rtt_ms', 'edge_lat_ms', 'ret_lat_ms',
+               'payload_size', 'actual_payload_bytes', 'mode', 'phase', 'note']
+
+STR_COLUMNS = ('mode', 'note')
+
+# Columns shared by every raw per-command file (logger.py and RTTBenchmark layouts,
+# including runs recorded before actual_payload_bytes was added)
+RAW_REQUIRED_COLUMNS = frozenset(['cmd_id', 't_send_ms', 't_ack_recv_ms', 'rtt_ms', 'payload_size'])
+
+
+# =============================================================================
+# ENCODING
+# =============================================================================
+
+def _field(record, name: str, default=None):
+    """Read a field from a dict record (RTTBenchmark) or dataclass (logger.py)."""
+    if isinstance(record, dict):
+        return record.get(name, default)
+    return getattr(record, name, default)
+
+
+def _uuid_bytes(cmd_id: Optional[str]) -> bytes:
+    try:
+        return uuid.UUID(str(cmd_id)).bytes
+    except (ValueError, TypeError):
+        return b"\x00" * 16
+
+
+def _int_or_na(value, na: int = INT_NA) -> int:
+    if value is None or value == '':
+        return na
+    return int(float(value))
+
+
+def _float_or_nan(value) -> float:
+    if value is None or value == '':
+        return np.nan
+    return float(value)
+
+
+def _encode(value) -> bytes:
+    return str(value or '').encode('utf-8')
+
+
+def make_dtype(str_width: int = 16) -> np.dtype:
+    """Structured dtype for one command record."""
+    return np.dtype([
+        ('cmd_id', 'V16'),
+        ('t_send_ms', '<f8'),
+        ('t_ack_recv_ms', '<f8'),
+        ('rtt_ms', '<f8'),
+        ('edge_lat_ms', '<f8'),
+        ('ret_lat_ms', '<f8'),
+        ('payload_size', '<i4'),
+        ('actual_payload_bytes', '<i4'),
+        ('mode', f'S{str_width}'),
+        ('phase', '<i2'),
+        ('note', f'S{str_width}'),
+    ])
+
+
+def records_to_array(records: Iterable) -> np.ndarray:
+    """Convert logger/RTTBenchmark records into a typed structured array."""
+    records = list(records)
+    width = max([1] + [len(_encode(_field(r, name))) for r in records for name in STR_COLUMNS])
+    arr = np.empty(len(records), dtype=make_dtype(width))
+
+    for i, r in enumerate(records):
+        arr[i] = (
+            _uuid_bytes(_field(r, 'cmd_id')),
+            _float_or_nan(_field(r, 't_send_ms')),
+            _float_or_nan(_field(r, 't_ack_recv_ms')),
+            _float_or_nan(_field(r, 'rtt_ms')),
+            _float_or_nan(_field(r, 'edge_lat_ms')),
+            _float_or_nan(_field(r, 'ret_lat_ms')),
+            _int_or_na(_field(r, 'payload_size', 0), INT32_NA),
+            _int_or_na(_field(r, 'actual_payload_bytes', 0), INT32_NA),
+            _encode(_field(r, 'mode')),
+            _int_or_na(_field(r, 'phase'), PHASE_NA),
+            _encode(_field(r, 'note')),
+        )
+    return arr
+
+
+def save_columnar(records: Iterable, filename: str) -> str:
+    """Save records as a typed .npy file. Returns the path written."""
+    arr = records_to_array(records)
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.save(filename, arr, allow_pickle=False)
+    print(f"💾 Saved: {filename}")
+    return filename
+
+
+def columnar_path(csv_file: str) -> str:
+    """Columnar sibling of a CSV path (case_0b.csv -> case_0b.npy)."""
+    return os.path.splitext(csv_file)[0] + COLUMNAR_SUFFIX
+
+
+def is_columnar(filename: str) -> bool:
+    return str(filename).endswith(COLUMNAR_SUFFIX)
+
+
+def is_raw_results(filename: str) -> bool:
+    """
+    True if the file has the raw per-command schema (CSV header / .npy dtype).
+    Summaries, timelines, multi-device and fleet CSVs that sit next to raw files
+    do not, so directory scans can match on the schema instead of on names.
+    """
+    try:
+        if is_columnar(filename):
+            names = load_columnar(filename).dtype.names or ()
+        else:
+            with open(filename, newline='', encoding='utf-8') as f:
+                names = next(csv.reader(f), [])
+    except (OSError, ValueError, UnicodeDecodeError):
+        return False
+    return RAW_REQUIRED_COLUMNS.issubset(names)
+
+
+# =============================================================================
+# DECODING
+# =============================================================================
+
+def load_columnar(filename: str, mmap: bool = True) -> np.ndarray:
+    """Load a .npy results file, memory-mapped by default."""
+    return np.load(filename, mmap_mode='r' if mmap else None, allow_pickle=False)
+
+
+def format_cmd_ids(arr: np.ndarray) -> List[str]:
+    return [str(uuid.UUID(bytes=bytes(b))) for b in arr['cmd_id']]
+
+
+def _decode_labels(col: np.ndarray) -> np.ndarray:
+    """Decode a low-cardinality bytes column (mode/note) once per distinct value."""
+    uniq, inverse = np.unique(col, return_inverse=True)
+    labels = np.array([u.decode('utf-8') for u in uniq], dtype=object)
+    return labels[inverse]
+
+
+def columnar_to_dataframe(arr: np.ndarray, include_ids: bool = False):
+    """
+    Build the same DataFrame analyzers get from pd.read_csv.
+    cmd_id is decoded only on request (it is not needed for statistics).
+    """
+    import pandas as pd
+
+    data = {}
+    if include_ids:
+        data['cmd_id'] = format_cmd_ids(arr)
+    for name in arr.dtype.names:
+        if name == 'cmd_id':
+            continue
+        col = arr[name]
+        if name == 't_ack_recv_ms' and col.dtype.kind == 'i':
+            col = np.where(col == INT_NA, np.nan, col)
+        elif name in ('payload_size', 'actual_payload_bytes'):
+            col = np.where(col == INT32_NA, np.nan, col) if (col == INT32_NA).any() else col
+        elif name == 'phase':
+            col = np.where(col == PHASE_NA, np.nan, col)
+        elif name in STR_COLUMNS:
+            col = _decode_labels(col)
+        data[name] = col
+    return pd.DataFrame(data)
+
+
+def read_results(filename: str):
+    """Load a raw results file (.csv or memory-mapped .npy) as a DataFrame."""
+    if is_columnar(filename):
+        return columnar_to_dataframe(load_columnar(filename))
+    import pandas as pd
+    return pd.read_csv(filename)
+
+
+def columnar_to_csv(src: str, dst: Optional[str] = None) -> str:
+    """Derive the text CSV from a columnar file."""
+    arr = load_columnar(src)
+    dst = dst or os.path.splitext(src)[0] + ".csv"
+
+    def text(value, missing):
+        return '' if missing else value
+
+    def time_ms(value):
+        # <f8 (NaN = missing), or the <i8 of older files (INT_NA = missing)
+        if np.issubdtype(type(value), np.integer):
+            return text(int(value), value == INT_NA)
+        return text(float(value), np.isnan(value))
+
+    ids = format_cmd_ids(arr)
+    with open(dst, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for i, row in enumerate(arr):
+            writer.writerow([
+                ids[i],
+                time_ms(row['t_send_ms']),
+                time_ms(row['t_ack_recv_ms']),
+                text(float(row['rtt_ms']), np.isnan(row['rtt_ms'])),
+                text(float(row['edge_lat_ms']), np.isnan(row['edge_lat_ms'])),
+                text(float(row['ret_lat_ms']), np.isnan(row['ret_lat_ms'])),
+                text(int(row['payload_size']), row['payload_size'] == INT32_NA),
+                text(int(row['actual_payload_bytes']), row['actual_payload_bytes'] == INT32_NA),
+                row['mode'].decode('utf-8'),
+                text(int(row['phase']), row['phase'] == PHASE_NA),
+                row['note'].decode('utf-8'),
+            ])
+    print(f"💾 Saved: {dst}")
+    return dst
+
+
+def csv_to_columnar(src: str, dst: Optional[str] = None) -> str:
+    """Convert an existing raw CSV (logger.py or RTTBenchmark layout) to .npy."""
+    with open(src, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    return save_columnar(rows, dst or columnar_path(src))
+
+
+# =============================================================================
+# LOAD-TIME BENCHMARK
+# =============================================================================
+
+def bench_load(csv_file: str, repeat: int = 10) -> dict:
+    """Time pd.read_csv against memory-mapped .npy loading for the same data."""
+    import pandas as pd
+
+    def best_of(fn) -> float:
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - t0) * 1000)
+        return min(times)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        npy_file = os.path.join(tmp, "bench.npy")
+        csv_to_columnar(csv_file, npy_file)
+
+        result = {
+            'rows': len(load_columnar(npy_file)),
+            'csv_bytes': os.path.getsize(csv_file),
+            'npy_bytes': os.path.getsize(npy_file),
+            'csv_load_ms': best_of(lambda: pd.read_csv(csv_file)),
+            'npy_load_ms': best_of(lambda: columnar_to_dataframe(load_columnar(npy_file))),
+            'npy_rtt_only_ms': best_of(lambda: np.nanmean(load_columnar(npy_file)['rtt_ms'])),
+        }
+    return result
+
+
+def print_bench(result: dict):
+    print("\n" + "=" * 50)
+    print("⏱️  RAW FORMAT LOAD BENCHMARK")
+    print("=" * 50)
+    print(f"  Rows:               {result['rows']}")
+    print(f"  CSV size:           {result['csv_bytes']:>10} bytes")
+    print(f"  NPY size:           {result['npy_bytes']:>10} bytes")
+    print(f"  pd.read_csv:        {result['csv_load_ms']:>10.2f} ms")
+    print(f"  npy -> DataFrame:   {result['npy_load_ms']:>10.2f} ms")
+    print(f"  npy rtt column:     {result['npy_rtt_only_ms']:>10.2f} ms")
+    if result['npy_load_ms'] > 0:
+        print(f"  Speedup:            {result['csv_load_ms'] / result['npy_load_ms']:>10.1f}x")
+    print("=" * 50 + "\n")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert and benchmark columnar raw result files',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python raw_columnar.py to-csv raw/case_0b.npy
+  python raw_columnar.py from-csv raw/case_0b.csv
+  python raw_columnar.py bench raw/case_0b.csv --repeat 20
+        """
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_csv = sub.add_parser('to-csv', help='Derive CSV from a .npy results file')
+    p_csv.add_argument('npy_file')
+    p_csv.add_argument('--out', default=None, help='Output CSV (default: same name, .csv)')
+
+    p_npy = sub.add_parser('from-csv', help='Convert a raw CSV to .npy')
+    p_npy.add_argument('csv_file')
+    p_npy.add_argument('--out', default=None, help='Output .npy (default: same name, .npy)')
+
+    p_bench = sub.add_parser('bench', help='Compare CSV vs .npy load time')
+    p_bench.add_argument('csv_file')
+    p_bench.add_argument('--repeat', type=int, default=10, help='Repetitions (best-of)')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'to-csv':
+            columnar_to_csv(args.npy_file, args.out)
+        elif args.command == 'from-csv':
+            csv_to_columnar(args.csv_file, args.out)
+        else:
+            print_bench(bench_load(args.csv_file, args.repeat))
+    except FileNotFoundError as e:
+        print(f"❌ File not found: {e.filename}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,17 @@
 """
 RTT Benchmark Report Generator - Traffic Light MQTT Demo
 Runs multiple benchmark cases, analyzes results, generates plots and report.
+With 2+ payload cases the report includes a per-byte cost model (payload_model.py):
+fixed + per-KB cost with CIs and, with 4+ sizes, a linearity breakpoint.
+Before the cases a short echo case against a local responder (echo_floor.py)
+measures the harness's own latency floor; --subtract-floor also reports net RTTs.
 
 Usage:
     python run_benchmark_report.py --host 127.0.0.1
     python run_benchmark_report.py --host 192.168.1.100 --cases "0,256,1024" --count 500
+    python run_benchmark_report.py --host 127.0.0.1 --raw-format both
+    python run_benchmark_report.py --host 127.0.0.1 --subtract-floor
+    python run_benchmark_report.py --host 127.0.0.1 --sweep --sweep-start 5 --sweep-max 2000
 """
 
 import argparse
@@ -18,27 +25,18 @@ import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 
 import paho.mqtt.client as mqtt
 
-# Optional imports for analysis and plotting
-try:
-    import numpy as np
-    import pandas as pd
-    HAS_PANDAS = True
-except ImportError:
-    HAS_PANDAS = False
-
-try:
-    import matplotlib
-    matplotlib.use('Agg')  # Non-interactive backend
-    import matplotlib.pyplot as plt
-    HAS_MATPLOTLIB = True
-except ImportError:
-    HAS_MATPLOTLIB = False
+from clock_sync import EPOCH_MS_MIN, ClockEstimate, ClockOffsetEstimator, PingExchange, describe
+from command_client import CommandClient, CommandFuture
+from echo_floor import EchoResponder
+from timeline import (DEFAULT_SPIKE_K, DEFAULT_SPIKE_MIN_MS, DEFAULT_WINDOW_MS, TimelineRecorder,
+                      TimelineWindow, flagged, plot_timeline, save_timeline, timeline_path)
 
+ACK_TIMEOUT_S = 10.0  # per-command ack deadline
 
 # =============================================================================
 # DATA STRUCTURES
@@ -56,7 +54,7 @@ class BenchmarkCase:
     name: str
     pad_bytes: int
     count: int
-    interval_ms: int
+    interval_ms: float
     description: str
     expected_reject: bool = False
 
@@ -89,6 +87,23 @@ class CaseResult:
     # One-Way Latencies
     mean_edge_lat: Optional[float]
     mean_ret_lat: Optional[float]
+    # Achieved offered rate (commands/s over the send window)
+    send_rate_hz: Optional[float] = None
+    # Edge clock offset (edge - local) used for the one-way split
+    clock_offset_ms: Optional[float] = None
+    clock_uncertainty_ms: Optional[float] = None
+    clock_drift_ppm: Optional[float] = None
+    # Per-window timeline (saved next to the raw file)
+    timeline_file: Optional[str] = None
+    timeline: List[TimelineWindow] = field(default_factory=list)
+    # Harness floor (calibration P50) taken off the net_* metrics (--subtract-floor)
+    floor_ms: Optional[float] = None
+    
+    def net(self, value: Optional[float]) -> Optional[float]:
+        """value minus the harness floor (None without --subtract-floor)."""
+        if value is None or self.floor_ms is None:
+            return None
+        return max(0.0, value - self.floor_ms)
 
 
 # =============================================================================
@@ -97,11 +112,18 @@ class CaseResult:
 
 class RTTBenchmark:
     def __init__(self, host: str, port: int, user: str, password: str,
-                 city: str = "demo", intersection: str = "001"):
+                 city: str = "demo", intersection: str = "001", raw_format: str = "csv",
+                 cmd_qos: int = 1, ack_qos: int = 1, clean_session: bool = True,
+                 clock_pings: int = 0, window_ms: int = DEFAULT_WINDOW_MS):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
+        self.raw_format = raw_format
+        self.cmd_qos = cmd_qos
+        self.ack_qos = ack_qos
+        self.clock_pings = clock_pings
+        self.window_ms = window_ms
         
         self.topic_cmd = f"city/{city}/intersection/{intersection}/cmd"
         self.topic_ack = f"city/{city}/intersection/{intersection}/ack"
@@ -109,43 +131,81 @@ class RTTBenchmark:
         self.records = {}
         self.received_count = 0
         self.connected = False
+        self.subscribed = False
+        self.commands: Optional[CommandClient] = None
+        self.pinger: Optional[PingExchange] = None
+        self.clock: Optional[ClockEstimate] = None
+        self.timeline = TimelineRecorder(window_ms)
         
+        # Persistent sessions need a stable client id across reconnects
+        client_id = (f"bench-{uuid.uuid4().hex[:8]}" if clean_session
+                     else f"bench-{city}-{intersection}")
         self.client = mqtt.Client(
-            client_id=f"bench-{uuid.uuid4().hex[:8]}",
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+            client_id=client_id,
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            clean_session=clean_session
         )
         self.client.username_pw_set(user, password)
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
+        self.client.on_subscribe = self._on_subscribe
     
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             self.connected = True
-            client.subscribe(self.topic_ack, qos=1)
+            client.subscribe(self.topic_ack, qos=self.ack_qos)
+    
+    def _on_subscribe(self, client, userdata, mid, reason_codes, properties=None):
+        self.subscribed = True
     
     def _on_message(self, client, userdata, msg):
-        t_recv = int(time.time() * 1000)
+        t_recv = time.time() * 1000
         try:
-            payload = json.loads(msg.payload.decode())
-            cmd_id = payload.get("cmd_id")
-            if cmd_id and cmd_id in self.records:
-                t_send = self.records[cmd_id]["t_send_ms"]
-                self.records[cmd_id]["t_ack_recv_ms"] = t_recv
-                self.records[cmd_id]["rtt_ms"] = t_recv - t_send
-                
-                # Check for one-way latency (only works if edge sends epoch ms, not uptime)
-                edge_ts = payload.get("edge_recv_ts_ms", 0)
-                if edge_ts > 1600000000000: # Valid Epoch MS
-                    self.records[cmd_id]["edge_lat_ms"] = edge_ts - t_send
-                    self.records[cmd_id]["ret_lat_ms"] = t_recv - edge_ts
-                else:
-                    self.records[cmd_id]["edge_lat_ms"] = None
-                    self.records[cmd_id]["ret_lat_ms"] = None
-                    
-                self.received_count += 1
+            if self.commands:
+                self.commands.on_ack(json.loads(msg.payload.decode()), t_recv)
         except:
             pass
     
+    def _on_ack(self, fut: CommandFuture):
+        """Done callback of a benchmark command: record its ack (timeouts stay lost)."""
+        if fut.exception() is not None:
+            self.timeline.on_lost(time.time() * 1000)
+            return
+        ack = fut.result()
+        record = self.records[ack.cmd_id]
+        t_recv = round(ack.t_recv_ms, 3)
+        record["t_ack_recv_ms"] = t_recv
+        record["rtt_ms"] = round(t_recv - record["t_send_ms"], 3)
+        # Edge timestamp; one-way latencies are derived after the run (_split_latency)
+        record["edge_recv_ts_ms"] = ack.payload.get("edge_recv_ts_ms")
+        self.received_count += 1
+        self.timeline.on_ack(t_recv, record["rtt_ms"])
+    
+    def _split_latency(self):
+        """
+        Compute edge_lat/ret_lat for every acked record.
+        With a clock estimate the edge timestamp is mapped to the local clock
+        (works for uptime clocks too); without one, epoch edge timestamps are
+        used as-is, as before.
+        """
+        for r in self.records.values():
+            edge_ts = r.get("edge_recv_ts_ms")
+            if r["t_ack_recv_ms"] is None or not isinstance(edge_ts, (int, float)):
+                continue
+            if self.clock is not None:
+                edge_local = self.clock.to_local(edge_ts)
+            elif edge_ts > EPOCH_MS_MIN:
+                edge_local = edge_ts
+            else:
+                continue
+            r["edge_lat_ms"] = round(edge_local - r["t_send_ms"], 3)
+            r["ret_lat_ms"] = round(r["t_ack_recv_ms"] - edge_local, 3)
+    
+    def _ping_burst(self):
+        if self.clock_pings > 0:
+            got = self.pinger.run_burst(self.clock_pings)
+            print(f"🏓 Clock ping: {got}/{self.clock_pings} replies")
+    
     def run(self, case: BenchmarkCase, output_csv: str) -> Optional[CaseResult]:
         """Run benchmark for a single case."""
         print(f"\n{'='*60}")
@@ -156,6 +216,12 @@ class RTTBenchmark:
         self.records = {}
         self.received_count = 0
         self.connected = False
+        self.subscribed = False
+        self.clock = None
+        self.timeline = TimelineRecorder(self.window_ms)
+        estimator = ClockOffsetEstimator()
+        self.commands = CommandClient(self.client, self.topic_cmd, qos=self.cmd_qos, timeout=ACK_TIMEOUT_S)
+        self.pinger = PingExchange(self.commands, estimator)
         
         try:
             self.client.connect(self.host, self.port, keepalive=60)
@@ -170,15 +236,20 @@ class RTTBenchmark:
             if not self.connected:
                 print("❌ Connection failed")
                 return None
+            while not self.subscribed and (time.time() - start) < timeout:
+                time.sleep(0.02)
+            
+            # Clock offset: one ping burst before and one after the case (drift fit)
+            self._ping_burst()
             
             print(f"✅ Connected. Sending {case.count} commands...")
             
-            # Send commands
+            # Send commands on a fixed schedule (publish time does not stretch the interval)
             interval_s = case.interval_ms / 1000.0
+            t_next = time.perf_counter()
             for i in range(case.count):
-                cmd_id = str(uuid.uuid4())
                 cmd = {
-                    "cmd_id": cmd_id,
+                    "cmd_id": str(uuid.uuid4()),
                     "type": "SET_MODE",
                     "mode": "AUTO",
                     "ts_ms": int(time.time() * 1000)
@@ -186,62 +257,93 @@ class RTTBenchmark:
                 if case.pad_bytes > 0:
                     cmd["pad"] = "x" * case.pad_bytes
                 
-                payload_json = json.dumps(cmd)
-                actual_payload_bytes = len(payload_json.encode('utf-8'))
-                t_send = int(time.time() * 1000)
-                self.records[cmd_id] = {
-                    "cmd_id": cmd_id,
+                fut = self.commands.send(cmd)
+                t_send = round(fut.t_send_ms, 3)   # µs resolution: the harness floor is sub-ms
+                self.records[fut.cmd_id] = {
+                    "cmd_id": fut.cmd_id,
                     "t_send_ms": t_send,
                     "t_ack_recv_ms": None,
                     "rtt_ms": None,
                     "edge_lat_ms": None,
                     "ret_lat_ms": None,
-                    "payload_size": len(payload_json),
-                    "actual_payload_bytes": actual_payload_bytes,
+                    "payload_size": len(fut.payload),
+                    "actual_payload_bytes": len(fut.payload.encode('utf-8')),
                     "mode": "AUTO",
                     "phase": None,
                     "note": case.name
                 }
-                
-                self.client.publish(self.topic_cmd, payload_json, qos=1)
+                self.timeline.on_send(t_send)
+                # An ack that already arrived is applied right here
+                fut.add_done_callback(self._on_ack)
                 
                 if (i + 1) % 100 == 0:
                     print(f"   Sent {i+1}/{case.count}...")
                 
                 if i < case.count - 1:
-                    time.sleep(interval_s)
+                    t_next += interval_s
+                    delay = t_next - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
             
-            # Wait for remaining acks
+            # Wait for remaining acks (each command has its own deadline)
             print("⏳ Waiting for acks...")
-            wait_start = time.time()
-            while self.received_count < len(self.records) and (time.time() - wait_start) < 10.0:
-                time.sleep(0.1)
+            self.commands.drain()
             
             print(f"✅ Received {self.received_count}/{len(self.records)} acks")
             
+            self._ping_burst()
+            self.clock = estimator.estimate()
+            if self.clock_pings > 0:
+                print(f"🕐 Edge clock: {describe(self.clock)}")
+            
         finally:
+            self.commands.close()
             self.client.loop_stop()
             self.client.disconnect()
         
-        # Save CSV
-        self._save_csv(output_csv)
+        self._split_latency()
+        
+        # Save raw results (CSV and/or columnar .npy) and the timeline next to them
+        raw_file = self._save_raw(output_csv)
+        windows = self.timeline.finalize()
+        timeline_file = timeline_path(output_csv)
+        save_timeline(windows, timeline_file, self.window_ms)
         
         # Analyze results
-        return self._analyze(case, output_csv)
+        result = self._analyze(case, raw_file)
+        result.timeline_file = timeline_file
+        result.timeline = windows
+        return result
+    
+    def _save_raw(self, output_csv: str) -> str:
+        """Save raw records in the configured format. Returns the primary file."""
+        if self.raw_format in ("csv", "both"):
+            self._save_csv(output_csv)
+        if self.raw_format in ("npy", "both"):
+            from raw_columnar import columnar_path, save_columnar
+            npy_file = save_columnar(self.records.values(), columnar_path(output_csv))
+            if self.raw_format == "npy":
+                return npy_file
+        return output_csv
     
     def _save_csv(self, filename: str):
         """Save results to CSV."""
         os.makedirs(os.path.dirname(filename), exist_ok=True)
+        
+        def cell(value):
+            # Only None is missing: 0 ms RTTs (loopback) and phase 0 are real values
+            return '' if value is None else value
+        
         with open(filename, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
             writer.writerow(['cmd_id', 't_send_ms', 't_ack_recv_ms', 'rtt_ms', 'edge_lat_ms', 'ret_lat_ms',
                            'payload_size', 'actual_payload_bytes', 'mode', 'phase', 'note'])
             for r in self.records.values():
                 writer.writerow([
-                    r["cmd_id"], r["t_send_ms"], r["t_ack_recv_ms"] or '',
-                    r["rtt_ms"] or '', r.get("edge_lat_ms", '') or '', r.get("ret_lat_ms", '') or '',
-                    r["payload_size"], r.get("actual_payload_bytes", ''), r["mode"],
-                    r["phase"] or '', r["note"]
+                    r["cmd_id"], r["t_send_ms"], cell(r["t_ack_recv_ms"]),
+                    cell(r["rtt_ms"]), cell(r.get("edge_lat_ms")), cell(r.get("ret_lat_ms")),
+                    r["payload_size"], cell(r.get("actual_payload_bytes")), r["mode"],
+                    cell(r["phase"]), r["note"]
                 ])
         print(f"💾 Saved: {filename}")
     
@@ -252,6 +354,9 @@ class RTTBenchmark:
         payload_min = min(payload_bytes) if payload_bytes else 0
         payload_max = max(payload_bytes) if payload_bytes else 0
         payload_mean = (sum(payload_bytes) / len(payload_bytes)) if payload_bytes else 0.0
+        send_times = [r["t_send_ms"] for r in self.records.values()]
+        send_span_s = (max(send_times) - min(send_times)) / 1000.0 if send_times else 0.0
+        send_rate = ((len(send_times) - 1) / send_span_s) if send_span_s > 0 else None
         
         if not rtts:
             status = "PASS" if case.expected_reject else "FAIL"
@@ -262,12 +367,16 @@ class RTTBenchmark:
                 mean=None, median=None, std=None, min_rtt=None, max_rtt=None,
                 p50=None, p75=None, p90=None, p95=None, p99=None, outlier_count=0, rtts=[],
                 payload_bytes_min=payload_min, payload_bytes_max=payload_max, payload_bytes_mean=payload_mean,
-                status=status, reason=reason, mean_edge_lat=None, mean_ret_lat=None
+                status=status, reason=reason, mean_edge_lat=None, mean_ret_lat=None,
+                send_rate_hz=send_rate, **self._clock_fields()
             )
         
         rtts.sort()
         n = len(rtts)
         
+        edge_lats = [r["edge_lat_ms"] for r in self.records.values() if r.get("edge_lat_ms") is not None]
+        ret_lats = [r["ret_lat_ms"] for r in self.records.values() if r.get("ret_lat_ms") is not None]
+        
         mean = sum(rtts) / n
         median = rtts[n // 2] if n % 2 == 1 else (rtts[n//2 - 1] + rtts[n//2]) / 2
         
@@ -315,17 +424,94 @@ class RTTBenchmark:
             payload_bytes_max=payload_max,
             payload_bytes_mean=payload_mean,
             status=status,
-            reason=reason
+            reason=reason,
+            mean_edge_lat=(sum(edge_lats) / len(edge_lats)) if edge_lats else None,
+            mean_ret_lat=(sum(ret_lats) / len(ret_lats)) if ret_lats else None,
+            send_rate_hz=send_rate,
+            **self._clock_fields()
         )
+    
+    def _clock_fields(self) -> dict:
+        if self.clock is None:
+            return {}
+        return {
+            "clock_offset_ms": self.clock.offset_ms,
+            "clock_uncertainty_ms": self.clock.uncertainty_ms,
+            "clock_drift_ppm": self.clock.drift_ppm,
+        }
+
+
+# =============================================================================
+# HARNESS FLOOR CALIBRATION
+# =============================================================================
+
+def run_calibration(args, outdir: str) -> Optional[CaseResult]:
+    """
+    Echo case against a local EchoResponder (echo_floor.py): same client, send
+    loop and ack path as the real cases, but the edge acks instantly, so the RTT
+    is the harness + broker floor of this machine. Saved under outdir/calibration/,
+    not raw/, so tools scanning a run's raw files do not take it for a case.
+    """
+    from raw_columnar import CALIBRATION_DIR
+
+    responder = EchoResponder(args.host, args.port, args.user, args.password)
+    if not responder.start():
+        print("⚠️ Echo responder did not start, skipping calibration")
+        return None
+    case = BenchmarkCase(
+        name="Calibration",
+        pad_bytes=0,
+        count=args.calibrate,
+        interval_ms=args.calibrate_interval_ms,
+        description="Echo loopback (harness floor)"
+    )
+    benchmark = RTTBenchmark(args.host, args.port, args.user, args.password,
+                             city=responder.city, intersection=responder.intersection,
+                             raw_format=args.raw_format, clock_pings=0, window_ms=args.window_ms)
+    try:
+        calib_dir = os.path.join(outdir, CALIBRATION_DIR)
+        os.makedirs(calib_dir, exist_ok=True)
+        floor = benchmark.run(case, os.path.join(calib_dir, "calibration.csv"))
+    finally:
+        responder.stop()
+    if floor is None or floor.p50 is None:
+        print("⚠️ No echo acks, calibration failed")
+        return None
+    print(f"🔁 Harness floor: P50 {floor.p50:.2f} ms, P99 {floor.p99:.2f} ms "
+          f"(min {floor.min_rtt:.2f}, {floor.received}/{floor.sent} echoes)")
+    return floor
+
+
+def floor_summary(floor: CaseResult) -> dict:
+    """Calibration distribution for meta.json."""
+    return {
+        "count": floor.sent,
+        "received": floor.received,
+        "interval_ms": floor.case.interval_ms,
+        "min_ms": floor.min_rtt,
+        "mean_ms": floor.mean,
+        "p50_ms": floor.p50,
+        "p90_ms": floor.p90,
+        "p95_ms": floor.p95,
+        "p99_ms": floor.p99,
+        "max_ms": floor.max_rtt,
+        "raw_file": os.path.join(os.path.basename(os.path.dirname(floor.csv_file)),
+                                 os.path.basename(floor.csv_file)),
+    }
 
 
 # =============================================================================
 # PLOTTING
 # =============================================================================
 
+# matplotlib (and analyze_results' pandas) are only imported when plots are
+# generated: benchmark-only runs, qos_matrix and multi_device_test never pay for them
+
 def generate_plots(results: List[CaseResult], plots_dir: str):
     """Generate all plots."""
-    if not HAS_MATPLOTLIB:
+    from analyze_results import load_pyplot
+    plt = load_pyplot()
+    if plt is None:
         print("⚠️ matplotlib not installed. Skipping plots.")
         return
     
@@ -358,6 +544,14 @@ def generate_plots(results: List[CaseResult], plots_dir: str):
         plt.close()
         print(f"📊 Saved: {filename}")
     
+    # 1b. Timeline for each case (also for no-ack cases: shows where acks stopped)
+    for r in results:
+        if r.timeline:
+            window_ms = (r.timeline[1].t_start_ms - r.timeline[0].t_start_ms
+                         if len(r.timeline) > 1 else DEFAULT_WINDOW_MS)
+            filename = os.path.join(plots_dir, f"timeline_{r.case.name.lower().replace(' ', '_')}.png")
+            plot_timeline(r.timeline, filename, f"RTT Timeline - {r.case.name}", window_ms)
+    
     # 2. Comparison bar chart
     if len(chart_results) > 1:
         fig, ax = plt.subplots(figsize=(12, 6))
@@ -440,7 +634,10 @@ def generate_summary_csv(results: List[CaseResult], output_file: str):
                         'mean', 'median', 'std', 'min', 'max',
                         'p50', 'p75', 'p90', 'p95', 'p99', 'outliers',
                         'payload_bytes_min', 'payload_bytes_max', 'payload_bytes_mean',
-                        'status', 'reason'])
+                        'status', 'reason', 'mean_edge_lat', 'mean_ret_lat',
+                        'clock_offset_ms', 'clock_uncertainty_ms', 'clock_drift_ppm',
+                        'stall_windows', 'spike_windows',
+                        'floor_ms', 'net_mean', 'net_p50', 'net_p95', 'net_p99'])
         for r in results:
             writer.writerow([
                 r.case.name, r.case.pad_bytes, r.case.count, r.case.interval_ms,
@@ -450,12 +647,132 @@ def generate_summary_csv(results: List[CaseResult], output_file: str):
                 csv_metric(r.p50), csv_metric(r.p75), csv_metric(r.p90),
                 csv_metric(r.p95), csv_metric(r.p99), r.outlier_count,
                 r.payload_bytes_min, r.payload_bytes_max, f"{r.payload_bytes_mean:.2f}",
-                r.status, r.reason
+                r.status, r.reason, csv_metric(r.mean_edge_lat), csv_metric(r.mean_ret_lat),
+                csv_metric(r.clock_offset_ms), csv_metric(r.clock_uncertainty_ms),
+                csv_metric(r.clock_drift_ppm),
+                sum(1 for w in r.timeline if w.flag == "STALL"),
+                sum(1 for w in r.timeline if w.flag == "SPIKE"),
+                csv_metric(r.floor_ms), csv_metric(r.net(r.mean)), csv_metric(r.net(r.p50)),
+                csv_metric(r.net(r.p95)), csv_metric(r.net(r.p99))
             ])
     print(f"💾 Saved: {output_file}")
 
 
-def generate_report(results: List[CaseResult], output_file: str, plots_dir: str):
+def generate_run_metadata(args, output_file: str, floor: Optional[CaseResult] = None):
+    """Save run parameters, environment and harness floor (read by catalog_runs.py)."""
+    import platform
+    import socket
+
+    params = {k: v for k, v in vars(args).items() if k != 'password'}
+    meta = {
+        "tool": "run_benchmark_report.py",
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "params": params,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "hostname": socket.gethostname(),
+            "paho_mqtt": getattr(sys.modules.get('paho.mqtt'), '__version__', None),
+        },
+        "harness_floor": floor_summary(floor) if floor else None,
+    }
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    print(f"💾 Saved: {output_file}")
+
+
+def build_payload_model(results: List[CaseResult], outdir: str, plots_dir: str):
+    """
+    Fit the per-byte RTT cost across all acked cases (payload_model.py), save
+    payload_model.json and plots/payload_model.png. None if < 2 payload cases.
+    """
+    files = [r.csv_file for r in results if r.received > 0 and not r.case.expected_reject]
+    if len({r.case.pad_bytes for r in results if r.csv_file in files}) < 2:
+        return None
+    
+    from payload_model import fit_payload_model, load_points, plot_model, save_json
+    
+    x, y = load_points(files)
+    model = fit_payload_model(x, y)
+    save_json(model, os.path.join(outdir, "payload_model.json"))
+    try:
+        plot_model(x, y, model, os.path.join(plots_dir, "payload_model.png"), "RTT vs payload size (all cases)")
+    except ImportError:
+        print("⚠️ matplotlib not installed. Skipping payload model plot.")
+    return model
+
+
+def payload_model_section(model) -> str:
+    """Report section for a PayloadModel (Vietnamese, like the rest of the report)."""
+    if model is None or model.linear is None:
+        return ""
+    lin = model.linear
+    section = f"""### Mô hình chi phí theo payload
+
+Fit RTT theo `actual_payload_bytes` trên {model.points} lệnh, {model.sizes} kích thước payload
+({model.size_min}–{model.size_max} B). Huber (robust) + piecewise, CI 95% bootstrap.
+
+| Tham số | Giá trị | CI 95% |
+|---------|---------|--------|
+| Chi phí cố định | {lin.fixed_ms.value:.2f} ms | [{lin.fixed_ms.low:.2f}, {lin.fixed_ms.high:.2f}] |
+| Chi phí mỗi KB (tuyến tính) | {lin.per_byte_ms.value * 1024:.3f} ms | [{lin.per_byte_ms.low * 1024:.3f}, {lin.per_byte_ms.high * 1024:.3f}] |
+"""
+    pw = model.piecewise
+    if pw is not None:
+        verdict = "phát hiện" if pw.detected else "không có ý nghĩa thống kê"
+        section += (
+            f"| Breakpoint ({verdict}) | {pw.breakpoint_bytes.value:.0f} B | "
+            f"[{pw.breakpoint_bytes.low:.0f}, {pw.breakpoint_bytes.high:.0f}] |\n"
+            f"| Mỗi KB trước breakpoint | {pw.slope_before.value * 1024:.3f} ms | "
+            f"[{pw.slope_before.low * 1024:.3f}, {pw.slope_before.high * 1024:.3f}] |\n"
+            f"| Mỗi KB sau breakpoint | {pw.slope_after.value * 1024:.3f} ms | "
+            f"[{pw.slope_after.low * 1024:.3f}, {pw.slope_after.high * 1024:.3f}] |\n"
+        )
+        if pw.detected:
+            section += (f"\n- RTT không còn tuyến tính quanh **{pw.breakpoint_bytes.value:.0f} B** "
+                        f"({pw.slope_before.value * 1024:.3f} → {pw.slope_after.value * 1024:.3f} ms/KB, "
+                        f"loss giảm {pw.gain * 100:.1f}% so với fit tuyến tính)\n")
+    else:
+        section += f"\n- Cần ≥ 4 kích thước payload để tìm breakpoint (hiện có {model.sizes})\n"
+    section += "\n![Payload model](plots/payload_model.png)\n\n"
+    return section
+
+
+def floor_section(floor: Optional[CaseResult], results: List[CaseResult]) -> str:
+    """Report section for the echo calibration (harness floor) and net RTTs."""
+    if floor is None:
+        return ""
+    section = f"""
+### Sàn độ trễ của harness (echo loopback)
+
+Trước các case, benchmark chạy {floor.sent} lệnh (mỗi {floor.case.interval_ms} ms) tới một echo responder
+cục bộ (`echo_floor.py`, topic `city/_calib/...`) ack ngay lập tức. Cùng client, cùng vòng gửi và đường
+xử lý ack như các case thật, nhưng edge không làm gì: RTT này là chi phí của chính harness (2 network
+thread paho, GIL, callback) + 2 lần qua broker trên máy này.
+
+| n | Min (ms) | Mean | P50 | P90 | P95 | P99 | Max |
+|---|----------|------|-----|-----|-----|-----|-----|
+| {floor.received}/{floor.sent} | {floor.min_rtt:.2f} | {floor.mean:.2f} | {floor.p50:.2f} | {floor.p90:.2f} | {floor.p95:.2f} | {floor.p99:.2f} | {floor.max_rtt:.2f} |
+
+"""
+    net = [r for r in results if r.floor_ms is not None and r.mean is not None]
+    if not net:
+        section += "- RTT trong báo cáo chưa trừ sàn (dùng `--subtract-floor` để có RTT net)\n"
+        return section
+    section += f"""RTT net = max(0, RTT − P50 sàn = {floor.p50:.2f} ms), phần độ trễ do broker→edge→broker thêm vào so với
+echo. Trừ một hằng số khỏi percentile chỉ là xấp xỉ (jitter của harness vẫn nằm trong P95/P99).
+
+| Case | Mean net (ms) | P50 net | P95 net | P99 net |
+|------|---------------|---------|---------|---------|
+"""
+    for r in net:
+        section += (f"| {r.case.name} | {r.net(r.mean):.2f} | {r.net(r.p50):.2f} | "
+                    f"{r.net(r.p95):.2f} | {r.net(r.p99):.2f} |\n")
+    return section
+
+
+def generate_report(results: List[CaseResult], output_file: str, plots_dir: str, payload_model=None,
+                    floor: Optional[CaseResult] = None):
     """Generate Markdown report."""
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
@@ -518,6 +835,22 @@ RTT = t_ack_recv - t_cmd_send (milliseconds)
         )
 
     report += """
+### Độ trễ một chiều (cmd → edge, edge → ack)
+
+Với `--clock-pings N`, offset đồng hồ edge được ước lượng kiểu NTP bằng lệnh `PING` trên cmd/ack (một loạt trước và một loạt sau mỗi case, chỉ giữ các mẫu có RTT nhỏ nhất, drift = hồi quy tuyến tính theo thời gian). `edge_recv_ts_ms` được quy về đồng hồ logger trước khi tách độ trễ; sai số offset (±) cũng là sai số của từng chiều. Mặc định không probe (mỗi `PING` chiếm một slot trong cache cmd_id chống trùng lặp của edge): offset là N/A và `edge_recv_ts_ms` (epoch) được dùng trực tiếp.
+
+| Case | Offset edge−local (ms) | ± (ms) | Drift (ppm) | Edge lat mean (ms) | Return lat mean (ms) |
+|------|------------------------|--------|-------------|--------------------|----------------------|
+"""
+
+    for r in results:
+        report += (
+            f"| {r.case.name} | {md_metric(r.clock_offset_ms)} | {md_metric(r.clock_uncertainty_ms)} | "
+            f"{md_metric(r.clock_drift_ppm)} | {md_metric(r.mean_edge_lat)} | {md_metric(r.mean_ret_lat)} |\n"
+        )
+
+    report += floor_section(floor, results)
+    report += """
 ### Quy tắc phát hiện Outlier
 
 ```
@@ -533,6 +866,9 @@ outlier_threshold = min(P95 × 2, Median + 3×Std)
         plot_name = f"histogram_{r.case.name.lower().replace(' ', '_')}.png"
         report += f"### {r.case.name}\n\n"
         report += f"![RTT Histogram - {r.case.name}](plots/{plot_name})\n\n"
+        if r.timeline:
+            timeline_plot = f"timeline_{r.case.name.lower().replace(' ', '_')}.png"
+            report += f"![RTT Timeline - {r.case.name}](plots/{timeline_plot})\n\n"
 
     report += """### So sánh giữa các Case
 
@@ -584,6 +920,25 @@ outlier_threshold = min(P95 × 2, Median + 3×Std)
         for r in no_ack_cases:
             report += f"- {r.case.name}: timeout/no-ack → không đủ dữ liệu RTT (FAIL)\n"
 
+    report += "\n" + payload_model_section(payload_model)
+    report += f"""### Timeline (cửa sổ theo thời gian)
+
+- **STALL**: có lệnh đang chờ nhưng không nhận được ack nào trong cửa sổ
+- **SPIKE**: P99 của cửa sổ > median + {DEFAULT_SPIKE_K:g} × 1.4826·MAD của toàn bộ RTT trong case (và cao hơn median ít nhất {DEFAULT_SPIKE_MIN_MS:g} ms)
+
+"""
+    any_flag = False
+    for r in results:
+        marks = flagged(r.timeline)
+        if not marks:
+            continue
+        any_flag = True
+        t0 = r.timeline[0].t_start_ms
+        spans = ", ".join(f"{w.flag} +{(w.t_start_ms - t0) / 1000:.1f}s" for w in marks[:10])
+        more = f" (+{len(marks) - 10} nữa)" if len(marks) > 10 else ""
+        report += f"- {r.case.name}: {len(marks)} cửa sổ bất thường — {spans}{more}\n"
+    if not any_flag:
+        report += "- Không phát hiện cửa sổ STALL/SPIKE\n"
     report += """
 ### Hạn chế khi dùng Mock ESP32
 
@@ -608,8 +963,13 @@ outlier_threshold = min(P95 × 2, Median + 3×Std)
 
 """
 
+    if floor is not None:
+        report += f"- [{floor.case.name}]({os.path.relpath(floor.csv_file, os.path.dirname(output_file))})\n"
     for r in results:
-        report += f"- [{r.case.name}](raw/{os.path.basename(r.csv_file)})\n"
+        report += f"- [{r.case.name}](raw/{os.path.basename(r.csv_file)})"
+        if r.timeline_file:
+            report += f" — [timeline](raw/{os.path.basename(r.timeline_file)})"
+        report += "\n"
 
     report += """
 ---
@@ -622,10 +982,239 @@ outlier_threshold = min(P95 × 2, Median + 3×Std)
     print(f"📝 Saved: {output_file}")
 
 
+# =============================================================================
+# SATURATION SWEEP
+# =============================================================================
+
+@dataclass
+class SweepThresholds:
+    mean_ms: float = 200.0
+    p95_ms: float = 500.0
+    p99_ms: float = 1000.0
+    loss_pct: float = 1.0
+
+
+@dataclass
+class SweepPoint:
+    rate_hz: float
+    phase: str
+    result: CaseResult
+    ok: bool
+    reason: str
+
+
+def check_sweep_point(r: CaseResult, th: SweepThresholds) -> tuple:
+    """(ok, reason) for one sweep step against the SPEC latency targets."""
+    if r.mean is None or r.p95 is None or r.p99 is None:
+        return False, "no acks"
+    failures = []
+    if r.loss_rate > th.loss_pct:
+        failures.append(f"loss {r.loss_rate:.1f}% > {th.loss_pct}%")
+    if r.mean > th.mean_ms:
+        failures.append(f"mean {r.mean:.0f} > {th.mean_ms:.0f}ms")
+    if r.p95 > th.p95_ms:
+        failures.append(f"P95 {r.p95:.0f} > {th.p95_ms:.0f}ms")
+    if r.p99 > th.p99_ms:
+        failures.append(f"P99 {r.p99:.0f} > {th.p99_ms:.0f}ms")
+    return not failures, "; ".join(failures)
+
+
+def run_saturation_sweep(benchmark: RTTBenchmark, raw_dir: str, pad_bytes: int,
+                         start_hz: float, factor: float, max_hz: float, step_s: float,
+                         min_count: int, bisect_steps: int, th: SweepThresholds) -> List[SweepPoint]:
+    """
+    Step the offered rate up geometrically until a threshold breaks, then bisect
+    between the last passing and first failing rate to locate the knee.
+    """
+    points: List[SweepPoint] = []
+
+    def measure(rate_hz: float, phase: str) -> Optional[SweepPoint]:
+        case = BenchmarkCase(
+            name=f"Sweep {rate_hz:.1f}Hz",
+            pad_bytes=pad_bytes,
+            count=max(min_count, int(rate_hz * step_s)),
+            interval_ms=1000.0 / rate_hz,
+            description=f"Saturation sweep ({phase}) at {rate_hz:.1f} cmd/s"
+        )
+        csv_file = os.path.join(raw_dir, f"sweep_{rate_hz:.1f}hz.csv")
+        result = benchmark.run(case, csv_file)
+        if result is None:
+            return None
+        ok, reason = check_sweep_point(result, th)
+        point = SweepPoint(rate_hz=rate_hz, phase=phase, result=result, ok=ok, reason=reason)
+        points.append(point)
+        verdict = "✅ within targets" if ok else f"❌ {reason}"
+        print(f"🔎 {rate_hz:.1f} cmd/s → P95={fmt_ms(result.p95)}ms "
+              f"P99={fmt_ms(result.p99)}ms loss={result.loss_rate:.1f}% {verdict}")
+        time.sleep(1)
+        return point
+
+    # Geometric ramp
+    good, bad = None, None
+    rate = start_hz
+    while rate <= max_hz:
+        point = measure(rate, "ramp")
+        if point is None:
+            break
+        if point.ok:
+            good = rate
+            rate *= factor
+        else:
+            bad = rate
+            break
+
+    # Bisection between last good and first bad rate
+    if good is not None and bad is not None:
+        lo, hi = good, bad
+        for _ in range(bisect_steps):
+            mid = (lo * hi) ** 0.5
+            point = measure(mid, "bisect")
+            if point is None:
+                break
+            if point.ok:
+                lo = mid
+            else:
+                hi = mid
+    return points
+
+
+def max_sustainable_rate(points: List[SweepPoint]) -> Optional[float]:
+    """Highest offered rate that met every threshold, below the first failing rate."""
+    failing = [p.rate_hz for p in points if not p.ok]
+    knee = min(failing) if failing else float('inf')
+    passing = [p.rate_hz for p in points if p.ok and p.rate_hz < knee]
+    return max(passing) if passing else None
+
+
+def fmt_ms(value: Optional[float]) -> str:
+    return "N/A" if value is None else f"{value:.1f}"
+
+
+def plot_sweep(points: List[SweepPoint], max_rate: Optional[float], th: SweepThresholds,
+               filename: str):
+    """Throughput vs latency curve with loss on a secondary axis."""
+    from analyze_results import load_pyplot
+    plt = load_pyplot()
+    if plt is None:
+        print("⚠️ matplotlib not installed. Skipping sweep plot.")
+        return
+    pts = sorted((p for p in points if p.result.p50 is not None), key=lambda p: p.rate_hz)
+    if not pts:
+        return
+
+    x = [p.result.send_rate_hz or p.rate_hz for p in pts]
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(x, [p.result.p50 for p in pts], 'o-', label='P50', color='#2196F3')
+    ax.plot(x, [p.result.p95 for p in pts], 's-', label='P95', color='#FF9800')
+    ax.plot(x, [p.result.p99 for p in pts], '^-', label='P99', color='#f44336')
+    ax.axhline(th.p95_ms, color='#FF9800', linestyle=':', label=f'P95 target {th.p95_ms:.0f}ms')
+    if max_rate is not None:
+        ax.axvline(max_rate, color='green', linestyle='--', label=f'Max sustainable {max_rate:.1f}/s')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel('Achieved command rate (cmd/s)')
+    ax.set_ylabel('RTT (ms)')
+    ax.set_title('Throughput vs Latency (saturation sweep)')
+    ax.grid(True, alpha=0.3, which='both')
+
+    ax2 = ax.twinx()
+    ax2.bar(x, [p.result.loss_rate for p in pts], width=[v * 0.08 for v in x],
+            alpha=0.25, color='gray', label='Loss %')
+    ax2.set_ylabel('Loss (%)')
+    ax2.set_ylim(0, max(1.0, max(p.result.loss_rate for p in pts) * 1.2))
+    lines, labels = ax.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax.legend(lines + lines2, labels + labels2, loc='upper left')
+
+    plt.savefig(filename, dpi=150, bbox_inches='tight')
+    plt.close()
+    print(f"📊 Saved: {filename}")
+
+
+def generate_sweep_outputs(points: List[SweepPoint], th: SweepThresholds, outdir: str,
+                           plots_dir: str) -> Optional[float]:
+    """Write sweep.csv, the curve plot and sweep.md. Returns the max sustainable rate."""
+    max_rate = max_sustainable_rate(points)
+    ordered = sorted(points, key=lambda p: p.rate_hz)
+
+    csv_file = os.path.join(outdir, "sweep.csv")
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['offered_hz', 'achieved_hz', 'phase', 'pad_bytes', 'count', 'sent', 'received',
+                         'loss_rate', 'mean', 'p50', 'p95', 'p99', 'max', 'ok', 'reason'])
+        for p in ordered:
+            r = p.result
+            writer.writerow([
+                f"{p.rate_hz:.2f}", "NA" if r.send_rate_hz is None else f"{r.send_rate_hz:.2f}",
+                p.phase, r.case.pad_bytes, r.case.count, r.sent, r.received, f"{r.loss_rate:.2f}",
+                fmt_ms(r.mean), fmt_ms(r.p50), fmt_ms(r.p95), fmt_ms(r.p99),
+                fmt_ms(r.max_rtt), int(p.ok), p.reason
+            ])
+    print(f"💾 Saved: {csv_file}")
+
+    plot_sweep(points, max_rate, th, os.path.join(plots_dir, "sweep_curve.png"))
+
+    md_file = os.path.join(outdir, "sweep.md")
+    lines = [
+        "# 📈 Saturation Sweep — Max Sustainable Command Rate",
+        "",
+        f"> **Ngày tạo:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "",
+        f"Targets: Mean ≤ {th.mean_ms:.0f}ms, P95 ≤ {th.p95_ms:.0f}ms, "
+        f"P99 ≤ {th.p99_ms:.0f}ms, Loss ≤ {th.loss_pct}%",
+        "",
+        f"**Max sustainable rate:** {'N/A' if max_rate is None else f'{max_rate:.1f} cmd/s'}",
+        "",
+        "| Offered (cmd/s) | Achieved | Phase | Sent | Recv | Loss% | P50 | P95 | P99 | Max | Status |",
+        "|-----------------|----------|-------|------|------|-------|-----|-----|-----|-----|--------|",
+    ]
+    for p in ordered:
+        r = p.result
+        lines.append(
+            f"| {p.rate_hz:.1f} | {fmt_ms(r.send_rate_hz)} | {p.phase} | {r.sent} | {r.received} | "
+            f"{r.loss_rate:.1f}% | {fmt_ms(r.p50)} | {fmt_ms(r.p95)} | {fmt_ms(r.p99)} | "
+            f"{fmt_ms(r.max_rtt)} | {'✅' if p.ok else '❌ ' + p.reason} |")
+    lines += ["", "![Throughput vs Latency](plots/sweep_curve.png)", ""]
+    with open(md_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+    print(f"📝 Saved: {md_file}")
+    return max_rate
+
+
 # =============================================================================
 # MAIN
 # =============================================================================
 
+def run_sweep_mode(args, outdir: str, raw_dir: str, plots_dir: str):
+    """--sweep: ramp the command rate and report the max sustainable rate."""
+    th = SweepThresholds(mean_ms=args.sweep_mean, p95_ms=args.sweep_p95, p99_ms=args.sweep_p99,
+                         loss_pct=args.sweep_loss)
+    benchmark = RTTBenchmark(args.host, args.port, args.user, args.password,
+                             raw_format=args.raw_format, clock_pings=args.clock_pings,
+                             window_ms=args.window_ms)
+    points = run_saturation_sweep(
+        benchmark, raw_dir, args.sweep_pad, args.sweep_start, args.sweep_factor,
+        args.sweep_max, args.sweep_step_s, args.sweep_min_count, args.sweep_bisect, th)
+    if not points:
+        print("❌ Sweep produced no data. Check broker/edge connectivity.")
+        sys.exit(1)
+    
+    print("\n" + "=" * 70)
+    print("📊 GENERATING SWEEP REPORT")
+    print("=" * 70)
+    generate_run_metadata(args, os.path.join(outdir, "meta.json"))
+    max_rate = generate_sweep_outputs(points, th, outdir, plots_dir)
+    
+    print("\n" + "=" * 70)
+    print("✅ SWEEP COMPLETE")
+    print("=" * 70)
+    print(f"  Steps:            {len(points)}")
+    print(f"  Max sustainable:  {'N/A' if max_rate is None else f'{max_rate:.1f} cmd/s'}")
+    print(f"  Curve:            {outdir}/sweep.csv, {plots_dir}/sweep_curve.png")
+    print(f"  Report:           {outdir}/sweep.md")
+    print("=" * 70 + "\n")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='RTT Benchmark Report Generator',
@@ -634,6 +1223,9 @@ def main():
 Examples:
   python run_benchmark_report.py --host 127.0.0.1
   python run_benchmark_report.py --host 192.168.1.100 --cases "0,256,1024" --count 500
+  python run_benchmark_report.py --host 127.0.0.1 --raw-format npy
+  python run_benchmark_report.py --host 127.0.0.1 --subtract-floor
+  python run_benchmark_report.py --host 127.0.0.1 --sweep --sweep-pad 256
         """
     )
     
@@ -641,14 +1233,54 @@ Examples:
     parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
     parser.add_argument('--user', default='demo', help='MQTT username')
     parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) and mock_esp32 instead of using --host')
     parser.add_argument('--count', type=int, default=500, help='Commands per case')
     parser.add_argument('--interval_ms', type=int, default=200, help='Interval between commands (ms)')
     parser.add_argument('--cases', default='0,256,512,900', help='Comma-separated pad_bytes values (latency cases)')
     parser.add_argument('--oversize', type=int, default=1200, help='Oversize pad_bytes for edge-case (<=0 to skip)')
     parser.add_argument('--outdir', default=None, help='Output directory')
+    parser.add_argument('--raw-format', choices=['csv', 'npy', 'both'], default='csv',
+                        help='Raw per-command output format (npy = typed columnar)')
+    parser.add_argument('--window_ms', type=int, default=DEFAULT_WINDOW_MS,
+                        help='Timeline window size (ms)')
+    parser.add_argument('--clock-pings', type=int, default=0,
+                        help='PING probes before/after each case for the edge clock offset (default 0 = trust '
+                             'the edge clock; probes evict benchmark cmd_ids from the edge idempotency cache, '
+                             'see clock_sync.py)')
+    parser.add_argument('--calibrate', type=int, default=100,
+                        help='Echo commands for the harness floor before the cases (0 = skip)')
+    parser.add_argument('--calibrate-interval-ms', type=int, default=50,
+                        help='Interval between calibration echoes (ms)')
+    parser.add_argument('--subtract-floor', action='store_true',
+                        help='Also report RTTs minus the floor P50 (net_* columns, report table)')
+    
+    # Saturation sweep
+    parser.add_argument('--sweep', action='store_true',
+                        help='Find the max sustainable command rate instead of running --cases')
+    parser.add_argument('--sweep-pad', type=int, default=0, help='Sweep payload pad_bytes')
+    parser.add_argument('--sweep-start', type=float, default=5.0, help='Initial rate (cmd/s)')
+    parser.add_argument('--sweep-factor', type=float, default=2.0, help='Geometric ramp factor')
+    parser.add_argument('--sweep-max', type=float, default=2000.0, help='Highest rate to try (cmd/s)')
+    parser.add_argument('--sweep-step-s', type=float, default=10.0, help='Duration of each step (s)')
+    parser.add_argument('--sweep-min-count', type=int, default=50, help='Minimum commands per step')
+    parser.add_argument('--sweep-bisect', type=int, default=4, help='Bisection steps after the knee')
+    parser.add_argument('--sweep-mean', type=float, default=SweepThresholds.mean_ms,
+                        help='Mean RTT target for the sweep (ms)')
+    parser.add_argument('--sweep-p95', type=float, default=SweepThresholds.p95_ms,
+                        help='P95 target for the sweep (ms)')
+    parser.add_argument('--sweep-p99', type=float, default=SweepThresholds.p99_ms,
+                        help='P99 target for the sweep (ms)')
+    parser.add_argument('--sweep-loss', type=float, default=SweepThresholds.loss_pct,
+                        help='Max loss for the sweep (%%)')
     
     args = parser.parse_args()
+    if args.sweep and args.sweep_factor <= 1:
+        parser.error("--sweep-factor must be > 1 (the rate would never ramp up)")
     configure_console_output()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        start_embedded_broker(args, with_mock=True)
     
     # Parse cases
     try:
@@ -678,6 +1310,10 @@ Examples:
     print(f"  Output: {outdir}")
     print("=" * 70)
     
+    if args.sweep:
+        run_sweep_mode(args, outdir, raw_dir, plots_dir)
+        return
+    
     # Define cases
     cases = []
     for i, pad in enumerate(pad_bytes_list):
@@ -702,14 +1338,23 @@ Examples:
             expected_reject=True
         ))
     
+    # Harness floor first (echo loopback), then the real cases
+    floor = run_calibration(args, outdir) if args.calibrate > 0 else None
+    if args.subtract_floor and floor is None:
+        print("⚠️ --subtract-floor without a calibration: net RTTs are not reported")
+    
     # Run benchmarks
-    benchmark = RTTBenchmark(args.host, args.port, args.user, args.password)
+    benchmark = RTTBenchmark(args.host, args.port, args.user, args.password,
+                             raw_format=args.raw_format, clock_pings=args.clock_pings,
+                             window_ms=args.window_ms)
     results = []
     
     for case in cases:
         csv_file = os.path.join(raw_dir, f"case_{case.pad_bytes}b.csv")
         result = benchmark.run(case, csv_file)
         if result:
+            if args.subtract_floor and floor is not None:
+                result.floor_ms = floor.p50
             results.append(result)
         else:
             print(f"⚠️ Case {case.name} failed, skipping...")
@@ -727,15 +1372,20 @@ Examples:
     print("=" * 70)
     
     generate_summary_csv(results, os.path.join(outdir, "summary.csv"))
+    generate_run_metadata(args, os.path.join(outdir, "meta.json"), floor)
     generate_plots(results, plots_dir)
-    generate_report(results, os.path.join(outdir, "report.md"), plots_dir)
+    payload_model = build_payload_model(results, outdir, plots_dir)
+    generate_report(results, os.path.join(outdir, "report.md"), plots_dir, payload_model, floor)
     
     # Print summary
     print("\n" + "=" * 70)
     print("✅ BENCHMARK COMPLETE")
     print("=" * 70)
     print(f"  Output directory: {outdir}")
-    print(f"  Raw CSV files:    {len(results)}")
+    print(f"  Raw files:        {len(results)} ({args.raw_format})")
+    if floor is not None:
+        print(f"  Harness floor:    P50 {floor.p50:.2f} ms, P99 {floor.p99:.2f} ms"
+              f"{' (subtracted)' if args.subtract_floor else ''}")
     print(f"  Summary:          {outdir}/summary.csv")
     print(f"  Report:           {outdir}/report.md")
     print(f"  Plots:            {plots_dir}/")
@@ -6,19 +6,49 @@ Runs all experiment cases and generates summary report.
 Usage:
     python run_experiments.py --host 192.168.1.100
     python run_experiments.py --host 192.168.1.100 --output-dir ../results/run_001
+    python run_experiments.py --host 192.168.1.100 --format npy
+    python run_experiments.py --host 192.168.1.100 --isolated
+    python run_experiments.py --host 127.0.0.1 --matrix experiment_matrix.json --output-dir ../results/overnight
+
+Cases run in-process on one shared broker connection (logger.run); --isolated
+runs each case as a separate logger.py process instead.
+
+With --matrix, the cases are the cartesian product of the axes in a JSON file
+(pad_bytes x rate x qos x count x delay_profile). Each cell is stored under a
+hash of its parameters (cases/<hash>/) and gets a done.json marker when it
+completes; rerunning the same matrix into the same output dir skips finished
+cells, so an interrupted sweep resumes where it stopped. A cell whose run or
+analysis fails gets failed.json instead and is retried on the next run.
+
+A rate becomes a whole-ms interval (rate 300/s -> 3 ms -> 333/s); the achieved
+send rate of every cell is recorded as send_rate_hz.
+
+Per-file analysis results (stats + histogram) are cached next to the results
+(.analysis_cache.json, see analysis_cache.py); --skip-run and re-analysis only
+recompute files that changed. --no-cache forces a full re-analysis.
 """
 
 import argparse
 import csv
+import hashlib
+import itertools
+import json
 import os
 import subprocess
 import sys
-from dataclasses import dataclass
+import time
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
+
+import logger
+from analysis_cache import AnalysisCache
 
-import pandas as pd
+LOGGER_SCRIPT = Path(__file__).resolve().parent / "logger.py"
+
+# Bump when analyze_case() changes what it computes (invalidates cached results)
+ANALYSIS_VERSION = "2"
 
 
 @dataclass
@@ -29,6 +59,11 @@ class ExperimentCase:
     interval_ms: int
     mode: str = "AUTO"
     description: str = ""
+    qos: int = 1
+    delay_profile: Optional[str] = None  # matrix only; None = no mock (real device)
+    ack_delay_ms: int = 0
+    ack_jitter_ms: int = 0
+    city: str = "demo"                   # topic location, not part of the cell hash
 
 
 # Define experiment cases
@@ -57,51 +92,253 @@ EXPERIMENT_CASES = [
 ]
 
 
-def run_case(case: ExperimentCase, host: str, port: int, user: str, password: str,
-             output_dir: Path) -> Optional[Path]:
-    """Run a single experiment case."""
-    output_file = output_dir / f"results_{case.name}.csv"
-    
-    print(f"\n{'='*60}")
-    print(f"📊 Running {case.name}: {case.description}")
-    print(f"   pad_bytes={case.pad_bytes}, count={case.count}, interval={case.interval_ms}ms")
-    print(f"   Output: {output_file}")
-    print(f"{'='*60}")
+# =============================================================================
+# EXPERIMENT MATRIX
+# =============================================================================
+
+MATRIX_AXES = ["pad_bytes", "rate", "qos", "count", "delay_profile"]
+MATRIX_DEFAULTS = {"pad_bytes": [0], "rate": [5], "qos": [1], "count": [500], "delay_profile": ["device"]}
+DONE_MARKER = "done.json"
+FAILED_MARKER = "failed.json"
+
+# Mock ack delay profiles (ms). "device" = no mock, measure whatever answers on
+# the intersection (real ESP32 or an externally started mock_esp32.py). The mock
+# holds delayed acks in a delay queue, so at any rate each ack is late by its
+# own delay only (delays of back-to-back commands overlap).
+DELAY_PROFILES: Dict[str, Optional[dict]] = {
+    "device": None,
+    "none": {"ack_delay_ms": 0, "ack_jitter_ms": 0},
+    "lan": {"ack_delay_ms": 5, "ack_jitter_ms": 2},
+    "wifi": {"ack_delay_ms": 30, "ack_jitter_ms": 20},
+    "cellular": {"ack_delay_ms": 120, "ack_jitter_ms": 80},
+}
+
+
+def case_params(case: ExperimentCase) -> dict:
+    """Parameters that define a matrix cell (and its hash)."""
+    return {
+        "pad_bytes": case.pad_bytes,
+        "interval_ms": case.interval_ms,
+        "qos": case.qos,
+        "count": case.count,
+        "mode": case.mode,
+        "mock": case.delay_profile != "device",
+        "ack_delay_ms": case.ack_delay_ms,
+        "ack_jitter_ms": case.ack_jitter_ms,
+    }
+
+
+def case_hash(case: ExperimentCase) -> str:
+    blob = json.dumps(case_params(case), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:12]
+
+
+def load_matrix(path: str) -> List[ExperimentCase]:
+    """Expand a matrix file into cases (named by parameter hash)."""
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+
+    unknown = set(spec) - set(MATRIX_AXES) - {"mode", "delay_profiles", "description", "city"}
+    if unknown:
+        raise ValueError(f"unknown matrix keys: {', '.join(sorted(unknown))}")
+    profiles = dict(DELAY_PROFILES)
+    profiles.update(spec.get("delay_profiles", {}))
+
+    axes = []
+    for axis in MATRIX_AXES:
+        values = spec.get(axis, MATRIX_DEFAULTS[axis])
+        axes.append(values if isinstance(values, list) else [values])
+
+    cases = []
+    for pad, rate, qos, count, profile in itertools.product(*axes):
+        if profile not in profiles:
+            raise ValueError(f"unknown delay_profile '{profile}' (known: {', '.join(profiles)})")
+        if qos not in (0, 1, 2) or rate <= 0 or count <= 0 or pad < 0:
+            raise ValueError(f"invalid cell: pad_bytes={pad} rate={rate} qos={qos} count={count}")
+        delay = profiles[profile] or {}
+        case = ExperimentCase(
+            name="",
+            pad_bytes=int(pad),
+            count=int(count),
+            interval_ms=max(1, round(1000 / rate)),
+            mode=spec.get("mode", "AUTO"),
+            description=f"pad={pad}B rate={rate}/s qos={qos} n={count} {profile}",
+            qos=int(qos),
+            delay_profile=profile,
+            ack_delay_ms=int(delay.get("ack_delay_ms", 0)),
+            ack_jitter_ms=int(delay.get("ack_jitter_ms", 0)),
+            city=spec.get("city", "demo"),
+        )
+        case.name = case_hash(case)
+        cases.append(case)
+
+    # Two profiles with identical delays are the same cell
+    unique = {c.name: c for c in cases}
+    return list(unique.values())
+
+
+def case_dir(output_dir: Path, case: ExperimentCase) -> Path:
+    return output_dir / "cases" / case.name
+
+
+def is_done(output_dir: Path, case: ExperimentCase) -> bool:
+    return (case_dir(output_dir, case) / DONE_MARKER).exists()
+
+
+def is_failed(output_dir: Path, case: ExperimentCase) -> bool:
+    return (case_dir(output_dir, case) / FAILED_MARKER).exists()
+
+
+def _write_marker(output_dir: Path, case: ExperimentCase, name: str, extra: dict):
+    """Write a marker atomically (a crash mid-write leaves the cell pending)."""
+    marker = case_dir(output_dir, case) / name
+    tmp = marker.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "case": asdict(case),
+            "params": case_params(case),
+            **extra,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+        }, f, indent=2, default=lambda v: v.item() if hasattr(v, "item") else str(v))  # numpy scalars
+    os.replace(tmp, marker)
+
+
+def mark_done(output_dir: Path, case: ExperimentCase, stats: dict):
+    _write_marker(output_dir, case, DONE_MARKER, {"stats": stats})
+    (case_dir(output_dir, case) / FAILED_MARKER).unlink(missing_ok=True)
+
+
+def mark_failed(output_dir: Path, case: ExperimentCase, reason: str):
+    """Record a failed attempt; the cell stays pending and is retried on resume."""
+    _write_marker(output_dir, case, FAILED_MARKER, {"reason": reason})
+
+
+def start_mock(case: ExperimentCase, host: str, port: int, user: str, password: str,
+               intersection: str):
+    """In-process mock_esp32 with the cell's delay profile and QoS (None for 'device')."""
+    if case.delay_profile == "device":
+        return None
+    from mock_esp32 import MockESP32
     
-    # Build command
-    cmd = [
-        sys.executable, "logger.py",
+    mock = MockESP32(host, port, user, password, case.city, intersection,
+                     ack_delay_ms=case.ack_delay_ms, ack_jitter_ms=case.ack_jitter_ms,
+                     cmd_qos=case.qos, ack_qos=case.qos, verbose=False)
+    if not mock.start():
+        raise OSError("mock connection timeout")
+    return mock
+
+
+def result_file(output_dir: Path, case: ExperimentCase, fmt: str = "csv") -> Path:
+    """Raw results path for a case (.npy is preferred when requested)."""
+    csv_file = output_dir / f"results_{case.name}.csv"
+    return csv_file.with_suffix(".npy") if fmt in ("npy", "both") else csv_file
+
+
+def logger_argv(case: ExperimentCase, host: str, port: int, user: str, password: str,
+                output_dir: Path, fmt: str = "csv", intersection: str = "001") -> List[str]:
+    """logger.py arguments for a case (shared by the in-process and isolated runs)."""
+    return [
         "--host", host,
+        "--city", case.city,
+        "--intersection", intersection,
         "--port", str(port),
         "--user", user,
         "--password", password,
         "--count", str(case.count),
         "--interval_ms", str(case.interval_ms),
+        "--qos", str(case.qos),
         "--mode", case.mode,
         "--pad_bytes", str(case.pad_bytes),
-        "--out", str(output_file)
+        "--out", str(output_dir / f"results_{case.name}.csv"),
+        "--format", fmt
     ]
+
+
+def run_case(case: ExperimentCase, host: str, port: int, user: str, password: str,
+             output_dir: Path, fmt: str = "csv", client=None, isolated: bool = False,
+             intersection: str = "001") -> Optional[Path]:
+    """
+    Run a single experiment case.
+    In-process by default, on `client` (a logger.connect() connection) if given;
+    isolated=True runs logger.py in a separate interpreter.
+    """
+    output_file = result_file(output_dir, case, fmt)
+    argv = logger_argv(case, host, port, user, password, output_dir, fmt, intersection)
     
-    try:
-        result = subprocess.run(cmd, capture_output=False, text=True)
-        if result.returncode == 0:
-            print(f"✅ {case.name} completed successfully")
-            return output_file
-        else:
-            print(f"❌ {case.name} failed with code {result.returncode}")
+    print(f"\n{'='*60}")
+    print(f"📊 Running {case.name}: {case.description}")
+    print(f"   pad_bytes={case.pad_bytes}, count={case.count}, interval={case.interval_ms}ms, qos={case.qos}")
+    print(f"   Output: {output_file}")
+    print(f"{'='*60}")
+    
+    if isolated:
+        try:
+            result = subprocess.run([sys.executable, str(LOGGER_SCRIPT)] + argv,
+                                    capture_output=False, text=True)
+            if result.returncode == 0:
+                print(f"✅ {case.name} completed successfully")
+                return output_file
+            else:
+                print(f"❌ {case.name} failed with code {result.returncode}")
+                return None
+        except Exception as e:
+            print(f"❌ {case.name} error: {e}")
             return None
+    
+    try:
+        stats = logger.run(logger.parse_args(argv), client)
     except Exception as e:
         print(f"❌ {case.name} error: {e}")
         return None
+    if stats is None:
+        print(f"❌ {case.name} failed (no connection)")
+        return None
+    print(f"✅ {case.name} completed successfully")
+    return output_file
+
 
+def histogram_file(csv_file: Path) -> Path:
+    return csv_file.parent / "histograms" / f"{csv_file.stem}_histogram.png"
 
-def analyze_case(csv_file: Path, histogram: bool = True) -> Optional[dict]:
-    """Analyze a single case result."""
+
+def analyze_case(csv_file: Path, histogram: bool = True,
+                 cache: Optional[AnalysisCache] = None) -> Optional[dict]:
+    """Analyze a single case result (served from cache if the file is unchanged)."""
     if not csv_file.exists():
         return None
     
+    # A deleted histogram is regenerated, which needs the data: skip the cache
+    needs_plot = histogram and not histogram_file(csv_file).exists()
+    cached = None
+    if cache is not None:
+        if needs_plot:
+            cache.misses += 1
+        else:
+            cached = cache.get(csv_file)
+    if cached is not None:
+        stats = dict(cached)
+        stats.pop('histogram', None)
+        if histogram and 'histogram' in cached:
+            stats['histogram'] = str(histogram_file(csv_file))
+        return stats
+    
+    stats = _analyze_case(csv_file, histogram)
+    if stats is not None and cache is not None:
+        cache.put(csv_file, stats)
+    return stats
+
+
+def send_rate_hz(df) -> Optional[float]:
+    """Achieved send rate (commands/s over the send window), as in RTTBenchmark._analyze."""
+    span_s = (df['t_send_ms'].max() - df['t_send_ms'].min()) / 1000.0 if len(df) > 1 else 0.0
+    return float((len(df) - 1) / span_s) if span_s > 0 else None
+
+
+def _analyze_case(csv_file: Path, histogram: bool) -> Optional[dict]:
+    from raw_columnar import read_results  # numpy/pandas only for analysis
+    
     try:
-        df = pd.read_csv(csv_file)
+        df = read_results(str(csv_file))
         rtts = df['rtt_ms'].dropna()
         
         if len(rtts) == 0:
@@ -119,7 +356,8 @@ def analyze_case(csv_file: Path, histogram: bool = True) -> Optional[dict]:
                 'p95': None,
                 'p99': None,
                 'status': 'FAIL',
-                'reason': 'Timeout/no-ack'
+                'reason': 'Timeout/no-ack',
+                'send_rate_hz': send_rate_hz(df)
             }
         
         stats = {
@@ -136,7 +374,8 @@ def analyze_case(csv_file: Path, histogram: bool = True) -> Optional[dict]:
             'p95': rtts.quantile(0.95),
             'p99': rtts.quantile(0.99),
             'status': 'PASS' if ((len(df) - len(rtts)) / len(df) * 100) < 1 else 'FAIL',
-            'reason': '' if ((len(df) - len(rtts)) / len(df) * 100) < 1 else 'Loss >= 1%'
+            'reason': '' if ((len(df) - len(rtts)) / len(df) * 100) < 1 else 'Loss >= 1%',
+            'send_rate_hz': send_rate_hz(df)
         }
         
         # Generate histogram
@@ -144,9 +383,8 @@ def analyze_case(csv_file: Path, histogram: bool = True) -> Optional[dict]:
             try:
                 import matplotlib.pyplot as plt
                 
-                hist_dir = csv_file.parent / "histograms"
-                hist_dir.mkdir(exist_ok=True)
-                hist_file = hist_dir / f"{csv_file.stem}_histogram.png"
+                hist_file = histogram_file(csv_file)
+                hist_file.parent.mkdir(exist_ok=True)
                 
                 fig, ax = plt.subplots(figsize=(10, 5))
                 ax.hist(rtts, bins=50, edgecolor='black', alpha=0.7, color='steelblue')
@@ -181,6 +419,8 @@ def generate_summary(results: List[dict], output_dir: Path):
         print("❌ No results to summarize")
         return
     
+    import pandas as pd
+    
     # CSV Summary
     csv_file = output_dir / "summary.csv"
     df = pd.DataFrame(results)
@@ -237,13 +477,87 @@ def generate_summary(results: List[dict], output_dir: Path):
             f.write("## Histograms\n\n")
             for r in results:
                 if 'histogram' in r:
-                    hist_path = Path(r['histogram']).name
+                    hist_path = Path(os.path.relpath(r['histogram'], output_dir)).as_posix()
                     f.write(f"### {r['file']}\n\n")
-                    f.write(f"![{r['file']}](histograms/{hist_path})\n\n")
+                    f.write(f"![{r['file']}]({hist_path})\n\n")
     
     print(f"📝 Summary MD: {md_file}")
 
 
+def run_matrix(cases: List[ExperimentCase], args, output_dir: Path) -> List[dict]:
+    """
+    Run the pending cells of a matrix (finished ones are skipped) and return
+    the summary rows of every finished cell, in matrix order.
+    """
+    pending = [c for c in cases if not is_done(output_dir, c)]
+    print(f"\n🧮 Matrix: {len(cases)} cells, {len(cases) - len(pending)} done, {len(pending)} to run")
+    
+    if pending and not args.skip_run:
+        client = None
+        if not args.isolated:
+            client = logger.connect(logger.parse_args(
+                logger_argv(pending[0], args.host, args.port, args.user, args.password,
+                            output_dir, args.format, args.intersection)))
+            if client is None:
+                sys.exit(1)
+        try:
+            for i, case in enumerate(pending, 1):
+                cell_dir = case_dir(output_dir, case)
+                cell_dir.mkdir(parents=True, exist_ok=True)
+                print(f"\n▶️  Cell {i}/{len(pending)} [{case.name}] {case.description}")
+                try:
+                    mock = start_mock(case, args.host, args.port, args.user, args.password,
+                                      args.intersection)
+                except OSError as e:
+                    print(f"❌ {case.name}: {e}")
+                    mark_failed(output_dir, case, f"mock: {e}")
+                    continue
+                try:
+                    result = run_case(case, args.host, args.port, args.user, args.password,
+                                      cell_dir, args.format, client=client, isolated=args.isolated,
+                                      intersection=args.intersection)
+                finally:
+                    if mock is not None:
+                        mock.stop()
+                stats = analyze_case(result, histogram=not args.no_histogram) if result else None
+                if stats:
+                    mark_done(output_dir, case, stats)
+                else:
+                    reason = "analysis failed" if result else "run failed"
+                    print(f"❌ {case.name}: {reason}, cell left pending (rerun to retry)")
+                    mark_failed(output_dir, case, reason)
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\n⚠️ Interrupted - finished cells are kept, rerun the same command to resume")
+        finally:
+            if client is not None:
+                logger.disconnect(client)
+    
+    rows = []
+    for case in cases:
+        if not is_done(output_dir, case):
+            continue
+        with open(case_dir(output_dir, case) / DONE_MARKER, encoding="utf-8") as f:
+            stats = json.load(f).get("stats")
+        if not stats:
+            continue
+        stats.update({
+            "file": case.description,
+            "case_id": case.name,
+            "pad_bytes": case.pad_bytes,
+            "interval_ms": case.interval_ms,
+            "scheduled_rate_hz": round(1000 / case.interval_ms, 3),
+            "qos": case.qos,
+            "count": case.count,
+            "delay_profile": case.delay_profile,
+        })
+        rows.append(stats)
+    missing = len(cases) - len(rows)
+    if missing:
+        print(f"⚠️ {missing} cell(s) not finished yet")
+    return rows
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Run all RTT experiment cases',
@@ -253,6 +567,8 @@ Examples:
   python run_experiments.py --host 192.168.1.100
   python run_experiments.py --host localhost --output-dir ../results/run_001
   python run_experiments.py --host 192.168.1.100 --skip-run  # Analyze existing results
+  python run_experiments.py --host 127.0.0.1 --matrix experiment_matrix.json --output-dir ../results/overnight
+  python run_experiments.py --host 127.0.0.1 --matrix experiment_matrix.json --list
         """
     )
     
@@ -263,6 +579,19 @@ Examples:
     parser.add_argument('--output-dir', default='../results', help='Output directory')
     parser.add_argument('--skip-run', action='store_true', help='Skip running, analyze existing')
     parser.add_argument('--no-histogram', action='store_true', help='Skip histogram generation')
+    parser.add_argument('--format', choices=['csv', 'npy', 'both'], default='csv',
+                        help='Raw output format passed to logger.py (npy/both analyze the .npy)')
+    parser.add_argument('--isolated', action='store_true',
+                        help='Run each case as a separate logger.py process (no shared connection)')
+    parser.add_argument('--matrix', default=None,
+                        help='JSON matrix file (pad_bytes x rate x qos x count x delay_profile); resumable')
+    parser.add_argument('--city', default=None,
+                        help='City ID for the cases and mocks (default: matrix "city", else demo)')
+    parser.add_argument('--intersection', default=None,
+                        help='Intersection ID for the cases (default: 001, matrix: "matrix")')
+    parser.add_argument('--list', action='store_true', help='With --matrix: list cells and their status, then exit')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore the analysis cache and re-analyze every file')
     
     args = parser.parse_args()
     
@@ -270,42 +599,91 @@ Examples:
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
     
+    cases = EXPERIMENT_CASES
+    if args.matrix:
+        try:
+            cases = load_matrix(args.matrix)
+        except (OSError, ValueError) as e:
+            print(f"❌ Invalid matrix {args.matrix}: {e}")
+            sys.exit(1)
+        # A dedicated intersection keeps mock cells away from a real device on 001
+        args.intersection = args.intersection or "matrix"
+        if args.list:
+            for case in cases:
+                status = ("✅ done" if is_done(output_dir, case)
+                          else "❌ failed" if is_failed(output_dir, case) else "⏳ pending")
+                print(f"  {case.name}  {status:<10} {case.description}")
+            return
+    args.intersection = args.intersection or "001"
+    if args.city:
+        for case in cases:
+            case.city = args.city
+    
     print("=" * 60)
     print("🔬 EXPERIMENT RUNNER")
     print("=" * 60)
     print(f"  Host: {args.host}:{args.port}")
     print(f"  User: {args.user}")
     print(f"  Output: {output_dir.absolute()}")
-    print(f"  Cases: {len(EXPERIMENT_CASES)}")
+    print(f"  Cases: {len(cases)}" + (f" (matrix {args.matrix})" if args.matrix else ""))
+    print(f"  Runner: {'isolated processes' if args.isolated else 'in-process, shared connection'}")
     print("=" * 60)
     
+    if args.matrix:
+        results = run_matrix(cases, args, output_dir)
+        generate_summary(results, output_dir)
+        print("\n" + "=" * 60)
+        print("🎉 MATRIX COMPLETE" if len(results) == len(cases) else "⏸️ MATRIX PARTIAL")
+        print("=" * 60)
+        print(f"  Results: {output_dir.absolute()}")
+        print(f"  Cells done: {len(results)}/{len(cases)}")
+        print(f"  Summary: summary.csv, summary.md")
+        print("=" * 60 + "\n")
+        return
+    
     # Run experiments
     csv_files = []
     
     if not args.skip_run:
-        for case in EXPERIMENT_CASES:
-            result = run_case(case, args.host, args.port, args.user, args.password, output_dir)
-            if result:
-                csv_files.append(result)
-            
-            # Small delay between cases
-            import time
-            time.sleep(2)
+        client = None
+        if not args.isolated:
+            client = logger.connect(logger.parse_args(
+                logger_argv(EXPERIMENT_CASES[0], args.host, args.port, args.user, args.password,
+                            output_dir, args.format, args.intersection)))
+            if client is None:
+                sys.exit(1)
+        try:
+            for case in EXPERIMENT_CASES:
+                result = run_case(case, args.host, args.port, args.user, args.password,
+                                  output_dir, args.format, client=client, isolated=args.isolated,
+                                  intersection=args.intersection)
+                if result:
+                    csv_files.append(result)
+                
+                # Small delay between cases
+                time.sleep(2)
+        finally:
+            if client is not None:
+                logger.disconnect(client)
     else:
         # Find existing CSV files
         print("\n⏭️ Skipping run, analyzing existing results...")
         for case in EXPERIMENT_CASES:
-            csv_file = output_dir / f"results_{case.name}.csv"
+            csv_file = result_file(output_dir, case, args.format)
             if csv_file.exists():
                 csv_files.append(csv_file)
     
     # Analyze results
     print(f"\n📊 Analyzing {len(csv_files)} result files...")
+    cache = None if args.no_cache else AnalysisCache(output_dir, ANALYSIS_VERSION)
     results = []
     for csv_file in csv_files:
-        stats = analyze_case(csv_file, histogram=not args.no_histogram)
+        stats = analyze_case(csv_file, histogram=not args.no_histogram, cache=cache)
         if stats:
             results.append(stats)
+    if cache is not None:
+        cache.save()
+        print(f"🗃️ Analysis cache: {cache.describe()}")
     
     # Generate summary
     generate_summary(results, output_dir)
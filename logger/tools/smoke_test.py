@@ -3,9 +3,17 @@
 Smoke Test - Traffic Light MQTT Demo
 Verifies end-to-end system connectivity and command processing.
 
+Fleet mode (--fleet) discovers intersections from their retained status
+messages and runs the same command sequence against many of them at once
+(--concurrency caps how many are in progress), so the wall time is set by the
+slowest devices rather than the sum over the fleet. Offline devices are
+listed but not tested.
+
 Usage:
     python smoke_test.py --host 192.168.1.100
     python smoke_test.py --host localhost --timeout 10
+    python smoke_test.py --host 192.168.1.100 --fleet --concurrency 100 --csv fleet.csv
+    python smoke_test.py --embedded-broker --fleet --embedded-devices 10
     
 Exit codes:
     0 = All tests passed
@@ -14,15 +22,20 @@ Exit codes:
 """
 
 import argparse
+import csv
 import json
 import sys
+import threading
 import time
 import uuid
-from dataclasses import dataclass
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 import paho.mqtt.client as mqtt
 
+from command_client import CommandClient, CommandTimeout
+
 
 @dataclass
 class TestResult:
@@ -48,9 +61,7 @@ class SmokeTest:
         
         # State
         self.connected = False
-        self.received_ack = None
         self.received_status = None
-        self.waiting_for_cmd_id = None
         
         # Results
         self.results: list[TestResult] = []
@@ -64,6 +75,7 @@ class SmokeTest:
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        self.commands = CommandClient(self.client, self.topic_cmd, qos=1, timeout=timeout)
     
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
@@ -74,12 +86,12 @@ class SmokeTest:
             self.connected = False
     
     def _on_message(self, client, userdata, msg):
+        t_recv = time.time() * 1000
         try:
             payload = json.loads(msg.payload.decode())
             
             if msg.topic == self.topic_ack:
-                if payload.get("cmd_id") == self.waiting_for_cmd_id:
-                    self.received_ack = payload
+                self.commands.on_ack(payload, t_recv)
             elif msg.topic == self.topic_status:
                 self.received_status = payload
                 
@@ -91,30 +103,18 @@ class SmokeTest:
     
     def _send_command(self, cmd_type: str, **kwargs) -> tuple[bool, Optional[dict], float]:
         """Send command and wait for ack. Returns (success, ack_payload, rtt_ms)."""
-        cmd_id = str(uuid.uuid4())
-        self.waiting_for_cmd_id = cmd_id
-        self.received_ack = None
-        
         cmd = {
-            "cmd_id": cmd_id,
+            "cmd_id": str(uuid.uuid4()),
             "type": cmd_type,
             "ts_ms": int(time.time() * 1000),
             **kwargs
         }
         
-        t_send = time.time()
-        self.client.publish(self.topic_cmd, json.dumps(cmd), qos=1)
-        
-        # Wait for ack
-        deadline = time.time() + self.timeout
-        while self.received_ack is None and time.time() < deadline:
-            time.sleep(0.05)
-        
-        if self.received_ack:
-            rtt_ms = (time.time() - t_send) * 1000
-            return True, self.received_ack, rtt_ms
-        else:
+        try:
+            ack = self.commands.send(cmd).result()
+        except CommandTimeout:
             return False, None, 0
+        return True, ack.payload, ack.rtt_ms
     
     def test_broker_connection(self) -> TestResult:
         """Test 1: Verify broker is reachable."""
@@ -225,6 +225,7 @@ class SmokeTest:
         self.results.append(result)
         
         # Cleanup
+        self.commands.close()
         self.client.loop_stop()
         self.client.disconnect()
         
@@ -259,6 +260,210 @@ class SmokeTest:
         print("=" * 60 + "\n")
 
 
+# =============================================================================
+# FLEET MODE
+# =============================================================================
+
+# Same sequence as SmokeTest.run_all; the AUTO step is cleanup and never fails a device
+FLEET_SEQUENCE = [
+    ("MANUAL", {"type": "SET_MODE", "mode": "MANUAL"}),
+    ("PHASE", {"type": "SET_PHASE", "phase": 0}),
+    ("AUTO", {"type": "SET_MODE", "mode": "AUTO"}),
+]
+CRITICAL_STEPS = ("MANUAL", "PHASE")
+
+
+@dataclass
+class StepResult:
+    ok: bool
+    rtt_ms: Optional[float] = None
+    err: str = ""
+
+    def cell(self) -> str:
+        if self.ok:
+            return f"✅ {self.rtt_ms:.1f}ms"
+        return f"❌ {self.err}"
+
+
+@dataclass
+class DeviceReport:
+    intersection: str
+    online: bool
+    steps: Dict[str, StepResult] = field(default_factory=dict)
+    elapsed_s: float = 0.0
+
+    @property
+    def passed(self) -> bool:
+        return self.online and all(self.steps.get(s, StepResult(False)).ok for s in CRITICAL_STEPS)
+
+
+class FleetSmokeTest:
+    """Smoke sequence against every intersection that announces itself on the status topic."""
+
+    def __init__(self, host: str, port: int, user: str, password: str, city: str,
+                 timeout: float, concurrency: int, discover_s: float):
+        self.host = host
+        self.port = port
+        self.city = city
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.discover_s = discover_s
+        
+        self.status: Dict[str, bool] = {}
+        self.subscribed = threading.Event()
+        self.last_status = time.monotonic()
+        
+        self.client = mqtt.Client(
+            client_id=f"smoke-fleet-{uuid.uuid4().hex[:8]}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.username_pw_set(user, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_subscribe = lambda c, userdata, mid, reason_codes, properties=None: self.subscribed.set()
+        self.client.on_message = self._on_message
+        # One command client for the whole fleet: acks are matched by cmd_id
+        self.commands = CommandClient(self.client, None, qos=1, timeout=timeout)
+    
+    def _topic(self, intersection: str, leaf: str) -> str:
+        return f"city/{self.city}/intersection/{intersection}/{leaf}"
+    
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            client.subscribe([(self._topic("+", "status"), 1), (self._topic("+", "ack"), 1)])
+    
+    def _on_message(self, client, userdata, msg):
+        t_recv = time.time() * 1000
+        try:
+            payload = json.loads(msg.payload.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return
+        if msg.topic.endswith("/ack"):
+            self.commands.on_ack(payload, t_recv)
+        elif msg.topic.endswith("/status") and isinstance(payload, dict):
+            self.status[msg.topic.split("/")[3]] = bool(payload.get("online"))
+            self.last_status = time.monotonic()
+    
+    def discover(self) -> Dict[str, bool]:
+        """Collect retained status messages until none arrived for discover_s."""
+        self.last_status = time.monotonic()
+        while time.monotonic() - self.last_status < self.discover_s:
+            time.sleep(0.05)
+        return dict(self.status)
+    
+    def check(self, intersection: str) -> DeviceReport:
+        """Run the smoke sequence against one intersection (skips PHASE if MANUAL failed)."""
+        report = DeviceReport(intersection, online=True)
+        t0 = time.perf_counter()
+        for i, (step, template) in enumerate(FLEET_SEQUENCE):
+            if step == "PHASE" and not report.steps["MANUAL"].ok:
+                report.steps[step] = StepResult(False, err="skipped")
+                continue
+            if i > 0:
+                time.sleep(0.2)  # let the controller apply the previous command
+            cmd = dict(template, cmd_id=str(uuid.uuid4()), ts_ms=int(time.time() * 1000))
+            try:
+                ack = self.commands.send(cmd, topic=self._topic(intersection, "cmd")).result()
+            except CommandTimeout:
+                report.steps[step] = StepResult(False, err="timeout")
+                continue
+            report.steps[step] = StepResult(ack.ok, ack.rtt_ms, "" if ack.ok else f"err={ack.payload.get('err')}")
+        report.elapsed_s = time.perf_counter() - t0
+        return report
+    
+    def run(self, csv_file: Optional[str] = None) -> int:
+        """Discover, check and print the table. Returns the exit code."""
+        print("\n" + "=" * 72)
+        print("🚦 FLEET SMOKE TEST")
+        print("=" * 72)
+        print(f"  Host: {self.host}:{self.port}, city: {self.city}")
+        print(f"  Timeout: {self.timeout}s per command, concurrency: {self.concurrency}")
+        print("=" * 72 + "\n")
+        
+        try:
+            self.client.connect(self.host, self.port, keepalive=30)
+        except OSError as e:
+            print(f"❌ Connection failed: {e}")
+            return 2
+        self.client.loop_start()
+        try:
+            if not self.subscribed.wait(5.0):
+                print("❌ Connection timeout")
+                return 2
+            
+            status = self.discover()
+            online = sorted(i for i, up in status.items() if up)
+            offline = sorted(i for i, up in status.items() if not up)
+            print(f"🔍 Discovered {len(status)} intersection(s): {len(online)} online, {len(offline)} offline")
+            if not online:
+                print("❌ No online intersections to test")
+                return 2
+            
+            reports = [DeviceReport(i, online=False) for i in offline]
+            t0 = time.perf_counter()
+            step = max(1, len(online) // 10)
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(online))) as pool:
+                futures = [pool.submit(self.check, i) for i in online]
+                for n, fut in enumerate(as_completed(futures), 1):
+                    reports.append(fut.result())
+                    if n % step == 0 or n == len(online):
+                        print(f"   Checked {n}/{len(online)}...")
+            wall_s = time.perf_counter() - t0
+        finally:
+            self.commands.close()
+            self.client.loop_stop()
+            self.client.disconnect()
+        
+        self._print_table(reports, wall_s)
+        if csv_file:
+            self._save_csv(reports, csv_file)
+        return 0 if all(r.passed for r in reports if r.online) else 1
+    
+    def _print_table(self, reports: List[DeviceReport], wall_s: float):
+        tested = [r for r in reports if r.online]
+        failed = [r for r in tested if not r.passed]
+        offline = sorted(r.intersection for r in reports if not r.online)
+        width = max([14] + [len(r.intersection) + 1 for r in tested])
+        
+        print("\n" + "=" * 72)
+        print("📋 FLEET SUMMARY")
+        print("=" * 72)
+        print(f"  {'Intersection':<{width}} {'MANUAL':<16} {'PHASE':<16} {'AUTO':<16} Result")
+        print("  " + "-" * (width + 54))
+        # Failures first
+        for r in sorted(tested, key=lambda r: (r.passed, r.intersection)):
+            cells = [r.steps[s].cell() for s, _ in FLEET_SEQUENCE]
+            result = "✅ PASS" if r.passed else "❌ FAIL"
+            print(f"  {r.intersection:<{width}} {cells[0]:<16} {cells[1]:<16} {cells[2]:<16} {result}")
+        
+        print()
+        slowest = max(tested, key=lambda r: r.elapsed_s)
+        print(f"  ⏱️ {len(tested)} device(s) in {wall_s:.1f}s "
+              f"(slowest {slowest.intersection}: {slowest.elapsed_s:.1f}s, "
+              f"sum over devices {sum(r.elapsed_s for r in tested):.1f}s)")
+        if failed:
+            print(f"⚠️ {len(tested) - len(failed)}/{len(tested)} DEVICES PASSED")
+        else:
+            print(f"🎉 ALL {len(tested)} DEVICES PASSED")
+        if offline:
+            shown = ", ".join(offline[:10]) + (f" (+{len(offline) - 10} more)" if len(offline) > 10 else "")
+            print(f"⚫ {len(offline)} offline (not tested): {shown}")
+        print("=" * 72 + "\n")
+    
+    def _save_csv(self, reports: List[DeviceReport], filename: str):
+        with open(filename, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["intersection", "online", "passed", "elapsed_s"]
+                            + [f"{s.lower()}_{k}" for s, _ in FLEET_SEQUENCE for k in ("ok", "rtt_ms", "err")])
+            for r in sorted(reports, key=lambda r: r.intersection):
+                row = [r.intersection, r.online, r.passed, round(r.elapsed_s, 3)]
+                for s, _ in FLEET_SEQUENCE:
+                    step = r.steps.get(s)
+                    row += ["", "", ""] if step is None else [
+                        step.ok, "" if step.rtt_ms is None else round(step.rtt_ms, 3), step.err]
+                writer.writerow(row)
+        print(f"💾 Results saved to: {filename}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Smoke test for Traffic Light MQTT Demo',
@@ -272,6 +477,9 @@ Exit codes:
 Examples:
   python smoke_test.py --host 192.168.1.100
   python smoke_test.py --host localhost --timeout 10
+  python smoke_test.py --host localhost --fleet
+  python smoke_test.py --host localhost --fleet --concurrency 200 --csv fleet.csv
+  python smoke_test.py --embedded-broker --fleet --embedded-devices 10
         """
     )
     
@@ -279,13 +487,45 @@ Examples:
     parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
     parser.add_argument('--user', default='demo', help='MQTT username')
     parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='Start an in-process broker (mini_broker.py) and mock_esp32 instead of using --host')
     parser.add_argument('--city', default='demo', help='City ID')
     parser.add_argument('--intersection', default='001', help='Intersection ID')
     parser.add_argument('--timeout', type=float, default=5.0, help='Timeout per test (seconds)')
     
+    # Fleet mode
+    parser.add_argument('--fleet', action='store_true',
+                        help='Test every intersection found via retained status messages')
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='Fleet mode: max devices tested at the same time')
+    parser.add_argument('--discover-s', type=float, default=1.0,
+                        help='Fleet mode: stop discovery after this long without a new status')
+    parser.add_argument('--csv', default=None, help='Fleet mode: save the pass/fail table as CSV')
+    parser.add_argument('--embedded-devices', type=int, default=5,
+                        help='Fleet mode with --embedded-broker: in-process mocks 001..N to test')
+    
     args = parser.parse_args()
+    if args.embedded_broker:
+        from mini_broker import start_embedded_broker
+        if args.fleet and args.embedded_devices < 1:
+            parser.error("--embedded-devices must be >= 1")
+        start_embedded_broker(args, with_mock=not args.fleet,
+                              fleet_size=args.embedded_devices if args.fleet else 0)
     
     try:
+        if args.fleet:
+            fleet = FleetSmokeTest(
+                host=args.host,
+                port=args.port,
+                user=args.user,
+                password=args.password,
+                city=args.city,
+                timeout=args.timeout,
+                concurrency=args.concurrency,
+                discover_s=args.discover_s
+            )
+            sys.exit(fleet.run(args.csv))
+        
         test = SmokeTest(
             host=args.host,
             port=args.port,
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Startup Budget - Traffic Light MQTT Demo
+Measures how long each tool takes to import and fails when one goes over budget.
+
+Each tool module is imported in a fresh interpreter (so nothing is cached from
+a previous import), several times; the fastest run is reported. Tools that
+talk to the broker (smoke checks, benchmarks, fleet scripts) must not load
+numpy, pandas or matplotlib at import - those belong on the analysis/plot
+code paths that use them.
+
+Usage:
+    python startup_budget.py
+    python startup_budget.py --repeat 5 --json startup.json
+    python startup_budget.py --tool run_benchmark_report --importtime 15
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY_MODULES = ("numpy", "pandas", "matplotlib")
+
+# tool -> import budget (ms). Light tools must also stay free of HEAVY_MODULES.
+LIGHT_BUDGET_MS = 150.0
+ANALYSIS_BUDGET_MS = 1500.0
+
+LIGHT_TOOLS = [
+    "smoke_test", "mock_esp32", "logger", "clock_sync", "timeline", "catalog_runs",
+    "run_benchmark_report", "run_experiments", "qos_matrix", "multi_device_test", "analysis_cache",
+    "command_client", "ingest_logger", "telemetry_rollup", "fleet_status", "state_monitor",
+    "broadcast_cmd", "mini_broker", "microbench", "echo_floor",
+]
+ANALYSIS_TOOLS = [
+    "raw_columnar", "streaming_stats", "analyze_results", "compare_runs", "payload_model",
+]
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - t0) * 1000
+print(json.dumps({{"ms": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+@dataclass
+class StartupResult:
+    tool: str
+    budget_ms: float
+    light: bool
+    import_ms: Optional[float] = None
+    heavy: List[str] = field(default_factory=list)
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        if self.error or self.import_ms is None:
+            return False
+        if self.light and self.heavy:
+            return False
+        return self.import_ms <= self.budget_ms
+
+    @property
+    def reason(self) -> str:
+        if self.error:
+            return self.error
+        if self.light and self.heavy:
+            return f"loads {', '.join(self.heavy)} at import"
+        if not self.ok:
+            return f"over budget by {self.import_ms - self.budget_ms:.0f} ms"
+        return ""
+
+
+def default_budgets() -> Dict[str, float]:
+    budgets = {t: LIGHT_BUDGET_MS for t in LIGHT_TOOLS}
+    budgets.update({t: ANALYSIS_BUDGET_MS for t in ANALYSIS_TOOLS})
+    return budgets
+
+
+def measure(tool: str, budget_ms: float, repeat: int = 3) -> StartupResult:
+    """Import a tool in `repeat` fresh interpreters; keep the fastest run."""
+    result = StartupResult(tool=tool, budget_ms=budget_ms, light=tool in LIGHT_TOOLS)
+    probe = PROBE.format(module=tool, heavy=HEAVY_MODULES)
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", probe], cwd=TOOLS_DIR,
+                              capture_output=True, text=True, timeout=60)
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            result.error = lines[-1] if lines else f"exit code {proc.returncode}"
+            return result
+        data = json.loads(proc.stdout.strip().splitlines()[-1])
+        if result.import_ms is None or data["ms"] < result.import_ms:
+            result.import_ms = data["ms"]
+        result.heavy = data["heavy"]
+    return result
+
+
+def importtime_top(tool: str, top: int) -> List[tuple]:
+    """Slowest modules (cumulative us) pulled in by importing a tool (python -X importtime)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {tool}"],
+                          cwd=TOOLS_DIR, capture_output=True, text=True, timeout=60)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|", 2)
+        rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def print_results(results: List[StartupResult]):
+    print("\n" + "=" * 72)
+    print("⏱️  STARTUP (IMPORT) TIME PER TOOL")
+    print("=" * 72)
+    print(f"  {'Tool':<22} {'Import':>10} {'Budget':>9}  Status")
+    print("  " + "-" * 68)
+    for r in results:
+        took = "N/A" if r.import_ms is None else f"{r.import_ms:.1f}ms"
+        status = "✅" if r.ok else f"❌ {r.reason}"
+        print(f"  {r.tool:<22} {took:>10} {r.budget_ms:>7.0f}ms  {status}")
+    failed = [r for r in results if not r.ok]
+    print("=" * 72)
+    if failed:
+        print(f"❌ {len(failed)}/{len(results)} tools over budget")
+    else:
+        print(f"🎉 All {len(results)} tools within budget")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure per-tool import time and fail when a tool exceeds its budget',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+Budgets:
+  {LIGHT_BUDGET_MS:.0f} ms, no numpy/pandas/matplotlib:  {', '.join(LIGHT_TOOLS)}
+  {ANALYSIS_BUDGET_MS:.0f} ms:                           {', '.join(ANALYSIS_TOOLS)}
+
+Examples:
+  python startup_budget.py
+  python startup_budget.py --repeat 5 --json startup.json
+  python startup_budget.py --tool run_benchmark_report --importtime 15
+  python startup_budget.py --scale 2     # slow CI machine: double every budget
+        """
+    )
+    parser.add_argument('--tool', action='append', default=None,
+                        help='Only check this tool (repeatable; default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh imports per tool (fastest is kept)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every budget by this factor')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='Also show the N slowest modules each tool imports')
+    parser.add_argument('--json', default=None, help='Save results as JSON')
+    args = parser.parse_args()
+
+    budgets = default_budgets()
+    tools = args.tool or list(budgets)
+    unknown = [t for t in tools if t not in budgets]
+    if unknown:
+        print(f"❌ Unknown tool(s): {', '.join(unknown)}")
+        sys.exit(2)
+
+    results = []
+    for tool in tools:
+        result = measure(tool, budgets[tool] * args.scale, args.repeat)
+        results.append(result)
+        if args.importtime:
+            print(f"\n🔍 {tool}: slowest imports (cumulative)")
+            for cumulative_us, name in importtime_top(tool, args.importtime):
+                print(f"  {cumulative_us / 1000:>8.1f}ms  {name}")
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([dict(asdict(r), ok=r.ok) for r in results], f, indent=2)
+        print(f"💾 Saved: {args.json}")
+
+    sys.exit(0 if all(r.ok for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+State Monitor - Traffic Light MQTT Demo
+Freshness and jitter of the state stream (1 Hz per intersection, mock and ESP32).
+
+Per intersection, from one subscription to city/+/intersection/+/state:
+- inter-arrival time (receive side) and how often updates arrive bunched
+  (< --bunch-frac x period) or late (> 2 x period, i.e. a missed update)
+- end-to-end lag: receive time - ts_ms (edge clock, so includes clock skew;
+  negative lags are counted separately)
+- network jitter: |inter-arrival - inter-departure|, i.e. what the broker /
+  Wi-Fi added on top of the firmware timer
+- stale: no state for --stale-s; reported once when it happens and again on
+  recovery. Devices are kept in arrival order (OrderedDict), so each check
+  only looks at the ones that just went stale.
+
+Distributions use QuantileSketch (log buckets, fixed memory per device), so
+thousands of intersections fit in one process.
+
+Usage:
+    python state_monitor.py --host 127.0.0.1
+    python state_monitor.py --host 127.0.0.1 --city demo --stale-s 3 --csv state_monitor.csv
+    python state_monitor.py --host 127.0.0.1 --simulate 2000 --duration 60
+"""
+
+import argparse
+import csv
+import json
+import random
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from clock_sync import EPOCH_MS_MIN
+
+
+@dataclass
+class StreamStats:
+    key: str
+    interarrival: Any                     # QuantileSketch (ms)
+    lag: Any                              # QuantileSketch (ms)
+    count: int = 0
+    last_recv_ms: float = 0.0
+    last_ts_ms: Optional[float] = None
+    bunched: int = 0
+    gaps: int = 0
+    max_gap_ms: float = 0.0
+    lag_min_ms: Optional[float] = None
+    lag_max_ms: Optional[float] = None
+    negative_lag: int = 0
+    net_jitter_max_ms: float = 0.0
+    stale_count: int = 0
+
+    def row(self) -> dict:
+        q = lambda s, p: round(s.quantile(p), 1) if s.count else None
+        return {
+            "device": self.key, "messages": self.count,
+            "interarrival_p50_ms": q(self.interarrival, 0.50), "interarrival_p99_ms": q(self.interarrival, 0.99),
+            "max_gap_ms": round(self.max_gap_ms, 1), "bunched": self.bunched, "gaps": self.gaps,
+            "lag_p50_ms": q(self.lag, 0.50), "lag_p99_ms": q(self.lag, 0.99),
+            "lag_min_ms": self.lag_min_ms, "lag_max_ms": self.lag_max_ms, "negative_lag": self.negative_lag,
+            "net_jitter_max_ms": round(self.net_jitter_max_ms, 1), "stale_count": self.stale_count,
+        }
+
+
+class StateMonitor:
+    """Per-device and fleet-wide inter-arrival / lag sketches with stale detection."""
+
+    def __init__(self, period_ms: float = 1000.0, stale_s: float = 5.0, bunch_frac: float = 0.25,
+                 alpha: float = 0.02):
+        from streaming_stats import QuantileSketch  # numpy, only when monitoring starts
+        self._sketch = lambda: QuantileSketch(alpha=alpha, max_buckets=256)
+        self.period_ms = period_ms
+        self.stale_ms = stale_s * 1000
+        self.bunch_ms = bunch_frac * period_ms
+        self.streams: Dict[str, StreamStats] = {}
+        self.by_arrival: "OrderedDict[str, float]" = OrderedDict()   # key -> last receive, oldest first
+        self.stale: Dict[str, float] = {}                            # key -> last receive before going stale
+        self.fleet_interarrival = QuantileSketch(alpha=0.01)
+        self.fleet_lag = QuantileSketch(alpha=0.01)
+        self.fleet_net_jitter = QuantileSketch(alpha=0.01)
+        self.lag_min_ms: Optional[float] = None    # the sketches clamp negative lags to 0
+        self.lag_max_ms: Optional[float] = None
+        self.messages = 0
+        self.events: List[str] = []
+        self.lock = threading.Lock()
+
+    def on_state(self, key: str, ts_ms: Optional[float], t_recv_ms: float):
+        with self.lock:
+            self.messages += 1
+            s = self.streams.get(key)
+            if s is None:
+                s = self.streams[key] = StreamStats(key, self._sketch(), self._sketch())
+            elif s.last_recv_ms:
+                ia = t_recv_ms - s.last_recv_ms
+                s.interarrival.add(ia)
+                self.fleet_interarrival.add(ia)
+                if ia < self.bunch_ms:
+                    s.bunched += 1
+                elif ia > 2 * self.period_ms:
+                    s.gaps += 1
+                s.max_gap_ms = max(s.max_gap_ms, ia)
+                if ts_ms is not None and s.last_ts_ms is not None:
+                    jitter = abs(ia - (ts_ms - s.last_ts_ms))
+                    self.fleet_net_jitter.add(jitter)
+                    s.net_jitter_max_ms = max(s.net_jitter_max_ms, jitter)
+            if ts_ms is not None:
+                lag = t_recv_ms - ts_ms
+                if lag < 0:
+                    s.negative_lag += 1         # edge clock ahead of ours
+                s.lag.add(lag)
+                self.fleet_lag.add(lag)
+                self.lag_min_ms = lag if self.lag_min_ms is None else min(self.lag_min_ms, lag)
+                self.lag_max_ms = lag if self.lag_max_ms is None else max(self.lag_max_ms, lag)
+                s.lag_min_ms = lag if s.lag_min_ms is None else min(s.lag_min_ms, lag)
+                s.lag_max_ms = lag if s.lag_max_ms is None else max(s.lag_max_ms, lag)
+            s.count += 1
+            s.last_recv_ms = t_recv_ms
+            s.last_ts_ms = ts_ms
+            self.by_arrival[key] = t_recv_ms
+            self.by_arrival.move_to_end(key)
+            silent_since = self.stale.pop(key, None)
+            if silent_since is not None:
+                self.events.append(f"✅ {key} back after {(t_recv_ms - silent_since) / 1000:.1f}s")
+
+    def check_stale(self, now_ms: Optional[float] = None) -> List[str]:
+        """Move devices silent for > stale_s to the stale set. Returns the newly stale keys."""
+        now_ms = time.time() * 1000 if now_ms is None else now_ms
+        newly = []
+        with self.lock:
+            while self.by_arrival:
+                key, last = next(iter(self.by_arrival.items()))
+                if now_ms - last <= self.stale_ms:
+                    break
+                self.by_arrival.popitem(last=False)
+                self.stale[key] = last
+                self.streams[key].stale_count += 1
+                newly.append(key)
+                self.events.append(f"⚠️ {key} stale (no state for {(now_ms - last) / 1000:.1f}s)")
+        return newly
+
+    def take_events(self) -> List[str]:
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def worst(self, n: int = 10, by: str = "lag_p99_ms") -> List[dict]:
+        with self.lock:
+            rows = [s.row() for s in self.streams.values()]
+        return sorted((r for r in rows if r[by] is not None), key=lambda r: -r[by])[:n]
+
+
+# =============================================================================
+# SIMULATED FLEET
+# =============================================================================
+
+def simulate_fleet(args, n: int, stop: threading.Event):
+    """
+    Publish 1 Hz state for n fake intersections (city 'sim') from one client:
+    ~5% bunch (two updates back to back every 2 s), ~2% go silent halfway.
+    """
+    client = mqtt.Client(client_id=f"state-sim-{uuid.uuid4().hex[:8]}",
+                         callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    client.username_pw_set(args.user, args.password)
+    client.max_queued_messages_set(0)
+    client.connect(args.host, args.port, keepalive=30)
+    client.loop_start()
+    rng = random.Random(1)
+    bunchy = set(rng.sample(range(n), max(1, n // 20)))
+    silent = set(rng.sample(range(n), max(1, n // 50)))
+    t0 = time.time()
+    period = args.period_ms / 1000
+    # Spread the devices evenly over one period
+    schedule = [(t0 + period * i / n, i) for i in range(n)]
+    tick = 0
+    try:
+        while not stop.is_set():
+            for t_due, i in schedule:
+                t_due += tick * period
+                delay = t_due - time.time()
+                if delay > 0 and stop.wait(delay):
+                    return
+                if i in silent and time.time() - t0 > args.duration / 2:
+                    continue
+                if i in bunchy and tick % 2 == 0:
+                    continue                            # held back, sent with the next one
+                copies = 2 if i in bunchy else 1
+                for _ in range(copies):
+                    payload = {"mode": "AUTO", "phase": "NS_GREEN", "ts_ms": int(time.time() * 1000)}
+                    client.publish(f"city/sim/intersection/{i:05d}/state", json.dumps(payload), qos=0)
+            tick += 1
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+def fmt_q(sketch, q: float) -> str:
+    return f"{sketch.quantile(q):.0f}" if sketch.count else "-"
+
+
+def print_status(mon: StateMonitor, rate: float):
+    with mon.lock:
+        ia, lag, nj = mon.fleet_interarrival, mon.fleet_lag, mon.fleet_net_jitter
+        bunched = sum(s.bunched for s in mon.streams.values())
+        line = (f"📡 {len(mon.streams):,} devices | {rate:,.0f} msg/s | "
+                f"inter-arrival p50/p99 {fmt_q(ia, 0.5)}/{fmt_q(ia, 0.99)} ms | "
+                f"lag p50/p99 {fmt_q(lag, 0.5)}/{fmt_q(lag, 0.99)} ms | "
+                f"net jitter p99 {fmt_q(nj, 0.99)} ms | bunched {bunched:,} | stale {len(mon.stale):,}")
+    print(line)
+
+
+def print_summary(mon: StateMonitor, elapsed_s: float, top: int):
+    print("\n" + "=" * 70)
+    print(f"📊 STATE STREAM: {len(mon.streams):,} devices, {mon.messages:,} messages in {elapsed_s:.0f}s")
+    print("=" * 70)
+    for label, sketch in (("Inter-arrival", mon.fleet_interarrival), ("Lag (recv - ts_ms)", mon.fleet_lag),
+                          ("Network jitter", mon.fleet_net_jitter)):
+        if sketch.count:
+            print(f"  {label:<20} p50 {fmt_q(sketch, 0.5):>6}  p90 {fmt_q(sketch, 0.9):>6}  "
+                  f"p99 {fmt_q(sketch, 0.99):>6}  p99.9 {fmt_q(sketch, 0.999):>6} ms  (n={sketch.count:,})")
+    negative = sum(s.negative_lag for s in mon.streams.values())
+    if mon.lag_min_ms is not None:
+        print(f"  Lag range            {mon.lag_min_ms:.0f} .. {mon.lag_max_ms:.0f} ms")
+    if negative:
+        print(f"  ⚠️ {negative:,} messages with negative lag (edge clock ahead - see clock_sync.py); "
+              f"lag quantiles count them as 0")
+    if mon.stale:
+        shown = ", ".join(sorted(mon.stale)[:20])
+        more = f" (+{len(mon.stale) - 20} more)" if len(mon.stale) > 20 else ""
+        print(f"  🔴 Stale now ({len(mon.stale)}): {shown}{more}")
+
+    for title, by in (("Worst lag p99", "lag_p99_ms"), ("Most bunched", "bunched"), ("Longest gap", "max_gap_ms")):
+        rows = [r for r in mon.worst(top, by) if r[by]]
+        if not rows:
+            continue
+        print(f"\n  {title}:")
+        for r in rows:
+            print(f"    {r['device']:<24} lag p50/p99 {r['lag_p50_ms']}/{r['lag_p99_ms']} ms  "
+                  f"ia p50/p99 {r['interarrival_p50_ms']}/{r['interarrival_p99_ms']} ms  "
+                  f"bunched {r['bunched']}  gaps {r['gaps']}  max gap {r['max_gap_ms']:.0f} ms")
+    print("=" * 70)
+
+
+def save_csv(mon: StateMonitor, path: str):
+    with mon.lock:
+        rows = [s.row() for s in mon.streams.values()]
+    if not rows:
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda r: r["device"]))
+    print(f"💾 Saved: {path}")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Per-intersection freshness, inter-arrival jitter and lag of the state stream',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python state_monitor.py --host 127.0.0.1
+  python state_monitor.py --host 127.0.0.1 --city demo --stale-s 3 --duration 300 --csv state.csv
+  python state_monitor.py --host 127.0.0.1 --simulate 2000 --duration 60   # synthetic fleet (city 'sim')
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--city', default='+', help='City ID (default: all)')
+    parser.add_argument('--period-ms', type=float, default=1000.0, help='Expected state period (ms)')
+    parser.add_argument('--stale-s', type=float, default=5.0, help='Flag a device after this long without state')
+    parser.add_argument('--bunch-frac', type=float, default=0.25,
+                        help='Inter-arrival below this fraction of the period counts as bunched')
+    parser.add_argument('--interval', type=float, default=5.0, help='Status line interval (s)')
+    parser.add_argument('--duration', type=float, default=0, help='Seconds to run (0 = until Ctrl+C)')
+    parser.add_argument('--top', type=int, default=5, help='Devices listed per ranking in the summary')
+    parser.add_argument('--csv', default=None, help='Save per-device stats as CSV')
+    parser.add_argument('--simulate', type=int, default=0, metavar='N',
+                        help='Also publish state for N synthetic intersections (city "sim")')
+    args = parser.parse_args()
+    if args.simulate and not args.duration:
+        args.duration = 60.0
+
+    mon = StateMonitor(args.period_ms, args.stale_s, args.bunch_frac)
+    ready = threading.Event()
+
+    def on_connect(c, userdata, flags, rc, properties=None):
+        if rc != 0:
+            print(f"❌ Connection failed with code: {rc}")
+            return
+        c.subscribe(f"city/{args.city}/intersection/+/state", qos=0)
+
+    def on_message(c, userdata, msg):
+        t_recv = time.time() * 1000
+        parts = msg.topic.split("/")
+        if len(parts) != 5 or msg.retain:
+            return
+        try:
+            ts = json.loads(msg.payload).get("ts_ms")
+        except (ValueError, AttributeError):
+            return
+        mon.on_state(f"{parts[1]}/{parts[3]}", ts if isinstance(ts, (int, float)) and ts > EPOCH_MS_MIN else None,
+                     t_recv)
+
+    client = mqtt.Client(client_id=f"state-monitor-{uuid.uuid4().hex[:8]}",
+                         callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    client.username_pw_set(args.user, args.password)
+    client.on_connect = on_connect
+    client.on_subscribe = lambda c, userdata, mid, reason_codes, properties=None: ready.set()
+    client.on_message = on_message
+    try:
+        client.connect(args.host, args.port, keepalive=30)
+    except OSError as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(2)
+    client.loop_start()
+    if not ready.wait(5.0):
+        print("❌ Connection timeout")
+        sys.exit(2)
+    print(f"📡 Monitoring city/{args.city}/intersection/+/state "
+          f"(period {args.period_ms:g} ms, stale after {args.stale_s:g}s)")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    sim = None
+    if args.simulate:
+        sim = threading.Thread(target=simulate_fleet, args=(args, args.simulate, stop), daemon=True)
+        sim.start()
+        print(f"🧪 Simulating {args.simulate:,} intersections under city/sim")
+
+    t0 = time.monotonic()
+    next_report = t0 + args.interval
+    last_count = 0
+    try:
+        while not stop.wait(0.5):
+            mon.check_stale()
+            for event in mon.take_events():
+                print(f"   {event}")
+            now = time.monotonic()
+            if now >= next_report:
+                print_status(mon, (mon.messages - last_count) / (now - next_report + args.interval))
+                last_count = mon.messages
+                next_report = now + args.interval
+            if args.duration and now - t0 >= args.duration:
+                break
+    finally:
+        stop.set()
+        if sim is not None:
+            sim.join(timeout=5)
+        client.loop_stop()
+        client.disconnect()
+
+    print_summary(mon, time.monotonic() - t0, args.top)
+    if args.csv:
+        save_csv(mon, args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Streaming Statistics - Traffic Light MQTT Demo
+Fixed-memory, mergeable accumulators for RTT analysis of files too large to load.
+
+- RunningStats:   count, mean, variance (Welford/Chan), min, max
+- QuantileSketch: log-bucketed quantile sketch (DDSketch-style) with bounded
+                  relative error, e.g. alpha=0.01 -> every quantile within +/-1%
+- GroupedStats:   RunningStats + QuantileSketch per key (command type, payload bucket)
+
+All three merge exactly (merge(a, b) == accumulate(a + b)), so chunks, files or
+worker processes can be combined afterwards.
+"""
+
+import math
+from typing import Dict, Hashable, Iterable, Optional
+
+import numpy as np
+
+
+class RunningStats:
+    """Count, mean, variance, min and max over a stream (mergeable)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add_many(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        other = RunningStats()
+        other.n = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other: "RunningStats"):
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self) -> Optional[float]:
+        """Sample standard deviation (ddof=1, same as pandas)."""
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch. Values v > min_value go to bucket
+    ceil(log(v) / log(gamma)), gamma = (1 + alpha) / (1 - alpha); a bucket's
+    representative value is within alpha (relative) of every value in it.
+    Values <= min_value (e.g. 0 ms RTTs) share one zero bucket.
+    Memory is bounded by max_buckets; beyond that the lowest buckets are
+    collapsed (accuracy is kept for the upper quantiles we report).
+    """
+
+    def __init__(self, alpha: float = 0.01, min_value: float = 1e-3, max_buckets: int = 2048):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.max_buckets = max_buckets
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        """Single value (live streams); add_many is the fast path for arrays."""
+        if value != value:
+            return
+        if value <= self.min_value:
+            self.zero_count += 1
+        else:
+            k = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[k] = self.buckets.get(k, 0) + 1
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        self.count += 1
+
+    def add_many(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        small = values <= self.min_value
+        self.zero_count += int(small.sum())
+        keys = np.ceil(np.log(values[~small]) / self.log_gamma).astype(np.int64)
+        uniq, counts = np.unique(keys, return_counts=True)
+        for k, c in zip(uniq.tolist(), counts.tolist()):
+            self.buckets[k] = self.buckets.get(k, 0) + c
+        self.count += len(values)
+        self._collapse()
+
+    def merge(self, other: "QuantileSketch"):
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different alpha")
+        for k, c in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + c
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+
+    def _collapse(self):
+        if len(self.buckets) <= self.max_buckets:
+            return
+        keys = sorted(self.buckets)
+        excess = keys[:len(keys) - self.max_buckets + 1]
+        target = keys[len(excess)]
+        self.buckets[target] += sum(self.buckets.pop(k) for k in excess)
+
+    def value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), nearest-rank on the bucketed data."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                return self.value(k)
+        return self.value(max(self.buckets))
+
+    def histogram(self):
+        """(lower_edges, upper_edges, counts) of the non-empty buckets, ascending."""
+        keys = sorted(self.buckets)
+        lower = np.array([self.gamma ** (k - 1) for k in keys])
+        upper = np.array([self.gamma ** k for k in keys])
+        counts = np.array([self.buckets[k] for k in keys])
+        if self.zero_count:
+            lower = np.concatenate([[0.0], lower])
+            upper = np.concatenate([[self.min_value], upper])
+            counts = np.concatenate([[self.zero_count], counts])
+        return lower, upper, counts
+
+
+class GroupedStats:
+    """RunningStats + QuantileSketch per group key."""
+
+    def __init__(self, alpha: float = 0.01):
+        self.alpha = alpha
+        self.stats: Dict[Hashable, RunningStats] = {}
+        self.sketches: Dict[Hashable, QuantileSketch] = {}
+
+    def _get(self, key):
+        if key not in self.stats:
+            self.stats[key] = RunningStats()
+            self.sketches[key] = QuantileSketch(self.alpha)
+        return self.stats[key], self.sketches[key]
+
+    def add_many(self, keys: Iterable, values: np.ndarray):
+        keys = np.asarray(keys)
+        values = np.asarray(values, dtype=float)
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        for i, key in enumerate(uniq.tolist()):
+            group = values[inverse == i]
+            rs, sk = self._get(key)
+            rs.add_many(group)
+            sk.add_many(group)
+
+    def merge(self, other: "GroupedStats"):
+        for key in other.stats:
+            rs, sk = self._get(key)
+            rs.merge(other.stats[key])
+            sk.merge(other.sketches[key])
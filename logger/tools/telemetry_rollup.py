@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Telemetry Rollup - Traffic Light MQTT Demo
+Multi-resolution rollups (min, max, mean, last) of telemetry and state
+metrics per intersection, plus a fleet-wide series, updated incrementally
+as messages arrive. Devices are keyed "<city>/<intersection>" (as in
+fleet_status.py and state_monitor.py), so equal ids in different cities stay
+separate; a bare intersection id in a query is accepted when it is unambiguous.
+
+Each message updates one bucket per resolution (10s, 1m, 1h) for the device
+and for the fleet ("*"), so ingest is O(resolutions x metrics) per message and
+queries read only the rollups. Each resolution has its own retention (10s: 6 h,
+1m: 7 days, 1h: 90 days); older buckets are evicted as new ones are created.
+Buckets are keyed by receive time (the edge clock may be skewed or uptime-based).
+
+Sources: live MQTT (telemetry + state topics) and/or ingest_logger JSONL files
+(--replay). The store can be saved and reloaded (--snapshot) so rollups survive
+restarts; a .gz snapshot path is compressed.
+
+Library use:
+    store = RollupStore()
+    store.ingest("city/demo/intersection/001/telemetry", {"heap_free_kb": 212.5}, t_ms)
+    store.query("telemetry.heap_free_kb", "1m")                     # fleet-wide
+    store.query("telemetry.heap_free_kb", "1m", intersection="demo/001")  # one device
+
+Usage:
+    python telemetry_rollup.py --replay results/ingest/*.jsonl.gz --query telemetry.heap_free_kb --res 1m
+    python telemetry_rollup.py --host 127.0.0.1 --duration 300 --snapshot rollup.json
+    python telemetry_rollup.py --snapshot rollup.json --query telemetry.rssi_dbm --res 10s --intersection demo/001
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FLEET = "*"
+
+# name -> (bucket seconds, retention seconds)
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {
+    "10s": (10, 6 * 3600),
+    "1m": (60, 7 * 86400),
+    "1h": (3600, 90 * 86400),
+}
+
+# topic leaf -> numeric payload fields rolled up (metric name is "<leaf>.<field>")
+DEFAULT_METRICS: Dict[str, Tuple[str, ...]] = {
+    "telemetry": ("rssi_dbm", "heap_free_kb", "uptime_s"),
+    "state": ("phase", "since_ms", "uptime_s"),
+}
+
+# Bucket layout: [min, max, sum, count, last, last_t_s]
+_MIN, _MAX, _SUM, _COUNT, _LAST, _LAST_T = range(6)
+
+
+@dataclass
+class Point:
+    t_s: int            # bucket start (epoch seconds)
+    min: float
+    max: float
+    mean: float
+    last: float
+    count: int
+
+
+class Series:
+    """Buckets of one (device, metric, resolution); evicts buckets past retention."""
+
+    __slots__ = ("step", "capacity", "buckets", "newest")
+
+    def __init__(self, step: int, retention_s: int):
+        self.step = step
+        self.capacity = max(1, retention_s // step)
+        self.buckets: Dict[int, list] = {}
+        self.newest = -1
+
+    def add(self, t_s: float, value: float):
+        idx = int(t_s // self.step)
+        if idx <= self.newest - self.capacity:
+            return  # older than retention
+        b = self.buckets.get(idx)
+        if b is None:
+            self.buckets[idx] = [value, value, value, 1, value, t_s]
+            if idx > self.newest:
+                self.newest = idx
+                # Amortised eviction: purge once the dict is 25% over capacity
+                if len(self.buckets) > self.capacity + max(8, self.capacity // 4):
+                    self.evict()
+            return
+        if value < b[_MIN]:
+            b[_MIN] = value
+        if value > b[_MAX]:
+            b[_MAX] = value
+        b[_SUM] += value
+        b[_COUNT] += 1
+        if t_s >= b[_LAST_T]:
+            b[_LAST] = value
+            b[_LAST_T] = t_s
+
+    def evict(self):
+        oldest = self.newest - self.capacity + 1
+        for idx in [i for i in self.buckets if i < oldest]:
+            del self.buckets[idx]
+
+    def points(self, start_s: Optional[float] = None, end_s: Optional[float] = None) -> List[Point]:
+        lo = self.newest - self.capacity + 1
+        if start_s is not None:
+            lo = max(lo, int(start_s // self.step))
+        hi = self.newest if end_s is None else int(end_s // self.step)
+        return [Point(idx * self.step, b[_MIN], b[_MAX], b[_SUM] / b[_COUNT], b[_LAST], b[_COUNT])
+                for idx, b in sorted(self.buckets.items()) if lo <= idx <= hi]
+
+
+class RollupStore:
+    """Rollups for every (device, metric, resolution); thread-safe ingest and query."""
+
+    def __init__(self, resolutions: Optional[Dict[str, Tuple[int, int]]] = None,
+                 metrics: Optional[Dict[str, Tuple[str, ...]]] = None):
+        self.resolutions = dict(resolutions or RESOLUTIONS)
+        self.metrics = dict(metrics or DEFAULT_METRICS)
+        self.series: Dict[Tuple[str, str], Dict[str, Series]] = {}   # (device, metric) -> res -> Series
+        # topic -> [(field, every Series a sample of that field updates)]; topics repeat, so
+        # ingest does one dict lookup per message instead of one per sample and resolution
+        self.routes: Dict[str, List[Tuple[str, List[Series]]]] = {}
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.samples = 0
+
+    def _series(self, device: str, metric: str) -> Dict[str, Series]:
+        key = (device, metric)
+        per_res = self.series.get(key)
+        if per_res is None:
+            per_res = self.series[key] = {name: Series(step, keep)
+                                          for name, (step, keep) in self.resolutions.items()}
+        return per_res
+
+    def _route(self, topic: str) -> List[Tuple[str, List[Series]]]:
+        parts = topic.split("/")
+        fields = self.metrics.get(parts[-1], ()) if len(parts) >= 5 else ()
+        route = []
+        for field in fields:
+            metric = f"{parts[-1]}.{field}"
+            route.append((field, [s for target in (f"{parts[1]}/{parts[3]}", FLEET)
+                                  for s in self._series(target, metric).values()]))
+        self.routes[topic] = route
+        return route
+
+    def ingest(self, topic: str, payload, t_ms: float) -> int:
+        """Roll up the numeric fields of one state/telemetry message. Returns samples added."""
+        if not isinstance(payload, dict):
+            return 0
+        t_s, added = t_ms / 1000, 0
+        with self.lock:
+            route = self.routes.get(topic)
+            if route is None:
+                route = self._route(topic)
+            if not route:
+                return 0
+            self.messages += 1
+            for field, targets in route:
+                value = payload.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    for series in targets:
+                        series.add(t_s, value)
+                    added += 1
+            self.samples += added
+        return added
+
+    def _device(self, intersection: Optional[str]) -> str:
+        """Series key for a "city/intersection" or an unambiguous bare intersection id."""
+        if not intersection:
+            return FLEET
+        devices = {d for d, _ in self.series}
+        if intersection in devices:
+            return intersection
+        matches = sorted(d for d in devices if d.rsplit("/", 1)[-1] == intersection)
+        if len(matches) > 1:
+            raise ValueError(f"intersection {intersection!r} is ambiguous (use one of {', '.join(matches)})")
+        return matches[0] if matches else intersection
+
+    def query(self, metric: str, resolution: str, start_s: Optional[float] = None,
+              end_s: Optional[float] = None, intersection: Optional[str] = None) -> List[Point]:
+        """Series of one metric at one resolution, fleet-wide (default) or for one device."""
+        if resolution not in self.resolutions:
+            raise ValueError(f"unknown resolution {resolution!r} (have {', '.join(self.resolutions)})")
+        with self.lock:
+            per_res = self.series.get((self._device(intersection), metric))
+            return per_res[resolution].points(start_s, end_s) if per_res else []
+
+    def latest(self, metric: str, resolution: str) -> Dict[str, Point]:
+        """Most recent bucket of every device (for ranking, e.g. lowest heap)."""
+        out = {}
+        with self.lock:
+            for (device, m), per_res in self.series.items():
+                if m == metric and device != FLEET:
+                    series = per_res[resolution]
+                    if series.newest >= 0:
+                        out[device] = series.points(series.newest * series.step)[0]
+        return out
+
+    def devices(self) -> List[str]:
+        with self.lock:
+            return sorted({d for d, _ in self.series if d != FLEET})
+
+    def metric_names(self) -> List[str]:
+        with self.lock:
+            return sorted({m for _, m in self.series})
+
+    def bucket_count(self) -> int:
+        with self.lock:
+            return sum(len(s.buckets) for per_res in self.series.values() for s in per_res.values())
+
+    # -- snapshot ---------------------------------------------------------------------------
+
+    def save(self, path: str):
+        """Write all buckets as JSON (atomically)."""
+        with self.lock:
+            data = {
+                "resolutions": self.resolutions,
+                "metrics": self.metrics,
+                "series": [
+                    {"device": d, "metric": m, "res": name,
+                     "buckets": [[idx] + b for idx, b in s.buckets.items()]}
+                    for (d, m), per_res in self.series.items() for name, s in per_res.items() if s.buckets
+                ],
+            }
+        tmp = path + ".tmp"
+        with (gzip.open if path.endswith(".gz") else open)(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RollupStore":
+        with (gzip.open if path.endswith(".gz") else open)(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        store = cls({k: tuple(v) for k, v in data["resolutions"].items()},
+                    {k: tuple(v) for k, v in data["metrics"].items()})
+        for entry in data["series"]:
+            series = store._series(entry["device"], entry["metric"])[entry["res"]]
+            for idx, *b in entry["buckets"]:
+                series.buckets[idx] = b
+                series.newest = max(series.newest, idx)
+        return store
+
+
+def slope_per_hour(points: List[Point]) -> Optional[float]:
+    """Least-squares slope of the bucket means (units per hour), e.g. heap decline."""
+    if len(points) < 2:
+        return None
+    xs = [p.t_s / 3600 for p in points]
+    ys = [p.mean for p in points]
+    x_mean, y_mean = sum(xs) / len(xs), sum(ys) / len(ys)
+    sxx = sum((x - x_mean) ** 2 for x in xs)
+    if sxx == 0:
+        return None
+    return sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) / sxx
+
+
+# =============================================================================
+# SOURCES
+# =============================================================================
+
+def replay(store: RollupStore, paths: Iterable[str]) -> int:
+    """Feed ingest_logger JSONL(.gz) files into the store. Returns lines read."""
+    lines = 0
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                store.ingest(rec.get("topic", ""), rec.get("payload"), rec.get("t_ms", 0))
+                lines += 1
+    return lines
+
+
+def subscribe_live(store: RollupStore, args):
+    """Start an MQTT client that feeds state/telemetry messages into the store."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(
+        client_id=f"rollup-{uuid.uuid4().hex[:8]}",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+    )
+    client.username_pw_set(args.user, args.password)
+
+    def on_connect(c, userdata, flags, rc, properties=None):
+        if rc == 0:
+            c.subscribe([(f"city/{args.city}/intersection/+/{leaf}", 0) for leaf in store.metrics])
+            print(f"✅ Connected to {args.host}:{args.port}, rolling up {', '.join(store.metrics)}")
+
+    def on_message(c, userdata, msg):
+        t_ms = time.time() * 1000
+        try:
+            store.ingest(msg.topic, json.loads(msg.payload), t_ms)
+        except ValueError:
+            pass
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.host, args.port, keepalive=60)
+    client.loop_start()
+    return client
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+def print_series(store: RollupStore, metric: str, resolution: str, intersection: Optional[str],
+                 last: int):
+    points = store.query(metric, resolution, intersection=intersection)
+    who = intersection or "fleet"
+    print(f"\n📈 {metric} @ {resolution} ({who}): {len(points)} bucket(s)")
+    if not points:
+        return
+    print(f"  {'Bucket':<20} {'Min':>10} {'Max':>10} {'Mean':>10} {'Last':>10} {'Count':>7}")
+    print("  " + "-" * 70)
+    for p in points[-last:]:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(p.t_s))
+        print(f"  {stamp:<20} {p.min:>10.2f} {p.max:>10.2f} {p.mean:>10.2f} {p.last:>10.2f} {p.count:>7}")
+    slope = slope_per_hour(points)
+    if slope is not None:
+        print(f"  Trend: {slope:+.3f} per hour over {len(points)} bucket(s)")
+
+
+def print_overview(store: RollupStore, resolution: str):
+    print("\n" + "=" * 60)
+    print("📊 ROLLUP STORE")
+    print("=" * 60)
+    print(f"  Messages:  {store.messages:,}  Samples: {store.samples:,}")
+    print(f"  Devices:   {len(store.devices())}  Buckets: {store.bucket_count():,}")
+    for metric in store.metric_names():
+        points = store.query(metric, resolution)
+        if points:
+            p = points[-1]
+            print(f"  {metric:<26} {resolution} latest: mean {p.mean:.2f} (min {p.min:.2f}, "
+                  f"max {p.max:.2f}, n={p.count})")
+    print("=" * 60)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Multi-resolution telemetry/state rollups per intersection and fleet-wide',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Resolutions (bucket / retention): 10s / 6h, 1m / 7d, 1h / 90d
+
+Examples:
+  python telemetry_rollup.py --replay "results/ingest/*.jsonl.gz"
+  python telemetry_rollup.py --replay "results/ingest/*.jsonl.gz" --query telemetry.heap_free_kb --res 1m
+  python telemetry_rollup.py --host 127.0.0.1 --duration 120 --snapshot rollup.json
+  python telemetry_rollup.py --snapshot rollup.json --query telemetry.rssi_dbm --intersection demo/001 --res 10s
+        """
+    )
+    parser.add_argument('--host', default=None, help='MQTT broker host (live rollup)')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--user', default='demo', help='MQTT username')
+    parser.add_argument('--password', default='demo_pass', help='MQTT password')
+    parser.add_argument('--city', default='+', help='City ID (default: all)')
+    parser.add_argument('--duration', type=float, default=0, help='Live: seconds to run (0 = until Ctrl+C)')
+    parser.add_argument('--replay', nargs='+', default=[], help='ingest_logger JSONL(.gz) files or globs')
+    parser.add_argument('--snapshot', default=None, help='Load rollups from this file (if present) and save back')
+    parser.add_argument('--save-s', type=float, default=60.0, help='Live: snapshot interval (s)')
+    parser.add_argument('--query', default=None, help='Metric to print, e.g. telemetry.heap_free_kb')
+    parser.add_argument('--res', choices=list(RESOLUTIONS), default='1m', help='Resolution for output')
+    parser.add_argument('--intersection', default=None, help='Query one device, city/id or an unambiguous id (default: fleet-wide)')
+    parser.add_argument('--last', type=int, default=30, help='Buckets to print')
+    args = parser.parse_args()
+
+    if args.snapshot and os.path.exists(args.snapshot):
+        store = RollupStore.load(args.snapshot)
+        print(f"📂 Loaded {store.bucket_count():,} buckets from {args.snapshot}")
+    else:
+        store = RollupStore()
+
+    if args.replay:
+        paths = sorted(p for pattern in args.replay for p in (glob.glob(pattern) or [pattern]))
+        t0 = time.perf_counter()
+        lines = replay(store, paths)
+        elapsed = time.perf_counter() - t0
+        print(f"📥 Replayed {lines:,} messages from {len(paths)} file(s) in {elapsed:.2f}s "
+              f"({lines / elapsed if elapsed else 0:,.0f} msg/s)")
+
+    if args.host:
+        stop = threading.Event()
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        try:
+            client = subscribe_live(store, args)
+        except OSError as e:
+            print(f"❌ Connection failed: {e}")
+            sys.exit(2)
+        deadline = time.monotonic() + args.duration if args.duration else None
+        while not stop.wait(min(args.save_s, deadline - time.monotonic()) if deadline else args.save_s):
+            if args.snapshot:
+                store.save(args.snapshot)
+            if deadline and time.monotonic() >= deadline:
+                break
+        client.loop_stop()
+        client.disconnect()
+
+    if args.query:
+        try:
+            print_series(store, args.query, args.res, args.intersection, args.last)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    else:
+        print_overview(store, args.res)
+
+    if args.snapshot:
+        store.save(args.snapshot)
+        print(f"💾 Snapshot saved: {args.snapshot}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Latency Timeline - Traffic Light MQTT Demo
+Per-window (default 1 s) sent/acked counts and RTT percentiles for one case.
+
+Windows are filled while the benchmark runs: a send is counted in the window
+of its send time, an ack (with its RTT) in the window it was received, and a
+lost command leaves the in-flight count when its ack timeout expires. A case
+summary hides short events; the timeline shows them:
+  - STALL: commands were in flight but no ack arrived in the window
+  - SPIKE: window P99 above the case's robust spread: median + spike_k x sigma,
+           sigma = 1.4826 x MAD of all acked RTTs, and at least spike_min_ms above
+           the median. The reference is the case's RTT distribution, not other
+           windows, so a spike repeating every window (e.g. each 1 s state loop)
+           is still flagged, and any window with an ack is judged (at 5 acks per
+           window the P99 is the max)
+
+--selftest checks the rule on a synthetic default-rate case (200 ms interval)
+with and without a 1 Hz injected spike.
+
+Usage:
+    python timeline.py results/bench_xxx/raw/case_0b.csv
+    python timeline.py results/bench_xxx/raw/case_0b.npy --window_ms 250 --plot timeline.png
+    python timeline.py --selftest
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+DEFAULT_WINDOW_MS = 1000
+TIMELINE_SUFFIX = "_timeline"
+DEFAULT_SPIKE_K = 8.0          # robust sigmas above the case median
+DEFAULT_SPIKE_MIN_MS = 5.0     # and never less than this above it (sub-ms loopback jitter)
+MAD_TO_SIGMA = 1.4826
+DEFAULT_ACK_TIMEOUT_MS = 10000   # RTTBenchmark's per-command deadline
+
+TIMELINE_COLUMNS = ['window', 't_start_ms', 'sent', 'acked', 'in_flight',
+                    'p50', 'p99', 'max', 'flag']
+
+
+@dataclass
+class _Window:
+    sent: int = 0
+    lost: int = 0
+    rtts: List[float] = field(default_factory=list)
+
+
+@dataclass
+class TimelineWindow:
+    index: int
+    t_start_ms: int
+    sent: int
+    acked: int
+    in_flight: int
+    p50: Optional[float]
+    p99: Optional[float]
+    max_rtt: Optional[float]
+    flag: str = ""
+
+
+def percentile(sorted_data: List[float], p: float) -> float:
+    """Nearest-rank percentile of already-sorted data, p in [0, 1] (same rule as RTTBenchmark._analyze)."""
+    return sorted_data[min(int(len(sorted_data) * p), len(sorted_data) - 1)]
+
+
+class TimelineRecorder:
+    """Incremental per-window counters; safe to feed from the MQTT callback thread."""
+
+    def __init__(self, window_ms: int = DEFAULT_WINDOW_MS):
+        self.window_ms = window_ms
+        self.t0_ms: Optional[int] = None
+        self.windows: Dict[int, _Window] = {}
+        self.lock = threading.Lock()
+
+    def _window(self, t_ms: float) -> _Window:
+        if self.t0_ms is None:
+            self.t0_ms = int(t_ms)
+        idx = int((t_ms - self.t0_ms) // self.window_ms)
+        w = self.windows.get(idx)
+        if w is None:
+            w = self.windows[idx] = _Window()
+        return w
+
+    def on_send(self, t_send_ms: float):
+        with self.lock:
+            self._window(t_send_ms).sent += 1
+
+    def on_ack(self, t_recv_ms: float, rtt_ms: float):
+        with self.lock:
+            self._window(t_recv_ms).rtts.append(rtt_ms)
+
+    def on_lost(self, t_ms: float):
+        """A command's ack timeout expired: it is no longer in flight from t_ms on."""
+        with self.lock:
+            self._window(t_ms).lost += 1
+
+    def finalize(self, spike_k: float = DEFAULT_SPIKE_K,
+                 spike_min_ms: float = DEFAULT_SPIKE_MIN_MS) -> List[TimelineWindow]:
+        """Close the timeline: fill empty windows, compute percentiles and flags."""
+        with self.lock:
+            if not self.windows:
+                return []
+            all_rtts = sorted(r for w in self.windows.values() for r in w.rtts)
+            threshold = spike_threshold(all_rtts, spike_k, spike_min_ms) if all_rtts else None
+
+            rows = []
+            in_flight = 0
+            for idx in range(min(self.windows), max(self.windows) + 1):
+                w = self.windows.get(idx, _Window())
+                rtts = sorted(w.rtts)
+                was_in_flight = in_flight + w.sent
+                in_flight = max(0, was_in_flight - len(rtts) - w.lost)
+                row = TimelineWindow(
+                    index=idx,
+                    t_start_ms=self.t0_ms + idx * self.window_ms,
+                    sent=w.sent,
+                    acked=len(rtts),
+                    in_flight=in_flight,
+                    p50=percentile(rtts, 0.5) if rtts else None,
+                    p99=percentile(rtts, 0.99) if rtts else None,
+                    max_rtt=rtts[-1] if rtts else None,
+                )
+                if was_in_flight > 0 and not rtts:
+                    row.flag = "STALL"
+                elif threshold is not None and rtts and row.p99 > threshold:
+                    row.flag = "SPIKE"
+                rows.append(row)
+            return rows
+
+
+def spike_threshold(sorted_rtts: List[float], spike_k: float = DEFAULT_SPIKE_K,
+                    spike_min_ms: float = DEFAULT_SPIKE_MIN_MS) -> float:
+    """Window P99 above which a window is a SPIKE: median + max(k x 1.4826 x MAD, min_ms)."""
+    median = percentile(sorted_rtts, 0.5)
+    mad = percentile(sorted(abs(r - median) for r in sorted_rtts), 0.5)
+    return median + max(spike_k * MAD_TO_SIGMA * mad, spike_min_ms)
+
+
+def flagged(rows: List[TimelineWindow]) -> List[TimelineWindow]:
+    return [r for r in rows if r.flag]
+
+
+# =============================================================================
+# FILE I/O
+# =============================================================================
+
+def timeline_path(raw_file: str) -> str:
+    """Timeline file stored with the raw data (case_0b.csv -> case_0b_timeline.csv)."""
+    return os.path.splitext(raw_file)[0] + TIMELINE_SUFFIX + ".csv"
+
+
+def save_timeline(rows: List[TimelineWindow], filename: str, window_ms: int):
+    def num(value):
+        return '' if value is None else f"{value:.2f}"
+
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(TIMELINE_COLUMNS)
+        for r in rows:
+            writer.writerow([r.index, r.t_start_ms, r.sent, r.acked, r.in_flight,
+                             num(r.p50), num(r.p99), num(r.max_rtt), r.flag])
+    print(f"💾 Saved: {filename} ({len(rows)} x {window_ms}ms windows, {len(flagged(rows))} flagged)")
+
+
+def load_timeline(filename: str) -> List[TimelineWindow]:
+    def num(value):
+        return float(value) if value != '' else None
+
+    with open(filename, newline='', encoding='utf-8') as f:
+        return [TimelineWindow(int(r['window']), int(r['t_start_ms']), int(r['sent']), int(r['acked']),
+                               int(r['in_flight']), num(r['p50']), num(r['p99']), num(r['max']), r['flag'])
+                for r in csv.DictReader(f)]
+
+
+def timeline_from_raw(raw_file: str, window_ms: int = DEFAULT_WINDOW_MS,
+                      spike_k: float = DEFAULT_SPIKE_K,
+                      spike_min_ms: float = DEFAULT_SPIKE_MIN_MS,
+                      ack_timeout_ms: int = DEFAULT_ACK_TIMEOUT_MS) -> List[TimelineWindow]:
+    """
+    Rebuild a timeline from a raw results file (runs recorded before timelines existed).
+    Unacked commands are retired at t_send + ack_timeout_ms (at the latest at the
+    file's last event, so no empty windows are added after the run).
+    """
+    from raw_columnar import read_results
+
+    df = read_results(raw_file)
+    if df.empty:
+        return []
+    rec = TimelineRecorder(window_ms)
+    t0 = int(df['t_send_ms'].min())
+    rec.t0_ms = t0
+    for t in df['t_send_ms']:
+        rec.on_send(int(t))
+    acked = df.dropna(subset=['t_ack_recv_ms', 'rtt_ms'])
+    for t, rtt in zip(acked['t_ack_recv_ms'], acked['rtt_ms']):
+        rec.on_ack(int(t), float(rtt))
+    t_end = int(max(df['t_send_ms'].max(), acked['t_ack_recv_ms'].max() if len(acked) else t0))
+    for t in df.loc[df['rtt_ms'].isna(), 't_send_ms']:
+        rec.on_lost(min(int(t) + ack_timeout_ms, t_end))
+    return rec.finalize(spike_k, spike_min_ms)
+
+
+# =============================================================================
+# PLOTTING
+# =============================================================================
+
+def plot_timeline(rows: List[TimelineWindow], filename: str, title: str, window_ms: int):
+    """RTT percentiles (top) and sent/acked per window (bottom), flagged windows shaded."""
+    from analyze_results import load_pyplot
+
+    plt = load_pyplot()
+    if plt is None:
+        print("⚠️ matplotlib not installed. Skipping timeline plot.")
+        return
+    if not rows:
+        return
+    t0 = rows[0].t_start_ms
+    xs = [(r.t_start_ms - t0) / 1000.0 for r in rows]
+    width = window_ms / 1000.0
+
+    def series(attr):
+        return [math.nan if getattr(r, attr) is None else getattr(r, attr) for r in rows]
+
+    mids = [x + width / 2 for x in xs]
+
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 7), sharex=True,
+                                   gridspec_kw={'height_ratios': [2, 1]})
+    ax1.plot(mids, series('p50'), marker='.', color='#2196F3', label='P50')
+    ax1.plot(mids, series('p99'), marker='.', color='#FF9800', label='P99')
+    ax1.plot(mids, series('max_rtt'), linestyle=':', color='#f44336', label='Max')
+    ax1.set_ylabel('RTT (ms)')
+    ax1.set_title(f'{title} ({window_ms}ms windows)')
+    ax1.grid(True, alpha=0.3)
+
+    ax2.bar([x + width * 0.1 for x in xs], [r.sent for r in rows], width * 0.4, align='edge',
+            color='#90A4AE', label='Sent')
+    ax2.bar([x + width * 0.5 for x in xs], [r.acked for r in rows], width * 0.4, align='edge',
+            color='#4CAF50', label='Acked')
+    ax2.set_xlabel('Time since first send (s)')
+    ax2.set_ylabel('Commands / window')
+    ax2.grid(True, alpha=0.3)
+
+    for r, x in zip(rows, xs):
+        if r.flag:
+            color = '#f44336' if r.flag == "STALL" else '#FFC107'
+            for ax in (ax1, ax2):
+                ax.axvspan(x, x + width, color=color, alpha=0.15, linewidth=0)
+    ax1.legend(loc='upper left')
+    ax2.legend(loc='upper left')
+
+    plt.savefig(filename, dpi=150, bbox_inches='tight')
+    plt.close()
+    print(f"📊 Saved: {filename}")
+
+
+# =============================================================================
+# SELF-TEST
+# =============================================================================
+
+def synthetic_case(spike_ms: float, duration_s: int = 60, interval_ms: int = 200,
+                   base_ms: float = 20.0, jitter_ms: float = 2.0, seed: int = 1) -> TimelineRecorder:
+    """Default-rate case: base RTT + Gaussian jitter, the first command of every second + spike_ms."""
+    rng = random.Random(seed)
+    rec = TimelineRecorder()
+    t0 = 1_700_000_000_000.0
+    for i in range(duration_s * 1000 // interval_ms):
+        t_send = t0 + i * interval_ms
+        rtt = max(0.1, rng.gauss(base_ms, jitter_ms)) + (spike_ms if (i * interval_ms) % 1000 == 0 else 0.0)
+        rec.on_send(t_send)
+        rec.on_ack(t_send + rtt, rtt)
+    return rec
+
+
+def selftest() -> int:
+    """SPIKE must fire on a 1 Hz spike at the default rate and stay quiet without it."""
+    spiky = [w for w in synthetic_case(spike_ms=150.0).finalize() if w.acked]
+    quiet = synthetic_case(spike_ms=0.0).finalize()
+    hit = sum(1 for w in spiky if w.flag == "SPIKE")
+    false_flags = sum(1 for w in quiet if w.flag)
+    print(f"🧪 1 Hz +150 ms spike, 200 ms interval: {hit}/{len(spiky)} windows flagged SPIKE")
+    print(f"🧪 No spike:                             {false_flags}/{len(quiet)} windows flagged")
+    ok = hit >= 0.9 * len(spiky) and false_flags == 0
+    print("✅ Self-test passed" if ok else "❌ Self-test failed")
+    return 0 if ok else 1
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Per-window latency/throughput timeline from a raw results file',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python timeline.py raw/case_0b.csv
+  python timeline.py raw/case_0b.npy --window_ms 250 --plot timeline.png
+  python timeline.py raw/case_0b.csv --spike-k 5 --spike-min-ms 2
+  python timeline.py --selftest
+        """
+    )
+    parser.add_argument('raw_file', nargs='?', help='Raw results (.csv or .npy)')
+    parser.add_argument('--window_ms', type=int, default=DEFAULT_WINDOW_MS, help='Window size (ms)')
+    parser.add_argument('--spike-k', type=float, default=DEFAULT_SPIKE_K,
+                        help='Flag windows with P99 above case median + k x 1.4826 x MAD')
+    parser.add_argument('--spike-min-ms', type=float, default=DEFAULT_SPIKE_MIN_MS,
+                        help='... and at least this far above the median (ms)')
+    parser.add_argument('--ack-timeout-ms', type=int, default=DEFAULT_ACK_TIMEOUT_MS,
+                        help='Unacked commands leave the in-flight count after this long')
+    parser.add_argument('--out', default=None, help='Output CSV (default: <raw>_timeline.csv)')
+    parser.add_argument('--plot', default=None, help='Also save a timeline plot (PNG)')
+    parser.add_argument('--selftest', action='store_true',
+                        help='Check the SPIKE rule on synthetic cases (no raw file needed)')
+    args = parser.parse_args()
+    if args.selftest:
+        sys.exit(selftest())
+    if not args.raw_file:
+        parser.error("raw_file is required (or use --selftest)")
+
+    try:
+        rows = timeline_from_raw(args.raw_file, args.window_ms, args.spike_k,
+                                 args.spike_min_ms, args.ack_timeout_ms)
+    except FileNotFoundError:
+        print(f"❌ File not found: {args.raw_file}")
+        sys.exit(1)
+
+    save_timeline(rows, args.out or timeline_path(args.raw_file), args.window_ms)
+    for r in flagged(rows):
+        print(f"  ⚠️ {r.flag} at +{(r.t_start_ms - rows[0].t_start_ms) / 1000:.1f}s: "
+              f"sent={r.sent} acked={r.acked} in_flight={r.in_flight} "
+              f"p99={'N/A' if r.p99 is None else f'{r.p99:.1f}ms'}")
+    if args.plot:
+        plot_timeline(rows, args.plot, os.path.basename(args.raw_file), args.window_ms)
+
+
+if __name__ == "__main__":
+    main()